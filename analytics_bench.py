@@ -0,0 +1,267 @@
+"""
+POS System Analytics Benchmark
+
+Author: Alejandro Vargas
+Github: https://github.com/sagravela
+
+This script compares the numpy arrays the analytics queries return against the
+lists of rows, with a `datetime.strptime` per row, they returned before. On a
+database of its own it generates ten years of daily sales, a million transactions
+of one line each, and times both ways of:
+
+- the daily sales, `get_transactions` against the query grouping the timestamps by date,
+- the conversion of the daily rows, and of the million raw transactions, to dates and totals,
+- the item ranking, `sold_items_sorted` against a query sorted in Python,
+- the drawing of the total sales chart from the arrays and from the lists.
+
+Both ways must give the same days, totals and ranking. The exit code is 1 if any
+differs, or if the arrays take over `--max-ratio` of the time of the lists.
+
+Examples
+--------
+    python analytics_bench.py
+    python analytics_bench.py --days 3653 --transactions 1000000 --items 1000
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from itertools import chain
+
+# Daily sales as they were read before, grouping the timestamps of the transactions by date
+DAILY_SALES = """
+    SELECT date, SUM(amount) FROM (
+        SELECT date(timestamp) AS date, total_amount AS amount FROM transactions
+        UNION ALL SELECT date(date) AS date, total_sales AS amount FROM daily_sales
+    ) GROUP BY date ORDER BY date
+"""
+
+# Quantity sold of each item, as the item ranking read it before
+ITEM_SALES = """
+    SELECT items.name, SUM(sold.quantity) FROM (
+        SELECT item_id, quantity FROM transaction_items UNION ALL SELECT item_id, quantity FROM item_sales
+    ) sold JOIN items ON items.id = sold.item_id GROUP BY sold.item_id
+"""
+
+def seed_sales(path: str, args: argparse.Namespace, rng: random.Random):
+    """
+    Adds the items and the transactions, spread evenly over the days up to yesterday.
+
+    Parameters
+    ----------
+    path : str
+        The path of the database.
+    args : argparse.Namespace
+        The parsed command line.
+    rng : random.Random
+        The random generator of the sales.
+    """
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA synchronous = OFF")
+    prices = [round(rng.uniform(0.5, 30), 2) for _ in range(args.items)]
+    connection.executemany(
+        "INSERT INTO items (id, name, price) VALUES (?, ?, ?)",
+        [(number + 1, f"Item {number + 1:05d}", price) for number, price in enumerate(prices)]
+    )
+    connection.executemany(
+        "INSERT INTO store (item_id, stock) VALUES (?, 0)", [(number + 1,) for number in range(args.items)]
+    )
+
+    start = datetime.combine(date.today() - timedelta(days=args.days), datetime.min.time())
+    seconds = args.days * 86400 / args.transactions
+    # A few items sell most, as in a shop
+    weights = [1 / number for number in range(1, args.items + 1)]
+    sold = rng.choices(range(args.items), weights, k=args.transactions)
+    quantities = [rng.randint(1, 5) for _ in range(args.transactions)]
+
+    def transactions():
+        for number in range(args.transactions):
+            timestamp = start + timedelta(seconds=number * seconds)
+            total = round(prices[sold[number]] * quantities[number], 2)
+            yield (
+                number + 1, total, total, 0, timestamp.strftime("%Y-%m-%d %H:%M:%S.%f"),
+                timestamp.year * 10000 + timestamp.month * 100 + timestamp.day
+            )
+
+    def transaction_items():
+        for number in range(args.transactions):
+            total = round(prices[sold[number]] * quantities[number], 2)
+            yield number + 1, sold[number] + 1, quantities[number], prices[sold[number]], total
+
+    connection.executemany(
+        "INSERT INTO transactions (id, total_amount, payment_received, change_returned, timestamp, day_key, discount) "
+        "VALUES (?, ?, ?, ?, ?, ?, 0)", transactions()
+    )
+    connection.executemany(
+        "INSERT INTO transaction_items (transaction_id, item_id, quantity, unit_price, line_total, discount) "
+        "VALUES (?, ?, ?, ?, ?, 0)", transaction_items()
+    )
+    connection.commit()
+    connection.execute("ANALYZE")
+    connection.close()
+
+def best(function, runs: int) -> tuple[float, object]:
+    """
+    Runs a function several times, returning its best time in milliseconds and its last result.
+    """
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - started)
+    return min(times) * 1000, result
+
+def run(args: argparse.Namespace) -> tuple[list[tuple], list[tuple[str, bool, str]]]:
+    """
+    Generates the sales and times the analytics with lists and with arrays.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The parsed command line.
+
+    Returns
+    -------
+    tuple of (list, list)
+        The name, rows, milliseconds with lists and with arrays of each stage, and the name
+        of each check, whether it passed and the values it compared.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import numpy as np
+    from database.database import create_db, database_path, reporting_path
+    from backend.services import get_transactions, sold_items_sorted, day_keys_to_dates
+    from backend.snapshot import refresh_snapshot
+
+    rng = random.Random(args.seed)
+    create_db()
+    started = time.perf_counter()
+    seed_sales(database_path, args, rng)
+    print(f"{args.transactions} transactions over {args.days} days generated in {time.perf_counter() - started:.1f} s", file=sys.stderr)
+    refresh_snapshot()
+    connection = sqlite3.connect(reporting_path)
+    stages, different = [], []
+
+    # Daily sales, the query and the conversion of its rows
+    def daily_lists():
+        rows = connection.execute(DAILY_SALES).fetchall()
+        return [datetime.strptime(day, '%Y-%m-%d') for day, _ in rows], [total for _, total in rows]
+
+    lists_ms, (days, totals) = best(daily_lists, args.runs)
+    arrays_ms, (dates, amounts, _) = best(lambda: get_transactions(engine="sqlite"), args.runs)
+    stages.append(("daily sales", len(dates), lists_ms, arrays_ms))
+    if not (np.array_equal(np.array(days, dtype='datetime64[D]'), dates) and np.allclose(totals, amounts)):
+        different.append("daily sales")
+
+    daily = connection.execute(
+        "SELECT date(timestamp), day_key, SUM(total_amount) FROM transactions GROUP BY day_key ORDER BY day_key"
+    ).fetchall()
+    lists_ms, (days, _) = best(lambda: ([datetime.strptime(day, '%Y-%m-%d') for day, _, _ in daily], [total for _, _, total in daily]), args.runs)
+    arrays_ms, (dates, _) = best(lambda: (
+        day_keys_to_dates(np.fromiter((key for _, key, _ in daily), dtype=np.int64, count=len(daily))),
+        np.fromiter((total for _, _, total in daily), dtype=np.float64, count=len(daily))
+    ), args.runs)
+    stages.append(("daily rows to arrays", len(daily), lists_ms, arrays_ms))
+    if not np.array_equal(np.array(days, dtype='datetime64[D]'), dates):
+        different.append("daily rows")
+
+    # A million raw transactions, read once, converted each way
+    raw = connection.execute("SELECT timestamp, day_key, total_amount FROM transactions").fetchall()
+    lists_ms, (days, _) = best(lambda: (
+        [datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S.%f') for timestamp, _, _ in raw], [total for _, _, total in raw]
+    ), 1)
+
+    def raw_arrays():
+        # Flattened straight into an array, as `get_transactions` reads its rows
+        rows = np.fromiter(chain.from_iterable(row[1:] for row in raw), dtype=np.float64).reshape(-1, 2)
+        return day_keys_to_dates(rows[:, 0].astype(np.int64)), rows[:, 1]
+
+    arrays_ms, (dates, _) = best(raw_arrays, 1)
+    stages.append(("raw rows to arrays", len(raw), lists_ms, arrays_ms))
+    if not np.array_equal(np.array(days, dtype='datetime64[D]'), dates):
+        different.append("raw rows")
+    del raw, days
+
+    # The item ranking, computed from all the lines the first time
+    lists_ms, ranking = best(lambda: sorted(connection.execute(ITEM_SALES).fetchall(), key=lambda row: row[1]), 1)
+    arrays_ms, (names, quantities) = best(lambda: sold_items_sorted("quantity", engine="sqlite"), 1)
+    stages.append(("item ranking", len(names), lists_ms, arrays_ms))
+    if sorted(ranking) != sorted(zip(names.tolist(), quantities.astype(int).tolist())) or not np.all(np.diff(quantities) >= 0):
+        different.append("item ranking")
+
+    # The total sales chart, drawn from the dates and totals of each kind
+    days, totals = daily_lists()
+    dates, amounts, _ = get_transactions(engine="sqlite")
+    connection.close()
+
+    def draw(x, y):
+        figure, ax = plt.subplots()
+        ax.plot(x, y)
+        figure.canvas.draw()
+        plt.close(figure)
+
+    lists_ms, _ = best(lambda: draw(days, totals), args.runs)
+    arrays_ms, _ = best(lambda: draw(dates, amounts), args.runs)
+    stages.append(("total sales chart", len(dates), lists_ms, arrays_ms))
+
+    slower = [name for name, _, lists_ms, arrays_ms in stages[1:] if arrays_ms > args.max_ratio * lists_ms]
+    checks = [
+        ("same results", not different, ", ".join(different) + " differ" if different else "days, totals and ranking match"),
+        ("arrays faster", not slower, ", ".join(slower) + " slower" if slower else f"every conversion within {args.max_ratio} of the lists"),
+    ]
+    return stages, checks
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Builds the parser of the command line.
+
+    Returns
+    -------
+    argparse.ArgumentParser
+        The parser.
+    """
+    parser = argparse.ArgumentParser(description="Compare the analytics read into numpy arrays with the lists of rows.")
+    parser.add_argument("--days", type=int, default=3653, help="number of days of sales, up to yesterday")
+    parser.add_argument("--transactions", type=int, default=1000000, help="number of transactions, of one line each")
+    parser.add_argument("--items", type=int, default=1000, help="number of items of the catalog")
+    parser.add_argument("--runs", type=int, default=3, help="number of runs of the quicker stages, the best is kept")
+    parser.add_argument("--max-ratio", type=float, default=1.0, help="maximum time of a conversion to arrays, relative to the lists")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the sales")
+    parser.add_argument("--database", help="database file, a new temporary one by default")
+    return parser
+
+def main(argv: list[str] = None):
+    """
+    The entry point of the analytics benchmark.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        The command line arguments. Defaults to None, which reads them from `sys.argv`.
+    """
+    args = build_parser().parse_args(argv)
+
+    # Run on a database and settings of its own, before the application reads them
+    directory = tempfile.mkdtemp(prefix="pos_analytics_")
+    os.environ["POS_DATABASE"] = args.database or os.path.join(directory, "analytics.db")
+    os.environ["POS_CONFIG"] = os.path.join(directory, "config.json")
+
+    stages, checks = run(args)
+    print(f"{'stage':<22} {'rows':>8} {'lists_ms':>10} {'arrays_ms':>10}")
+    for name, rows, lists_ms, arrays_ms in stages:
+        print(f"{name:<22} {rows:>8} {lists_ms:>10.1f} {arrays_ms:>10.1f}")
+    print()
+    for name, passed, values in checks:
+        print(f"{name:<14} {'ok' if passed else 'FAILED':<7} {values}")
+    passed = all(passed for _, passed, _ in checks)
+    print("PASSED" if passed else "FAILED")
+    sys.exit(0 if passed else 1)
+
+if __name__ == '__main__':
+    main()
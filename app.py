@@ -13,9 +13,15 @@ import sys
 import os
 from PyQt6.QtWidgets import QApplication
 from PyQt6.QtGui import QIcon
+from PyQt6.QtCore import QTimer
 from frontend.main_window import POSApp
 from database.database import create_db
 from backend.path import get_resource_path
+from backend.config import get_setting
+from backend.sync import SyncEngine, HttpTransport
+from backend.snapshot import start_scheduler
+from backend.maintenance import start_maintenance
+from backend.quick_keys import start_quick_keys
 
 # Add an ID to the application in order to display the icon in the Windows taskbar
 try:
@@ -31,10 +37,12 @@ def main():
 
     This function performs the following steps:
     1. Creates the database if it doesn't exist.
-    2. Initializes the PyQt application.
-    3. Sets the application icon.
-    4. Loads and applies the stylesheet from the frontend directory.
-    5. Initializes and displays the main window of the POS system.
+    2. Starts syncing with the back-office hub, if this is a terminal,
+       refreshing the reporting snapshot and the quick keys and maintaining the database in the background.
+    3. Initializes the PyQt application.
+    4. Sets the application icon.
+    5. Loads and applies the stylesheet from the frontend directory.
+    6. Initializes and displays the main window of the POS system.
 
     If the stylesheet is not found, a warning message is printed, and the application
     will use the default style instead.
@@ -42,6 +50,15 @@ def main():
     # Create the database if it doesn't exist
     create_db()
 
+    # Sync with the back-office hub in the background
+    if get_setting("sync_role") == "terminal":
+        SyncEngine(HttpTransport(get_setting("sync_hub_url"))).start()
+
+    # Keep the reporting snapshot and the quick keys fresh, and maintain the database when the tills are idle
+    start_scheduler()
+    start_maintenance()
+    start_quick_keys()
+
     # Initialize the PyQt application
     app = QApplication(sys.argv)
     
@@ -60,6 +77,10 @@ def main():
     window = POSApp()
     window.show()
 
+    # Quit once the window is painted, to measure the startup time (see startup_bench.py)
+    if os.environ.get("POS_EXIT_AFTER_START"):
+        QTimer.singleShot(0, app.quit)
+
     # Start the application's event loop
     sys.exit(app.exec())
 
@@ -0,0 +1,335 @@
+from database.database import get_engine, get_archive_path, archive_prefix
+from database.migrations import migrate
+from database.models import Base, Items, Transaction, TransactionItem, TransactionDiscount, DailySales, ItemSales, ItemDaySales
+from sqlalchemy import MetaData, Table, create_engine, select, update, delete, func, literal, text
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+from datetime import datetime
+import glob, os, re
+
+# Copies of the transaction tables bound to the schema of each attached archive
+archive_metadata = MetaData()
+
+def get_archived_years() -> list[int]:
+    """
+    Lists the years whose transactions were moved to an archive database.
+
+    Returns
+    -------
+    list of int
+        The archived years, in ascending order.
+    """
+    years = []
+    for path in glob.glob(glob.escape(archive_prefix) + "_[0-9][0-9][0-9][0-9].db"):
+        match = re.search(r"_(\d{4})\.db$", os.path.basename(path))
+        if match:
+            years.append(int(match.group(1)))
+    return sorted(years)
+
+def day_key_date(day_key):
+    """
+    Builds the SQL expression formatting a YYYYMMDD day key as the YYYY-MM-DD date of the rollups.
+    """
+    return func.printf('%04d-%02d-%02d', day_key // 10000, day_key // 100 % 100, day_key % 100)
+
+def get_archivable_years() -> list[int]:
+    """
+    Lists the closed years that still have transactions in the main database.
+
+    Returns
+    -------
+    list of int
+        The years that can be archived, in ascending order.
+    """
+    # The years are read from the `ix_transactions_day_key` index, day keys are YYYYMMDD
+    with get_engine().connect() as connection:
+        years = connection.execute(
+            select((Transaction.day_key // 10000).label('year'))
+            .where(Transaction.day_key < datetime.now().year * 10000)
+            .distinct()
+        ).scalars().all()
+    return sorted(int(year) for year in years if year)
+
+def get_archive_tables(year: int) -> tuple[Table, Table]:
+    """
+    Returns the transaction tables of an archive, qualified with its schema name.
+
+    The tables can only be queried on a connection where the archive was
+    attached with `attach_archive`.
+
+    Parameters
+    ----------
+    year : int
+        The archived year.
+
+    Returns
+    -------
+    tuple of (Table, Table)
+        The `transactions` and `transaction_items` tables of the archive.
+    """
+    schema = f"archive_{year}"
+    if f"{schema}.transactions" not in archive_metadata.tables:
+        Transaction.__table__.to_metadata(archive_metadata, schema=schema)
+        TransactionItem.__table__.to_metadata(archive_metadata, schema=schema)
+        TransactionDiscount.__table__.to_metadata(archive_metadata, schema=schema)
+    return (
+        archive_metadata.tables[f"{schema}.transactions"],
+        archive_metadata.tables[f"{schema}.transaction_items"]
+    )
+
+def attach_archive(connection: Connection, year: int) -> str:
+    """
+    Attaches the archive database of a year to a connection, if it isn't attached yet.
+
+    Parameters
+    ----------
+    connection : sqlalchemy.engine.Connection
+        The connection to the main database.
+    year : int
+        The archived year.
+
+    Returns
+    -------
+    str
+        The schema name of the attached archive.
+    """
+    schema = f"archive_{int(year)}"
+    attached = {row[1] for row in connection.exec_driver_sql("PRAGMA database_list")}
+    if schema not in attached:
+        connection.exec_driver_sql(f"ATTACH DATABASE ? AS {schema}", (get_archive_path(int(year)),))
+    return schema
+
+def item_sales_rollup(transaction_items: Table, year: int):
+    """
+    Returns the query of the quantity, revenue and margin sold of each item in a table of sale lines.
+
+    Parameters
+    ----------
+    transaction_items : Table
+        The sale lines, of the main database or of an attached archive.
+    year : int
+        The year of the sales.
+
+    Returns
+    -------
+    sqlalchemy.sql.Select
+        The query, with the columns of `ItemSales`.
+    """
+    return (
+        select(
+            literal(year),
+            transaction_items.c.item_id,
+            func.sum(transaction_items.c.quantity),
+            func.coalesce(func.sum(transaction_items.c.line_total), 0),
+            # Lines without a known cost are left out of the margin
+            func.sum(transaction_items.c.line_total - transaction_items.c.quantity * transaction_items.c.unit_cost)
+        )
+        .group_by(transaction_items.c.item_id)
+    )
+
+def item_day_sales_rollup():
+    """
+    Returns the query of the quantity sold of each item each day, in the transactions of the main database.
+
+    Returns
+    -------
+    sqlalchemy.sql.Select
+        The query, with the columns of `ItemDaySales`.
+    """
+    return (
+        select(Transaction.day_key, TransactionItem.item_id, func.sum(TransactionItem.quantity))
+        .join(Transaction, Transaction.id == TransactionItem.transaction_id)
+        .where(Transaction.day_key.is_not(None))
+        .group_by(Transaction.day_key, TransactionItem.item_id)
+    )
+
+def add_item_day_sales(session: Session, sales: dict[tuple[int, int], int]):
+    """
+    Adds the quantities of new sales to the daily sales rollup of each item, in the transaction of the session.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.Session
+        The session saving the sales.
+    sales : dict
+        The quantity sold of each item, by day key and item id.
+    """
+    if not sales:
+        return
+    rollup = insert(ItemDaySales)
+    session.execute(
+        rollup.on_conflict_do_update(
+            index_elements=['day_key', 'item_id'],
+            set_={'quantity': ItemDaySales.quantity + rollup.excluded.quantity}
+        ),
+        [{'day_key': day, 'item_id': item_id, 'quantity': quantity} for (day, item_id), quantity in sales.items()]
+    )
+
+def archive_year(year: int) -> int:
+    """
+    Moves the transactions of a closed year into its archive database.
+
+    The transactions, their items and their discounts are copied to the archive, their daily
+    and per-item sales are added to the rollup tables of the main database and then they are
+    deleted from the main database. Everything happens in a single transaction, so a failure
+    leaves both databases untouched. Archiving a year again moves the transactions
+    added to it since the last time.
+
+    Parameters
+    ----------
+    year : int
+        The year to archive. It must be before the current year.
+
+    Returns
+    -------
+    int
+        The number of transactions archived.
+
+    Raises
+    ------
+    ValueError
+        If the year is not closed yet.
+    """
+    if year >= datetime.now().year:
+        raise ValueError(f"Only closed years can be archived, {year} is still open.")
+
+    # Create the archive database with the transaction tables only, and bring older archives up to date
+    archive_engine = create_engine(f"sqlite:///{get_archive_path(year)}")
+    Base.metadata.create_all(
+        archive_engine, tables=[Transaction.__table__, TransactionItem.__table__, TransactionDiscount.__table__]
+    )
+    migrate(archive_engine)
+    archive_engine.dispose()
+
+    transactions, transaction_items = Transaction.__table__, TransactionItem.__table__
+    archived_transactions, archived_items = get_archive_tables(year)
+
+    in_year = (transactions.c.day_key >= year * 10000) & (transactions.c.day_key < (year + 1) * 10000)
+    transaction_ids = select(transactions.c.id).where(in_year)
+    in_transactions = transaction_items.c.transaction_id.in_(transaction_ids)
+    transaction_discounts = TransactionDiscount.__table__
+    archived_discounts = archive_metadata.tables[f"archive_{year}.transaction_discounts"]
+    in_discounted = transaction_discounts.c.transaction_id.in_(transaction_ids)
+
+    with get_engine().connect() as connection:
+        attach_archive(connection, year)
+        connection.commit()
+
+        # Copy the transactions and their items into the archive
+        columns = [column.name for column in transactions.columns]
+        connection.execute(archived_transactions.insert().from_select(
+            columns, select(*transactions.c).where(in_year)
+        ))
+        columns = [column.name for column in transaction_items.columns]
+        connection.execute(archived_items.insert().from_select(
+            columns, select(*transaction_items.c).where(in_transactions)
+        ))
+        columns = [column.name for column in transaction_discounts.columns]
+        connection.execute(archived_discounts.insert().from_select(
+            columns, select(*transaction_discounts.c).where(in_discounted)
+        ))
+
+        # Add their sales to the rollups
+        daily_sales = insert(DailySales).from_select(
+            ['date', 'total_sales', 'transactions'],
+            select(day_key_date(transactions.c.day_key), func.sum(transactions.c.total_amount), func.count())
+            .where(in_year)
+            .group_by(transactions.c.day_key)
+        )
+        connection.execute(daily_sales.on_conflict_do_update(
+            index_elements=['date'],
+            set_={
+                'total_sales': DailySales.total_sales + daily_sales.excluded.total_sales,
+                'transactions': DailySales.transactions + daily_sales.excluded.transactions
+            }
+        ))
+        item_sales = insert(ItemSales).from_select(
+            ['year', 'item_id', 'quantity', 'revenue', 'margin'],
+            item_sales_rollup(transaction_items, year).where(in_transactions)
+        )
+        connection.execute(item_sales.on_conflict_do_update(
+            index_elements=['year', 'item_id'],
+            set_={
+                'quantity': ItemSales.quantity + item_sales.excluded.quantity,
+                'revenue': ItemSales.revenue + item_sales.excluded.revenue,
+                # The margin stays unknown only if both are
+                'margin': func.coalesce(
+                    ItemSales.margin + item_sales.excluded.margin, ItemSales.margin, item_sales.excluded.margin
+                )
+            }
+        ))
+
+        # Remove them from the main database
+        connection.execute(delete(ItemDaySales).where(
+            (ItemDaySales.day_key >= year * 10000) & (ItemDaySales.day_key < (year + 1) * 10000)
+        ))
+        connection.execute(delete(transaction_items).where(in_transactions))
+        connection.execute(delete(transaction_discounts).where(in_discounted))
+        archived = connection.execute(delete(transactions).where(in_year)).rowcount
+        connection.commit()
+
+        connection.execute(text(f"DETACH DATABASE archive_{year}"))
+
+    return archived
+
+def rebuild_rollups() -> int:
+    """
+    Recomputes the rollup tables from the archive databases, and the daily sales
+    of each item from the transactions of the main database.
+
+    Archives made by older versions are migrated first, and their sale lines
+    are backfilled with the current price of their items.
+
+    Returns
+    -------
+    int
+        The number of archived years processed.
+    """
+    years = get_archived_years()
+    for year in years:
+        # Archives made by older versions lack the columns of the rollups
+        archive_engine = create_engine(f"sqlite:///{get_archive_path(year)}")
+        migrate(archive_engine)
+        archive_engine.dispose()
+
+    with get_engine().connect() as connection:
+        for year in years:
+            attach_archive(connection, year)
+        connection.commit()
+
+        connection.execute(delete(DailySales))
+        connection.execute(delete(ItemSales))
+        connection.execute(delete(ItemDaySales))
+        connection.execute(ItemDaySales.__table__.insert().from_select(
+            ['day_key', 'item_id', 'quantity'], item_day_sales_rollup()
+        ))
+        for year in years:
+            transactions, transaction_items = get_archive_tables(year)
+
+            # Lines archived before prices were saved get the current price of their item
+            unit_price = select(Items.price).where(Items.id == transaction_items.c.item_id).scalar_subquery()
+            connection.execute(
+                update(transaction_items).where(transaction_items.c.unit_price.is_(None)).values(unit_price=unit_price)
+            )
+            connection.execute(
+                update(transaction_items).where(transaction_items.c.line_total.is_(None))
+                .values(line_total=transaction_items.c.unit_price * transaction_items.c.quantity)
+            )
+
+            connection.execute(DailySales.__table__.insert().from_select(
+                ['date', 'total_sales', 'transactions'],
+                select(day_key_date(transactions.c.day_key), func.sum(transactions.c.total_amount), func.count())
+                .where(transactions.c.day_key.is_not(None))
+                .group_by(transactions.c.day_key)
+            ))
+            connection.execute(ItemSales.__table__.insert().from_select(
+                ['year', 'item_id', 'quantity', 'revenue', 'margin'],
+                item_sales_rollup(transaction_items, year)
+            ))
+        connection.commit()
+
+        for year in years:
+            connection.execute(text(f"DETACH DATABASE archive_{year}"))
+
+    return len(years)
@@ -0,0 +1,135 @@
+from database.database import get_session
+from database.models import Items, Store, Reservation, ParkedCart
+from backend.config import get_setting
+from backend.locations import get_till_location
+from backend.services import reserved_quantity, with_retry
+from sqlalchemy import select, insert, update, delete, func, and_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from datetime import datetime, timedelta
+import json
+
+def park_cart(cart_id: str, cart: list[tuple], total: float):
+    """
+    Parks a cart, so the till can serve other customers until it is resumed.
+
+    The items stay reserved for the cart, with their time to live renewed. Parking a
+    cart again replaces its saved lines.
+
+    Parameters
+    ----------
+    cart_id : str
+        The identifier of the cart.
+    cart : list of tuple
+        A list of tuples where each tuple contains the item name and quantity.
+    total : float
+        The total amount of the cart.
+    """
+    location_id, _ = get_till_location()
+    lines = json.dumps([[name, quantity] for name, quantity in cart], separators=(',', ':'))
+
+    def operation():
+        with get_session() as session:
+            now = datetime.now()
+            statement = sqlite_insert(ParkedCart).values(
+                cart_id=cart_id, location_id=location_id, lines=lines, total=total, parked_at=now
+            )
+            session.execute(statement.on_conflict_do_update(
+                index_elements=['cart_id'],
+                set_={'lines': statement.excluded.lines, 'total': statement.excluded.total, 'parked_at': now}
+            ))
+            session.execute(
+                update(Reservation).where(Reservation.cart_id == cart_id)
+                .values(expires_at=now + timedelta(seconds=get_setting("reservation_ttl")))
+            )
+            session.commit()
+
+    with_retry(operation)
+
+def get_parked_carts() -> list[tuple]:
+    """
+    Retrieves the carts parked at the till's location, oldest first.
+
+    Returns
+    -------
+    list of tuple
+        A list of tuples with the identifier, the time it was parked, the number of items
+        and the total amount of each cart.
+    """
+    location_id, _ = get_till_location()
+    with get_session() as session:
+        return session.execute(
+            select(ParkedCart.cart_id, ParkedCart.parked_at, func.json_array_length(ParkedCart.lines), ParkedCart.total)
+            .where(ParkedCart.location_id == location_id)
+            .order_by(ParkedCart.parked_at)
+        ).all()
+
+def resume_cart(cart_id: str) -> tuple[list[tuple], list[str]]:
+    """
+    Resumes a parked cart, reserving its items again.
+
+    Its reservations may have expired while it was parked, so the stock of all its
+    items is checked again with a single query. Items sold out meanwhile are reduced to
+    the quantity still available, or removed from the cart. The reservations are dropped
+    first, which takes the write lock, so no other till can take the stock between the
+    check and the new reservations.
+
+    Parameters
+    ----------
+    cart_id : str
+        The identifier of the cart.
+
+    Returns
+    -------
+    tuple of (list of tuple, list of str)
+        The name, current price and quantity of each item of the resumed cart, and the
+        names of the items whose quantity was reduced or that were removed.
+
+    Raises
+    ------
+    KeyError
+        If there is no parked cart with that identifier.
+    """
+    location_id, _ = get_till_location()
+
+    def operation():
+        with get_session() as session:
+            session.execute(delete(Reservation).where(Reservation.cart_id == cart_id))
+            lines = session.execute(select(ParkedCart.lines).where(ParkedCart.cart_id == cart_id)).scalar()
+            if lines is None:
+                session.rollback()
+                raise KeyError(cart_id)
+            cart = json.loads(lines)
+
+            now = datetime.now()
+            found = {
+                name: (item_id, price, available) for item_id, name, price, available in session.execute(
+                    select(
+                        Items.id, Items.name, Items.price,
+                        func.coalesce(Store.stock, 0) - reserved_quantity(Items.id, location_id, now)
+                    )
+                    .outerjoin(Store, and_(Store.location_id == location_id, Store.item_id == Items.id))
+                    .where(Items.name.in_([name for name, _ in cart]))
+                )
+            }
+
+            resumed, short, reservations = [], [], []
+            expires_at = now + timedelta(seconds=get_setting("reservation_ttl"))
+            for name, quantity in cart:
+                item_id, price, available = found.get(name, (None, None, 0))
+                taken = min(quantity, max(available, 0))
+                if taken < quantity:
+                    short.append(name)
+                if taken:
+                    resumed.append((name, price, taken))
+                    reservations.append({
+                        'cart_id': cart_id, 'item_id': item_id, 'location_id': location_id,
+                        'quantity': taken, 'expires_at': expires_at
+                    })
+
+            if reservations:
+                session.execute(insert(Reservation), reservations)
+            session.execute(delete(ParkedCart).where(ParkedCart.cart_id == cart_id))
+            session.commit()
+            return resumed, short
+
+    return with_retry(operation)
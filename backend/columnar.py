@@ -0,0 +1,402 @@
+from database.database import reporting_path, parquet_path
+from database.models import day_key
+from backend.config import get_setting
+from backend.snapshot import ensure_snapshot
+from importlib.util import find_spec
+from datetime import date, datetime
+import numpy as np
+import json, os, threading, time
+
+# Engines of the analytics reports: SQLite itself, DuckDB on the reporting snapshot and DuckDB on its Parquet export
+ENGINES = ("sqlite", "duckdb", "parquet")
+
+# Tables of the Parquet export, with the column holding the transaction of their rows
+EXPORTED = {"transactions": "id", "transaction_items": "transaction_id"}
+
+# Files of a table in the Parquet export, each with the sales of a refresh, after which they are merged into one
+MAX_FILES = 16
+
+# Totals of the item reports, as the expression of a sale line and the column of the `item_sales` rollup
+METRICS = {
+    "quantity": ("quantity", "quantity"),
+    "revenue": ("line_total", "revenue"),
+    "margin": ("line_total - quantity * unit_cost", "margin"),
+}
+
+# The report queries of `get_transactions` and `sold_items_sorted`, on the views made by `connect`
+DAILY_SALES = """
+    SELECT day_key, sum(amount) AS amount, sum(transactions) AS transactions FROM (
+        SELECT day_key, sum(total_amount) AS amount, count(*) AS transactions FROM transactions
+        WHERE day_key IS NOT NULL AND day_key >= $start GROUP BY day_key
+        UNION ALL
+        SELECT CAST(strftime(date, '%Y%m%d') AS INTEGER), total_sales, transactions FROM daily_sales
+        WHERE date >= $start_date
+    ) GROUP BY day_key ORDER BY day_key
+"""
+ITEM_TOTALS = """
+    SELECT item_id, CAST(sum(value) AS DOUBLE) AS total FROM (
+        SELECT item_id, {line} AS value FROM transaction_items WHERE transaction_id <= $last
+        UNION ALL
+        SELECT item_id, {rollup} FROM item_sales
+    ) GROUP BY item_id HAVING sum(value) IS NOT NULL
+"""
+
+# State of the snapshot the export is checked against, read by SQLite itself from its indexes
+SNAPSHOT_STATE = """
+    SELECT CAST(last_id AS BIGINT), CAST(rollups AS BIGINT), CAST(version AS BIGINT) FROM sqlite_query('snapshot',
+        'SELECT (SELECT coalesce(max(id), 0) FROM transactions) AS last_id, (SELECT count(*) FROM daily_sales) AS rollups,
+        (SELECT user_version FROM pragma_user_version) AS version')
+"""
+
+# Serializes the refreshes of the Parquet export
+_lock = threading.Lock()
+
+# Whether DuckDB and its SQLite extension could be loaded, None until it is checked
+_available = None
+
+# DuckDB database in memory shared by the reports, with the snapshot attached. Loading the SQLite
+# extension takes a third of a second, so it is only done once, and each report opens a cursor on it.
+_database = None
+_database_lock = threading.Lock()
+
+def _literal(value: str) -> str:
+    """
+    Quotes a string as an SQL literal, for the statements of DuckDB that take no parameters.
+    """
+    return "'" + value.replace("'", "''") + "'"
+
+def _load_sqlite(connection):
+    """
+    Loads the SQLite extension of DuckDB into a connection.
+
+    The extension is loaded from the `duckdb-extension-sqlite-scanner` package if it is
+    installed, so computers without internet access can use it, and otherwise DuckDB
+    downloads it the first time.
+    """
+    import duckdb
+    spec = find_spec("duckdb_extension_sqlite_scanner")
+    if spec is not None:
+        path = os.path.join(
+            spec.submodule_search_locations[0], "extensions", f"v{duckdb.__version__}", "sqlite_scanner.duckdb_extension"
+        )
+        if os.path.exists(path):
+            connection.execute(f"LOAD {_literal(path)}")
+            return
+    connection.execute("LOAD sqlite")
+
+def is_available() -> bool:
+    """
+    Checks that the DuckDB engine can run, which needs the optional `duckdb` package and its SQLite extension.
+
+    It is only checked once per process.
+    """
+    global _available
+    if _available is None:
+        try:
+            _cursor().close()
+            _available = True
+        except Exception as error:
+            print(f"Warning: The DuckDB analytics engine is not available, using SQLite: {error}")
+            _available = False
+    return _available
+
+def get_analytics_engine() -> str:
+    """
+    Returns the engine the analytics reports run on, from the "analytics_engine" setting.
+
+    Returns
+    -------
+    str
+        One of `ENGINES`. It is "sqlite" if the setting asks for a DuckDB engine but DuckDB is not available.
+    """
+    engine = get_setting("analytics_engine")
+    if engine not in ENGINES or (engine != "sqlite" and not is_available()):
+        return "sqlite"
+    return engine
+
+def _cursor():
+    """
+    Opens a connection to the shared DuckDB database, creating it the first time.
+    """
+    global _database
+    with _database_lock:
+        if _database is None:
+            import duckdb
+            ensure_snapshot()
+            database = duckdb.connect()
+            try:
+                _load_sqlite(database)
+                database.execute(f"ATTACH {_literal(reporting_path)} AS snapshot (TYPE sqlite, READ_ONLY)")
+            except Exception:
+                database.close()
+                raise
+            _database = database
+        return _database.cursor()
+
+def _rows_after(connection, table: str, after: int, last_id: int = None) -> str:
+    """
+    Builds the query of the rows of an exported table made after a transaction, and up to another.
+
+    Unless all the rows are read, the query runs on SQLite, through the index on the transaction
+    of the rows, since DuckDB would read the whole table to filter it. SQLite returns its values as text, so they are
+    cast back to the types of the columns.
+    """
+    key = EXPORTED[table]
+    if not after:
+        # All the rows are read anyway, and reading the table directly is faster than casting text
+        return f"SELECT * FROM snapshot.{table}" + (f" WHERE {key} <= {int(last_id)}" if last_id is not None else "")
+    condition = f"{key} > {int(after)}" + (f" AND {key} <= {int(last_id)}" if last_id is not None else "")
+    columns = ", ".join(
+        f'CAST("{name}" AS {column_type}) AS "{name}"'
+        for name, column_type, *_ in connection.execute(f"DESCRIBE snapshot.{table}").fetchall()
+    )
+    return f"SELECT {columns} FROM sqlite_query('snapshot', 'SELECT * FROM {table} WHERE {condition}')"
+
+def _read_manifest() -> dict | None:
+    """
+    Reads the description of the Parquet export: its files and the state of the snapshot it was made from.
+    """
+    try:
+        with open(os.path.join(parquet_path, "manifest.json")) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+def _files(manifest: dict, table: str) -> str:
+    """
+    Lists the files of a table in the Parquet export, as the SQL list `read_parquet` takes.
+    """
+    return "[" + ", ".join(_literal(os.path.join(parquet_path, name)) for name in manifest["files"][table]) + "]"
+
+def _is_current(manifest: dict | None, state: tuple) -> bool:
+    """
+    Tells whether an export can be read with the snapshot, its later sales being read from the snapshot itself.
+
+    Archiving a year deletes its transactions and adds its rollups, and a migration changes
+    the tables, so the export is made again after either.
+    """
+    last_id, rollups, version = state
+    return (
+        manifest is not None and manifest["rollups"] == rollups and manifest["version"] == version
+        and manifest["last_id"] <= last_id
+    )
+
+def _export(connection, full: bool = False) -> int:
+    """
+    Refreshes the Parquet export from the snapshot attached to a connection, see `export_parquet`.
+    """
+    state = connection.execute(SNAPSHOT_STATE).fetchone()
+    last_id = state[0]
+    manifest = _read_manifest()
+    if full or not _is_current(manifest, state):
+        manifest = None
+    elif manifest["last_id"] == last_id:
+        return manifest["transactions"]
+
+    os.makedirs(parquet_path, exist_ok=True)
+    after = manifest["last_id"] if manifest else 0
+    # Only the new rows are read from the snapshot, into a file of their own, until the files are merged
+    append = manifest is not None and len(manifest["files"]["transactions"]) < MAX_FILES
+    first = after + 1 if append else 1
+    files, exported = {}, manifest["transactions"] if append else 0
+    for table in EXPORTED:
+        rows = _rows_after(connection, table, after, last_id)
+        if manifest is not None and not append:
+            rows = f"SELECT * FROM read_parquet({_files(manifest, table)}) UNION ALL BY NAME {rows}"
+        # The files are named after their transactions, so the files of the previous export are kept for its readers
+        name = f"{table}_{first}_{last_id}.parquet"
+        written = connection.execute(
+            f"COPY ({rows}) TO {_literal(os.path.join(parquet_path, name))} (FORMAT parquet)"
+        ).fetchone()[0]
+        files[table] = (manifest["files"][table] if append else []) + [name]
+        if table == "transactions":
+            exported += written
+
+    manifest = {
+        "last_id": last_id, "rollups": state[1], "version": state[2], "transactions": exported,
+        "files": files, "exported_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    temporary = os.path.join(parquet_path, "manifest.json.tmp")
+    with open(temporary, "w") as file:
+        json.dump(manifest, file, indent=4)
+    os.replace(temporary, os.path.join(parquet_path, "manifest.json"))
+
+    for name in os.listdir(parquet_path):
+        if name.endswith(".parquet") and not any(name in names for names in files.values()):
+            try:
+                os.remove(os.path.join(parquet_path, name))
+            except OSError:
+                pass
+    return exported
+
+def connect(engine: str):
+    """
+    Opens a connection to DuckDB with the tables of the reports as views.
+
+    The reporting snapshot is attached read-only through DuckDB's SQLite extension. With
+    the "duckdb" engine the views read its tables directly. With the "parquet" engine the
+    transactions and their lines are read from the Parquet export, which is columnar and
+    compressed, and only those made after the export from the snapshot. The rollups are
+    small, so they are always read from the snapshot. If the export doesn't match the
+    snapshot, it is made first.
+
+    Parameters
+    ----------
+    engine : str
+        The engine, "duckdb" or "parquet".
+
+    Returns
+    -------
+    duckdb.DuckDBPyConnection
+        The connection, to close after use.
+    """
+    ensure_snapshot()
+    connection = _cursor()
+    try:
+        # Temporary views belong to the connection, so the reports running at once don't share them
+        for table in ("daily_sales", "item_sales"):
+            connection.execute(f"CREATE TEMP VIEW {table} AS SELECT * FROM snapshot.{table}")
+        if engine != "parquet":
+            for table in EXPORTED:
+                connection.execute(f"CREATE TEMP VIEW {table} AS SELECT * FROM snapshot.{table}")
+            return connection
+
+        manifest = _read_manifest()
+        if not _is_current(manifest, connection.execute(SNAPSHOT_STATE).fetchone()):
+            with _lock:
+                _export(connection)
+            manifest = _read_manifest()
+        for table in EXPORTED:
+            connection.execute(
+                f"CREATE TEMP VIEW {table} AS SELECT * FROM read_parquet({_files(manifest, table)}) "
+                f"UNION ALL BY NAME {_rows_after(connection, table, manifest['last_id'])}"
+            )
+        return connection
+    except Exception:
+        connection.close()
+        raise
+
+def export_parquet(full: bool = False) -> int:
+    """
+    Exports the transactions and their lines of the reporting snapshot to Parquet, for the "parquet" engine.
+
+    The transactions are only added to, so each refresh only reads the transactions made
+    since the previous one from the snapshot, and saves them to files of their own. Once
+    there are `MAX_FILES` of them, they are merged into one. The export is made again from
+    the whole snapshot the first time, after archiving a year and after a migration.
+
+    Parameters
+    ----------
+    full : bool, optional
+        Whether to make the export again from the whole snapshot. Defaults to False.
+
+    Returns
+    -------
+    int
+        The number of transactions in the export.
+    """
+    ensure_snapshot()
+    with _lock, _cursor() as connection:
+        return _export(connection, full)
+
+def daily_sales(start: date = None, engine: str = "duckdb") -> np.ndarray:
+    """
+    Totals the sales by day on DuckDB, as `get_transactions` does on SQLite.
+
+    Parameters
+    ----------
+    start : date, optional
+        Only include the days from this one on. Defaults to None, which includes all of them.
+    engine : str, optional
+        The engine, "duckdb" or "parquet". Defaults to "duckdb".
+
+    Returns
+    -------
+    numpy.ndarray
+        A row per day, in order, with its YYYYMMDD day key, total sales amount and number of transactions.
+    """
+    parameters = {"start": day_key(start) if start else 0, "start_date": start or date.min}
+    with connect(engine) as connection:
+        result = connection.execute(DAILY_SALES, parameters).fetchnumpy()
+    return np.column_stack([result["day_key"], result["amount"], result["transactions"]]).astype(np.float64).reshape(-1, 3)
+
+def totals_by_item(metric: str, last_id: int, engine: str = "duckdb") -> tuple[np.ndarray, np.ndarray]:
+    """
+    Totals a metric of the sale lines by item on DuckDB, as `sold_items_sorted` does on SQLite.
+
+    Parameters
+    ----------
+    metric : str
+        The total: "quantity", "revenue" or "margin".
+    last_id : int
+        The id of the last transaction included, so the totals match those of SQLite on the same snapshot.
+    engine : str, optional
+        The engine, "duckdb" or "parquet". Defaults to "duckdb".
+
+    Returns
+    -------
+    tuple of (numpy.ndarray, numpy.ndarray)
+        - The ids of the items with a known total.
+        - Their totals, as `float64`.
+    """
+    line, rollup = METRICS[metric]
+    with connect(engine) as connection:
+        result = connection.execute(ITEM_TOTALS.format(line=line, rollup=rollup), {"last": last_id}).fetchnumpy()
+    return result["item_id"].astype(np.int64), result["total"].astype(np.float64)
+
+def compare_engines(engines: list[str] = None, start: date = None, tolerance: float = 1e-9) -> list[tuple]:
+    """
+    Runs the analytics reports on SQLite and on the DuckDB engines, and compares their results.
+
+    The daily sales, from the first day and from `start`, and the items ranked by each
+    metric are compared. The days, the items and the counts must be identical. The
+    amounts are summed in another order by each engine, so they may only differ by
+    the rounding of the floating point sums.
+
+    Parameters
+    ----------
+    engines : list of str, optional
+        The engines compared with SQLite. Defaults to None, for "duckdb" and "parquet".
+    start : date, optional
+        The first day of the second daily report. Defaults to None, for 90 days ago.
+    tolerance : float, optional
+        The largest difference allowed between two amounts, relative to the amount. Defaults to 1e-9.
+
+    Returns
+    -------
+    list of tuple
+        For each report and engine: the report, the engine, the number of rows, the seconds
+        the report took, the largest difference with SQLite and whether the results match.
+    """
+    from backend.services import get_transactions, sold_items_sorted
+    engines = engines or list(ENGINES[1:])
+    start = start or date.fromordinal(date.today().toordinal() - 90)
+
+    reports = [("daily", lambda engine: get_transactions(engine=engine)),
+               (f"daily from {start.isoformat()}", lambda engine: get_transactions(start, engine=engine))]
+    reports += [(f"items by {metric}", lambda engine, metric=metric: sold_items_sorted(metric, engine=engine)) for metric in METRICS]
+
+    comparison = []
+    for name, report in reports:
+        started = time.perf_counter()
+        expected = report("sqlite")
+        comparison.append((name, "sqlite", len(expected[0]), time.perf_counter() - started, 0.0, True))
+        for engine in engines:
+            started = time.perf_counter()
+            result = report(engine)
+            seconds = time.perf_counter() - started
+
+            if name.startswith("daily"):
+                same = np.array_equal(result[0], expected[0]) and np.array_equal(result[2], expected[2])
+                amounts, expected_amounts = result[1], expected[1]
+            else:
+                # Items with equal totals may be ranked in another order, so they are compared by name
+                same = sorted(result[0]) == sorted(expected[0])
+                amounts = result[1][np.argsort(result[0], kind="stable")]
+                expected_amounts = expected[1][np.argsort(expected[0], kind="stable")]
+            difference = 0.0
+            if same and len(amounts):
+                difference = float(np.max(np.abs(amounts - expected_amounts)))
+                same = bool(np.all(np.abs(amounts - expected_amounts) <= tolerance * np.maximum(np.abs(expected_amounts), 1)))
+            comparison.append((name, engine, len(result[0]), seconds, difference, same))
+    return comparison
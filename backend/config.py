@@ -0,0 +1,117 @@
+import json, os
+
+# Settings are saved in the user's home directory, unless another file is given in POS_CONFIG
+config_path = os.environ.get("POS_CONFIG", os.path.join(os.path.expanduser("~"), ".pos_config.json"))
+
+# Default value of every setting
+DEFAULTS = {
+    # Name of the location whose stock this till sells, it is created if it doesn't exist
+    "till_location": "Main",
+    # Number of slots of the quick-key grid of the POS tab, the first 12 are bound to the keys F1 to F12
+    "quick_keys": 12,
+    # Number of columns of the quick-key grid
+    "quick_keys_columns": 6,
+    # Names of the items always shown in the first slots, the other slots hold the top sellers
+    "quick_keys_pinned": [],
+    # Seconds between refreshes of the top sellers of the quick-key grid
+    "quick_keys_interval": 5 * 60,
+    # Seconds between compilations of the promotions, they are also compiled when one starts or ends
+    "promotions_interval": 60,
+    # Seconds an item added to a cart stays reserved for it
+    "reservation_ttl": 15 * 60,
+    # Role of this database in the replication: None (standalone), "terminal" or "hub"
+    "sync_role": None,
+    # URL of the hub the terminal syncs with
+    "sync_hub_url": "http://127.0.0.1:8765",
+    # Seconds between syncs of a terminal
+    "sync_interval": 30,
+    # Maximum number of changes sent or received per request
+    "sync_batch_size": 500,
+    # Maximum age in seconds of the reporting snapshot before it's refreshed
+    "snapshot_interval": 5 * 60,
+    # Number of sales after which the reporting snapshot is refreshed
+    "snapshot_sales": 50,
+    # Engine of the analytics reports: "sqlite", or with the optional DuckDB installed "duckdb", which
+    # attaches the reporting snapshot, or "parquet", which reads a Parquet export of it, for long histories
+    "analytics_engine": "sqlite",
+    # Days of sales the forecast is computed from
+    "forecast_days": 365,
+    # Days after which the weight of a day of sales in the forecast is halved
+    "forecast_half_life": 14,
+    # Days a reorder takes to arrive
+    "reorder_lead_time": 7,
+    # Days of sales a reorder should cover after it arrives
+    "reorder_cover_days": 14,
+    # Folder the database backups are saved to, None for ".pos_backups" next to the database
+    "backup_dir": None,
+    # Number of backups kept, the oldest ones are deleted
+    "backup_keep": 7,
+    # Seconds between runs of each maintenance task
+    "backup_interval": 24 * 60 * 60,
+    "optimize_interval": 6 * 60 * 60,
+    "quick_check_interval": 24 * 60 * 60,
+    "vacuum_interval": 24 * 60 * 60,
+    "checkpoint_interval": 24 * 60 * 60,
+    "parquet_interval": 60 * 60,
+    # Maximum number of free pages returned to the file system by each vacuum
+    "vacuum_pages": 1000,
+    # Seconds without sales after which the database is considered idle for maintenance
+    "maintenance_idle": 10 * 60,
+}
+
+# Settings last loaded, with the modification time of the file they were loaded from
+_cache = (None, {})
+
+def load_config() -> dict:
+    """
+    Loads the settings saved in the configuration file.
+
+    The file is only read again when it changes, since settings are looked up
+    on hot paths such as checkout.
+
+    Returns
+    -------
+    dict
+        The saved settings, or an empty dictionary if the file doesn't exist.
+    """
+    global _cache
+    try:
+        mtime = os.stat(config_path).st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    if _cache[0] != mtime:
+        with open(config_path, "r") as file:
+            _cache = (mtime, json.load(file))
+    return dict(_cache[1])
+
+def get_setting(key: str):
+    """
+    Returns the value of a setting, falling back to its default value.
+
+    Parameters
+    ----------
+    key : str
+        The name of the setting.
+
+    Returns
+    -------
+    object
+        The value of the setting.
+    """
+    return load_config().get(key, DEFAULTS.get(key))
+
+def set_setting(key: str, value):
+    """
+    Saves the value of a setting in the configuration file.
+
+    Parameters
+    ----------
+    key : str
+        The name of the setting.
+    value : object
+        The new value, it must be serializable to JSON.
+    """
+    config = load_config()
+    config[key] = value
+    with open(config_path, "w") as file:
+        json.dump(config, file, indent=4)
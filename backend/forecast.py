@@ -0,0 +1,206 @@
+from database.database import get_reporting_session
+from database.models import Transaction, TransactionItem, ItemDaySales, day_key
+from backend.config import get_setting
+from backend.services import get_item_columns
+from backend.snapshot import ensure_snapshot
+from sqlalchemy import Float, Integer, column, func, select, values
+from sqlalchemy.orm import Session
+from datetime import date
+from itertools import chain
+import numpy as np
+
+# Weighted sales of the last forecast: the day it ends on, the last transaction it includes, its item ids,
+# the quantities each item sold times the weights of their days, and the settings they were weighted with
+_cache = {'day': None, 'last_id': None, 'item_ids': None, 'sales': None, 'days': None, 'half_life': None}
+
+def day_weights(today: date, ages: range, half_life: float) -> list[tuple[int, float]]:
+    """
+    Returns the day key and weight of the days of some ages, the weight halving every `half_life` days.
+
+    Parameters
+    ----------
+    today : date
+        The day of age 0.
+    ages : range
+        The ages of the days, in days before `today`. Negative ages are days after it.
+    half_life : float
+        The number of days after which the weight of a day is halved.
+
+    Returns
+    -------
+    list of tuple of (int, float)
+        The day key and weight of each day.
+    """
+    ordinal = today.toordinal()
+    return [(day_key(date.fromordinal(ordinal - age)), 0.5 ** (age / half_life)) for age in ages]
+
+def weighted_sales(session: Session, weights: list[tuple[int, float]], after: int = None) -> np.ndarray:
+    """
+    Sums the quantities sold of each item on some days, times the weight of their day.
+
+    Without a transaction id they are read from the daily sales rollup of each item, a row per
+    item and day. With one, from the lines of the transactions after it, the few the
+    snapshot added since the last forecast.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.Session
+        The session on the reporting snapshot.
+    weights : list of tuple of (int, float)
+        The day key and weight of each day, from `day_weights`.
+    after : int, optional
+        The id of the last transaction already summed. Defaults to None, for the rollup.
+
+    Returns
+    -------
+    numpy.ndarray
+        The rows of item id and weighted quantity, sorted by item id.
+    """
+    if after is not None:
+        # Bounding both tables by the id lets SQLite read only the transactions after it,
+        # and the few days they were sold on are weighted here
+        result = session.execute(
+            select(TransactionItem.item_id, Transaction.day_key, func.sum(TransactionItem.quantity))
+            .join(Transaction, Transaction.id == TransactionItem.transaction_id)
+            .where(TransactionItem.transaction_id > after, Transaction.id > after)
+            .group_by(Transaction.day_key, TransactionItem.item_id)
+        )
+        weight = dict(weights)
+        sold = [(item_id, quantity * weight.get(day, 0.0)) for item_id, day, quantity in result]
+        return np.array(sorted(sold), dtype=np.float64).reshape(-1, 2)
+
+    # SQLite reads the rollup by ranges of its key, a day at a time
+    days = values(column('day_key', Integer), column('weight', Float), name='weights').data(weights).cte('weights')
+    result = session.execute(
+        select(ItemDaySales.item_id, func.sum(ItemDaySales.quantity * days.c.weight))
+        .select_from(days)
+        .join(ItemDaySales, ItemDaySales.day_key == days.c.day_key)
+        .group_by(ItemDaySales.item_id)
+        .order_by(ItemDaySales.item_id)
+    )
+    # Flatten the rows straight into the array, numpy is slow at converting row objects
+    return np.fromiter(chain.from_iterable(result), dtype=np.float64).reshape(-1, 2)
+
+def add_sales(item_ids: np.ndarray, sales: np.ndarray, rows: np.ndarray, sign: float = 1) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Adds weighted quantities to the weighted sales of the items, adding the items missing.
+
+    Parameters
+    ----------
+    item_ids : numpy.ndarray
+        The sorted ids of the items.
+    sales : numpy.ndarray
+        The weighted quantities of the items, which are updated in place if no item is missing.
+    rows : numpy.ndarray
+        The rows of item id and weighted quantity to add, from `weighted_sales`.
+    sign : float, optional
+        -1 to subtract the quantities instead. Defaults to 1.
+
+    Returns
+    -------
+    tuple of (numpy.ndarray, numpy.ndarray)
+        The ids of the items and their weighted quantities.
+    """
+    ids = rows[:, 0].astype(np.int64)
+    missing = np.setdiff1d(ids, item_ids)
+    if len(missing):
+        # Items added since are given rows of their own
+        all_ids = np.union1d(item_ids, missing)
+        all_sales = np.zeros(len(all_ids))
+        all_sales[np.searchsorted(all_ids, item_ids)] = sales
+        item_ids, sales = all_ids, all_sales
+    np.add.at(sales, np.searchsorted(item_ids, ids), sign * rows[:, 1])
+    return item_ids, sales
+
+def get_velocity(today: date = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the sales velocity of every item sold, computed from the reporting snapshot.
+
+    The velocity is an exponentially weighted mean of the quantities sold on each of the last
+    "forecast_days" days, whose weight halves every "forecast_half_life" days. It's built from the
+    daily sales rollup of each item, and cached: when the snapshot holds new sales, only their
+    transactions are queried and added to it, and when the day changes, the weights are shifted
+    and the days out of the window subtracted, so it's only built from scratch the first time.
+
+    Parameters
+    ----------
+    today : date, optional
+        The last day of the window. Defaults to the current date.
+
+    Returns
+    -------
+    tuple of (numpy.ndarray, numpy.ndarray)
+        - The sorted ids of the items.
+        - Their estimated units sold per day.
+    """
+    days, half_life = get_setting("forecast_days"), get_setting("forecast_half_life")
+    today = today or date.today()
+
+    ensure_snapshot()
+    with get_reporting_session() as session:
+        last_id = session.execute(select(func.max(Transaction.id))).scalar() or 0
+
+        shift = (today - _cache['day']).days if _cache['day'] else days
+        if (
+            _cache['sales'] is None or (_cache['days'], _cache['half_life']) != (days, half_life)
+            or not 0 <= shift < days or last_id < _cache['last_id']
+        ):
+            rows = weighted_sales(session, day_weights(today, range(days), half_life))
+            _cache['item_ids'], _cache['sales'] = rows[:, 0].astype(np.int64), rows[:, 1].copy()
+        else:
+            item_ids, sales, day = _cache['item_ids'], _cache['sales'], _cache['day']
+            if last_id > _cache['last_id']:
+                # New sales are weighted by the day of the last forecast, including the days since
+                rows = weighted_sales(session, day_weights(day, range(-shift, days), half_life), _cache['last_id'])
+                item_ids, sales = add_sales(item_ids, sales, rows)
+            if shift:
+                # The oldest days leave the window, and the weights of the others halve with age
+                rows = weighted_sales(session, day_weights(day, range(days - shift, days), half_life))
+                item_ids, sales = add_sales(item_ids, sales, rows, -1)
+                # Items whose sales all left the window are left with rounding errors instead of 0
+                sales = np.where(np.abs(sales) < 1e-9, 0.0, sales * 0.5 ** (shift / half_life))
+            _cache['item_ids'], _cache['sales'] = item_ids, sales
+        _cache.update(day=today, last_id=last_id, days=days, half_life=half_life)
+
+    weights = 0.5 ** (np.arange(days) / half_life)
+    return _cache['item_ids'], _cache['sales'] / weights.sum()
+
+def get_forecast() -> dict[str, np.ndarray]:
+    """
+    Forecasts the sales velocity, days of stock left and reorder quantity of every item.
+
+    The velocity comes from `get_velocity` and the stock is always the current one.
+    An item should be reordered when its stock doesn't cover the "reorder_lead_time"
+    plus "reorder_cover_days" days of sales.
+
+    Returns
+    -------
+    dict of str to numpy.ndarray
+        The columns "name", "stock", "velocity", "days_left" and "reorder", one row per item,
+        the items running out first at the top. Items that don't sell have infinite days left.
+    """
+    item_ids, velocity = get_velocity()
+
+    columns = get_item_columns()
+    ids, names, stock = columns['id'], columns['name'], columns['stock'].astype(np.float64)
+
+    # Align the velocity with the current items, the ones added after the snapshot didn't sell yet
+    item_velocity = np.zeros(len(ids))
+    if len(item_ids):
+        index = np.searchsorted(item_ids, ids).clip(max=len(item_ids) - 1)
+        known = item_ids[index] == ids
+        item_velocity[known] = velocity[index[known]]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days_left = np.where(item_velocity > 0, stock / item_velocity, np.inf)
+    target = item_velocity * (get_setting("reorder_lead_time") + get_setting("reorder_cover_days"))
+    reorder = np.ceil(np.maximum(target - stock, 0)).astype(np.int64)
+
+    order = np.argsort(days_left, kind='stable')
+    return {
+        'name': names[order],
+        'stock': stock[order].astype(np.int64),
+        'velocity': item_velocity[order],
+        'days_left': days_left[order],
+        'reorder': reorder[order]
+    }
@@ -0,0 +1,197 @@
+from database.database import get_engine, get_session
+from database.models import Items, Location, Store, StockMovement, StockCheckpoint, StockCheckpointLine
+from sqlalchemy import select, insert, func, literal, union_all
+from datetime import datetime
+
+# Causes of the stock movements
+KINDS = ("sale", "receipt", "adjustment", "transfer")
+
+def record_movements(session, kind: str, movements: list[tuple], reference: str = None):
+    """
+    Records stock movements in the ledger, within the caller's database transaction.
+
+    It must be called in the same transaction as the change to the stock it records,
+    so the ledger and the stock never disagree.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.session.Session
+        The session of the ongoing database transaction.
+    kind : str
+        The cause of the movements, one of `KINDS`.
+    movements : list of tuple
+        The item id, location id and quantity added to the stock of each movement,
+        negative for the quantities taken from it. Movements of 0 are skipped.
+    reference : str, optional
+        What the movements belong to, e.g. the id of the transaction of a sale. Defaults to None.
+    """
+    now = datetime.now()
+    rows = [
+        {'item_id': item_id, 'location_id': location_id, 'kind': kind,
+         'quantity': quantity, 'reference': reference, 'created_at': now}
+        for item_id, location_id, quantity in movements if quantity
+    ]
+    if rows:
+        session.execute(insert(StockMovement), rows)
+
+def create_checkpoint() -> tuple[int | None, int]:
+    """
+    Saves a copy of the current stock as a checkpoint, unless nothing moved since the last one.
+
+    The checkpoint row is inserted first, with the id of the last movement, which takes
+    the write lock, so the stock copied next matches that movement exactly.
+
+    Returns
+    -------
+    tuple of (int or None, int)
+        The id of the new checkpoint, None if none was needed, and the number of stock entries saved.
+    """
+    with get_session() as session:
+        last = session.execute(select(func.coalesce(func.max(StockMovement.id), 0))).scalar()
+        previous = session.execute(select(func.max(StockCheckpoint.last_movement_id))).scalar()
+        if previous is not None and previous >= last:
+            return None, 0
+
+        checkpoint_id = session.execute(
+            insert(StockCheckpoint)
+            .from_select(
+                ['taken_at', 'last_movement_id'],
+                select(literal(datetime.now()), func.coalesce(func.max(StockMovement.id), 0))
+            )
+            .returning(StockCheckpoint.id)
+        ).scalar()
+        saved = session.execute(
+            insert(StockCheckpointLine).from_select(
+                ['checkpoint_id', 'item_id', 'location_id', 'stock'],
+                select(literal(checkpoint_id), Store.item_id, Store.location_id, Store.stock).where(Store.stock != 0)
+            )
+        ).rowcount
+        session.commit()
+        return checkpoint_id, saved
+
+def get_stock_at(when: datetime, name: str = None, location: str = None) -> list[tuple]:
+    """
+    Rebuilds the stock of the items at a past time.
+
+    The stock is read from the last checkpoint taken at or before that time, and the
+    movements made between the checkpoint and the time are added to it. The movements
+    are read as a range of ids, bounded by the next checkpoint, so at most the movements
+    of the interval between two checkpoints are read, however long the history.
+
+    Parameters
+    ----------
+    when : datetime
+        The time of the stock.
+    name : str, optional
+        Only rebuild the stock of the item with this name. Defaults to None, for all the items.
+    location : str, optional
+        Only rebuild the stock of this location. Defaults to None, for all the locations.
+
+    Returns
+    -------
+    list of tuple
+        The name, location and stock of each item and location with stock, sorted by name and location.
+
+    Raises
+    ------
+    ValueError
+        If the time is earlier than the first checkpoint, when the ledger started.
+    """
+    with get_engine().connect() as connection:
+        checkpoint = connection.execute(
+            select(StockCheckpoint.id, StockCheckpoint.last_movement_id)
+            .where(StockCheckpoint.taken_at <= when)
+            .order_by(StockCheckpoint.taken_at.desc())
+            .limit(1)
+        ).first()
+        if checkpoint is None:
+            raise ValueError(f"There is no stock history before {when:%Y-%m-%d %H:%M}.")
+        checkpoint_id, first = checkpoint
+        # Movements after the next checkpoint were made after the time
+        last = connection.execute(
+            select(func.min(StockCheckpoint.last_movement_id)).where(StockCheckpoint.taken_at > when)
+        ).scalar()
+
+        saved = select(
+            StockCheckpointLine.item_id.label('item_id'),
+            StockCheckpointLine.location_id.label('location_id'),
+            StockCheckpointLine.stock.label('quantity')
+        ).where(StockCheckpointLine.checkpoint_id == checkpoint_id)
+        moved = select(StockMovement.item_id, StockMovement.location_id, StockMovement.quantity).where(
+            StockMovement.id > first, StockMovement.created_at <= when
+        )
+        if last is not None:
+            moved = moved.where(StockMovement.id <= last)
+
+        filters = []
+        if name is not None:
+            item_id = connection.execute(select(Items.id).where(Items.name == name)).scalar()
+            if item_id is None:
+                return []
+            saved, moved = saved.where(StockCheckpointLine.item_id == item_id), moved.where(StockMovement.item_id == item_id)
+        if location is not None:
+            filters.append(Location.name == location)
+
+        stock = union_all(saved, moved).subquery()
+        total = func.sum(stock.c.quantity)
+        return connection.execute(
+            select(Items.name, Location.name, total)
+            .select_from(stock)
+            .join(Items, Items.id == stock.c.item_id)
+            .join(Location, Location.id == stock.c.location_id)
+            .where(*filters)
+            .group_by(stock.c.item_id, stock.c.location_id)
+            .having(total != 0)
+            .order_by(Items.name, Location.name)
+        ).tuples().all()
+
+def get_movements(
+    name: str = None, location: str = None, kind: str = None,
+    start: datetime = None, end: datetime = None, limit: int = 100
+) -> list[tuple]:
+    """
+    Retrieves the stock movements, newest first, to audit the changes to the stock.
+
+    Parameters
+    ----------
+    name : str, optional
+        Only include the movements of the item with this name. Defaults to None.
+    location : str, optional
+        Only include the movements of this location. Defaults to None.
+    kind : str, optional
+        Only include the movements of this kind, one of `KINDS`. Defaults to None.
+    start : datetime, optional
+        Only include the movements made at or after this time. Defaults to None.
+    end : datetime, optional
+        Only include the movements made before this time. Defaults to None.
+    limit : int, optional
+        The maximum number of movements returned. Defaults to 100.
+
+    Returns
+    -------
+    list of tuple
+        The time, item name, location name, kind, quantity and reference of each movement.
+    """
+    query = (
+        select(
+            StockMovement.created_at, Items.name, Location.name,
+            StockMovement.kind, StockMovement.quantity, StockMovement.reference
+        )
+        .outerjoin(Items, Items.id == StockMovement.item_id)
+        .join(Location, Location.id == StockMovement.location_id)
+        .order_by(StockMovement.id.desc())
+        .limit(limit)
+    )
+    if name is not None:
+        query = query.where(StockMovement.item_id == select(Items.id).where(Items.name == name).scalar_subquery())
+    if location is not None:
+        query = query.where(Location.name == location)
+    if kind is not None:
+        query = query.where(StockMovement.kind == kind)
+    if start is not None:
+        query = query.where(StockMovement.created_at >= start)
+    if end is not None:
+        query = query.where(StockMovement.created_at < end)
+
+    with get_session() as session:
+        return session.execute(query).all()
@@ -0,0 +1,67 @@
+from database.database import get_session
+from database.models import Location
+from backend.config import get_setting
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+# Location of the stock of databases created before there were locations, and of the
+# stock changes replicated by tills of older versions
+DEFAULT_LOCATION = "Main"
+
+# IDs of the locations already looked up, they never change
+_location_ids = {}
+
+def lookup_location(session, name: str, create: bool = False) -> int:
+    """
+    Looks up the ID of a location by name, within the caller's database transaction.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.session.Session
+        The session of the ongoing database transaction.
+    name : str
+        The name of the location.
+    create : bool, optional
+        Whether to create the location if it doesn't exist. Defaults to False.
+
+    Returns
+    -------
+    int
+        The ID of the location.
+
+    Raises
+    ------
+    KeyError
+        If there is no location with that name and `create` is False.
+    """
+    if create:
+        session.execute(sqlite_insert(Location).values(name=name).on_conflict_do_nothing(index_elements=['name']))
+    found = session.execute(select(Location.id).where(Location.name == name)).scalar()
+    if found is None:
+        raise KeyError(name)
+    return found
+
+def get_till_location() -> tuple[int, str]:
+    """
+    Returns the location this till sells from, given by the "till_location" setting.
+
+    The location is created the first time a till is bound to it.
+
+    Returns
+    -------
+    tuple of (int, str)
+        The ID and the name of the location.
+    """
+    name = get_setting("till_location") or DEFAULT_LOCATION
+    if name not in _location_ids:
+        with get_session() as session:
+            _location_ids[name] = lookup_location(session, name, create=True)
+            session.commit()
+    return _location_ids[name], name
+
+def get_locations() -> list[str]:
+    """
+    Retrieves the names of all the locations, in the order they were created.
+    """
+    with get_session() as session:
+        return session.execute(select(Location.name).order_by(Location.id)).scalars().all()
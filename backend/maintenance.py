@@ -0,0 +1,372 @@
+from database.database import get_engine, get_session, backup_database, database_path, BackupBusyError
+from database.models import Transaction, MaintenanceLog
+from backend.config import get_setting
+from backend.ledger import create_checkpoint
+from sqlalchemy import select, func
+from datetime import datetime, timedelta
+import glob, os, threading, time
+
+# Checks of the data the tills rely on, each a query returning the offending rows
+CHECKS = {
+    "negative stock": "SELECT items.name, store.stock FROM store JOIN items ON items.id = store.item_id WHERE store.stock < 0",
+    "items without stock entry": "SELECT items.name FROM items LEFT JOIN store ON store.item_id = items.id WHERE store.id IS NULL",
+    "stock entries without item": "SELECT store.id FROM store LEFT JOIN items ON items.id = store.item_id WHERE items.id IS NULL",
+    "stock entries without location": (
+        "SELECT store.id, store.location_id FROM store "
+        "LEFT JOIN locations ON locations.id = store.location_id WHERE locations.id IS NULL"
+    ),
+    "lines without transaction": (
+        "SELECT transaction_items.id FROM transaction_items "
+        "LEFT JOIN transactions ON transactions.id = transaction_items.transaction_id WHERE transactions.id IS NULL"
+    ),
+    "lines with a wrong total": (
+        "SELECT id, quantity, unit_price, line_total FROM transaction_items "
+        "WHERE abs(line_total + discount - unit_price * quantity) > 0.005"
+    ),
+    "stock not matching its ledger": (
+        "SELECT items.name, store.location_id, store.stock, COALESCE(saved.stock, 0) + COALESCE(moved.quantity, 0) "
+        "FROM store JOIN items ON items.id = store.item_id "
+        "LEFT JOIN stock_checkpoint_lines saved ON saved.checkpoint_id = (SELECT max(id) FROM stock_checkpoints) "
+        "AND saved.item_id = store.item_id AND saved.location_id = store.location_id "
+        "LEFT JOIN (SELECT item_id, location_id, sum(quantity) AS quantity FROM stock_movements "
+        "WHERE id > (SELECT COALESCE(max(last_movement_id), 0) FROM stock_checkpoints) GROUP BY item_id, location_id) moved "
+        "ON moved.item_id = store.item_id AND moved.location_id = store.location_id "
+        "WHERE store.stock != COALESCE(saved.stock, 0) + COALESCE(moved.quantity, 0)"
+    ),
+    "total stock not matching the locations": (
+        "SELECT items.name, items.total_stock, COALESCE(sum(store.stock), 0) AS total FROM items "
+        "LEFT JOIN store ON store.item_id = items.id GROUP BY items.id HAVING items.total_stock != total"
+    ),
+    "daily item sales not matching the sales": (
+        "SELECT day_key, item_id, sum(quantity) AS difference FROM ("
+        "SELECT transactions.day_key, transaction_items.item_id, transaction_items.quantity FROM transaction_items "
+        "JOIN transactions ON transactions.id = transaction_items.transaction_id WHERE transactions.day_key IS NOT NULL "
+        "UNION ALL SELECT day_key, item_id, -quantity FROM item_day_sales"
+        ") GROUP BY day_key, item_id HAVING difference != 0"
+    ),
+    "discounts without transaction": (
+        "SELECT transaction_discounts.id FROM transaction_discounts "
+        "LEFT JOIN transactions ON transactions.id = transaction_discounts.transaction_id WHERE transactions.id IS NULL"
+    ),
+}
+
+def check_integrity(quick: bool = False) -> list[str]:
+    """
+    Checks the database file and the consistency of its data.
+
+    SQLite's own check verifies the file structure and the indexes, and the
+    foreign key check finds rows pointing to missing parents. Then each query
+    in `CHECKS` looks for data the application never writes.
+
+    Parameters
+    ----------
+    quick : bool, optional
+        Whether to run `PRAGMA quick_check`, which skips verifying that the indexes
+        match their tables, instead of the full `PRAGMA integrity_check`. Defaults to False.
+
+    Returns
+    -------
+    list of str
+        A description of each problem found, empty if the database is fine.
+    """
+    problems = []
+    with get_engine().connect() as connection:
+        pragma = "quick_check" if quick else "integrity_check"
+        for message, in connection.exec_driver_sql(f"PRAGMA {pragma}"):
+            if message != "ok":
+                problems.append(f"{pragma}: {message}")
+
+        for table, rowid, parent, _ in connection.exec_driver_sql("PRAGMA foreign_key_check"):
+            problems.append(f"foreign key: row {rowid} of {table} points to a missing {parent} row")
+
+        for name, query in CHECKS.items():
+            rows = connection.exec_driver_sql(query).all()
+            if rows:
+                sample = ", ".join(" ".join(str(value) for value in row) for row in rows[:5])
+                problems.append(f"{name}: {len(rows)} rows, e.g. {sample}")
+
+    return problems
+
+def get_backup_dir() -> str:
+    """
+    Returns the folder the database backups are saved to, from the "backup_dir" setting,
+    or ".pos_backups" next to the database by default.
+    """
+    return get_setting("backup_dir") or os.path.join(os.path.dirname(database_path), ".pos_backups")
+
+def backup() -> tuple[int, str]:
+    """
+    Saves a backup of the database and deletes the oldest ones beyond "backup_keep".
+
+    The backup is made with the SQLite online backup API a few pages at a time,
+    so the tills keep selling while it runs. If their writes keep restarting it, it is
+    given up and tried again at the next check for due tasks.
+
+    Returns
+    -------
+    tuple of (int, str)
+        The number of pages copied and "ok" with the path of the backup, or "busy".
+    """
+    folder = get_backup_dir()
+    os.makedirs(folder, exist_ok=True)
+    # Backups are named after the database, "pos_inventory" for the default one, so databases
+    # sharing the folder never prune each other's
+    name = os.path.basename(os.path.splitext(database_path)[0]).lstrip(".")
+    path = os.path.join(folder, f"{name}_{datetime.now():%Y%m%d-%H%M%S}.db")
+    try:
+        pages = backup_database(path)
+    except BackupBusyError as error:
+        return 0, f"busy: {error}"
+
+    # The timestamp in the name sorts the backups from oldest to newest
+    pattern = f"{glob.escape(name)}_{'[0-9]' * 8}-{'[0-9]' * 6}.db"
+    backups = sorted(glob.glob(os.path.join(glob.escape(folder), pattern)))
+    for old in backups[:-get_setting("backup_keep")]:
+        os.remove(old)
+
+    return pages, f"ok: {path}"
+
+def optimize() -> tuple[int, str]:
+    """
+    Updates the statistics the query planner uses to choose indexes.
+
+    The first time the statistics are gathered with `ANALYZE`, later `PRAGMA optimize`
+    only analyzes the tables whose size changed a lot. Each index is sampled rather
+    than read whole, so it takes a fraction of a second on large databases.
+
+    Returns
+    -------
+    tuple of (int, str)
+        The number of pages of the database and "ok".
+    """
+    with get_engine().connect() as connection:
+        connection.exec_driver_sql("PRAGMA analysis_limit = 1000")
+        analyzed = connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+        ).first()
+        connection.exec_driver_sql("PRAGMA optimize" if analyzed else "ANALYZE")
+        connection.commit()
+        pages = connection.exec_driver_sql("PRAGMA page_count").scalar()
+    return pages, "ok"
+
+def quick_check() -> tuple[int, str]:
+    """
+    Runs `check_integrity` with SQLite's quick check.
+
+    Returns
+    -------
+    tuple of (int, str)
+        The number of pages checked and "ok" or the problems found.
+    """
+    problems = check_integrity(quick=True)
+    with get_engine().connect() as connection:
+        pages = connection.exec_driver_sql("PRAGMA page_count").scalar()
+    return pages, "; ".join(problems) if problems else "ok"
+
+def vacuum(pages: int = None) -> tuple[int, str]:
+    """
+    Returns up to "vacuum_pages" free pages to the file system with `PRAGMA incremental_vacuum`.
+
+    Unlike `VACUUM`, it doesn't rewrite the database, so it is short and doesn't
+    need exclusive access for long. It only works on databases in incremental
+    auto-vacuum mode, see `enable_incremental_vacuum`.
+
+    Parameters
+    ----------
+    pages : int, optional
+        The maximum number of pages to free. Defaults to None, which uses the "vacuum_pages" setting.
+
+    Returns
+    -------
+    tuple of (int, str)
+        The number of pages freed and "ok", or a note if the database is not in incremental mode.
+    """
+    with get_engine().connect() as connection:
+        if connection.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+            return 0, "auto_vacuum is not incremental"
+        before = connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+        # The pragma frees a page per step and the driver steps it only once, except in a script
+        connection.connection.driver_connection.executescript(
+            f"PRAGMA incremental_vacuum({int(pages or get_setting('vacuum_pages'))});"
+        )
+        after = connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+    return before - after, "ok"
+
+def enable_incremental_vacuum() -> tuple[int, str]:
+    """
+    Switches a database created by an older version to incremental auto-vacuum.
+
+    The switch needs a full `VACUUM`, which rewrites the database and blocks the tills
+    while it runs, so it is only run on demand, from the command line tool.
+
+    Returns
+    -------
+    tuple of (int, str)
+        The number of pages of the rewritten database and "ok".
+    """
+    with get_engine().connect() as connection:
+        connection.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+        connection.exec_driver_sql("VACUUM")
+        pages = connection.exec_driver_sql("PRAGMA page_count").scalar()
+    return pages, "ok"
+
+def checkpoint() -> tuple[int, str]:
+    """
+    Takes a checkpoint of the stock, so the stock at later times is rebuilt from it.
+
+    Returns
+    -------
+    tuple of (int, str)
+        The number of stock entries saved and "ok" with the checkpoint, or "ok" if nothing moved since the last one.
+    """
+    checkpoint_id, saved = create_checkpoint()
+    return saved, f"ok: checkpoint {checkpoint_id}" if checkpoint_id is not None else "ok"
+
+def parquet() -> tuple[int, str]:
+    """
+    Refreshes the Parquet export of the reporting snapshot, if the analytics reports run on the "parquet" engine.
+
+    The reports read the sales made since the export from the snapshot, so the fresher
+    the export, the fewer rows they read from SQLite.
+
+    Returns
+    -------
+    tuple of (int, str)
+        The number of transactions in the export and "ok", or 0 and a note if the engine isn't used.
+    """
+    # Imported here, since it needs numpy, which the command line tool doesn't load for the other tasks
+    from backend.columnar import get_analytics_engine, export_parquet
+
+    if get_analytics_engine() != "parquet":
+        return 0, "the parquet engine is not used"
+    return export_parquet(), "ok"
+
+# Maintenance tasks, with the setting of the seconds between their runs
+TASKS = {
+    "backup": (backup, "backup_interval"),
+    "optimize": (optimize, "optimize_interval"),
+    "quick_check": (quick_check, "quick_check_interval"),
+    "vacuum": (vacuum, "vacuum_interval"),
+    "checkpoint": (checkpoint, "checkpoint_interval"),
+    "parquet": (parquet, "parquet_interval"),
+}
+
+def run_task(task: str, function=None) -> MaintenanceLog:
+    """
+    Runs a maintenance task and records how long it took and how many pages it touched.
+
+    Errors are recorded as the result of the task instead of being raised, so
+    a failing task doesn't stop the others. Nothing is printed, the callers show
+    the record as they need, e.g. the command line tool as JSON.
+
+    Parameters
+    ----------
+    task : str
+        The name of the task, a key of `TASKS`.
+    function : callable, optional
+        The function to run instead of the task's own. Defaults to None.
+
+    Returns
+    -------
+    MaintenanceLog
+        The record of the run.
+    """
+    started_at, start = datetime.now(), time.perf_counter()
+    try:
+        pages, result = (function or TASKS[task][0])()
+    except Exception as error:
+        pages, result = 0, f"error: {error}"
+
+    entry = MaintenanceLog(
+        task=task, started_at=started_at, seconds=time.perf_counter() - start, pages=pages, result=result
+    )
+    with get_session() as session:
+        session.add(entry)
+        session.commit()
+        session.refresh(entry)
+        session.expunge(entry)
+    return entry
+
+def get_maintenance_log(limit: int = 20) -> list[MaintenanceLog]:
+    """
+    Retrieves the last runs of the maintenance tasks, newest first.
+
+    Parameters
+    ----------
+    limit : int, optional
+        The number of runs to retrieve. Defaults to 20.
+
+    Returns
+    -------
+    list of MaintenanceLog
+        The runs.
+    """
+    with get_session() as session:
+        return session.query(MaintenanceLog).order_by(MaintenanceLog.started_at.desc()).limit(limit).all()
+
+def due_tasks() -> list[str]:
+    """
+    Lists the maintenance tasks whose interval has passed since their last run.
+
+    Runs given up because the database was busy don't count, so they are retried.
+    """
+    with get_session() as session:
+        last_runs = dict(
+            session.query(MaintenanceLog.task, func.max(MaintenanceLog.started_at))
+            .filter(MaintenanceLog.result.notlike("busy%"))
+            .group_by(MaintenanceLog.task).all()
+        )
+    now = datetime.now()
+    return [
+        task for task, (_, interval) in TASKS.items()
+        if task not in last_runs or now - last_runs[task] >= timedelta(seconds=get_setting(interval))
+    ]
+
+# Last transaction seen by `is_idle` and since when it is the last one
+_activity = (None, None)
+
+def is_idle() -> bool:
+    """
+    Checks that no till has made a sale in the last "maintenance_idle" seconds.
+
+    Sales are detected by a new last transaction id, which also catches the sales
+    synced from other tills whatever their clocks say.
+    """
+    global _activity
+    with get_session() as session:
+        last_id = session.execute(select(func.max(Transaction.id))).scalar()
+    now = datetime.now()
+    if _activity[1] is None or last_id != _activity[0]:
+        _activity = (last_id, now)
+    return now - _activity[1] >= timedelta(seconds=get_setting("maintenance_idle"))
+
+def start_maintenance(check_every: float = 60) -> threading.Event:
+    """
+    Runs the due maintenance tasks on a background thread whenever the database is idle.
+
+    Parameters
+    ----------
+    check_every : float, optional
+        The seconds between checks for due tasks. Defaults to 60.
+
+    Returns
+    -------
+    threading.Event
+        An event that stops the thread when set.
+    """
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(check_every):
+            try:
+                for task in due_tasks():
+                    # Stop as soon as a till starts selling again
+                    if stop.is_set() or not is_idle():
+                        break
+                    entry = run_task(task)
+                    print(f"Maintenance: {task} took {entry.seconds:.2f} s, {entry.pages} pages, {entry.result}")
+            except Exception as error:
+                print(f"Warning: Could not run the database maintenance: {error}")
+
+    threading.Thread(target=run, name="maintenance", daemon=True).start()
+    return stop
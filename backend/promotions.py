@@ -0,0 +1,491 @@
+from database.database import get_session
+from database.models import Items, Promotion
+from backend.config import get_setting
+from sqlalchemy import select, delete, func, or_
+from datetime import datetime, timedelta
+import json, threading
+
+# Kinds of promotions, see `Promotion`
+KINDS = ("percent", "multibuy", "bundle")
+
+class Rule:
+    """
+    A promotion compiled for evaluation, computing the discount of the cart lines it applies to.
+    """
+    __slots__ = ('id', 'name', 'kind', 'quantity', 'value', 'bundle')
+
+    def __init__(self, id: int, name: str, kind: str, quantity: int, value: float, bundle: tuple = ()):
+        self.id, self.name, self.kind = id, name, kind
+        self.quantity, self.value, self.bundle = quantity, value, bundle
+
+    def evaluate(self, lines: dict[str, tuple[int, float]]) -> dict[str, float]:
+        """
+        Computes the discount of the cart lines the rule applies to.
+
+        Parameters
+        ----------
+        lines : dict
+            The quantity and unit price of the lines of the cart with the items of the rule, by item name.
+
+        Returns
+        -------
+        dict
+            The discount of each line, rounded to cents, for the lines discounted.
+        """
+        if self.kind == "percent":
+            ratio = self.value / 100
+            return {name: round(quantity * price * ratio, 2) for name, (quantity, price) in lines.items()}
+
+        if self.kind == "multibuy":
+            # The most expensive units are grouped first, so the customer gets the best deal
+            groups = sum(quantity for quantity, _ in lines.values()) // self.quantity
+            if not groups:
+                return {}
+            left, gross, grouped = groups * self.quantity, 0.0, {}
+            for name, (quantity, price) in sorted(lines.items(), key=lambda line: -line[1][1]):
+                units = min(quantity, left)
+                grouped[name] = units * price
+                gross += units * price
+                left -= units
+                if not left:
+                    break
+            discount = gross - groups * self.value
+
+        else:
+            # A bundle needs one of each of its items, as many times as the scarcest one is bought
+            if len(lines) < len(self.bundle):
+                return {}
+            count = min(quantity for quantity, _ in lines.values())
+            grouped = {name: count * price for name, (_, price) in lines.items()}
+            gross = sum(grouped.values())
+            discount = gross - count * self.value
+
+        # The discount is shared by the lines in proportion to the amount they put in
+        if discount <= 0:
+            return {}
+        return {name: round(amount * discount / gross, 2) for name, amount in grouped.items()}
+
+class PromotionIndex:
+    """
+    The promotions active at a time, looked up by the name of the items they apply to.
+
+    Attributes
+    ----------
+    by_item : dict
+        The rules targeting each item, or that have it in their bundle, by item name.
+    by_category : dict
+        The rules targeting each category, by category.
+    categories : dict
+        The category of the items of the categories with rules, by item name.
+    expires_at : datetime
+        The time the index must be compiled again, when a promotion starts or ends
+        or after "promotions_interval" seconds.
+    """
+    def __init__(self, by_item: dict, by_category: dict, categories: dict, expires_at: datetime):
+        self.by_item, self.by_category, self.categories = by_item, by_category, categories
+        self.expires_at = expires_at
+        self._rules = {}
+
+    def rules_for(self, name: str) -> tuple:
+        """
+        Returns the rules that apply to an item.
+        """
+        rules = self._rules.get(name)
+        if rules is None:
+            rules = self._rules[name] = (
+                tuple(self.by_item.get(name, ())) + tuple(self.by_category.get(self.categories.get(name), ()))
+            )
+        return rules
+
+def compile_promotions(now: datetime = None) -> PromotionIndex:
+    """
+    Compiles the promotions active at a time into an index by item and category.
+
+    Parameters
+    ----------
+    now : datetime, optional
+        The time of the evaluation. Defaults to the current time.
+
+    Returns
+    -------
+    PromotionIndex
+        The compiled promotions.
+    """
+    now = now or datetime.now()
+    by_item, by_category = {}, {}
+    with get_session() as session:
+        rows = session.execute(
+            select(
+                Promotion.id, Promotion.name, Promotion.kind, Items.name, Promotion.category,
+                Promotion.quantity, Promotion.value, Promotion.bundle
+            )
+            .outerjoin(Items, Items.id == Promotion.item_id)
+            .where(
+                or_(Promotion.starts_at.is_(None), Promotion.starts_at <= now),
+                or_(Promotion.ends_at.is_(None), Promotion.ends_at > now)
+            )
+        ).all()
+        for id, name, kind, item, category, quantity, value, bundle in rows:
+            if kind == "bundle":
+                members = tuple(json.loads(bundle))
+                rule = Rule(id, name, kind, quantity, value, members)
+                for member in members:
+                    by_item.setdefault(member, []).append(rule)
+            elif item is not None:
+                by_item.setdefault(item, []).append(Rule(id, name, kind, quantity, value))
+            elif category is not None:
+                by_category.setdefault(category, []).append(Rule(id, name, kind, quantity, value))
+
+        categories = dict(session.execute(
+            select(Items.name, Items.category).where(Items.category.in_(list(by_category)))
+        ).all()) if by_category else {}
+
+        # The index is valid until the next promotion starts or ends
+        starts = select(func.min(Promotion.starts_at)).where(Promotion.starts_at > now).scalar_subquery()
+        ends = select(func.min(Promotion.ends_at)).where(Promotion.ends_at > now).scalar_subquery()
+        changes = session.execute(select(starts, ends)).one()
+
+    expires_at = min(
+        [now + timedelta(seconds=get_setting("promotions_interval"))] + [change for change in changes if change is not None]
+    )
+    return PromotionIndex(by_item, by_category, categories, expires_at)
+
+# Promotions compiled last, replaced whole on each refresh so the tills read them without locks
+_index = None
+
+# Serializes the compilations of the promotions
+_lock = threading.Lock()
+
+def refresh_promotions() -> PromotionIndex:
+    """
+    Compiles the promotions active now, replacing the ones returned by `get_promotion_index`.
+
+    Returns
+    -------
+    PromotionIndex
+        The compiled promotions.
+    """
+    global _index
+    with _lock:
+        _index = compile_promotions()
+        return _index
+
+def refresh_promotions_async():
+    """
+    Compiles the promotions on a background thread, unless a compilation is already running.
+    """
+    def run():
+        try:
+            refresh_promotions()
+        except Exception as error:
+            print(f"Warning: Could not compile the promotions: {error}")
+
+    if not _lock.locked():
+        threading.Thread(target=run, name="promotions", daemon=True).start()
+
+def get_promotion_index() -> PromotionIndex:
+    """
+    Returns the promotions compiled last, compiling them first if they never were.
+
+    Once they expire, they are compiled again on a background thread and the previous
+    ones are returned meanwhile, so pricing a cart never waits for the database.
+
+    Returns
+    -------
+    PromotionIndex
+        The compiled promotions.
+    """
+    index = _index
+    if index is None:
+        return refresh_promotions()
+    if index.expires_at <= datetime.now():
+        refresh_promotions_async()
+    return index
+
+class CartPricer:
+    """
+    Applies the promotions to a cart, incrementally.
+
+    Each change of a line only evaluates again the rules that apply to its item, over
+    the lines of the cart they apply to, so its cost doesn't grow with the size of the
+    cart nor with the number of promotions. Promotions add up, but the discounts of a
+    line never exceed its amount.
+
+    Attributes
+    ----------
+    index : PromotionIndex
+        The promotions applied.
+    lines : dict
+        The quantity and unit price of each line of the cart, by item name.
+    gross : float
+        The amount of the cart before the discounts.
+    discount : float
+        The amount taken off the cart by the promotions.
+    """
+    def __init__(self, index: PromotionIndex = None):
+        self.index = index or get_promotion_index()
+        self.clear()
+
+    def clear(self):
+        """
+        Removes all the lines of the cart.
+        """
+        self.lines = {}
+        self.gross = 0.0
+        self.discount = 0.0
+        # Lines each rule applies to, discount of each of those lines and sum of the discounts of each line
+        self._members = {}
+        self._shares = {}
+        self._line_discounts = {}
+        # Discount of each line, capped at its amount
+        self._capped = {}
+
+    def set_line(self, name: str, quantity: int, price: float) -> float:
+        """
+        Sets the quantity and unit price of a line of the cart, removing it if the quantity is 0.
+
+        If the promotions were compiled again since the last change, they are all applied
+        again to the whole cart first.
+
+        Parameters
+        ----------
+        name : str
+            The name of the item.
+        quantity : int
+            The quantity of the item in the cart.
+        price : float
+            The unit price of the item.
+
+        Returns
+        -------
+        float
+            The amount taken off the cart by the promotions.
+        """
+        index = get_promotion_index()
+        if index is not self.index:
+            lines = self.lines
+            self.index = index
+            self.clear()
+            for line, (line_quantity, line_price) in lines.items():
+                self._set_line(line, line_quantity, line_price)
+        self._set_line(name, quantity, price)
+        return self.discount
+
+    def add(self, name: str, quantity: int, price: float) -> float:
+        """
+        Adds a quantity of an item to the cart, or removes it if negative.
+
+        Parameters
+        ----------
+        name : str
+            The name of the item.
+        quantity : int
+            The quantity to add.
+        price : float
+            The unit price of the item.
+
+        Returns
+        -------
+        float
+            The amount taken off the cart by the promotions.
+        """
+        return self.set_line(name, self.lines.get(name, (0, price))[0] + quantity, price)
+
+    def _set_line(self, name: str, quantity: int, price: float):
+        old_quantity, old_price = self.lines.get(name, (0, 0.0))
+        self.gross += quantity * price - old_quantity * old_price
+        if quantity > 0:
+            self.lines[name] = (quantity, price)
+        else:
+            self.lines.pop(name, None)
+
+        changed = {name}
+        for rule in self.index.rules_for(name):
+            members = self._members.setdefault(rule, {})
+            if quantity > 0:
+                members[name] = (quantity, price)
+            else:
+                members.pop(name, None)
+
+            # Move the discounts of the rule from the lines it applied to, to the ones it applies to now
+            shares = rule.evaluate(members) if members else {}
+            for line, share in self._shares.pop(rule, {}).items():
+                self._line_discounts[line] -= share
+                changed.add(line)
+            for line, share in shares.items():
+                self._line_discounts[line] = self._line_discounts.get(line, 0.0) + share
+                changed.add(line)
+            if shares:
+                self._shares[rule] = shares
+
+        for line in changed:
+            line_quantity, line_price = self.lines.get(line, (0, 0.0))
+            capped = min(max(self._line_discounts.get(line, 0.0), 0.0), line_quantity * line_price)
+            self.discount += capped - self._capped.get(line, 0.0)
+            self._capped[line] = capped
+            if line not in self.lines:
+                self._line_discounts.pop(line, None)
+                self._capped.pop(line, None)
+
+    @property
+    def total(self) -> float:
+        """
+        The amount of the cart after the discounts.
+        """
+        return round(self.gross - self.discount, 2)
+
+    def line_discount(self, name: str) -> float:
+        """
+        Returns the amount taken off a line by the promotions.
+        """
+        return round(self._capped.get(name, 0.0), 2)
+
+    def applied(self) -> list[tuple[int, str, float]]:
+        """
+        Returns the promotions applied to the cart.
+
+        When the promotions of a line add up to more than its amount, the share of each one
+        is scaled down to the capped discount of the line, so the discounts of the promotions
+        add up to the discount of the cart, to the cent.
+
+        Returns
+        -------
+        list of tuple of (int, str, float)
+            The identifier, name and discount of each promotion applied.
+        """
+        amounts = {}
+        for rule, shares in self._shares.items():
+            amount = 0.0
+            for line, share in shares.items():
+                raw = self._line_discounts.get(line, 0.0)
+                if raw > 0:
+                    amount += share * self._capped.get(line, 0.0) / raw
+            amounts[rule] = round(amount, 2)
+
+        # The cents lost or gained rounding each promotion go to the largest one
+        difference = round(sum(self.line_discount(line) for line in self.lines) - sum(amounts.values()), 2)
+        if difference and amounts:
+            largest = max(amounts, key=amounts.get)
+            amounts[largest] = round(amounts[largest] + difference, 2)
+        return [(rule.id, rule.name, amount) for rule, amount in amounts.items()]
+
+def save_promotion(
+    name: str, kind: str, value: float, item: str = None, category: str = None, quantity: int = None,
+    bundle: list[str] = None, starts_at: datetime = None, ends_at: datetime = None
+) -> int:
+    """
+    Adds a promotion, applied to the carts of this till from the next change.
+
+    Parameters
+    ----------
+    name : str
+        The name of the promotion, shown on the receipts.
+    kind : str
+        "percent", "multibuy" or "bundle", see `Promotion`.
+    value : float
+        The percentage off, or the price of the multi-buy units or of the bundle.
+    item : str, optional
+        The name of the item targeted, for percentages and multi-buys. Defaults to None.
+    category : str, optional
+        The category targeted, for percentages and multi-buys, instead of an item. Defaults to None.
+    quantity : int, optional
+        The number of units of a multi-buy deal. Defaults to None.
+    bundle : list of str, optional
+        The names of the items of a bundle. Defaults to None.
+    starts_at : datetime, optional
+        The time the promotion starts. Defaults to None, for now.
+    ends_at : datetime, optional
+        The time the promotion ends. Defaults to None, for never.
+
+    Returns
+    -------
+    int
+        The identifier of the promotion.
+
+    Raises
+    ------
+    ValueError
+        If the kind is unknown or its parameters don't fit it.
+    KeyError
+        If an item doesn't exist.
+    """
+    if kind not in KINDS:
+        raise ValueError(f"Unknown kind of promotion {kind!r}, expected one of {', '.join(KINDS)}.")
+    if kind == "bundle":
+        bundle = list(dict.fromkeys(bundle or []))
+        if len(bundle) < 2 or item is not None or category is not None:
+            raise ValueError("A bundle needs at least two different items, and no item nor category.")
+    elif (item is None) == (category is None) or bundle:
+        raise ValueError("The promotion needs either an item or a category.")
+    if kind == "percent" and not 0 < value <= 100:
+        raise ValueError("The percentage must be greater than 0 and at most 100.")
+    if kind == "multibuy" and (quantity is None or quantity < 2):
+        raise ValueError("A multi-buy needs a quantity of at least 2.")
+    if value < 0:
+        raise ValueError("The value can't be negative.")
+    if starts_at is not None and ends_at is not None and ends_at <= starts_at:
+        raise ValueError("The promotion must end after it starts.")
+
+    with get_session() as session:
+        names = bundle if kind == "bundle" else [item] if item is not None else []
+        item_ids = dict(session.execute(select(Items.name, Items.id).where(Items.name.in_(names))).all())
+        missing = [name for name in names if name not in item_ids]
+        if missing:
+            raise KeyError(", ".join(missing))
+
+        promotion = Promotion(
+            name=name, kind=kind, value=value, item_id=item_ids.get(item), category=category,
+            quantity=quantity if kind == "multibuy" else None,
+            bundle=json.dumps(bundle) if kind == "bundle" else None,
+            starts_at=starts_at, ends_at=ends_at
+        )
+        session.add(promotion)
+        session.commit()
+        promotion_id = promotion.id
+
+    refresh_promotions()
+    return promotion_id
+
+def get_promotions() -> list[tuple]:
+    """
+    Retrieves all the promotions, including the ones ended or not started yet.
+
+    Returns
+    -------
+    list of tuple
+        A list of tuples with the identifier, name, kind, target (item, category or
+        bundled items), quantity, value, start and end of each promotion.
+    """
+    with get_session() as session:
+        rows = session.execute(
+            select(
+                Promotion.id, Promotion.name, Promotion.kind, Items.name, Promotion.category, Promotion.bundle,
+                Promotion.quantity, Promotion.value, Promotion.starts_at, Promotion.ends_at
+            )
+            .outerjoin(Items, Items.id == Promotion.item_id)
+            .order_by(Promotion.id)
+        ).all()
+    return [
+        (id, name, kind, item or category or ", ".join(json.loads(bundle or "[]")), quantity, value, starts_at, ends_at)
+        for id, name, kind, item, category, bundle, quantity, value, starts_at, ends_at in rows
+    ]
+
+def remove_promotion(promotion_id: int) -> bool:
+    """
+    Removes a promotion. The sales it was applied to keep their discounts.
+
+    Parameters
+    ----------
+    promotion_id : int
+        The identifier of the promotion.
+
+    Returns
+    -------
+    bool
+        True if the promotion existed.
+    """
+    with get_session() as session:
+        removed = session.execute(delete(Promotion).where(Promotion.id == promotion_id)).rowcount
+        session.commit()
+    refresh_promotions()
+    return bool(removed)
@@ -0,0 +1,87 @@
+from database.database import get_session
+from database.models import Items
+from backend.config import get_setting
+from backend.services import sold_items_sorted
+from sqlalchemy import select
+import threading
+
+# Items of the quick-key grid, as (name, price) pairs in slot order. The list is replaced
+# whole on each refresh, so the POS tab reads it without locks nor database queries.
+_quick_keys = []
+
+# Serializes the refreshes of the quick keys
+_lock = threading.Lock()
+
+def get_quick_keys() -> list[tuple[str, float]]:
+    """
+    Returns the items of the quick-key grid as of the last refresh, without querying the database.
+
+    Returns
+    -------
+    list of tuple of (str, float)
+        The name and price of the item of each slot, in slot order.
+    """
+    return _quick_keys
+
+def refresh_quick_keys() -> list[tuple[str, float]]:
+    """
+    Fills the slots of the quick-key grid with the pinned items and then the top sellers.
+
+    The top sellers are ranked by quantity with `sold_items_sorted`, whose totals are cached
+    and only updated with the new sales of the reporting snapshot.
+
+    Returns
+    -------
+    list of tuple of (str, float)
+        The name and price of the item of each slot, in slot order.
+    """
+    global _quick_keys
+    with _lock:
+        count = get_setting("quick_keys")
+        pinned = list(get_setting("quick_keys_pinned") or [])[:count]
+        names, _ = sold_items_sorted("quantity")
+        top = [name for name in names[::-1][:count + len(pinned)].tolist() if name not in pinned]
+        candidates = pinned + top
+
+        with get_session() as session:
+            prices = dict(session.execute(select(Items.name, Items.price).where(Items.name.in_(candidates))).all())
+
+        # Pinned items that don't exist leave their slot to the next top seller
+        _quick_keys = [(name, prices[name]) for name in candidates if name in prices][:count]
+        return _quick_keys
+
+def refresh_quick_keys_async():
+    """
+    Refreshes the quick keys on a background thread, unless a refresh is already running.
+    """
+    def run():
+        try:
+            refresh_quick_keys()
+        except Exception as error:
+            print(f"Warning: Could not refresh the quick keys: {error}")
+
+    if not _lock.locked():
+        threading.Thread(target=run, name="quick-keys", daemon=True).start()
+
+def start_quick_keys() -> threading.Event:
+    """
+    Refreshes the quick keys now and then every "quick_keys_interval" seconds, on a background thread.
+
+    Returns
+    -------
+    threading.Event
+        An event that stops the thread when set.
+    """
+    stop = threading.Event()
+
+    def run():
+        while True:
+            try:
+                refresh_quick_keys()
+            except Exception as error:
+                print(f"Warning: Could not refresh the quick keys: {error}")
+            if stop.wait(get_setting("quick_keys_interval")):
+                return
+
+    threading.Thread(target=run, name="quick-keys-scheduler", daemon=True).start()
+    return stop
@@ -1,132 +1,834 @@
-from database.database import get_session
-from database.models import Items, Store, Transaction, TransactionItem
-from sqlalchemy import func
-from datetime import datetime
+from database.database import get_engine, get_session, get_reporting_session
+from database.models import (
+    Items, Store, Transaction, TransactionItem, TransactionDiscount, DailySales, ItemSales, Reservation, Promotion, day_key
+)
+from backend.archive import get_archived_years, get_archive_tables, attach_archive, add_item_day_sales
+from backend.config import get_setting
+from backend.sync import log_change
+from backend.locations import get_till_location, lookup_location
+from backend.promotions import CartPricer
+from backend.ledger import record_movements
+from backend.snapshot import ensure_snapshot, note_sale
+from backend.columnar import get_analytics_engine, daily_sales, totals_by_item
+from sqlalchemy import func, select, insert, update, delete, literal, bindparam, and_, tuple_, union_all, cast, DateTime, Integer
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import aliased
+from datetime import date, datetime, timedelta
+from itertools import chain
+import numpy as np
+import random, threading, time
 
-def get_items():
+def reserved_quantity(item_id, location_id, now: datetime, cart_id: str = None):
+    """
+    Builds a scalar subquery with the quantity of an item held by active reservations at a location.
+
+    Parameters
+    ----------
+    item_id : sqlalchemy.sql.ColumnElement
+        The item ID column the subquery correlates to.
+    location_id : sqlalchemy.sql.ColumnElement
+        The location ID column the subquery correlates to.
+    now : datetime
+        The current time, reservations expired before it are ignored.
+    cart_id : str, optional
+        A cart whose reservations are ignored. Defaults to None, which counts all of them.
+
+    Returns
+    -------
+    sqlalchemy.sql.ScalarSelect
+        The reserved quantity of the item.
+    """
+    query = select(func.coalesce(func.sum(Reservation.quantity), 0)).where(
+        Reservation.item_id == item_id,
+        Reservation.location_id == location_id,
+        Reservation.expires_at > now
+    )
+    if cart_id is not None:
+        query = query.where(Reservation.cart_id != cart_id)
+    return query.scalar_subquery()
+
+# Quantities held by the active reservations of each item at the till's location,
+# `now` and `location` are bound on each execution
+_reserved = (
+    select(Reservation.item_id, func.sum(Reservation.quantity).label('quantity'))
+    .where(Reservation.expires_at > bindparam('now'), Reservation.location_id == bindparam('location'))
+    .group_by(Reservation.item_id)
+    .subquery()
+)
+
+# Stock entry of each item at the till's location. Items not held there have no local stock.
+_local = aliased(Store, name='local')
+
+# Columns of the catalog, built once so every call reuses the compiled statement from the engine's cache.
+# The total stock over the locations is read from the item itself, so the catalog costs the same
+# however many locations hold the items.
+_catalog = (
+    select(
+        Items.name, Items.price, Items.cost,
+        func.coalesce(_local.stock, 0).label('stock'),
+        func.coalesce(_local.reorder_threshold, 0).label('reorder_threshold'),
+        (func.coalesce(_local.stock, 0) - func.coalesce(_reserved.c.quantity, 0)).label('available'),
+        Items.total_stock
+    )
+    .select_from(Items)
+    .outerjoin(_local, and_(_local.location_id == bindparam('location'), _local.item_id == Items.id))
+    .outerjoin(_reserved, _reserved.c.item_id == Items.id)
+)
+_catalog_by_name = _catalog.where(Items.name == bindparam('name'))
+_catalog_columns = select(Items.id, Items.name, Items.total_stock).order_by(Items.id)
+
+def get_items() -> list[tuple]:
     """
     Retrieves a list of items along with their stock information.
 
     This function queries the database for all items and their associated stock levels. 
-    It joins the `Store` and `Items` tables to obtain this information.
+    It joins the `Store` and `Items` tables to obtain this information, along with the
+    available stock, which is the stock of the till's location minus the quantity reserved
+    by its open carts, and the total stock of all the locations.
+
+    The rows are read with a Core statement straight from the driver, without building
+    ORM objects, since the callers only display them.
 
     Returns
     -------
     list of tuple
-        A list of tuples where each tuple contains information from both `Store` and `Items` tables.
+        A list of tuples with the name, price, cost, stock, reorder threshold, available stock
+        and total stock of each item. The stock and the reorder threshold are those of the till's location.
     """
-    with get_session() as session:
-        results = session.query(Store, Items).join(Items, Items.id == Store.item_id).all()
-    return results
+    location_id, _ = get_till_location()
+    with get_engine().connect() as connection:
+        return connection.execute(_catalog, {'now': datetime.now(), 'location': location_id}).tuples().all()
+
+def get_item(name: str) -> tuple | None:
+    """
+    Looks up an item by name with its stock information.
+
+    Parameters
+    ----------
+    name : str
+        The name of the item.
+
+    Returns
+    -------
+    tuple or None
+        The name, price, cost, stock, reorder threshold, available stock and total stock
+        of the item, as returned by `get_items`, or None if there is no item with that name.
+    """
+    location_id, _ = get_till_location()
+    with get_engine().connect() as connection:
+        return connection.execute(_catalog_by_name, {'now': datetime.now(), 'location': location_id, 'name': name}).tuples().first()
+
+def get_item_columns() -> dict[str, np.ndarray]:
+    """
+    Retrieves the id, name and stock of every item as column arrays, sorted by id.
+
+    Returns
+    -------
+    dict of str to numpy.ndarray
+        The columns "id", "name" and "stock", one row per item. The stock is the total of all the locations.
+    """
+    with get_engine().connect() as connection:
+        rows = connection.execute(_catalog_columns).all()
+    ids, names, stock = zip(*rows) if rows else ((), (), ())
+    return {
+        'id': np.fromiter(ids, dtype=np.int64, count=len(ids)),
+        'name': np.array(names, dtype=object),
+        'stock': np.fromiter(stock, dtype=np.int64, count=len(stock))
+    }
+
+def reserve_stock(cart_id: str, name: str, quantity: int) -> bool:
+    """
+    Reserves a quantity of an item for a cart, if enough of it is available at the till's location.
+
+    The availability check and the reservation are a single statement, so two carts
+    can't reserve the same units. Reserving also drops the expired reservations and
+    renews the time to live of the other reservations of the cart.
 
-def get_transactions():
+    Parameters
+    ----------
+    cart_id : str
+        The identifier of the cart.
+    name : str
+        The name of the item.
+    quantity : int
+        The quantity to reserve.
+
+    Returns
+    -------
+    bool
+        True if the quantity was reserved, False if there isn't enough available stock.
+    """
+    location_id, _ = get_till_location()
+
+    def operation():
+        with get_session() as session:
+            now = datetime.now()
+            expires_at = now + timedelta(seconds=get_setting("reservation_ttl"))
+
+            session.execute(delete(Reservation).where(Reservation.expires_at <= now))
+            session.execute(update(Reservation).where(Reservation.cart_id == cart_id).values(expires_at=expires_at))
+
+            result = session.execute(insert(Reservation).from_select(
+                ['cart_id', 'item_id', 'location_id', 'quantity', 'expires_at'],
+                select(literal(cart_id), Store.item_id, Store.location_id, literal(quantity), literal(expires_at, DateTime))
+                .join(Items, Items.id == Store.item_id)
+                .where(
+                    Items.name == name,
+                    Store.location_id == location_id,
+                    Store.stock - reserved_quantity(Store.item_id, Store.location_id, now) >= quantity
+                )
+            ))
+            session.commit()
+            return result.rowcount == 1
+
+    return with_retry(operation)
+
+def release_reservations(cart_id: str, names: list[str] = None):
+    """
+    Releases the items reserved by a cart.
+
+    Parameters
+    ----------
+    cart_id : str
+        The identifier of the cart.
+    names : list of str, optional
+        The names of the items to release. Defaults to None, which releases the whole cart.
+    """
+    def operation():
+        with get_session() as session:
+            query = delete(Reservation).where(Reservation.cart_id == cart_id)
+            if names is not None:
+                query = query.where(Reservation.item_id.in_(select(Items.id).where(Items.name.in_(names))))
+            session.execute(query)
+            session.commit()
+
+    with_retry(operation)
+
+def day_keys_to_dates(keys: np.ndarray) -> np.ndarray:
+    """
+    Converts an array of YYYYMMDD day keys to `datetime64[D]` dates, all at once.
+    """
+    months = (keys // 10000 - 1970) * 12 + keys // 100 % 100 - 1
+    return months.astype('datetime64[M]').astype('datetime64[D]') + (keys % 100 - 1)
+
+def get_transactions(start: date = None, engine: str = None):
     """
     Retrieves aggregated sales data by day.
 
-    This function queries the database for total sales amount grouped by day. 
-    It aggregates the sales data and formats the results for plotting.
+    This function queries the reporting snapshot for total sales amount grouped by day. 
+    It aggregates the sales data and formats the results for plotting. Sales
+    of archived years are read from the `daily_sales` rollup.
+
+    The transactions are grouped on their indexed `day_key`, and the rows are read
+    straight from the cursor into an array, whose day keys numpy converts to dates at once.
+    With a DuckDB engine the same query runs on DuckDB instead, see `backend.columnar`.
+
+    Parameters
+    ----------
+    start : date, optional
+        Only include the days from this one on. Defaults to None, which includes all of them.
+    engine : str, optional
+        The engine the query runs on, one of `backend.columnar.ENGINES`. Defaults to None,
+        which uses the "analytics_engine" setting.
 
     Returns
     -------
-    tuple of (list of datetime, list of float)
-        - A list of dates.
-        - A list of total sales amounts corresponding to each date.
+    tuple of (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        - The days, as `datetime64[D]`, in order.
+        - The total sales amount of each day, as `float64`.
+        - The number of transactions of each day, as `int64`.
     """
+    engine = engine or get_analytics_engine()
+    if engine != "sqlite":
+        rows = daily_sales(start, engine)
+    else:
+        # The transactions are grouped by day before the union, from the `ix_transactions_day_key` index alone
+        transactions = (
+            select(
+                Transaction.day_key.label('day_key'),
+                func.sum(Transaction.total_amount).label('amount'),
+                func.count().label('transactions')
+            )
+            .where(Transaction.day_key.is_not(None))
+            .group_by(Transaction.day_key)
+        )
+        rollups = select(cast(func.strftime('%Y%m%d', DailySales.date), Integer), DailySales.total_sales, DailySales.transactions)
+        if start is not None:
+            transactions = transactions.where(Transaction.day_key >= day_key(start))
+            rollups = rollups.where(DailySales.date >= start)
+        sales = union_all(transactions, rollups).subquery()
+
+        ensure_snapshot()
+        with get_reporting_session() as session:
+            result = session.execute(
+                select(sales.c.day_key, func.sum(sales.c.amount), func.sum(sales.c.transactions))
+                .group_by(sales.c.day_key)
+                .order_by(sales.c.day_key)
+            )
+            # Flatten the rows straight into the array, numpy is slow at converting row objects
+            rows = np.fromiter(chain.from_iterable(result), dtype=np.float64).reshape(-1, 3)
+
+    dates = day_keys_to_dates(rows[:, 0].astype(np.int64))
+    return dates, np.ascontiguousarray(rows[:, 1]), rows[:, 2].astype(np.int64)
+
+def get_sales_after(after: int) -> tuple[date | None, int]:
+    """
+    Finds the first day with sales made after a transaction, to update the daily sales from it.
+
+    Parameters
+    ----------
+    after : int
+        The id of the last transaction already read, 0 for none.
+
+    Returns
+    -------
+    tuple of (date or None, int)
+        - The earliest day of the transactions after it, None if there are none.
+        - The id of the last transaction.
+    """
+    ensure_snapshot()
+    with get_reporting_session() as session:
+        first, last_id = session.execute(
+            select(func.min(Transaction.day_key), func.max(Transaction.id)).where(Transaction.id > after)
+        ).one()
+    first = date(first // 10000, first // 100 % 100, first % 100) if first is not None else None
+    return first, last_id or after
+
+def get_sales_heatmap(start: datetime = None, end: datetime = None):
+    """
+    Retrieves the revenue and number of transactions by weekday and hour of the day.
+
+    The sales are aggregated by a single query on the reporting snapshot, which
+    returns at most one row per weekday and hour. Archived years are not included,
+    since their rollups are by day.
+
+    Parameters
+    ----------
+    start : datetime, optional
+        Only include the transactions made on or after the day of this time. Defaults to None.
+    end : datetime, optional
+        Only include the transactions made before the day of this time. Defaults to None.
+
+    Returns
+    -------
+    tuple of (numpy.ndarray, numpy.ndarray)
+        - The revenue, as a 7 × 24 array with a row per weekday, starting on Monday, and a column per hour.
+        - The number of transactions, with the same shape.
+    """
+    # SQLite numbers the weekdays from Sunday
+    weekday = (cast(func.strftime('%w', Transaction.timestamp), Integer) + 6) % 7
+    hour = cast(func.strftime('%H', Transaction.timestamp), Integer)
+    query = (
+        select(weekday, hour, func.sum(Transaction.total_amount), func.count())
+        .where(Transaction.day_key.is_not(None))
+        .group_by(weekday, hour)
+    )
+    if start is not None:
+        query = query.where(Transaction.day_key >= day_key(start))
+    if end is not None:
+        query = query.where(Transaction.day_key < day_key(end))
+
+    ensure_snapshot()
+    with get_reporting_session() as session:
+        rows = np.fromiter(chain.from_iterable(session.execute(query)), dtype=np.float64).reshape(-1, 4)
+
+    day, hour = rows[:, 0].astype(np.int64), rows[:, 1].astype(np.int64)
+    revenue, transactions = np.zeros((7, 24)), np.zeros((7, 24), dtype=np.int64)
+    revenue[day, hour], transactions[day, hour] = rows[:, 2], rows[:, 3]
+    return revenue, transactions
+
+# Totals per item id of each engine and metric, as of the last transaction of the snapshot they include.
+# The lock keeps the threads ranking the items from adding the same new sales twice.
+_item_totals = {}
+_item_totals_lock = threading.Lock()
+
+def _sum_by_item(session, query) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Runs a query of item ids and totals into two arrays, skipping the unknown totals.
+    """
+    rows = [row for row in session.execute(query) if row[1] is not None]
+    ids, totals = zip(*rows) if rows else ((), ())
+    return np.fromiter(ids, dtype=np.int64, count=len(ids)), np.fromiter(totals, dtype=np.float64, count=len(totals))
+
+def sold_items_sorted(metric: str = "quantity", engine: str = None):
+    """
+    Retrieves and sorts items by the total quantity sold, revenue or margin.
+
+    This function returns the items along with their totals, sorted in ascending order.
+    Totals are summed straight from the sale lines of the reporting snapshot, which the
+    `ix_transaction_items_item_sales` index covers, and the ones of archived years from
+    the `item_sales` rollup. The margin only counts the lines with a known cost, and
+    items without any are left out.
+
+    The totals of each metric are cached by item. When the snapshot holds new sales
+    only their lines are summed and added, through the transaction index, so the
+    ranking is only computed from all the lines the first time. With a DuckDB engine
+    that first time runs on DuckDB instead, see `backend.columnar`.
+
+    Parameters
+    ----------
+    metric : str, optional
+        The total to sort by: "quantity", "revenue" or "margin". Defaults to "quantity".
+    engine : str, optional
+        The engine the totals of all the lines are computed on, one of `backend.columnar.ENGINES`.
+        Defaults to None, which uses the "analytics_engine" setting.
+
+    Returns
+    -------
+    tuple of (numpy.ndarray, numpy.ndarray)
+        - The names of the items.
+        - Their totals, as `float64`.
+    """
+    lines = {
+        'quantity': TransactionItem.quantity,
+        'revenue': TransactionItem.line_total,
+        'margin': TransactionItem.line_total - TransactionItem.quantity * TransactionItem.unit_cost
+    }
+    rollups = {'quantity': ItemSales.quantity, 'revenue': ItemSales.revenue, 'margin': ItemSales.margin}
+    engine = engine or get_analytics_engine()
+
+    ensure_snapshot()
+    with _item_totals_lock, get_reporting_session() as session:
+        last_id = session.execute(select(func.max(Transaction.id))).scalar() or 0
+        cached_id, totals = _item_totals.get((engine, metric), (None, None))
+
+        if totals is None or last_id < cached_id:
+            if engine != "sqlite":
+                ids, sums = totals_by_item(metric, last_id, engine)
+            else:
+                sold = union_all(
+                    select(TransactionItem.item_id, lines[metric].label('value')),
+                    select(ItemSales.item_id, rollups[metric].label('value'))
+                ).subquery()
+                ids, sums = _sum_by_item(
+                    session, select(sold.c.item_id, func.sum(sold.c.value)).group_by(sold.c.item_id)
+                )
+            # Totals by item id, NaN for the items without any
+            totals = np.full(ids.max() + 1 if len(ids) else 0, np.nan)
+            totals[ids] = sums
+        elif last_id > cached_id:
+            ids, sums = _sum_by_item(
+                session,
+                select(TransactionItem.item_id, func.sum(lines[metric]))
+                .where(TransactionItem.transaction_id > cached_id)
+                .group_by(TransactionItem.item_id)
+            )
+            if len(ids) and ids.max() >= len(totals):
+                totals = np.concatenate([totals, np.full(ids.max() + 1 - len(totals), np.nan)])
+            totals[ids] = np.where(np.isnan(totals[ids]), sums, totals[ids] + sums)
+        _item_totals[(engine, metric)] = (last_id, totals)
+
+        items = session.execute(select(Items.id, Items.name)).all()
+
+    item_ids, names = zip(*items) if items else ((), ())
+    item_ids = np.fromiter(item_ids, dtype=np.int64, count=len(item_ids))
+    names = np.array(names, dtype=object)
+
+    # Items sold at least once, with a known total, in ascending order
+    known = item_ids < len(totals)
+    item_totals = totals[item_ids[known]]
+    sold = ~np.isnan(item_totals)
+    names, item_totals = names[known][sold], item_totals[sold]
+    order = np.argsort(item_totals, kind='stable')
+    return names[order], item_totals[order]
+
+def _transaction_page(session, transactions, transaction_items, after, limit, start, end, min_amount, max_amount, item):
+    """
+    Runs the keyset page query of `get_transaction_page` on a pair of transaction tables,
+    either the ones of the main database or the ones of an attached archive.
+    """
+    query = select(
+        transactions.c.id,
+        transactions.c.timestamp,
+        transactions.c.total_amount,
+        transactions.c.payment_received,
+        transactions.c.change_returned
+    )
+
+    if after is not None:
+        query = query.where(tuple_(transactions.c.timestamp, transactions.c.id) < tuple_(*after))
+    if start is not None:
+        query = query.where(transactions.c.timestamp >= start)
+    if end is not None:
+        query = query.where(transactions.c.timestamp < end)
+    if min_amount is not None:
+        query = query.where(transactions.c.total_amount >= min_amount)
+    if max_amount is not None:
+        query = query.where(transactions.c.total_amount <= max_amount)
+    if item:
+        item_ids = select(Items.id).where(Items.name.icontains(item, autoescape=True))
+        query = query.where(
+            select(transaction_items.c.id)
+            .where(transaction_items.c.transaction_id == transactions.c.id, transaction_items.c.item_id.in_(item_ids))
+            .exists()
+        )
+
+    return session.execute(
+        query
+        .order_by(transactions.c.timestamp.desc(), transactions.c.id.desc())
+        .limit(limit)
+    ).all()
+
+def get_transaction_page(
+        after: tuple = None,
+        limit: int = 100,
+        start: datetime = None,
+        end: datetime = None,
+        min_amount: float = None,
+        max_amount: float = None,
+        item: str = None
+    ):
+    """
+    Retrieves one page of transactions, newest first.
+
+    The page is fetched with keyset pagination on (timestamp, id): instead of an offset,
+    the key of the last row of the previous page is given, so every page costs the same
+    no matter how deep into the history it is. All filters are applied in SQL and are
+    backed by the indexes of the `transactions` and `transaction_items` tables.
+
+    Archived years are attached and queried only when the page may contain some of their
+    transactions, that is, when their year falls in the date range and the main database
+    doesn't fill the page with newer transactions.
+
+    Parameters
+    ----------
+    after : tuple of (datetime, int), optional
+        The (timestamp, id) key of the last transaction of the previous page.
+        Defaults to None, which fetches the first page.
+    limit : int, optional
+        The maximum number of transactions to retrieve. Defaults to 100.
+    start : datetime, optional
+        Only include transactions made at or after this time.
+    end : datetime, optional
+        Only include transactions made before this time.
+    min_amount : float, optional
+        Only include transactions with a total amount greater or equal than this value.
+    max_amount : float, optional
+        Only include transactions with a total amount less or equal than this value.
+    item : str, optional
+        Only include transactions with at least one item whose name contains this text.
+
+    Returns
+    -------
+    list of tuple
+        A list of tuples with the id, timestamp, total amount, payment received and change
+        returned of each transaction.
+    """
+    filters = (after, limit, start, end, min_amount, max_amount, item)
+
     with get_session() as session:
-        results = session.query(
-            func.date(Transaction.timestamp).label('date'),
-            func.sum(Transaction.total_amount).label('total_sales')
-        ).group_by(func.date(Transaction.timestamp)).order_by(func.date(Transaction.timestamp)).all()
+        rows = _transaction_page(session, Transaction.__table__, TransactionItem.__table__, *filters)
 
-    # Extract dates and sales from results
-    dates = [datetime.strptime(result.date, '%Y-%m-%d') for result in results]
-    total_sales = [result.total_sales for result in results]
-    
-    return dates, total_sales
+        years = [
+            year for year in get_archived_years()
+            if (start is None or year >= start.year)
+            and (end is None or datetime(year, 1, 1) < end)
+            and (after is None or year <= after[0].year)
+            and (len(rows) < limit or year >= rows[-1].timestamp.year)
+        ]
+        for year in years:
+            attach_archive(session.connection(), year)
+            rows += _transaction_page(session, *get_archive_tables(year), *filters)
 
-def sold_items_sorted():
+    if years:
+        rows = sorted(rows, key=lambda row: (row.timestamp, row.id), reverse=True)[:limit]
+    return rows
+
+def get_transaction_lines(transaction_id: int, timestamp: datetime = None):
     """
-    Retrieves and sorts items by the total quantity sold.
+    Retrieves the items sold in a transaction.
 
-    This function returns a list of items along with their total quantities sold, sorted in ascending order by quantity.
+    Parameters
+    ----------
+    transaction_id : int
+        The id of the transaction.
+    timestamp : datetime, optional
+        The time of the transaction. When its year is archived, the items are
+        read from the archive database.
 
     Returns
     -------
     list of tuple
-        A list of tuples where each tuple contains the item name and its total quantity sold.
+        A list of tuples where each tuple contains the item name and the quantity sold.
+        The name is None if the item was removed from the store.
     """
     with get_session() as session:
-        return (
-            session.query(
-                Items.name.label('item_name'),
-                func.sum(TransactionItem.quantity).label('total_quantity')
+        transaction_items = TransactionItem.__table__
+        if timestamp is not None and timestamp.year in get_archived_years():
+            attach_archive(session.connection(), timestamp.year)
+            _, archived_items = get_archive_tables(timestamp.year)
+            # Transactions made after their year was archived are still in the main database
+            live = session.execute(
+                select(Transaction.id).where(Transaction.id == transaction_id, Transaction.timestamp == timestamp)
+            ).first()
+            if not live:
+                transaction_items = archived_items
+
+        return session.execute(
+            select(Items.name.label('item_name'), transaction_items.c.quantity)
+            .outerjoin(Items, transaction_items.c.item_id == Items.id)
+            .where(transaction_items.c.transaction_id == transaction_id)
+            .order_by(transaction_items.c.id)
+        ).all()
+
+class InsufficientStockError(Exception):
+    """
+    Raised when a sale asks for more units of some items than there are in stock.
+
+    Attributes
+    ----------
+    items : list of str
+        The names of the items without enough stock.
+    """
+    def __init__(self, items: list[str]):
+        super().__init__(f"Not enough stock for: {', '.join(items)}")
+        self.items = items
+
+class PriceChangedError(Exception):
+    """
+    Raised when the total of a sale at the current prices and promotions isn't the total shown to the customer.
+
+    Attributes
+    ----------
+    total : float
+        The total of the sale at the current prices, after the discounts.
+    prices : dict
+        The current price of each item of the sale, by name.
+    """
+    def __init__(self, total: float, prices: dict[str, float]):
+        super().__init__(f"The total of the sale changed to {total:.2f}")
+        self.total = total
+        self.prices = prices
+
+def with_retry(operation, attempts: int = 5, delay: float = 0.05):
+    """
+    Runs a database operation, retrying it when the database is busy or locked.
+
+    Another till writing to the same database file makes SQLite fail with
+    "database is locked" once its busy timeout runs out. The operation is then
+    retried a bounded number of times, doubling the wait between attempts.
+
+    Parameters
+    ----------
+    operation : callable
+        The function to run. It must be safe to run again after a rollback.
+    attempts : int, optional
+        The maximum number of attempts. Defaults to 5.
+    delay : float, optional
+        The wait in seconds before the first retry. Defaults to 0.05.
+
+    Returns
+    -------
+    object
+        The value returned by the operation.
+
+    Raises
+    ------
+    sqlalchemy.exc.OperationalError
+        If the database is still busy after the last attempt, or on any other database error.
+    """
+    for attempt in range(attempts):
+        try:
+            return operation()
+        except OperationalError as error:
+            message = str(error.orig).lower()
+            if attempt == attempts - 1 or ("locked" not in message and "busy" not in message):
+                raise
+            # Exponential backoff with jitter so competing tills don't retry in lockstep
+            time.sleep(delay * 2 ** attempt * (1 + random.random()))
+
+def _discount_stock(session, items: dict, location_id: int, cart_id: str = None) -> list[int]:
+    """
+    Subtracts the sold quantities from the stock of a location with conditional atomic updates.
+
+    Each update only applies if there is enough stock, not reserved by other carts,
+    at the moment it runs, so concurrent sales can neither drive the stock negative
+    nor overwrite each other.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.session.Session
+        The session of the ongoing database transaction.
+    items : dict
+        A dictionary where keys are item IDs and values are quantities to be subtracted from the stock.
+    location_id : int
+        The ID of the location whose stock is decremented.
+    cart_id : str, optional
+        The cart being sold, whose own reservations don't count against it.
+
+    Returns
+    -------
+    list of int
+        The IDs of the items without enough stock at the location, which were left untouched.
+    """
+    now = datetime.now()
+    failed = []
+    for item_id, quantity in items.items():
+        result = session.execute(
+            update(Store)
+            .where(
+                Store.location_id == location_id,
+                Store.item_id == item_id,
+                Store.stock - reserved_quantity(Store.item_id, Store.location_id, now, cart_id) >= quantity
             )
-            .join(Items, TransactionItem.item_id == Items.id)
-            .group_by(Items.name)
-            .order_by(func.sum(TransactionItem.quantity))
-            .all()
+            .values(stock=Store.stock - quantity)
         )
-    
-def save_transaction(total: float, amount: float, change: float, cart: list[tuple]):
+        if result.rowcount == 0:
+            failed.append(item_id)
+    return failed
+
+def save_transaction(total: float, amount: float, change: float, cart: list[tuple], cart_id: str = None):
     """
     Saves a new transaction along with its associated items to the database.
 
-    This function creates a new transaction entry, saves it to the database, and 
-    then adds each item in the cart to the `TransactionItem` table. 
+    This function subtracts the sold quantities from the stock of the till's location, saves the transaction
+    and its items, with their current price and cost, records the stock taken in the movement ledger
+    and turns the reservations of the cart into the sale, in a single database transaction. If any item doesn't have enough stock, nothing is saved.
+    It is retried if the database is busy with another till.
+
+    The promotions are applied to the current prices with a `CartPricer`, and the discount of
+    each line and each promotion applied are saved with the transaction. If the total they give
+    isn't the total shown to the customer, because a price or a promotion changed meanwhile,
+    nothing is saved, so the stored total always matches the stored lines.
 
     Parameters
     ----------
     total : float
-        The total amount for the transaction.
+        The total amount for the transaction, after the discounts.
     amount : float
         The amount of payment received.
     change : float
         The amount of change to be returned.
     cart : list of tuple
         A list of tuples where each tuple contains the item name and quantity.
+    cart_id : str, optional
+        The identifier of the cart, whose reservations are released. Defaults to None.
 
     Returns
     -------
     dict
         A dictionary mapping item IDs to quantities for the items in the cart.
+
+    Raises
+    ------
+    InsufficientStockError
+        If some items of the cart don't have enough stock.
+    PriceChangedError
+        If the total at the current prices and promotions isn't the total given.
     """
-    # Create a new transaction
-    with get_session() as session:
-        transaction = Transaction(
-            total_amount=total,
-            payment_received=amount,
-            change_returned=change
-        )
-        session.add(transaction)
-        session.commit()
+    location_id, location = get_till_location()
+
+    def operation():
+        with get_session() as session:
+            # Map the names in the cart to their item IDs
+            names = [name for name, _ in cart]
+            catalog = {
+                name: (item_id, price, cost) for name, item_id, price, cost in
+                session.query(Items.name, Items.id, Items.price, Items.cost).filter(Items.name.in_(names)).all()
+            }
+            item_id_map = {name: item_id for name, (item_id, _, _) in catalog.items()}
+
+            items, quantities = {}, {}
+            for name, quantity in cart:
+                item_id = item_id_map.get(name)
+                items[item_id] = items.get(item_id, 0) + quantity
+                quantities[name] = quantities.get(name, 0) + quantity
+
+            # Discount the stock first, so the write lock is taken before anything else
+            failed = _discount_stock(session, items, location_id, cart_id)
+            if failed:
+                session.rollback()
+                raise InsufficientStockError([name for name in names if item_id_map.get(name) in failed])
 
-        # Fetch all items with stock to create a mapping
-        item_data = session.query(Items).all()
-        item_id_map = {item.name: item.id for item in item_data}
-
-        # Add transaction items
-        items = {}
-        for item in cart:
-            name, quantity = item
-            item_id = item_id_map.get(name)
-            items[item_id] = quantity
-            transaction_item = TransactionItem(
-                transaction_id=transaction.id,
-                item_id=item_id,
-                quantity=quantity,
+            # The sold items are no longer held by the cart
+            if cart_id is not None:
+                session.execute(delete(Reservation).where(Reservation.cart_id == cart_id))
+
+            # Apply the promotions to the prices the items are sold at
+            pricer = CartPricer()
+            for name, quantity in quantities.items():
+                pricer.set_line(name, quantity, catalog[name][1])
+            discounts = {name: pricer.line_discount(name) for name in quantities}
+            if abs(pricer.total - total) >= 0.005:
+                session.rollback()
+                raise PriceChangedError(pricer.total, {name: catalog[name][1] for name in quantities})
+
+            # Create a new transaction
+            transaction = Transaction(
+                total_amount=pricer.total,
+                payment_received=amount,
+                change_returned=change,
+                discount=round(sum(discounts.values()), 2)
             )
-            session.add(transaction_item)
+            session.add(transaction)
+            session.flush()
 
-        session.commit()
+            # Add transaction items, with the prices they were sold at
+            lines = []
+            for name, quantity in quantities.items():
+                item_id, price, cost = catalog[name]
+                discount = discounts[name]
+                session.add(TransactionItem(
+                    transaction_id=transaction.id,
+                    item_id=item_id,
+                    quantity=quantity,
+                    unit_price=price,
+                    line_total=price * quantity - discount,
+                    unit_cost=cost,
+                    discount=discount
+                ))
+                lines.append((name, quantity, price, cost, discount))
+
+            # The quantities sold that day, which the reorder forecast reads
+            add_item_day_sales(session, {(transaction.day_key, item_id): quantity for item_id, quantity in items.items()})
+
+            # The stock taken by the sale, with the transaction it belongs to
+            record_movements(
+                session, "sale", [(item_id, location_id, -quantity) for item_id, quantity in items.items()],
+                str(transaction.id)
+            )
+
+            # The discounts of the promotions must add up to the discount of the sale
+            applied = pricer.applied()
+            if abs(sum(discount for _, _, discount in applied) - transaction.discount) >= 0.005:
+                session.rollback()
+                raise ValueError(
+                    f"The promotions applied add up to {sum(discount for _, _, discount in applied):.2f}, "
+                    f"not the discount of the sale {transaction.discount:.2f}."
+                )
+            for promotion_id, name, discount in applied:
+                session.add(TransactionDiscount(
+                    transaction_id=transaction.id, promotion_id=promotion_id, name=name, amount=discount
+                ))
+
+            # Record the sale and its stock decrements for the hub
+            log_change(session, "sale", str(transaction.id), {
+                'timestamp': transaction.timestamp.isoformat(),
+                'total': transaction.total_amount,
+                'received': amount,
+                'change': change,
+                'discount': transaction.discount,
+                'lines': lines,
+                'discounts': [(name, discount) for _, name, discount in applied]
+            })
+            for name, quantity in quantities.items():
+                log_change(session, "stock", name, {'delta': -quantity, 'location': location, 'kind': "sale"})
 
+            session.commit()
+            return items
+
+    items = with_retry(operation)
+    note_sale()
     return items
 
 def discount_stock(items: dict):
     """
     Updates the stock quantities based on the items sold in a transaction.
 
-    This function subtracts the specified quantities of items from the stock. 
-    It updates the `Store` table to reflect the new stock levels.
+    This function subtracts the specified quantities of items from the stock of the till's location
+    with conditional atomic updates, in a single database transaction. If any item
+    doesn't have enough stock, no stock is changed.
 
     Parameters
     ----------
@@ -136,24 +838,242 @@ def discount_stock(items: dict):
     Returns
     -------
     None
+
+    Raises
+    ------
+    InsufficientStockError
+        If some items don't have enough stock.
     """
-    with get_session() as session:
-        for item_id, quantity in items.items():
-            # Retrieve the POS entry for the given item_id
-            store_item = session.query(Store).filter_by(item_id=item_id).first()
-            
-            # Subtract the quantity from stock
-            store_item.stock -= quantity
-                
-            # Commit the changes to the database
+    location_id, location = get_till_location()
+
+    def operation():
+        with get_session() as session:
+            failed = _discount_stock(session, items, location_id)
+            if failed:
+                session.rollback()
+                names = [name for name, in session.query(Items.name).filter(Items.id.in_(failed)).all()]
+                raise InsufficientStockError(names)
+
+            # Record the stock decrements in the ledger and for the hub
+            record_movements(session, "sale", [(item_id, location_id, -quantity) for item_id, quantity in items.items()])
+            names = dict(session.query(Items.id, Items.name).filter(Items.id.in_(list(items))).all())
+            for item_id, quantity in items.items():
+                log_change(session, "stock", names[item_id], {'delta': -quantity, 'location': location, 'kind': "sale"})
+
+            session.commit()
+
+    with_retry(operation)
+
+def receive_stock(name: str, quantity: int, cost: float = None, location: str = None) -> int:
+    """
+    Adds a delivery of an item to its stock at a location.
+
+    The stock is increased with an atomic update, so sales made meanwhile are not lost,
+    and the increase is replicated as a delta. It is retried if the database is busy.
+
+    Parameters
+    ----------
+    name : str
+        The name of the item.
+    quantity : int
+        The quantity received.
+    cost : float, optional
+        The price paid per unit, saved as the item's cost. Defaults to None, which keeps the current cost.
+    location : str, optional
+        The name of the location receiving the delivery, created if it doesn't exist.
+        Defaults to None, which is the till's location.
+
+    Returns
+    -------
+    int
+        The stock at the location after the delivery.
+
+    Raises
+    ------
+    KeyError
+        If there is no item with that name.
+    """
+    if location is None:
+        _, location = get_till_location()
+
+    def operation():
+        with get_session() as session:
+            item = session.query(Items).filter_by(name=name).first()
+            if item is None:
+                raise KeyError(name)
+
+            location_id = lookup_location(session, location, create=True)
+            stock = _add_stock(session, item.id, location_id, quantity)
+            record_movements(session, "receipt", [(item.id, location_id, quantity)])
+            log_change(session, "stock", name, {'delta': quantity, 'location': location, 'kind': "receipt"})
+            if cost is not None:
+                item.cost = cost
+                log_change(session, "item", name, {'price': item.price, 'cost': cost})
+
             session.commit()
+            return stock
+
+    return with_retry(operation)
+
+def _add_stock(session, item_id: int, location_id: int, quantity: int) -> int:
+    """
+    Adds a quantity to the stock of an item at a location with an atomic upsert,
+    creating the stock entry if the location didn't hold the item yet.
+
+    Returns
+    -------
+    int
+        The stock at the location after the addition.
+    """
+    statement = sqlite_insert(Store).values(location_id=location_id, item_id=item_id, stock=quantity)
+    return session.execute(
+        statement.on_conflict_do_update(
+            index_elements=['location_id', 'item_id'], set_={'stock': Store.stock + statement.excluded.stock}
+        ).returning(Store.stock)
+    ).scalar()
+
+def transfer_stock(name: str, quantity: int, source: str, destination: str) -> tuple[int, int]:
+    """
+    Moves a quantity of an item from the stock of a location to another one.
+
+    The decrement and the increment are applied in a single database transaction, so the
+    quantity is never lost or counted twice, and the decrement is conditional, so the source
+    can't be driven negative nor lose units reserved by its open carts. It is retried if the
+    database is busy, and replicated as a delta on each location.
 
-def save_item(name: str, price: float, stock: int):
+    Parameters
+    ----------
+    name : str
+        The name of the item.
+    quantity : int
+        The quantity to move, it must be positive.
+    source : str
+        The name of the location the quantity is taken from.
+    destination : str
+        The name of the location receiving the quantity, created if it doesn't exist.
+
+    Returns
+    -------
+    tuple of (int, int)
+        The stock at the source and at the destination after the transfer.
+
+    Raises
+    ------
+    KeyError
+        If there is no item or source location with that name.
+    ValueError
+        If the quantity isn't positive or both locations are the same.
+    InsufficientStockError
+        If the source doesn't have enough stock of the item.
+    """
+    if quantity <= 0:
+        raise ValueError("The quantity to transfer must be positive.")
+    if source == destination:
+        raise ValueError("The source and the destination must be different locations.")
+
+    def operation():
+        with get_session() as session:
+            item_id = session.execute(select(Items.id).where(Items.name == name)).scalar()
+            if item_id is None:
+                raise KeyError(name)
+            source_id = lookup_location(session, source)
+
+            # Take the quantity first, so the write lock is held before anything else
+            left = session.execute(
+                update(Store)
+                .where(
+                    Store.location_id == source_id,
+                    Store.item_id == item_id,
+                    Store.stock - reserved_quantity(Store.item_id, Store.location_id, datetime.now()) >= quantity
+                )
+                .values(stock=Store.stock - quantity)
+                .returning(Store.stock)
+            ).scalar()
+            if left is None:
+                session.rollback()
+                raise InsufficientStockError([name])
+
+            destination_id = lookup_location(session, destination, create=True)
+            stock = _add_stock(session, item_id, destination_id, quantity)
+            # Each side of the transfer refers to the other location
+            record_movements(session, "transfer", [(item_id, source_id, -quantity)], destination)
+            record_movements(session, "transfer", [(item_id, destination_id, quantity)], source)
+            log_change(session, "stock", name, {'delta': -quantity, 'location': source, 'kind': "transfer"})
+            log_change(session, "stock", name, {'delta': quantity, 'location': destination, 'kind': "transfer"})
+
+            session.commit()
+            return left, stock
+
+    return with_retry(operation)
+
+def get_sales_lines(start: datetime = None, end: datetime = None):
+    """
+    Retrieves the lines of the transactions made in a period, oldest first.
+
+    Parameters
+    ----------
+    start : datetime, optional
+        Only include the transactions made at or after this time. Defaults to None.
+    end : datetime, optional
+        Only include the transactions made before this time. Defaults to None.
+
+    Returns
+    -------
+    list of tuple
+        A list of tuples with the transaction id and time, and the name, quantity,
+        unit price and line total of each item sold.
+    """
+    query = (
+        select(
+            Transaction.id, Transaction.timestamp, Items.name,
+            TransactionItem.quantity, TransactionItem.unit_price, TransactionItem.line_total
+        )
+        .join(TransactionItem, TransactionItem.transaction_id == Transaction.id)
+        .outerjoin(Items, Items.id == TransactionItem.item_id)
+        .order_by(Transaction.timestamp, Transaction.id)
+    )
+    if start is not None:
+        query = query.where(Transaction.timestamp >= start)
+    if end is not None:
+        query = query.where(Transaction.timestamp < end)
+
+    with get_session() as session:
+        return session.execute(query).all()
+
+def get_low_stock():
+    """
+    Retrieves the items whose stock at the till's location is at or below their reorder threshold.
+
+    The condition matches the partial index `ix_store_low_stock`, which SQLite
+    maintains on every stock change, so only the low stock items are read.
+
+    Returns
+    -------
+    list of tuple
+        A list of tuples with the name, stock and reorder threshold of each item, lowest stock first.
+    """
+    location_id, _ = get_till_location()
+    with get_session() as session:
+        return (
+            session.query(Items.name, Store.stock, Store.reorder_threshold)
+            .join(Items, Items.id == Store.item_id)
+            .filter(Store.location_id == location_id, Store.stock <= Store.reorder_threshold)
+            .order_by(Store.stock)
+            .all()
+        )
+
+def save_item(name: str, price: float, stock: int, reorder_threshold: int = None, cost: float = None, category: str = None):
     """
     Adds a new item to the database or updates an existing item's details.
 
     This function checks if an item with the given name exists. If it does, it updates the item's 
     price and stock information. If it does not exist, it creates a new item and adds it to the database.
+    The stock and the reorder threshold are those of the till's location.
+
+    The stock given is a count, which replaces the stock of an existing item: sales made
+    after the count was taken, e.g. since the Store tab loaded it, are undone by it. Only
+    the current stock is read with the write lock already held, so no sale can be committed
+    between reading it and writing the count, and the ledger records the change actually made.
 
     Parameters
     ----------
@@ -162,41 +1082,79 @@ def save_item(name: str, price: float, stock: int):
     price : float
         The price of the item.
     stock : int
-        The quantity of the item in stock.
+        The quantity of the item in stock at the till's location.
+    reorder_threshold : int, optional
+        The stock at or below which the item is low on stock. Defaults to None,
+        which keeps the current threshold, or 0 for a new item.
+    cost : float, optional
+        The price paid for the item. Defaults to None, which leaves it unknown.
+    category : str, optional
+        The category of the item, which promotions can target. Defaults to None,
+        which keeps the current category, or none for a new item.
 
     Returns
     -------
     None
     """
-    with get_session() as session:
-        item_data = session.query(Items).filter_by(name=name).first()
-        if item_data:
-            # Update existing item
-            item = session.query(Items).filter_by(id=item_data.id).first()
+    location_id, location = get_till_location()
+    payload = {'price': float(price), 'cost': cost}
+    if category is not None:
+        payload['category'] = category
+
+    def operation():
+        with get_session() as session:
+            item = session.query(Items).filter_by(name=name).first()
             if item:
-                item.name = name
+                # Update existing item
                 item.price = price
+                item.cost = cost
+                if category is not None:
+                    item.category = category
 
-                store_entry = session.query(Store).filter_by(item_id=item_data.id).first()
-                if store_entry:
-                    store_entry.stock = stock
+                # Adding nothing takes the write lock and reads the stock in one statement, creating the entry
+                # if the location didn't hold the item yet, so no sale can commit between the read and the count
+                current = _add_stock(session, item.id, location_id, 0)
 
+                # Record the stock as a delta, so it adds up with the sales of other tills
+                delta = stock - current
+                if delta:
+                    _add_stock(session, item.id, location_id, delta)
+                    record_movements(session, "adjustment", [(item.id, location_id, delta)])
+                    log_change(session, "stock", name, {'delta': delta, 'location': location, 'kind': "adjustment"})
+                if reorder_threshold is not None:
+                    session.execute(
+                        update(Store)
+                        .where(Store.location_id == location_id, Store.item_id == item.id)
+                        .values(reorder_threshold=reorder_threshold)
+                    )
+
+                log_change(session, "item", name, payload)
                 session.commit()  # Commit the updates
-        else:
-            # Add a new item
-            new_item = Items(name=name, price=price)
-            session.add(new_item)
-            session.commit()  # Commit to get the new item's ID
+            else:
+                # Add a new item
+                new_item = Items(name=name, price=price, cost=cost, category=category)
+                session.add(new_item)
+                session.flush()  # Flush to get the new item's ID
+
+                new_pos_entry = Store(
+                    location_id=location_id, item_id=new_item.id, stock=stock, reorder_threshold=reorder_threshold or 0
+                )
+                session.add(new_pos_entry)
 
-            new_pos_entry = Store(item_id=new_item.id, stock=stock)
-            session.add(new_pos_entry)
-            session.commit()  # Commit the new entry
+                log_change(session, "item", name, payload)
+                if stock:
+                    record_movements(session, "adjustment", [(new_item.id, location_id, stock)])
+                    log_change(session, "stock", name, {'delta': stock, 'location': location, 'kind': "adjustment"})
+                session.commit()  # Commit the new item and its entry
+
+    with_retry(operation)
 
 def remove_item_by_name(name: str):
     """
-    Removes an item and its associated stock entry from the database.
+    Removes an item and its associated stock entries from the database.
 
-    This function deletes the item with the specified name from both the `Items` and `Store` tables.
+    This function deletes the item with the specified name from both the `Items` and `Store` tables,
+    at every location. Its remaining stock is written off in the movement ledger.
 
     Parameters
     ----------
@@ -211,9 +1169,16 @@ def remove_item_by_name(name: str):
         # Find the item by name
         item = session.query(Items).filter(Items.name == name).first()
 
-        # Delete the corresponding entry in the Store table
+        # Delete the corresponding entry in the Store table, writing its stock off, and its promotions
+        record_movements(session, "adjustment", [
+            (item.id, location_id, -stock) for location_id, stock in
+            session.query(Store.location_id, Store.stock).filter(Store.item_id == item.id).all()
+        ], "removed")
         session.query(Store).filter(Store.item_id == item.id).delete()
+        session.query(Promotion).filter(Promotion.item_id == item.id).delete()
 
         # Delete the item itself
         session.delete(item)
+
+        log_change(session, "item", name, {'deleted': True})
         session.commit()
@@ -0,0 +1,127 @@
+from database.database import backup_database, reporting_path, database_path, BUSY_TIMEOUT, BackupBusyError
+from backend.config import get_setting
+from datetime import datetime
+import os, sqlite3, threading
+
+# Serializes the refreshes of the snapshot
+_lock = threading.Lock()
+
+# Sales made since the last refresh
+_sales = 0
+
+# Connection that only watches the live database for changes made by the others, and the
+# data version it saw when the snapshot was last refreshed
+_watcher = None
+_version = None
+
+def _data_version() -> int:
+    """
+    Returns the data version of the live database, which changes whenever another connection commits a change.
+    """
+    global _watcher
+    if _watcher is None:
+        _watcher = sqlite3.connect(database_path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+    return _watcher.execute("PRAGMA data_version").fetchone()[0]
+
+def get_snapshot_time() -> datetime:
+    """
+    Returns when the reporting snapshot was last refreshed.
+
+    Returns
+    -------
+    datetime or None
+        The time of the last refresh, None if there is no snapshot yet.
+    """
+    try:
+        return datetime.fromtimestamp(os.path.getmtime(reporting_path))
+    except FileNotFoundError:
+        return None
+
+def refresh_snapshot() -> int:
+    """
+    Refreshes the reporting snapshot from the live database.
+
+    If nothing changed since the last refresh, the snapshot is only marked as fresh.
+    If the tills keep writing while it is copied, the refresh is given up and the
+    snapshot kept as it was: it is still stale, so the scheduler tries again.
+
+    The whole database is copied, not only the rows added since the last refresh,
+    since sales, counts and edits also change existing rows. The copy doesn't make
+    the tills wait, and is skipped when nothing changed.
+
+    Returns
+    -------
+    int
+        The number of pages copied, 0 if none were.
+
+    Raises
+    ------
+    BackupBusyError
+        If the refresh was given up and there is no snapshot yet.
+    """
+    global _sales, _version
+    with _lock:
+        _sales = 0
+        version = _data_version()
+        if version == _version and os.path.exists(reporting_path):
+            os.utime(reporting_path)
+            return 0
+        try:
+            pages = backup_database(reporting_path)
+        except BackupBusyError:
+            if not os.path.exists(reporting_path):
+                raise
+            return 0
+        _version = version
+    return pages
+
+def refresh_snapshot_async():
+    """
+    Refreshes the reporting snapshot on a background thread, unless a refresh is already running.
+    """
+    if not _lock.locked():
+        threading.Thread(target=refresh_snapshot, name="snapshot", daemon=True).start()
+
+def ensure_snapshot():
+    """
+    Creates the reporting snapshot if it doesn't exist yet, so reports can run on it.
+    """
+    if get_snapshot_time() is None:
+        refresh_snapshot()
+
+def note_sale():
+    """
+    Counts a sale, refreshing the snapshot in the background every "snapshot_sales" sales.
+    """
+    global _sales
+    _sales += 1
+    if _sales >= get_setting("snapshot_sales"):
+        refresh_snapshot_async()
+
+def start_scheduler() -> threading.Event:
+    """
+    Refreshes the snapshot on a background thread whenever it gets older than "snapshot_interval" seconds.
+
+    Returns
+    -------
+    threading.Event
+        An event that stops the thread when set.
+    """
+    stop = threading.Event()
+
+    def run():
+        while True:
+            interval = get_setting("snapshot_interval")
+            snapshot_time = get_snapshot_time()
+            age = (datetime.now() - snapshot_time).total_seconds() if snapshot_time else interval
+            if stop.wait(max(interval - age, 1)):
+                return
+            snapshot_time = get_snapshot_time()
+            if snapshot_time is None or (datetime.now() - snapshot_time).total_seconds() >= interval:
+                try:
+                    refresh_snapshot()
+                except Exception as error:
+                    print(f"Warning: Could not refresh the reporting snapshot: {error}")
+
+    threading.Thread(target=run, name="snapshot-scheduler", daemon=True).start()
+    return stop
@@ -0,0 +1,501 @@
+from database.database import get_session
+from database.models import Items, Store, Transaction, TransactionItem, TransactionDiscount, ChangeLog, SyncState, day_key
+from backend.config import get_setting, set_setting
+from backend.locations import DEFAULT_LOCATION, lookup_location
+from backend.ledger import record_movements
+from backend.archive import add_item_day_sales
+from sqlalchemy import select, insert, update, delete, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from datetime import datetime
+from urllib import request
+import json, threading, time, uuid
+
+def get_terminal_id() -> str:
+    """
+    Returns the identifier of this terminal, creating it the first time.
+
+    Returns
+    -------
+    str
+        The terminal identifier, saved in the "terminal_id" setting.
+    """
+    terminal_id = get_setting("terminal_id")
+    if terminal_id is None:
+        terminal_id = uuid.uuid4().hex
+        set_setting("terminal_id", terminal_id)
+    return terminal_id
+
+def log_change(session, entity: str, key: str, payload: dict):
+    """
+    Records a local change in the change log, within the caller's database transaction.
+
+    Nothing is recorded unless the database takes part in the replication,
+    that is, when the "sync_role" setting is "terminal" or "hub".
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.session.Session
+        The session of the ongoing database transaction.
+    entity : str
+        The kind of change: "item", "stock" or "sale".
+    key : str
+        The natural key of the changed entity, e.g. the item name.
+    payload : dict
+        The change, it must be serializable to JSON.
+    """
+    if get_setting("sync_role") is None:
+        return
+    session.add(ChangeLog(
+        origin=get_terminal_id(),
+        entity=entity,
+        key=key,
+        payload=json.dumps(payload, separators=(',', ':'))
+    ))
+
+def get_state(session, key: str) -> int:
+    """
+    Returns a replication watermark, 0 if it was never set.
+    """
+    return session.execute(select(SyncState.value).where(SyncState.key == key)).scalar() or 0
+
+def set_state(session, key: str, value: int):
+    """
+    Saves a replication watermark, within the caller's database transaction.
+    """
+    statement = sqlite_insert(SyncState).values(key=key, value=value)
+    session.execute(statement.on_conflict_do_update(index_elements=['key'], set_={'value': statement.excluded.value}))
+
+def apply_changes(session, changes: list[dict], relay: bool = False):
+    """
+    Applies changes made on other terminals to the local database.
+
+    Conflicts are resolved per kind of change:
+
+    - "item": the change that reaches the hub last wins, since changes are applied in feed order.
+    - "stock": changes are deltas, so concurrent sales on several tills add up instead
+      of overwriting each other. Each applies to the stock of its location, created if
+      it doesn't exist, or to the default location for tills of older versions, and is
+      recorded in the movement ledger with its kind and the terminal it came from.
+    - "sale": sales are only ever inserted.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.session.Session
+        The session of the ongoing database transaction.
+    changes : list of dict
+        The changes, as exported by `export_changes`.
+    relay : bool, optional
+        Whether to record the changes in the change log, keeping their origin, so they are
+        forwarded to the other terminals. Only the hub relays changes. Defaults to False.
+    """
+    item_ids = dict(session.execute(select(Items.name, Items.id)).all())
+    location_ids = {}
+
+    # Stock deltas are summed per item and location, the quantities sold per day and item, and sales, sale lines,
+    # discounts and relayed changes are inserted in bulk, so a batch costs a few statements instead of a few per change
+    deltas, day_sales, sales, relayed = {}, {}, [], []
+
+    def flush_deltas(keys: list[str]):
+        stock, movements = [], {}
+        for key in keys:
+            for (location, kind, origin), delta in deltas.pop(key, {}).items():
+                if delta and key in item_ids:
+                    if location not in location_ids:
+                        location_ids[location] = lookup_location(session, location, create=True)
+                    stock.append({'location_id': location_ids[location], 'item_id': item_ids[key], 'stock': delta})
+                    movements.setdefault((kind, origin), []).append((item_ids[key], location_ids[location], delta))
+        if stock:
+            statement = sqlite_insert(Store)
+            session.execute(statement.on_conflict_do_update(
+                index_elements=['location_id', 'item_id'], set_={'stock': Store.stock + statement.excluded.stock}
+            ), stock)
+        for (kind, origin), moved in movements.items():
+            record_movements(session, kind, moved, origin)
+
+    for change in changes:
+        entity, key, payload = change['entity'], change['key'], change['payload']
+
+        if entity == "item":
+            # Deltas received before an item change apply to the item as it was
+            flush_deltas([key])
+            if payload.get('deleted'):
+                if key in item_ids:
+                    # The stock left is written off, as on the till that removed the item
+                    record_movements(session, "adjustment", session.execute(
+                        select(Store.item_id, Store.location_id, -Store.stock).where(Store.item_id == item_ids[key])
+                    ).tuples().all(), "removed")
+                    session.execute(delete(Store).where(Store.item_id == item_ids[key]))
+                    session.execute(delete(Items).where(Items.id == item_ids.pop(key)))
+            elif key in item_ids:
+                # Tills of older versions don't send the category, and changes without it keep it
+                values = {'price': payload['price'], 'cost': payload.get('cost')}
+                if payload.get('category') is not None:
+                    values['category'] = payload['category']
+                session.execute(update(Items).where(Items.id == item_ids[key]).values(**values))
+            else:
+                item_id = session.execute(insert(Items).values(
+                    name=key, price=payload['price'], cost=payload.get('cost'), category=payload.get('category')
+                )).inserted_primary_key[0]
+                session.execute(insert(Store).values(location_id=1, item_id=item_id, stock=0))
+                item_ids[key] = item_id
+
+        elif entity == "stock":
+            # Tills of older versions don't send the kind of the change
+            group = (payload.get('location', DEFAULT_LOCATION), payload.get('kind', "adjustment"), change['origin'])
+            by_group = deltas.setdefault(key, {})
+            by_group[group] = by_group.get(group, 0) + payload['delta']
+
+        elif entity == "sale":
+            timestamp = datetime.fromisoformat(payload['timestamp'])
+            # Lines are name, quantity, unit price, unit cost and discount, tills of older versions send fewer
+            sale_lines = []
+            for name, quantity, *prices in payload['lines']:
+                if name in item_ids:
+                    unit_price, unit_cost, line_discount = prices + [None, None, 0][len(prices):]
+                    sale_lines.append({
+                        'item_id': item_ids[name],
+                        'quantity': quantity,
+                        'unit_price': unit_price,
+                        'line_total': unit_price * quantity - line_discount if unit_price is not None else None,
+                        'unit_cost': unit_cost,
+                        'discount': line_discount
+                    })
+                    sale_key = (day_key(timestamp), item_ids[name])
+                    day_sales[sale_key] = day_sales.get(sale_key, 0) + quantity
+            # Promotions have other identifiers on each till, so only their names are kept
+            sales.append(({
+                'timestamp': timestamp,
+                'day_key': day_key(timestamp),
+                'total_amount': payload['total'],
+                'payment_received': payload['received'],
+                'change_returned': payload['change'],
+                'discount': payload.get('discount', 0)
+            }, sale_lines, payload.get('discounts', [])))
+
+        if relay:
+            relayed.append({
+                'origin': change['origin'],
+                'origin_seq': change['origin_seq'],
+                'entity': entity,
+                'key': key,
+                'payload': json.dumps(payload, separators=(',', ':')),
+                'created_at': datetime.fromisoformat(change['created_at'])
+            })
+
+    flush_deltas(list(deltas))
+    if sales:
+        # The ids of the new transactions come back in the order of the sales
+        transaction_ids = session.execute(
+            insert(Transaction).returning(Transaction.id, sort_by_parameter_order=True), [sale for sale, _, _ in sales]
+        ).scalars().all()
+        lines = [
+            {'transaction_id': transaction_id, **line}
+            for transaction_id, (_, sale_lines, _) in zip(transaction_ids, sales) for line in sale_lines
+        ]
+        discounts = [
+            {'transaction_id': transaction_id, 'name': name, 'amount': amount}
+            for transaction_id, (_, _, sale_discounts) in zip(transaction_ids, sales) for name, amount in sale_discounts
+        ]
+        if lines:
+            session.execute(insert(TransactionItem), lines)
+        if discounts:
+            session.execute(insert(TransactionDiscount), discounts)
+    add_item_day_sales(session, day_sales)
+    if relayed:
+        session.execute(insert(ChangeLog), relayed)
+
+def export_changes(rows) -> list[dict]:
+    """
+    Converts change log rows into plain dictionaries for the transport.
+    """
+    return [
+        {
+            'seq': row.seq,
+            'origin': row.origin,
+            'origin_seq': row.origin_seq if row.origin_seq is not None else row.seq,
+            'entity': row.entity,
+            'key': row.key,
+            'payload': json.loads(row.payload),
+            'created_at': row.created_at.isoformat()
+        }
+        for row in rows
+    ]
+
+
+class Hub:
+    """
+    The back-office side of the replication, working on the local database of the hub.
+
+    The hub applies the changes pushed by the tills to its own database and appends
+    them to its change log, which is the feed the tills pull from.
+    """
+    def __init__(self):
+        # Batches are applied one at a time, even when several tills push at once
+        self.lock = threading.Lock()
+
+    def receive(self, origin: str, changes: list[dict]) -> int:
+        """
+        Applies a batch of changes pushed by a terminal.
+
+        Batches already received are ignored, so a terminal can safely push a batch
+        again when it didn't get the acknowledgement.
+
+        Parameters
+        ----------
+        origin : str
+            The identifier of the pushing terminal.
+        changes : list of dict
+            The changes, in the order of the terminal's change log.
+
+        Returns
+        -------
+        int
+            The sequence number of the last change of the terminal received so far.
+        """
+        with self.lock, get_session() as session:
+            received = get_state(session, f"received:{origin}")
+            changes = [change for change in changes if change['origin_seq'] > received]
+            if changes:
+                apply_changes(session, changes, relay=True)
+                received = changes[-1]['origin_seq']
+                set_state(session, f"received:{origin}", received)
+            session.commit()
+        return received
+
+    def feed(self, after: int, origin: str, limit: int) -> tuple[list[dict], int]:
+        """
+        Returns the changes of the feed that a terminal hasn't pulled yet.
+
+        Parameters
+        ----------
+        after : int
+            The sequence number of the last change the terminal pulled.
+        origin : str
+            The identifier of the terminal, whose own changes are skipped.
+        limit : int
+            The maximum number of changes to return.
+
+        Returns
+        -------
+        tuple of (list of dict, int)
+            - The changes, in feed order.
+            - The sequence number to pull after the next time.
+        """
+        with get_session() as session:
+            # Read the end of the feed first, changes received meanwhile are left for the next pull
+            max_seq = session.execute(select(func.max(ChangeLog.seq))).scalar() or after
+            rows = session.execute(
+                select(ChangeLog)
+                .where(ChangeLog.seq > after, ChangeLog.seq <= max_seq, ChangeLog.origin != origin)
+                .order_by(ChangeLog.seq)
+                .limit(limit)
+            ).scalars().all()
+            # When the page isn't full, the rest up to the end are the terminal's own changes
+            last_seq = rows[-1].seq if len(rows) == limit else max_seq
+            return export_changes(rows), max(last_seq, after)
+
+    def serve(self, host: str = "127.0.0.1", port: int = 8765):
+        """
+        Serves the hub over HTTP until the process is stopped.
+
+        POST /push receives a JSON body with "origin" and "changes" and answers
+        {"received": seq}. GET /pull?after=seq&origin=id&limit=n answers
+        {"changes": [...], "last_seq": seq}.
+
+        Parameters
+        ----------
+        host : str, optional
+            The address to listen on. Defaults to "127.0.0.1".
+        port : int, optional
+            The port to listen on. Defaults to 8765.
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from urllib.parse import urlparse, parse_qs
+        hub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def reply(self, body: dict):
+                data = json.dumps(body, separators=(',', ':')).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                self.reply({'received': hub.receive(body['origin'], body['changes'])})
+
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                changes, last_seq = hub.feed(int(query['after'][0]), query['origin'][0], int(query['limit'][0]))
+                self.reply({'changes': changes, 'last_seq': last_seq})
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+
+
+class LocalTransport:
+    """
+    Transport calling a `Hub` in the same process, without any network.
+    """
+    def __init__(self, hub: Hub):
+        self.hub = hub
+
+    def push(self, origin: str, changes: list[dict]) -> int:
+        return self.hub.receive(origin, changes)
+
+    def pull(self, after: int, origin: str, limit: int) -> tuple[list[dict], int]:
+        return self.hub.feed(after, origin, limit)
+
+
+class HttpTransport:
+    """
+    Transport talking to a hub served with `Hub.serve`.
+    """
+    def __init__(self, url: str, timeout: float = 10):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def push(self, origin: str, changes: list[dict]) -> int:
+        data = json.dumps({'origin': origin, 'changes': changes}, separators=(',', ':')).encode()
+        req = request.Request(f"{self.url}/push", data=data, headers={"Content-Type": "application/json"})
+        with request.urlopen(req, timeout=self.timeout) as response:
+            return json.loads(response.read())['received']
+
+    def pull(self, after: int, origin: str, limit: int) -> tuple[list[dict], int]:
+        with request.urlopen(f"{self.url}/pull?after={after}&origin={origin}&limit={limit}", timeout=self.timeout) as response:
+            body = json.loads(response.read())
+        return body['changes'], body['last_seq']
+
+
+class SyncEngine:
+    """
+    The terminal side of the replication.
+
+    Local changes are pushed to the hub from the change log in batches, and the
+    changes of the other terminals are pulled from the hub feed in batches. Each
+    pulled batch is applied in one database transaction together with its watermark,
+    so an interrupted sync resumes where it stopped without applying anything twice.
+    """
+    def __init__(self, transport, batch_size: int = None):
+        """
+        Initializes the sync engine.
+
+        Parameters
+        ----------
+        transport : LocalTransport or HttpTransport
+            The transport used to reach the hub.
+        batch_size : int, optional
+            The maximum number of changes per request. Defaults to the "sync_batch_size" setting.
+        """
+        self.transport = transport
+        self.batch_size = batch_size or get_setting("sync_batch_size")
+        self.terminal_id = get_terminal_id()
+
+    def push(self) -> int:
+        """
+        Pushes the local changes to the hub and removes them from the outbox once received.
+
+        Returns
+        -------
+        int
+            The number of changes pushed.
+        """
+        pushed = 0
+        while True:
+            with get_session() as session:
+                rows = session.execute(
+                    select(ChangeLog)
+                    .where(ChangeLog.origin == self.terminal_id)
+                    .order_by(ChangeLog.seq)
+                    .limit(self.batch_size)
+                ).scalars().all()
+                if not rows:
+                    return pushed
+
+                received = self.transport.push(self.terminal_id, export_changes(rows))
+
+                session.execute(delete(ChangeLog).where(ChangeLog.origin == self.terminal_id, ChangeLog.seq <= received))
+                set_state(session, "last_pushed_seq", received)
+                session.commit()
+            pushed += len(rows)
+
+    def pull(self) -> int:
+        """
+        Pulls the changes of the other terminals from the hub and applies them.
+
+        Returns
+        -------
+        int
+            The number of changes applied.
+        """
+        pulled = 0
+        while True:
+            with get_session() as session:
+                after = get_state(session, "last_pulled_seq")
+                changes, last_seq = self.transport.pull(after, self.terminal_id, self.batch_size)
+                apply_changes(session, changes)
+                set_state(session, "last_pulled_seq", last_seq)
+                session.commit()
+            pulled += len(changes)
+            if len(changes) < self.batch_size:
+                return pulled
+
+    def sync(self) -> dict:
+        """
+        Pushes the local changes and then pulls the remote ones.
+
+        Returns
+        -------
+        dict
+            The number of changes "pushed" and "pulled", and the "seconds" it took.
+        """
+        start = time.perf_counter()
+        pushed = self.push()
+        pulled = self.pull()
+        return {'pushed': pushed, 'pulled': pulled, 'seconds': time.perf_counter() - start}
+
+    def start(self, interval: float = None) -> threading.Event:
+        """
+        Syncs periodically on a background thread, so sales never wait for the hub.
+
+        Errors, e.g. when the hub can't be reached, are ignored until the next sync.
+
+        Parameters
+        ----------
+        interval : float, optional
+            The seconds between syncs. Defaults to the "sync_interval" setting.
+
+        Returns
+        -------
+        threading.Event
+            An event that stops the thread when set.
+        """
+        interval = interval or get_setting("sync_interval")
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                try:
+                    self.sync()
+                except Exception as error:
+                    print(f"Warning: Sync with the hub failed: {error}")
+
+        threading.Thread(target=run, name="sync", daemon=True).start()
+        return stop
+
+
+if __name__ == '__main__':
+    # Stand-in hub: serves the database given in POS_DATABASE, e.g.
+    # POS_DATABASE=hub.db python -m backend.sync 8765
+    import sys
+    from database.database import create_db
+    create_db()
+    Hub().serve(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8765)
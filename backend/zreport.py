@@ -0,0 +1,276 @@
+from database.database import get_engine, get_session
+from database.models import Items, Transaction, TransactionItem, ZReport, day_key
+from backend.services import with_retry
+from sqlalchemy import func, select, cast, Integer
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from datetime import date, datetime
+import json
+
+def compute_z_report(day: date) -> dict:
+    """
+    Computes the end-of-day report of a day from its transactions.
+
+    The range of ids of the day's transactions is read from the `ix_transactions_day_key`
+    index first. The transactions and their lines are then each read once, as a range of
+    their table and of the `ix_transaction_items_transaction_id` index, and totalled by
+    SQLite by hour and by item, so the time grows with the sales of the day, not with
+    those of the whole history. The lines are only checked against the day of their
+    transaction when sales of other days, synced from other tills, were saved in between.
+
+    Parameters
+    ----------
+    day : date
+        The day of the report.
+
+    Returns
+    -------
+    dict
+        The report: the number of transactions, the total sales, the discounts, the
+        average basket, the items sold, the money received and the change given, and
+        the transactions and sales by hour and the quantity and revenue by item.
+    """
+    key = day_key(day)
+    hour = cast(func.strftime('%H', Transaction.timestamp), Integer).label('hour')
+
+    with get_engine().connect() as connection:
+        first, last, count = connection.execute(
+            select(func.min(Transaction.id), func.max(Transaction.id), func.count()).where(Transaction.day_key == key)
+        ).one()
+
+        by_hour, by_item = [], []
+        if count:
+            in_range = Transaction.id.between(first, last)
+            by_hour = connection.execute(
+                select(
+                    hour, func.count(), func.sum(Transaction.total_amount), func.sum(Transaction.payment_received),
+                    func.sum(Transaction.change_returned), func.sum(Transaction.discount)
+                )
+                .where(in_range, Transaction.day_key == key)
+                .group_by(hour)
+                .order_by(hour)
+            ).all()
+
+            lines = (
+                select(
+                    TransactionItem.item_id.label('item_id'),
+                    func.sum(TransactionItem.quantity).label('quantity'),
+                    func.coalesce(func.sum(TransactionItem.line_total), 0).label('revenue')
+                )
+                .where(TransactionItem.transaction_id.between(first, last))
+                .group_by(TransactionItem.item_id)
+            )
+            if last - first + 1 > count:
+                lines = lines.where(TransactionItem.transaction_id.in_(
+                    select(Transaction.id).where(in_range, Transaction.day_key == key)
+                ))
+            lines = lines.subquery()
+            # The names are joined once per item, after the lines are totalled
+            by_item = connection.execute(
+                select(Items.name, lines.c.quantity, lines.c.revenue)
+                .join(Items, Items.id == lines.c.item_id)
+                .order_by(lines.c.revenue.desc(), Items.name)
+            ).all()
+
+    total = sum((row[2] for row in by_hour), 0.0)
+    return {
+        'date': day.isoformat(),
+        'closed_at': None,
+        'transactions': count,
+        'total_sales': round(total, 2),
+        'discount': round(sum((row[5] for row in by_hour), 0.0), 2),
+        'average_basket': round(total / count, 2) if count else 0.0,
+        'items_sold': sum(row[1] for row in by_item),
+        'payment_received': round(sum((row[3] for row in by_hour), 0.0), 2),
+        'change_returned': round(sum((row[4] for row in by_hour), 0.0), 2),
+        'last_transaction_id': last,
+        'by_hour': [[hour, transactions, round(amount, 2)] for hour, transactions, amount, *_ in by_hour],
+        'by_item': [[name, quantity, round(revenue, 2)] for name, quantity, revenue in by_item],
+    }
+
+def get_z_report(day: date) -> dict:
+    """
+    Retrieves the end-of-day report of a day.
+
+    The report of a closed day is read from its saved row. The report of a day not
+    closed yet is computed from its transactions, with `closed_at` set to None.
+
+    Parameters
+    ----------
+    day : date
+        The day of the report.
+
+    Returns
+    -------
+    dict
+        The report, as returned by `compute_z_report`.
+    """
+    with get_session() as session:
+        saved = session.execute(select(ZReport.report).where(ZReport.date == day)).scalar()
+    return json.loads(saved) if saved is not None else compute_z_report(day)
+
+def close_day(day: date = None) -> dict:
+    """
+    Closes a day, saving its end-of-day report.
+
+    A day is closed once: its report is never recomputed, even if sales of that day
+    are synced from other tills later. Closing a closed day returns its saved report.
+
+    Parameters
+    ----------
+    day : date, optional
+        The day to close. Defaults to None, which closes today.
+
+    Returns
+    -------
+    dict
+        The saved report, as returned by `compute_z_report`.
+
+    Raises
+    ------
+    ValueError
+        If the day is in the future.
+    """
+    day = day or date.today()
+    if day > date.today():
+        raise ValueError(f"{day.isoformat()} hasn't started yet.")
+
+    report = compute_z_report(day)
+    report['closed_at'] = datetime.now().isoformat(timespec='seconds')
+
+    def operation():
+        with get_session() as session:
+            session.execute(
+                sqlite_insert(ZReport).values(
+                    date=day, closed_at=datetime.fromisoformat(report['closed_at']),
+                    transactions=report['transactions'], total_sales=report['total_sales'],
+                    last_transaction_id=report['last_transaction_id'],
+                    report=json.dumps(report, separators=(',', ':'))
+                ).on_conflict_do_nothing(index_elements=['date'])
+            )
+            session.commit()
+
+    with_retry(operation)
+    return get_z_report(day)
+
+def get_closed_days(limit: int = None) -> list[tuple]:
+    """
+    Lists the closed days, newest first.
+
+    Parameters
+    ----------
+    limit : int, optional
+        The maximum number of days listed. Defaults to None, which lists all of them.
+
+    Returns
+    -------
+    list of tuple
+        The date, the time it was closed, the number of transactions and the total sales of each day.
+    """
+    with get_session() as session:
+        return session.execute(
+            select(ZReport.date, ZReport.closed_at, ZReport.transactions, ZReport.total_sales)
+            .order_by(ZReport.date.desc())
+            .limit(limit)
+        ).all()
+
+def format_z_report(report: dict, width: int = 48) -> str:
+    """
+    Formats an end-of-day report as plain text, to show, print or export.
+
+    Parameters
+    ----------
+    report : dict
+        The report, as returned by `get_z_report`.
+    width : int, optional
+        The width of the lines. Defaults to 48.
+
+    Returns
+    -------
+    str
+        The report, one line per row.
+    """
+    def row(label: str, value: str) -> str:
+        label = label[:width - len(value) - 1]
+        return label + value.rjust(width - len(label))
+
+    closed = f"Closed at {report['closed_at'].replace('T', ' ')}" if report['closed_at'] else "Not closed"
+    lines = [
+        f"Z REPORT {report['date']}".center(width),
+        closed.center(width),
+        "",
+        row("Transactions", f"{report['transactions']:,}"),
+        row("Total sales", f"${report['total_sales']:,.2f}"),
+        row("Discounts", f"${report['discount']:,.2f}"),
+        row("Average basket", f"${report['average_basket']:,.2f}"),
+        row("Items sold", f"{report['items_sold']:,}"),
+        "",
+        "PAYMENTS",
+        row("Received", f"${report['payment_received']:,.2f}"),
+        row("Change given", f"${report['change_returned']:,.2f}"),
+        row("Net cash", f"${report['payment_received'] - report['change_returned']:,.2f}"),
+        "",
+        "SALES BY HOUR",
+    ]
+    lines += [row(f"{hour:02d}:00  {count:>6,} sales", f"${total:,.2f}") for hour, count, total in report['by_hour']]
+    lines += ["", "SALES BY ITEM"]
+    lines += [row(f"{quantity:>6,} x {name}", f"${revenue:,.2f}") for name, quantity, revenue in report['by_item']]
+    return "\n".join(lines)
+
+def _pdf_document(lines: list[str], font_size: int = 9) -> bytes:
+    """
+    Builds a PDF document of lines of text, in the Courier font, on A4 pages.
+
+    PDF files of plain text are simple enough to write directly, without a dependency.
+    """
+    leading, margin, height = font_size + 3, 50, 842
+    per_page = (height - 2 * margin) // leading
+    pages = [lines[start:start + per_page] for start in range(0, len(lines), per_page)] or [[]]
+
+    def escape(line: str) -> str:
+        return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    # Objects 1 to 3 are the catalog, the page tree and the font, then a page and its content for each page
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % (4 + 2 * page) for page in range(len(pages)))
+        + b"] /Count %d >>" % len(pages),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>",
+    ]
+    for page, page_lines in enumerate(pages):
+        text = "".join(f"({escape(line)}) '\n" for line in page_lines)
+        stream = (f"BT /F1 {font_size} Tf {leading} TL {margin} {height - margin} Td\n{text}ET\n").encode("cp1252", "replace")
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> "
+            b"/Contents %d 0 R >>" % (5 + 2 * page)
+        )
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"endstream")
+
+    document = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(document))
+        document += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(document)
+    document += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    document += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    document += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(document)
+
+def export_z_report(report: dict, path: str):
+    """
+    Exports an end-of-day report to a file, as PDF if its name ends in ".pdf" and as text otherwise.
+
+    Parameters
+    ----------
+    report : dict
+        The report, as returned by `get_z_report`.
+    path : str
+        The path of the file.
+    """
+    text = format_z_report(report)
+    if path.lower().endswith(".pdf"):
+        with open(path, "wb") as file:
+            file.write(_pdf_document(text.split("\n")))
+    else:
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(text + "\n")
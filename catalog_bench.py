@@ -0,0 +1,213 @@
+"""
+POS System Catalog Benchmark
+
+Author: Alejandro Vargas
+Github: https://github.com/sagravela
+
+This script measures how long the item tables of the POS and Store tabs take to load
+on a large catalog. On a database of its own it adds many items, held at several
+locations, and times `get_items`, which the tables are filled from:
+
+- on the catalog as generated,
+- after transfers and deliveries between the locations.
+
+It also times checkouts, with the reload of the rows of the items sold that the
+POS tab makes after each of them, with `get_item`.
+
+The total stock of each item read must be the sum of its stock at every location.
+The exit code is 1 if any differs, or if a median time is over its threshold.
+
+Examples
+--------
+    python catalog_bench.py
+    python catalog_bench.py --items 100000 --locations 10 --sales 20
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+# Total stock of each item, summed from the stock entries of the locations
+TOTALS = "SELECT items.name, COALESCE(SUM(store.stock), 0) FROM items LEFT JOIN store ON store.item_id = items.id GROUP BY items.id"
+
+def seed_catalog(path: str, location_id: int, args: argparse.Namespace, rng: random.Random) -> tuple[list[tuple[str, float]], list[str]]:
+    """
+    Adds the items, the locations and the stock of every item at every location.
+
+    Parameters
+    ----------
+    path : str
+        The path of the database.
+    location_id : int
+        The location of the till, the first one.
+    args : argparse.Namespace
+        The parsed command line.
+    rng : random.Random
+        The random generator of the catalog and the stock.
+
+    Returns
+    -------
+    tuple of (list, list)
+        The name and price of each item, and the names of the other locations.
+    """
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA synchronous = OFF")
+    items = [(number, f"Item {number:06d}", round(rng.uniform(0.5, 30), 2)) for number in range(1, args.items + 1)]
+    connection.executemany("INSERT INTO items (id, name, price) VALUES (?, ?, ?)", items)
+    others = [f"Location {number}" for number in range(1, args.locations)]
+    connection.executemany("INSERT INTO locations (name) VALUES (?)", [(name,) for name in others])
+    location_ids = [location_id] + [
+        row[0] for row in connection.execute("SELECT id FROM locations WHERE id != ? ORDER BY id", (location_id,))
+    ]
+    for location in location_ids:
+        connection.executemany(
+            "INSERT INTO store (location_id, item_id, stock, reorder_threshold) VALUES (?, ?, ?, ?)",
+            [(location, item_id, rng.randint(10, 200), rng.randint(0, 20)) for item_id, _, _ in items]
+        )
+    connection.commit()
+    connection.execute("ANALYZE")
+    connection.close()
+    return [(name, price) for _, name, price in items], others
+
+def timed(function, *args) -> tuple[float, object]:
+    """
+    Runs a function, returning the milliseconds it took and its result.
+    """
+    started = time.perf_counter()
+    result = function(*args)
+    return (time.perf_counter() - started) * 1000, result
+
+def mismatches(path: str, rows: list[tuple], partial: bool = False) -> int:
+    """
+    Counts the items whose total stock differs from the sum of their stock at the locations.
+
+    Unless `partial` is True, the rows must also hold every item of the catalog.
+    """
+    connection = sqlite3.connect(path)
+    totals = dict(connection.execute(TOTALS).fetchall())
+    connection.close()
+    missing = 0 if partial else abs(len(totals) - len(rows))
+    return sum(totals.get(name) != total for name, *_, total in rows) + missing
+
+def run(args: argparse.Namespace) -> tuple[list[tuple], list[tuple[str, bool, str]]]:
+    """
+    Generates the catalog and times the loads of the item tables.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The parsed command line.
+
+    Returns
+    -------
+    tuple of (list, list)
+        The name, median and maximum milliseconds of each stage, and the name of each
+        check, whether it passed and the values it compared.
+    """
+    from database.database import create_db, database_path
+    from backend.locations import get_till_location
+    from backend.services import get_items, get_item, save_transaction, transfer_stock, receive_stock
+
+    rng = random.Random(args.seed)
+    create_db()
+    location_id, till = get_till_location()
+    started = time.perf_counter()
+    items, others = seed_catalog(database_path, location_id, args, rng)
+    print(f"{args.items} items at {args.locations} locations generated in {time.perf_counter() - started:.1f} s", file=sys.stderr)
+
+    stages, different = [], 0
+    times = []
+    for _ in range(args.loads):
+        milliseconds, rows = timed(get_items)
+        times.append(milliseconds)
+    different += mismatches(database_path, rows)
+    stages.append(("catalog", times))
+
+    times = []
+    for _ in range(args.sales):
+        name, _ = rng.choice(items)
+        if others and rng.random() < 0.5:
+            transfer_stock(name, 1, till, rng.choice(others))
+        else:
+            receive_stock(name, 5, location=rng.choice(others or [till]))
+        milliseconds, rows = timed(get_items)
+        times.append(milliseconds)
+    different += mismatches(database_path, rows)
+    stages.append(("after transfers", times))
+
+    # The POS tab reloads the rows of the items sold after every checkout, the last row read of each item is its current one
+    prices = dict(items)
+    times, sold = [], {}
+    for _ in range(args.sales):
+        cart = [(name, rng.randint(1, 3)) for name, _ in rng.sample(items, 3)]
+        total = round(sum(prices[name] * quantity for name, quantity in cart), 2)
+        milliseconds, _ = timed(save_transaction, total, total, 0.0, cart)
+        reload, rows = timed(lambda: [get_item(name) for name, _ in cart])
+        times.append(milliseconds + reload)
+        sold.update((row[0], row) for row in rows)
+    different += mismatches(database_path, list(sold.values()), partial=True)
+    stages.append(("checkout and reload", times))
+
+    stages = [(name, statistics.median(values), max(values)) for name, values in stages]
+    load = max(stages[0][1], stages[1][1])
+    checks = [
+        ("total stock of the items", different == 0, f"{different} items differ from their stock at the locations"),
+        ("catalog", load <= args.max_ms, f"median {load:.0f} ms (max {args.max_ms:.0f} ms)"),
+        ("checkout and reload", stages[2][1] <= args.max_checkout_ms, f"median {stages[2][1]:.0f} ms (max {args.max_checkout_ms:.0f} ms)"),
+    ]
+    return stages, checks
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Builds the parser of the command line.
+
+    Returns
+    -------
+    argparse.ArgumentParser
+        The parser.
+    """
+    parser = argparse.ArgumentParser(description="Time the loads of the item tables on a large catalog held at several locations.")
+    parser.add_argument("--items", type=int, default=100000, help="number of items of the catalog")
+    parser.add_argument("--locations", type=int, default=10, help="number of locations holding every item")
+    parser.add_argument("--loads", type=int, default=10, help="number of loads of the catalog timed")
+    parser.add_argument("--sales", type=int, default=20, help="number of checkouts, and of transfers and deliveries, timed")
+    parser.add_argument("--max-ms", type=float, default=400, help="maximum median time of a load of the catalog, in ms")
+    parser.add_argument("--max-checkout-ms", type=float, default=50, help="maximum median time of a checkout and the reload of its rows, in ms")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the catalog and the sales")
+    parser.add_argument("--database", help="database file, a new temporary one by default")
+    return parser
+
+def main(argv: list[str] = None):
+    """
+    The entry point of the catalog benchmark.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        The command line arguments. Defaults to None, which reads them from `sys.argv`.
+    """
+    args = build_parser().parse_args(argv)
+
+    # Run on a database and settings of its own, before the application reads them
+    directory = tempfile.mkdtemp(prefix="pos_catalog_")
+    os.environ["POS_DATABASE"] = args.database or os.path.join(directory, "catalog.db")
+    os.environ["POS_CONFIG"] = os.path.join(directory, "config.json")
+
+    stages, checks = run(args)
+    print(f"{'stage':<20} {'median_ms':>10} {'max_ms':>8}")
+    for name, median, maximum in stages:
+        print(f"{name:<20} {median:>10.1f} {maximum:>8.1f}")
+    print()
+    for name, passed, values in checks:
+        print(f"{name:<26} {'ok' if passed else 'FAILED':<7} {values}")
+    passed = all(passed for _, passed, _ in checks)
+    print("PASSED" if passed else "FAILED")
+    sys.exit(0 if passed else 1)
+
+if __name__ == '__main__':
+    main()
@@ -1,26 +1,75 @@
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
 from .models import Base
-import os
+from .migrations import migrate
+import os, sqlite3, tempfile, time
 
-# Save the corresponding database to the user root
+# Save the corresponding database to the user root, unless another file is given in POS_DATABASE
 home_directory = os.path.expanduser("~")
-database_path = os.path.join(home_directory, ".pos_inventory.db")
+database_path = os.environ.get("POS_DATABASE", os.path.join(home_directory, ".pos_inventory.db"))
 DATABASE_URL = f"sqlite:///{database_path}"
 
+# Read-only copy of the database that reports run on, so they never block sales
+reporting_path = os.path.splitext(database_path)[0] + "_reporting.db"
+
+# Folder of the Parquet export of the reporting snapshot, read by the optional DuckDB analytics engine
+parquet_path = os.path.splitext(database_path)[0] + "_parquet"
+
+# Start of the paths of the archives of closed years, next to the database and named after it. Those
+# of the default database keep the ".pos_archive_<year>.db" names they had before
+if database_path == os.path.join(home_directory, ".pos_inventory.db"):
+    archive_prefix = os.path.join(home_directory, ".pos_archive")
+else:
+    archive_prefix = os.path.splitext(database_path)[0] + "_archive"
+
+# Seconds SQLite waits for another till to release the database before failing with "database is locked"
+BUSY_TIMEOUT = 5
+
+# Times a backup made a few pages at a time is restarted by the tills' writes before it's given up
+BACKUP_RESTARTS = 3
+
+# Engines shared by all the sessions of the process
+_engine = None
+_reporting_engine = None
+
+def get_archive_path(year: int) -> str:
+    """
+    Returns the path of the archive database holding the transactions of a year.
+
+    Archives are saved next to the main database, as "<database name>_archive_<year>.db",
+    or ".pos_archive_<year>.db" for the default database, so each database only sees its own.
+
+    Parameters
+    ----------
+    year : int
+        The year of the archived transactions.
+
+    Returns
+    -------
+    str
+        The path to the archive database file.
+    """
+    return f"{archive_prefix}_{year}.db"
+
 def get_engine():
     """
     Creates and returns the SQLAlchemy engine for the database connection.
 
     The engine is configured to connect to an SQLite database stored 
     in the user's home directory, under the path ".pos_inventory.db".
+    It is created once, so its connections are pooled instead of being
+    opened for every session.
 
     Returns
     -------
     sqlalchemy.engine.base.Engine
         The SQLAlchemy engine object for connecting to the SQLite database.
     """
-    return create_engine(DATABASE_URL)
+    global _engine
+    if _engine is None:
+        _engine = create_engine(DATABASE_URL, connect_args={"timeout": BUSY_TIMEOUT})
+    return _engine
 
 def create_db():
     """
@@ -30,10 +79,39 @@ def create_db():
     defined in the `Base` metadata, if they do not already exist.
 
     It uses the engine generated by `get_engine` to connect to the 
-    SQLite database and applies the table definitions.
+    SQLite database and applies the table definitions. Databases created by
+    older versions are then migrated, and indexes are created separately so
+    that they also get them.
     """
     engine = get_engine()
+
+    # New databases can return their free pages to the file system with `PRAGMA incremental_vacuum`.
+    # The mode can only be set before the first table is created.
+    with engine.connect() as connection:
+        if not connection.exec_driver_sql("PRAGMA page_count").scalar():
+            connection.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+
     Base.metadata.create_all(engine)
+    migrate(engine)
+
+    # `create_all` skips existing tables, including their indexes
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+    # A reporting snapshot taken before a migration lacks its columns, so it is taken again
+    if os.path.exists(reporting_path):
+        snapshot = sqlite3.connect(reporting_path, timeout=BUSY_TIMEOUT)
+        snapshot_version = snapshot.execute("PRAGMA user_version").fetchone()[0]
+        snapshot.close()
+        with engine.connect() as connection:
+            version = connection.exec_driver_sql("PRAGMA user_version").scalar()
+        if snapshot_version != version:
+            try:
+                backup_database(reporting_path)
+            except BackupBusyError:
+                # The first report takes a new one instead
+                os.remove(reporting_path)
 
 def get_session():
     """
@@ -48,6 +126,100 @@ def get_session():
     sqlalchemy.orm.session.Session
         A new session object for querying and modifying the database.
     """
-    engine = get_engine()
-    Session = sessionmaker(bind=engine)
-    return Session()
+    return Session(bind=get_engine())
+
+def get_reporting_session():
+    """
+    Creates and returns a new SQLAlchemy session on the reporting snapshot.
+
+    The snapshot is a copy of the database refreshed with `backup_database`,
+    so long reports running on it never hold locks on the live database.
+    Connections aren't pooled, since a refresh replaces the file: each session
+    opens the latest snapshot, while the sessions already open keep reading theirs.
+
+    Returns
+    -------
+    sqlalchemy.orm.session.Session
+        A new session object for querying the reporting snapshot.
+    """
+    global _reporting_engine
+    if _reporting_engine is None:
+        _reporting_engine = create_engine(
+            f"sqlite:///{reporting_path}", connect_args={"timeout": BUSY_TIMEOUT}, poolclass=NullPool
+        )
+    return Session(bind=_reporting_engine)
+
+class BackupBusyError(Exception):
+    """
+    Raised when the writes of the tills keep restarting a backup, which is given up to be made later.
+    """
+
+def backup_database(destination: str, pages: int = 256, sleep: float = 0.005) -> int:
+    """
+    Copies the live database into another file with the SQLite online backup API.
+
+    The copy is made a few pages at a time, releasing the database between steps,
+    so the tills can keep writing while it runs. If the database changes in the
+    meantime, SQLite restarts the copy, so it is always consistent. After
+    `BACKUP_RESTARTS` restarts the copy is given up, rather than made in a single
+    step that would make the tills wait for it, and the destination is left as it was.
+
+    The copy is made into a temporary file in the folder of the destination,
+    which then replaces it, so the destination is never seen half copied.
+
+    Parameters
+    ----------
+    destination : str
+        The path of the copy. It is replaced if it exists.
+    pages : int, optional
+        The number of pages copied per step. Defaults to 256.
+    sleep : float, optional
+        The seconds to pause between steps. Defaults to 0.005.
+
+    Returns
+    -------
+    int
+        The number of pages of the database.
+
+    Raises
+    ------
+    BackupBusyError
+        If the copy was restarted `BACKUP_RESTARTS` times.
+    """
+    total, remaining, restarts = 0, None, 0
+
+    def progress(status, left, count):
+        nonlocal total, remaining, restarts
+        total = count
+        # The pages left only go up when the copy starts over
+        if remaining is not None and left > remaining:
+            restarts += 1
+            if restarts >= BACKUP_RESTARTS:
+                raise BackupBusyError(f"The database kept changing, the backup was restarted {restarts} times.")
+        remaining = left
+
+    handle, temporary = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(os.path.abspath(destination)))
+    os.close(handle)
+    try:
+        source = sqlite3.connect(database_path, timeout=BUSY_TIMEOUT)
+        target = sqlite3.connect(temporary, timeout=BUSY_TIMEOUT)
+        try:
+            source.backup(target, pages=pages, progress=progress, sleep=sleep)
+        finally:
+            target.close()
+            source.close()
+
+        # On Windows a file can't be replaced while a report is reading it
+        for attempt in range(5):
+            try:
+                os.replace(temporary, destination)
+                break
+            except PermissionError:
+                if attempt == 4:
+                    raise
+                time.sleep(0.1 * 2 ** attempt)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    return total
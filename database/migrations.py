@@ -0,0 +1,198 @@
+from sqlalchemy.engine import Connection, Engine
+from datetime import datetime
+
+def has_table(connection: Connection, table: str) -> bool:
+    """
+    Checks whether a table exists in the database.
+    """
+    return connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).first() is not None
+
+def add_column(connection: Connection, table: str, column: str, definition: str) -> bool:
+    """
+    Adds a column to a table, unless the table is missing or already has it.
+
+    Tables created by `create_all` on a new database already have all the columns,
+    and archive databases only have the transaction tables.
+
+    Parameters
+    ----------
+    connection : sqlalchemy.engine.Connection
+        The connection to the database.
+    table : str
+        The name of the table.
+    column : str
+        The name of the column.
+    definition : str
+        The SQL type and constraints of the column.
+
+    Returns
+    -------
+    bool
+        True if the column was added.
+    """
+    if not has_table(connection, table):
+        return False
+    columns = {row[1] for row in connection.exec_driver_sql(f"PRAGMA table_info({table})")}
+    if column in columns:
+        return False
+    connection.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return True
+
+def add_reorder_threshold(connection: Connection):
+    """
+    Adds the reorder threshold of each item to the store.
+    """
+    add_column(connection, "store", "reorder_threshold", "INTEGER NOT NULL DEFAULT 0")
+
+def add_line_prices(connection: Connection):
+    """
+    Adds the cost of the items, and the prices and costs of the sale lines.
+
+    Lines sold before had no price saved, so they are backfilled with the
+    current price of their item, the best estimate left. Their cost stays unknown.
+    """
+    add_column(connection, "items", "cost", "FLOAT")
+    add_column(connection, "transaction_items", "unit_price", "FLOAT")
+    add_column(connection, "transaction_items", "line_total", "FLOAT")
+    add_column(connection, "transaction_items", "unit_cost", "FLOAT")
+    add_column(connection, "item_sales", "revenue", "FLOAT NOT NULL DEFAULT 0")
+    add_column(connection, "item_sales", "margin", "FLOAT")
+
+    # Archive databases don't have the items to backfill from
+    if has_table(connection, "transaction_items") and has_table(connection, "items"):
+        connection.exec_driver_sql(
+            "UPDATE transaction_items SET unit_price = (SELECT price FROM items WHERE items.id = transaction_items.item_id) "
+            "WHERE unit_price IS NULL"
+        )
+        connection.exec_driver_sql("UPDATE transaction_items SET line_total = unit_price * quantity WHERE line_total IS NULL")
+    if has_table(connection, "item_sales") and has_table(connection, "items"):
+        connection.exec_driver_sql(
+            "UPDATE item_sales SET revenue = quantity * (SELECT price FROM items WHERE items.id = item_sales.item_id) "
+            "WHERE revenue = 0 AND item_id IN (SELECT id FROM items)"
+        )
+
+def add_day_key(connection: Connection):
+    """
+    Adds the day of each transaction as the integer YYYYMMDD, backfilled from its timestamp.
+
+    The timestamps saved before weren't updated on each sale, they hold the time the
+    application was started, so their day is as good as the timestamp itself.
+    """
+    if add_column(connection, "transactions", "day_key", "INTEGER"):
+        connection.exec_driver_sql(
+            "UPDATE transactions SET day_key = CAST(strftime('%Y%m%d', timestamp) AS INTEGER) "
+            "WHERE day_key IS NULL AND timestamp IS NOT NULL"
+        )
+
+def add_locations(connection: Connection):
+    """
+    Adds the location of the stock and of the reservations.
+
+    The existing stock is assigned to the default location 1, named "Main". The indexes
+    whose columns changed are dropped, so they are created again with the new ones.
+    """
+    if has_table(connection, "locations"):
+        connection.exec_driver_sql("INSERT OR IGNORE INTO locations (id, name) VALUES (1, 'Main')")
+    add_column(connection, "store", "location_id", "INTEGER NOT NULL DEFAULT 1")
+    add_column(connection, "reservations", "location_id", "INTEGER NOT NULL DEFAULT 1")
+    for index in ("ix_store_low_stock", "ix_store_item_id", "ix_reservations_item_id_expires_at"):
+        connection.exec_driver_sql(f"DROP INDEX IF EXISTS {index}")
+
+def add_promotions(connection: Connection):
+    """
+    Adds the category of the items, and the discounts of the transactions and of their lines.
+
+    Sales made before had no promotions, so their discounts are 0.
+    """
+    add_column(connection, "items", "category", "VARCHAR")
+    add_column(connection, "transactions", "discount", "FLOAT NOT NULL DEFAULT 0")
+    add_column(connection, "transaction_items", "discount", "FLOAT NOT NULL DEFAULT 0")
+
+def add_stock_ledger(connection: Connection):
+    """
+    Takes the opening checkpoint of the stock movement ledger.
+
+    The stock changes made before had no movements, so the current stock is saved as a
+    checkpoint that later movements add to. The stock at earlier times is unknown.
+    """
+    if has_table(connection, "stock_checkpoints") and has_table(connection, "store"):
+        checkpoint_id = connection.exec_driver_sql(
+            "INSERT INTO stock_checkpoints (taken_at, last_movement_id) VALUES (?, 0)",
+            (datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f"),)
+        ).lastrowid
+        connection.exec_driver_sql(
+            "INSERT INTO stock_checkpoint_lines (checkpoint_id, item_id, location_id, stock) "
+            "SELECT ?, item_id, location_id, stock FROM store WHERE stock != 0",
+            (checkpoint_id,)
+        )
+
+def add_item_day_sales(connection: Connection):
+    """
+    Fills the daily sales rollup of each item from the transactions saved before it.
+    """
+    if has_table(connection, "item_day_sales") and has_table(connection, "transactions"):
+        connection.exec_driver_sql(
+            "INSERT INTO item_day_sales (day_key, item_id, quantity) "
+            "SELECT transactions.day_key, transaction_items.item_id, SUM(transaction_items.quantity) "
+            "FROM transaction_items JOIN transactions ON transactions.id = transaction_items.transaction_id "
+            "WHERE transactions.day_key IS NOT NULL GROUP BY transactions.day_key, transaction_items.item_id"
+        )
+
+def add_total_stock(connection: Connection):
+    """
+    Adds the total stock of each item over all the locations, and the triggers keeping it up to date.
+
+    SQLite runs the triggers in the statement changing the stock, so every writer, including
+    the sync of other tills and the stock entries removed with their item, updates the total
+    in the same transaction. It is backfilled from the current stock.
+    """
+    if not (has_table(connection, "items") and has_table(connection, "store")):
+        return
+    add_column(connection, "items", "total_stock", "INTEGER NOT NULL DEFAULT 0")
+    connection.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS store_total_stock_insert AFTER INSERT ON store BEGIN "
+        "UPDATE items SET total_stock = total_stock + NEW.stock WHERE id = NEW.item_id; END"
+    )
+    connection.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS store_total_stock_update AFTER UPDATE OF stock, item_id ON store "
+        "WHEN NEW.stock != OLD.stock OR NEW.item_id != OLD.item_id BEGIN "
+        "UPDATE items SET total_stock = total_stock - OLD.stock WHERE id = OLD.item_id; "
+        "UPDATE items SET total_stock = total_stock + NEW.stock WHERE id = NEW.item_id; END"
+    )
+    connection.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS store_total_stock_delete AFTER DELETE ON store BEGIN "
+        "UPDATE items SET total_stock = total_stock - OLD.stock WHERE id = OLD.item_id; END"
+    )
+    connection.exec_driver_sql(
+        "UPDATE items SET total_stock = COALESCE((SELECT SUM(stock) FROM store WHERE store.item_id = items.id), 0)"
+    )
+
+# Migrations in the order they were introduced. The number of migrations applied
+# to a database is saved in its `user_version`, so only new ones run on startup.
+MIGRATIONS = [
+    add_reorder_threshold,
+    add_line_prices,
+    add_day_key,
+    add_locations,
+    add_promotions,
+    add_stock_ledger,
+    add_item_day_sales,
+    add_total_stock,
+]
+
+def migrate(engine: Engine):
+    """
+    Applies the pending migrations to a database, in a single transaction.
+
+    Parameters
+    ----------
+    engine : sqlalchemy.engine.Engine
+        The engine of the database to migrate.
+    """
+    with engine.begin() as connection:
+        version = connection.exec_driver_sql("PRAGMA user_version").scalar()
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            migration(connection)
+            connection.exec_driver_sql(f"PRAGMA user_version = {number}")
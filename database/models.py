@@ -1,11 +1,24 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, Text, ForeignKey, Index, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
-from datetime import datetime
+from datetime import date, datetime
 
 # Base class for all the models
 Base = declarative_base()
 
+def day_key(value: date) -> int:
+    """
+    Returns the day of a date or datetime as the integer YYYYMMDD, the `day_key` of the transactions.
+    """
+    return value.year * 10000 + value.month * 100 + value.day
+
+def default_day_key(context) -> int:
+    """
+    Computes the `day_key` of a new transaction from its timestamp, when it isn't given.
+    """
+    timestamp = context.get_current_parameters().get('timestamp')
+    return day_key(timestamp) if timestamp is not None else None
+
 class Items(Base):
     """
     The Items class represents the items available in the store.
@@ -18,6 +31,13 @@ class Items(Base):
         The name of the item.
     price : float
         The price of the item.
+    cost : float
+        The price paid for the item, used to report margins. None if unknown.
+    category : str
+        The category of the item, which promotions can target. None if it has none.
+    total_stock : int
+        The stock of the item summed over all the locations. Triggers on the Store table
+        keep it up to date, in the same database transaction as each change to the stock.
 
     Relationships
     -------------
@@ -28,22 +48,50 @@ class Items(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String, unique=True, nullable=False)
     price = Column(Float, nullable=False)
+    cost = Column(Float)
+    category = Column(String)
+    total_stock = Column(Integer, default=0, server_default='0', nullable=False)
 
     # Relationships to Store and POS
     stores = relationship("Store", back_populates="item")
 
+    # Index to find the items of the categories with promotions
+    __table_args__ = (
+        Index('ix_items_category', 'category'),
+    )
+
+class Location(Base):
+    """
+    The Location class represents a place holding stock, e.g. the shop floor, the back room or a branch.
+
+    Attributes
+    ----------
+    id : int
+        Primary key of the Locations table. The location 1 holds the stock of databases
+        created before there were locations.
+    name : str
+        The name of the location.
+    """
+    __tablename__ = 'locations'
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
+
 class Store(Base):
     """
-    The Store class represents the inventory of items in stock.
+    The Store class represents the inventory of items in stock, one row per item and location.
 
     Attributes
     ----------
     id : int
         Primary key of the Store table.
+    location_id : int
+        Foreign key linking to the Locations table, the location holding the stock.
     item_id : int
         Foreign key linking to the Items table.
     stock : int
-        The quantity of the item available in stock.
+        The quantity of the item available in stock at the location.
+    reorder_threshold : int
+        The item is low on stock at the location when its stock falls to this quantity or below.
 
     Relationships
     -------------
@@ -52,12 +100,115 @@ class Store(Base):
     """
     __tablename__ = 'store'
     id = Column(Integer, primary_key=True)
+    location_id = Column(Integer, ForeignKey('locations.id'), default=1, server_default='1', nullable=False)
     item_id = Column(Integer, ForeignKey('items.id'), nullable=False)
     stock = Column(Integer, default=0, nullable=False)
+    reorder_threshold = Column(Integer, default=0, server_default='0', nullable=False)
+
+    # Partial index holding only the items low on stock. SQLite keeps it up to date on
+    # every stock change, so the low stock set is never computed by scanning the catalog.
+    # The unique index serves the stock lookups and updates of a till's location, and the
+    # covering index on the item the lookups of all the stock of an item, e.g. when it is removed.
+    __table_args__ = (
+        Index('ix_store_low_stock', 'location_id', 'item_id', sqlite_where=text('stock <= reorder_threshold')),
+        Index('ix_store_location_id_item_id', 'location_id', 'item_id', unique=True),
+        Index('ix_store_item_id', 'item_id', 'location_id', 'stock', 'reorder_threshold'),
+    )
 
     # Relationship to Items
     item = relationship("Items", back_populates="stores")
 
+class StockMovement(Base):
+    """
+    The StockMovement class represents a change to the stock of an item at a location.
+
+    Movements are only ever inserted, in the same database transaction as the change to
+    the stock they explain, so the stock of the `Store` table is always the stock of the
+    last checkpoint plus the movements made since.
+
+    Attributes
+    ----------
+    id : int
+        Primary key of the StockMovements table, it grows with every movement.
+    item_id : int
+        The id of the item. It isn't a foreign key, since the movements of removed items are kept.
+    location_id : int
+        Foreign key linking to the Locations table, the location whose stock changed.
+    kind : str
+        The cause of the movement: "sale", "receipt", "adjustment" or "transfer".
+    quantity : int
+        The quantity added to the stock, negative for the quantities taken from it.
+    reference : str
+        What the movement belongs to: the id of the transaction of a sale, the other
+        location of a transfer, or the terminal of a movement synced from another till.
+        None if there is nothing to refer to.
+    created_at : datetime
+        When the movement was made.
+    """
+    __tablename__ = 'stock_movements'
+    id = Column(Integer, primary_key=True)
+    item_id = Column(Integer, nullable=False)
+    location_id = Column(Integer, ForeignKey('locations.id'), nullable=False)
+    kind = Column(String, nullable=False)
+    quantity = Column(Integer, nullable=False)
+    reference = Column(String)
+    created_at = Column(DateTime, nullable=False, default=datetime.now)
+
+    # Indexes to read the movements of an item at a location in order, and to find the movements of a period
+    __table_args__ = (
+        Index('ix_stock_movements_item_id_location_id_id', 'item_id', 'location_id', 'id', 'quantity'),
+        Index('ix_stock_movements_created_at', 'created_at'),
+    )
+
+class StockCheckpoint(Base):
+    """
+    The StockCheckpoint class represents a copy of the whole stock taken at a point in time.
+
+    The stock at any past time is the stock of the last checkpoint taken before it plus
+    the movements made between the two, so only the movements since a checkpoint are read.
+
+    Attributes
+    ----------
+    id : int
+        Primary key of the StockCheckpoints table.
+    taken_at : datetime
+        When the checkpoint was taken.
+    last_movement_id : int
+        The id of the last movement included in the checkpoint, 0 for none.
+    """
+    __tablename__ = 'stock_checkpoints'
+    id = Column(Integer, primary_key=True)
+    taken_at = Column(DateTime, nullable=False)
+    last_movement_id = Column(Integer, nullable=False)
+
+    # Index to find the last checkpoint taken before a time
+    __table_args__ = (
+        Index('ix_stock_checkpoints_taken_at', 'taken_at'),
+    )
+
+class StockCheckpointLine(Base):
+    """
+    The StockCheckpointLine class represents the stock of an item at a location in a checkpoint.
+
+    Only the stock that isn't 0 is saved.
+
+    Attributes
+    ----------
+    checkpoint_id : int
+        Part of the primary key, the checkpoint.
+    item_id : int
+        Part of the primary key, the id of the item.
+    location_id : int
+        Part of the primary key, the id of the location.
+    stock : int
+        The stock of the item at the location when the checkpoint was taken.
+    """
+    __tablename__ = 'stock_checkpoint_lines'
+    checkpoint_id = Column(Integer, primary_key=True)
+    item_id = Column(Integer, primary_key=True)
+    location_id = Column(Integer, primary_key=True)
+    stock = Column(Integer, nullable=False)
+
 class Transaction(Base):
     """
     The Transaction class represents a sales transaction.
@@ -74,6 +225,10 @@ class Transaction(Base):
         The amount of change returned to the customer.
     timestamp : datetime
         The date and time when the transaction was made, with a default of the current time.
+    day_key : int
+        The day of the timestamp as the integer YYYYMMDD, which the daily aggregates group on.
+    discount : float
+        The amount taken off the transaction by promotions, already deducted from the total.
 
     Relationships
     -------------
@@ -85,11 +240,21 @@ class Transaction(Base):
     total_amount = Column(Float, nullable=False)
     payment_received = Column(Float, nullable=False)
     change_returned = Column(Float, nullable=False)
-    timestamp = Column(DateTime, default=datetime.now())
+    timestamp = Column(DateTime, default=datetime.now)
+    day_key = Column(Integer, default=default_day_key)
+    discount = Column(Float, default=0, server_default='0', nullable=False)
 
     # Relationship to TransactionItems
     transaction = relationship("TransactionItem", back_populates="items")
 
+    # Indexes backing the keyset pagination (newest first) and the amount filter of the history browser,
+    # and the daily aggregates, which read the day and the total from the index alone
+    __table_args__ = (
+        Index('ix_transactions_timestamp_id', 'timestamp', 'id'),
+        Index('ix_transactions_total_amount', 'total_amount'),
+        Index('ix_transactions_day_key', 'day_key', 'total_amount'),
+    )
+
 class TransactionItem(Base):
     """
     The TransactionItem class represents the items involved in a transaction.
@@ -104,6 +269,14 @@ class TransactionItem(Base):
         Foreign key linking to the Items table.
     quantity : int
         The quantity of the item involved in the transaction.
+    unit_price : float
+        The price of the item at the time of the sale.
+    line_total : float
+        The amount charged for the line, the unit price times the quantity less the discount.
+    discount : float
+        The amount taken off the line by promotions.
+    unit_cost : float
+        The cost of the item at the time of the sale. None if unknown.
 
     Relationships
     -------------
@@ -117,7 +290,347 @@ class TransactionItem(Base):
     transaction_id = Column(Integer, ForeignKey('transactions.id'), nullable=False)
     item_id = Column(Integer, ForeignKey('items.id'), nullable=False)
     quantity = Column(Integer, nullable=False)
+    unit_price = Column(Float)
+    line_total = Column(Float)
+    unit_cost = Column(Float)
+    discount = Column(Float, default=0, server_default='0', nullable=False)
 
     # Relationships
     items = relationship("Transaction", back_populates="transaction")
     item = relationship("Items")
+
+    # Indexes to fetch the lines of a transaction, to find transactions by item
+    # and to sum the sales of each item without reading the table
+    __table_args__ = (
+        Index('ix_transaction_items_transaction_id', 'transaction_id'),
+        Index('ix_transaction_items_item_id_transaction_id', 'item_id', 'transaction_id'),
+        Index('ix_transaction_items_item_sales', 'item_id', 'quantity', 'line_total', 'unit_cost'),
+    )
+
+class TransactionDiscount(Base):
+    """
+    The TransactionDiscount class represents a promotion applied to a transaction.
+
+    Attributes
+    ----------
+    id : int
+        Primary key of the TransactionDiscounts table.
+    transaction_id : int
+        Foreign key linking to the Transactions table.
+    promotion_id : int
+        The promotion applied. None for sales synced from other tills, whose promotions
+        have other identifiers.
+    name : str
+        The name of the promotion at the time of the sale.
+    amount : float
+        The amount the promotion took off the transaction.
+    """
+    __tablename__ = 'transaction_discounts'
+    id = Column(Integer, primary_key=True)
+    transaction_id = Column(Integer, ForeignKey('transactions.id'), nullable=False)
+    promotion_id = Column(Integer)
+    name = Column(String, nullable=False)
+    amount = Column(Float, nullable=False)
+
+    # Index to fetch the discounts of a transaction
+    __table_args__ = (
+        Index('ix_transaction_discounts_transaction_id', 'transaction_id'),
+    )
+
+class DailySales(Base):
+    """
+    The DailySales class represents the daily sales rollup of archived transactions.
+
+    When a year of transactions is moved to its archive database, its sales are
+    aggregated by day into this table so that analytics don't need the archive.
+
+    Attributes
+    ----------
+    date : date
+        Primary key, the day of the sales.
+    total_sales : float
+        The total amount sold that day.
+    transactions : int
+        The number of transactions made that day.
+    """
+    __tablename__ = 'daily_sales'
+    date = Column(Date, primary_key=True)
+    total_sales = Column(Float, nullable=False)
+    transactions = Column(Integer, nullable=False)
+
+class ItemSales(Base):
+    """
+    The ItemSales class represents the yearly sales rollup of each item in archived transactions.
+
+    Attributes
+    ----------
+    year : int
+        Part of the primary key, the year of the sales.
+    item_id : int
+        Part of the primary key, the id of the item sold.
+    quantity : int
+        The total quantity of the item sold that year.
+    revenue : float
+        The total amount charged for the item that year.
+    margin : float
+        The revenue minus the cost of the lines with a known cost. None if no line had one.
+    """
+    __tablename__ = 'item_sales'
+    year = Column(Integer, primary_key=True)
+    item_id = Column(Integer, primary_key=True)
+    quantity = Column(Integer, nullable=False)
+    revenue = Column(Float, default=0, server_default='0', nullable=False)
+    margin = Column(Float)
+
+class ItemDaySales(Base):
+    """
+    The ItemDaySales class represents the daily sales rollup of each item in the transactions of the main database.
+
+    It is updated in the same database transaction as each sale, so the reorder forecast
+    reads a row per item and day instead of every sale line. The days of an archived
+    year are removed with its transactions.
+
+    Attributes
+    ----------
+    day_key : int
+        Part of the primary key, the day of the sales as the integer YYYYMMDD.
+    item_id : int
+        Part of the primary key, the id of the item sold.
+    quantity : int
+        The total quantity of the item sold that day.
+    """
+    __tablename__ = 'item_day_sales'
+    day_key = Column(Integer, primary_key=True)
+    item_id = Column(Integer, primary_key=True)
+    quantity = Column(Integer, nullable=False)
+
+    # The rows are stored in the order of their key, so the days of the forecast are read as ranges
+    __table_args__ = {'sqlite_with_rowid': False}
+
+class ZReport(Base):
+    """
+    The ZReport class represents the end-of-day report of a closed day.
+
+    The report is saved once, when the day is closed, and never updated, so past reports
+    reopen without reading their transactions, even after their year is archived.
+
+    Attributes
+    ----------
+    date : date
+        Primary key, the day of the report.
+    closed_at : datetime
+        When the day was closed.
+    transactions : int
+        The number of transactions of the day.
+    total_sales : float
+        The total amount sold that day.
+    last_transaction_id : int
+        The id of the last transaction of the day included, None if there were no sales.
+    report : str
+        The full report, serialized as JSON.
+    """
+    __tablename__ = 'z_reports'
+    date = Column(Date, primary_key=True)
+    closed_at = Column(DateTime, nullable=False)
+    transactions = Column(Integer, nullable=False)
+    total_sales = Column(Float, nullable=False)
+    last_transaction_id = Column(Integer)
+    report = Column(Text, nullable=False)
+
+class Reservation(Base):
+    """
+    The Reservation class represents a quantity of an item held by a cart until checkout.
+
+    Reservations expire after a time to live, so the items of abandoned carts
+    return to the available stock.
+
+    Attributes
+    ----------
+    id : int
+        Primary key of the Reservations table.
+    cart_id : str
+        The identifier of the cart holding the item.
+    item_id : int
+        Foreign key linking to the Items table.
+    location_id : int
+        Foreign key linking to the Locations table, the location of the till holding the item.
+    quantity : int
+        The quantity of the item reserved.
+    expires_at : datetime
+        The date and time when the reservation expires.
+    """
+    __tablename__ = 'reservations'
+    id = Column(Integer, primary_key=True)
+    cart_id = Column(String, nullable=False)
+    item_id = Column(Integer, ForeignKey('items.id'), nullable=False)
+    location_id = Column(Integer, ForeignKey('locations.id'), default=1, server_default='1', nullable=False)
+    quantity = Column(Integer, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+    # The first index covers the sum of the active reservations of an item at a location
+    __table_args__ = (
+        Index('ix_reservations_item_id_expires_at', 'item_id', 'location_id', 'expires_at', 'quantity'),
+        Index('ix_reservations_cart_id', 'cart_id'),
+        Index('ix_reservations_expires_at', 'expires_at'),
+    )
+
+class ParkedCart(Base):
+    """
+    The ParkedCart class represents a cart set aside at a till while its customer steps away.
+
+    The cart keeps its reservations until they expire, and its lines are saved in a single
+    row, so parking and resuming a cart are a single write each and survive a restart.
+
+    Attributes
+    ----------
+    cart_id : str
+        Primary key, the identifier of the cart, which its reservations refer to.
+    location_id : int
+        Foreign key linking to the Locations table, the location of the till that parked the cart.
+    lines : str
+        The names and quantities of the items in the cart, as a JSON list of pairs.
+    total : float
+        The total amount of the cart when it was parked.
+    parked_at : datetime
+        The date and time when the cart was parked.
+    """
+    __tablename__ = 'parked_carts'
+    cart_id = Column(String, primary_key=True)
+    location_id = Column(Integer, ForeignKey('locations.id'), nullable=False)
+    lines = Column(Text, nullable=False)
+    total = Column(Float, nullable=False)
+    parked_at = Column(DateTime, nullable=False, default=datetime.now)
+
+    # Index to list the carts parked at a location, oldest first
+    __table_args__ = (
+        Index('ix_parked_carts_location_id_parked_at', 'location_id', 'parked_at'),
+    )
+
+class Promotion(Base):
+    """
+    The Promotion class represents a discount rule applied to the carts at checkout.
+
+    A promotion targets a single item, all the items of a category, or for bundles
+    a set of items bought together.
+
+    Attributes
+    ----------
+    id : int
+        Primary key of the Promotions table.
+    name : str
+        The name of the promotion, shown on the receipts.
+    kind : str
+        "percent" takes `value` percent off each line, "multibuy" sells every
+        `quantity` units for `value` in total, and "bundle" sells one of each item
+        of `bundle` for `value` in total.
+    item_id : int
+        Foreign key linking to the Items table, the item targeted. None for categories and bundles.
+    category : str
+        The category targeted. None for items and bundles.
+    quantity : int
+        The number of units of a multi-buy deal. None for the other kinds.
+    value : float
+        The percentage off, or the price of the multi-buy units or of the bundle.
+    bundle : str
+        The names of the items of a bundle, as a JSON list. None for the other kinds.
+    starts_at : datetime
+        The date and time the promotion starts. None if it is active since created.
+    ends_at : datetime
+        The date and time the promotion ends. None if it never ends.
+    """
+    __tablename__ = 'promotions'
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    kind = Column(String, nullable=False)
+    item_id = Column(Integer, ForeignKey('items.id'))
+    category = Column(String)
+    quantity = Column(Integer)
+    value = Column(Float, nullable=False)
+    bundle = Column(Text)
+    starts_at = Column(DateTime)
+    ends_at = Column(DateTime)
+
+class ChangeLog(Base):
+    """
+    The ChangeLog class represents a change to replicate between the tills and the hub.
+
+    On a till it is the outbox of the changes waiting to be pushed to the hub. On the
+    hub it is the feed of all the changes, which the tills pull. Sequence numbers are
+    never reused, so they only grow.
+
+    Attributes
+    ----------
+    seq : int
+        Primary key of the ChangeLog table, the sequence number of the change.
+    origin : str
+        The identifier of the terminal where the change was made.
+    origin_seq : int
+        The sequence number of the change in the log of its origin, None for local changes.
+    entity : str
+        The kind of change: "item", "stock" or "sale".
+    key : str
+        The natural key of the changed entity, e.g. the item name.
+    payload : str
+        The change, serialized as JSON.
+    created_at : datetime
+        The date and time when the change was made.
+    """
+    __tablename__ = 'change_log'
+    __table_args__ = (
+        Index('ix_change_log_origin_seq', 'origin', 'seq'),
+        {'sqlite_autoincrement': True},
+    )
+    seq = Column(Integer, primary_key=True)
+    origin = Column(String, nullable=False)
+    origin_seq = Column(Integer)
+    entity = Column(String, nullable=False)
+    key = Column(String, nullable=False)
+    payload = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.now)
+
+class SyncState(Base):
+    """
+    The SyncState class represents the replication progress of a database.
+
+    Attributes
+    ----------
+    key : str
+        Primary key, e.g. "last_pushed_seq", "last_pulled_seq" or "received:<origin>".
+    value : int
+        The last sequence number processed.
+    """
+    __tablename__ = 'sync_state'
+    key = Column(String, primary_key=True)
+    value = Column(Integer, nullable=False)
+
+class MaintenanceLog(Base):
+    """
+    The MaintenanceLog class represents a run of a database maintenance task.
+
+    Attributes
+    ----------
+    id : int
+        Primary key of the MaintenanceLog table.
+    task : str
+        The task run: "backup", "optimize", "quick_check", "vacuum" or "checkpoint".
+    started_at : datetime
+        When the task started.
+    seconds : float
+        How long the task took.
+    pages : int
+        The number of database pages the task copied, checked or freed, or the rows it wrote.
+    result : str
+        "ok", or a description of the problems or the error found.
+    """
+    __tablename__ = 'maintenance_log'
+    id = Column(Integer, primary_key=True)
+    task = Column(String, nullable=False)
+    started_at = Column(DateTime, nullable=False)
+    seconds = Column(Float, nullable=False)
+    pages = Column(Integer, nullable=False)
+    result = Column(Text, nullable=False)
+
+    # Index to find the last run of each task
+    __table_args__ = (
+        Index('ix_maintenance_log_task_started_at', 'task', 'started_at'),
+    )
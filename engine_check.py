@@ -0,0 +1,206 @@
+"""
+POS System Analytics Engine Check
+
+Author: Alejandro Vargas
+Github: https://github.com/sagravela
+
+This script checks that the optional DuckDB analytics engines give the same reports
+as SQLite. On a database of its own it generates a sales history, with lines of
+unknown cost, discounts and the rollups of an archived year, and compares the
+daily sales and the item rankings of every engine with `compare_engines`:
+
+- after the first Parquet export,
+- with sales made since the export, which the "parquet" engine reads from the snapshot,
+- after the export adds them in a file of their own.
+
+The exit code is 1 if any report differs. Without DuckDB nothing is compared and the
+exit code is 0, unless `--require` is given.
+
+Examples
+--------
+    python engine_check.py
+    python engine_check.py --lines 1000000 --require
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+from datetime import date, datetime, timedelta
+
+def seed_history(path: str, items: list[tuple[int, float, float | None]], lines: int, rng: random.Random):
+    """
+    Adds a history of sales over the last three years, and the rollups of the year before it.
+
+    Parameters
+    ----------
+    path : str
+        The path of the database.
+    items : list of tuple of (int, float, float or None)
+        The identifier, price and cost of each item sold.
+    lines : int
+        The number of lines of the history, three per sale.
+    rng : random.Random
+        The random generator of the history.
+    """
+    connection = sqlite3.connect(path)
+    start = datetime.now() - timedelta(days=3 * 365)
+    count = lines // 3
+
+    def transactions():
+        for number in range(1, count + 1):
+            timestamp = start + timedelta(seconds=number * 3 * 365 * 24 * 3600 // count + rng.randrange(3600))
+            yield number, timestamp.strftime("%Y-%m-%d %H:%M:%S.%f"), int(timestamp.strftime("%Y%m%d"))
+
+    def transaction_items():
+        for number in range(1, count + 1):
+            for _ in range(3):
+                item_id, price, cost = rng.choice(items)
+                quantity = rng.randint(1, 5)
+                discount = round(price * quantity * 0.1, 2) if rng.random() < 0.1 else 0.0
+                # Sales saved before the costs were recorded don't have one
+                unit_cost = None if rng.random() < 0.1 else cost
+                yield number, item_id, quantity, price, round(price * quantity - discount, 2), unit_cost, discount
+
+    connection.executemany(
+        "INSERT INTO transactions (id, total_amount, payment_received, change_returned, timestamp, day_key, discount) "
+        "VALUES (?, 0, 0, 0, ?, ?, 0)", transactions()
+    )
+    connection.executemany(
+        "INSERT INTO transaction_items (transaction_id, item_id, quantity, unit_price, line_total, unit_cost, discount) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)", transaction_items()
+    )
+    connection.execute("""
+        UPDATE transactions SET
+            total_amount = (SELECT SUM(line_total) FROM transaction_items WHERE transaction_id = transactions.id),
+            discount = (SELECT SUM(discount) FROM transaction_items WHERE transaction_id = transactions.id)
+    """)
+    connection.execute("UPDATE transactions SET payment_received = total_amount")
+
+    # Rollups of the year archived before the history
+    year = start.year - 1
+    connection.executemany(
+        "INSERT INTO daily_sales (date, total_sales, transactions) VALUES (?, ?, ?)",
+        [((date(year, 1, 1) + timedelta(days=day)).isoformat(), round(rng.uniform(100, 5000), 2), rng.randint(5, 300))
+         for day in range(365)]
+    )
+    connection.executemany(
+        "INSERT INTO item_sales (year, item_id, quantity, revenue, margin) VALUES (?, ?, ?, ?, ?)",
+        [(year, item_id, rng.randint(1, 500), round(rng.uniform(10, 5000), 2), None if cost is None else round(rng.uniform(1, 2000), 2))
+         for item_id, _, cost in items]
+    )
+    connection.commit()
+    connection.close()
+
+def sell(items: list[tuple[str, float]], sales: int, rng: random.Random):
+    """
+    Checks out some carts, as a till would.
+    """
+    from backend.services import save_transaction
+
+    prices = dict(items)
+    for _ in range(sales):
+        cart = [(name, rng.randint(1, 3)) for name, _ in rng.sample(items, 3)]
+        total = round(sum(prices[name] * quantity for name, quantity in cart), 2)
+        save_transaction(total, total, 0.0, cart)
+
+def run(args: argparse.Namespace) -> list[tuple]:
+    """
+    Fills the database and compares the engines at each stage of the Parquet export.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The parsed command line.
+
+    Returns
+    -------
+    list of tuple
+        For each stage, report and engine: the stage and the comparison of `compare_engines`.
+    """
+    from sqlalchemy import select
+    from database.database import get_session, database_path
+    from database.models import Items
+    from backend.services import save_item
+    from backend.snapshot import refresh_snapshot
+    from backend.columnar import compare_engines, export_parquet
+
+    rng = random.Random(args.seed)
+    for number in range(args.items):
+        price = round(rng.uniform(0.5, 50), 2)
+        cost = None if number % 7 == 0 else round(price * rng.uniform(0.3, 0.8), 2)
+        save_item(f"Item {number:04d}", price, 10 ** 7, cost=cost, category=f"Category {number % 10}")
+    with get_session() as session:
+        catalog = session.execute(select(Items.id, Items.name, Items.price, Items.cost)).all()
+    seed_history(database_path, [(item_id, price, cost) for item_id, _, price, cost in catalog], args.lines, rng)
+    items = [(name, price) for _, name, price, _ in catalog]
+
+    results = []
+    refresh_snapshot()
+    export_parquet(full=True)
+    results += [("first export", *row) for row in compare_engines(tolerance=args.tolerance)]
+
+    sell(items, args.sales, rng)
+    refresh_snapshot()
+    results += [("sales after the export", *row) for row in compare_engines(tolerance=args.tolerance)]
+
+    export_parquet()
+    results += [("incremental export", *row) for row in compare_engines(tolerance=args.tolerance)]
+    return results
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Builds the parser of the command line.
+
+    Returns
+    -------
+    argparse.ArgumentParser
+        The parser.
+    """
+    parser = argparse.ArgumentParser(description="Check that the DuckDB analytics engines give the same reports as SQLite.")
+    parser.add_argument("--lines", type=int, default=300000, help="number of lines of the sales history")
+    parser.add_argument("--items", type=int, default=500, help="number of items of the catalog")
+    parser.add_argument("--sales", type=int, default=50, help="number of sales made after the first export")
+    parser.add_argument("--tolerance", type=float, default=1e-9, help="largest difference allowed between two amounts, relative to the amount")
+    parser.add_argument("--require", action="store_true", help="fail if DuckDB is not available, instead of skipping the check")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the history")
+    parser.add_argument("--database", help="database file, a new temporary one by default")
+    return parser
+
+def main(argv: list[str] = None):
+    """
+    The entry point of the engine check.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        The command line arguments. Defaults to None, which reads them from `sys.argv`.
+    """
+    args = build_parser().parse_args(argv)
+
+    # Run on a database and settings of its own, before the application reads them
+    directory = tempfile.mkdtemp(prefix="pos_engines_")
+    os.environ["POS_DATABASE"] = args.database or os.path.join(directory, "engines.db")
+    os.environ["POS_CONFIG"] = os.path.join(directory, "config.json")
+
+    from database.database import create_db
+    from backend.columnar import is_available
+
+    # The DuckDB engine attaches the snapshot of the database, so the tables must exist first
+    create_db()
+    if not is_available():
+        print("SKIPPED: the DuckDB engines need the duckdb package and its SQLite extension.")
+        sys.exit(1 if args.require else 0)
+
+    results = run(args)
+    print(f"{'stage':<24} {'report':<28} {'engine':<8} {'rows':>7} {'seconds':>8} {'difference':>11}  match")
+    for stage, report, engine, rows, seconds, difference, match in results:
+        print(f"{stage:<24} {report:<28} {engine:<8} {rows:>7} {seconds:>8.3f} {difference:>11.2e}  {'ok' if match else 'FAILED'}")
+    passed = all(row[-1] for row in results)
+    print("PASSED" if passed else "FAILED")
+    sys.exit(0 if passed else 1)
+
+if __name__ == '__main__':
+    main()
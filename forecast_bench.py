@@ -0,0 +1,253 @@
+"""
+POS System Reorder Forecast Benchmark
+
+Author: Alejandro Vargas
+Github: https://github.com/sagravela
+
+This script measures how long the reorder forecast of the Analytics tab takes. On a
+database of its own it generates a year of sales of thousands of items, fills the
+daily sales rollup of each item from them, and times `get_forecast`:
+
+- the first time, with nothing cached,
+- again, with nothing new,
+- after some checkouts, once the snapshot is refreshed,
+- on the next day, when the days of the forecast shift.
+
+At each stage the sales velocity must be the one computed from every sale line of
+the window. The exit code is 1 if any differs, or if the first forecast is slower
+than `--max-first-ms`.
+
+Examples
+--------
+    python forecast_bench.py
+    python forecast_bench.py --items 10000 --lines 1100000 --sales 50
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+def seed_sales(path: str, location_id: int, args: argparse.Namespace, rng: random.Random) -> list[tuple[str, float]]:
+    """
+    Adds the items, their stock and a year of sales, three lines per sale.
+
+    Parameters
+    ----------
+    path : str
+        The path of the database.
+    location_id : int
+        The location of the stock.
+    args : argparse.Namespace
+        The parsed command line.
+    rng : random.Random
+        The random generator of the catalog and the sales.
+
+    Returns
+    -------
+    list of tuple of (str, float)
+        The name and price of each item.
+    """
+    connection = sqlite3.connect(path)
+    items = [(number, f"Item {number:05d}", round(rng.uniform(0.5, 30), 2)) for number in range(1, args.items + 1)]
+    connection.executemany("INSERT INTO items (id, name, price) VALUES (?, ?, ?)", items)
+    connection.executemany(
+        "INSERT INTO store (location_id, item_id, stock, reorder_threshold) VALUES (?, ?, ?, 0)",
+        [(location_id, item_id, rng.randint(50, 500)) for item_id, _, _ in items]
+    )
+
+    # A few items sell most, as in a shop
+    weights = [1 / number ** 0.5 for number in range(1, args.items + 1)]
+    start = datetime.now() - timedelta(days=args.days - 1)
+    count = args.lines // 3
+
+    def transactions():
+        for number in range(1, count + 1):
+            timestamp = start + timedelta(seconds=number * (args.days - 1) * 24 * 3600 // count)
+            yield number, timestamp.strftime("%Y-%m-%d %H:%M:%S.%f"), int(timestamp.strftime("%Y%m%d"))
+
+    def transaction_items():
+        for number in range(1, count + 1):
+            for item_id, _, price in rng.choices(items, weights, k=3):
+                quantity = rng.randint(1, 5)
+                yield number, item_id, quantity, price, round(price * quantity, 2)
+
+    connection.executemany(
+        "INSERT INTO transactions (id, total_amount, payment_received, change_returned, timestamp, day_key, discount) "
+        "VALUES (?, 0, 0, 0, ?, ?, 0)", transactions()
+    )
+    connection.executemany(
+        "INSERT INTO transaction_items (transaction_id, item_id, quantity, unit_price, line_total, discount) "
+        "VALUES (?, ?, ?, ?, ?, 0)", transaction_items()
+    )
+    connection.commit()
+    connection.close()
+    return [(name, price) for _, name, price in items]
+
+def line_velocity(path: str, today: date, days: int, half_life: float):
+    """
+    Computes the sales velocity of every item from every sale line of the window, as the forecast did before the rollup.
+
+    Returns
+    -------
+    tuple of (numpy.ndarray, numpy.ndarray)
+        The ids of the items, and their estimated units sold per day.
+    """
+    import numpy as np
+
+    start = today - timedelta(days=days - 1)
+    connection = sqlite3.connect(path)
+    sold = np.array(connection.execute(
+        "SELECT transaction_items.item_id, transactions.day_key, sum(transaction_items.quantity) "
+        "FROM transaction_items JOIN transactions ON transactions.id = transaction_items.transaction_id "
+        "WHERE transactions.day_key BETWEEN ? AND ? GROUP BY transactions.day_key, transaction_items.item_id",
+        (int(start.strftime("%Y%m%d")), int(today.strftime("%Y%m%d")))
+    ).fetchall(), dtype=np.int64).reshape(-1, 3)
+    connection.close()
+
+    item_ids = np.unique(sold[:, 0])
+    age = {key: (today - datetime.strptime(str(key), "%Y%m%d").date()).days for key in np.unique(sold[:, 1])}
+    matrix = np.zeros((len(item_ids), days))
+    np.add.at(matrix, (np.searchsorted(item_ids, sold[:, 0]), [age[key] for key in sold[:, 1]]), sold[:, 2])
+    weights = 0.5 ** (np.arange(days) / half_life)
+    return item_ids, matrix @ (weights / weights.sum())
+
+def difference(velocity: tuple, expected: tuple) -> float:
+    """
+    Returns the largest difference between two velocities of the items, relative to the velocity.
+    """
+    import numpy as np
+
+    item_ids = np.union1d(velocity[0], expected[0])
+    values = []
+    for ids, rates in (velocity, expected):
+        full = np.zeros(len(item_ids))
+        full[np.searchsorted(item_ids, ids)] = rates
+        values.append(full)
+    return float(np.max(np.abs(values[0] - values[1]) / np.maximum(np.abs(values[1]), 1), initial=0))
+
+def timed(function, *args) -> tuple[float, object]:
+    """
+    Runs a function, returning the milliseconds it took and its result.
+    """
+    started = time.perf_counter()
+    result = function(*args)
+    return (time.perf_counter() - started) * 1000, result
+
+def run(args: argparse.Namespace) -> tuple[list[tuple], list[tuple[str, bool, str]]]:
+    """
+    Generates the sales and times the forecast at each stage.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The parsed command line.
+
+    Returns
+    -------
+    tuple of (list, list)
+        The name, milliseconds and difference from the sale lines of each stage, and the name
+        of each check, whether it passed and the values it compared.
+    """
+    from database.database import create_db, database_path, reporting_path
+    from backend.archive import rebuild_rollups
+    from backend.config import get_setting
+    from backend.forecast import get_forecast, get_velocity
+    from backend.locations import get_till_location
+    from backend.services import save_transaction
+    from backend.snapshot import refresh_snapshot
+
+    rng = random.Random(args.seed)
+    create_db()
+    location_id, _ = get_till_location()
+    started = time.perf_counter()
+    items = seed_sales(database_path, location_id, args, rng)
+    print(f"{args.lines} sale lines generated in {time.perf_counter() - started:.1f} s", file=sys.stderr)
+    seconds, _ = timed(rebuild_rollups)
+    print(f"daily sales rollup filled in {seconds / 1000:.1f} s", file=sys.stderr)
+    refresh_snapshot()
+
+    days, half_life = get_setting("forecast_days"), get_setting("forecast_half_life")
+    today = date.today()
+    stages = []
+
+    milliseconds, expected = timed(line_velocity, reporting_path, today, days, half_life)
+    stages.append(("from the sale lines", milliseconds, 0.0))
+    milliseconds, _ = timed(get_forecast)
+    stages.append(("first forecast", milliseconds, difference(get_velocity(), expected)))
+    milliseconds, _ = timed(get_forecast)
+    stages.append(("cached forecast", milliseconds, difference(get_velocity(), expected)))
+
+    prices = dict(items)
+    for _ in range(args.sales):
+        cart = [(name, rng.randint(1, 3)) for name, _ in rng.sample(items, 3)]
+        total = round(sum(prices[name] * quantity for name, quantity in cart), 2)
+        save_transaction(total, total, 0.0, cart)
+    refresh_snapshot()
+    milliseconds, _ = timed(get_forecast)
+    stages.append((f"after {args.sales} sales", milliseconds, difference(get_velocity(), line_velocity(reporting_path, today, days, half_life))))
+
+    tomorrow = today + timedelta(days=1)
+    milliseconds, velocity = timed(get_velocity, tomorrow)
+    stages.append(("next day", milliseconds, difference(velocity, line_velocity(reporting_path, tomorrow, days, half_life))))
+
+    checks = [
+        ("same velocity as the lines", all(stage[2] <= args.tolerance for stage in stages),
+         f"largest difference {max(stage[2] for stage in stages):.1e} (max {args.tolerance:.0e})"),
+        ("first forecast", stages[1][1] <= args.max_first_ms, f"{stages[1][1]:.0f} ms (max {args.max_first_ms:.0f} ms)"),
+    ]
+    return stages, checks
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Builds the parser of the command line.
+
+    Returns
+    -------
+    argparse.ArgumentParser
+        The parser.
+    """
+    parser = argparse.ArgumentParser(description="Time the reorder forecast on a year of sales.")
+    parser.add_argument("--items", type=int, default=10000, help="number of items of the catalog")
+    parser.add_argument("--lines", type=int, default=1100000, help="number of lines of the sales history")
+    parser.add_argument("--days", type=int, default=365, help="number of days the sales span, up to today")
+    parser.add_argument("--sales", type=int, default=50, help="number of checkouts made after the first forecast")
+    parser.add_argument("--max-first-ms", type=float, default=1000, help="maximum time of the first forecast, in ms")
+    parser.add_argument("--tolerance", type=float, default=1e-9, help="largest difference allowed from the velocity of the lines, relative to it")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the catalog and the sales")
+    parser.add_argument("--database", help="database file, a new temporary one by default")
+    return parser
+
+def main(argv: list[str] = None):
+    """
+    The entry point of the forecast benchmark.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        The command line arguments. Defaults to None, which reads them from `sys.argv`.
+    """
+    args = build_parser().parse_args(argv)
+
+    # Run on a database and settings of its own, before the application reads them
+    directory = tempfile.mkdtemp(prefix="pos_forecast_")
+    os.environ["POS_DATABASE"] = args.database or os.path.join(directory, "forecast.db")
+    os.environ["POS_CONFIG"] = os.path.join(directory, "config.json")
+
+    stages, checks = run(args)
+    print(f"{'stage':<22} {'ms':>8} {'difference':>11}")
+    for name, milliseconds, different in stages:
+        print(f"{name:<22} {milliseconds:>8.1f} {different:>11.1e}")
+    print()
+    for name, passed, values in checks:
+        print(f"{name:<28} {'ok' if passed else 'FAILED':<7} {values}")
+    passed = all(passed for _, passed, _ in checks)
+    print("PASSED" if passed else "FAILED")
+    sys.exit(0 if passed else 1)
+
+if __name__ == '__main__':
+    main()
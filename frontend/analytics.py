@@ -1,9 +1,18 @@
-from PyQt6.QtWidgets import QMainWindow, QVBoxLayout, QWidget
+from PyQt6.QtWidgets import (
+    QMainWindow, QVBoxLayout, QHBoxLayout, QWidget, QLabel, QPushButton, QTableWidget, QTableWidgetItem, QHeaderView,
+    QComboBox
+)
+from PyQt6.QtCore import Qt
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
-from backend.services import get_transactions, sold_items_sorted
+from backend.services import get_transactions, get_sales_after, sold_items_sorted, get_sales_heatmap
+from backend.forecast import get_forecast
+from backend.snapshot import get_snapshot_time, refresh_snapshot
+from backend.config import get_setting
+from datetime import datetime, timedelta
+import numpy as np
 
 class Plots(QWidget):
     """
@@ -13,6 +22,11 @@ class Plots(QWidget):
     including total sales over time and the most and least sold items.
     It utilizes Matplotlib for plotting and offers functionality to
     refresh and display these plots.
+
+    The axes, the line and the bars are created once and updated in place. Only
+    the days with new sales are read on a refresh, and unless the data leaves the
+    axes limits, the changed axes are re-rendered alone by blitting them over a
+    saved background.
     """
     def __init__(self, parent: QWidget=None):
         """
@@ -37,13 +51,32 @@ class Plots(QWidget):
         # Number of items to display in barh
         self.limit = 5
 
+        # Total the items are ranked by, with the titles of the top and bottom charts
+        self.metric = "quantity"
+        self.titles = {
+            "quantity": ("Most Sold Items", "Less Sold Items"),
+            "revenue": ("Top Items by Revenue", "Bottom Items by Revenue"),
+            "margin": ("Top Items by Margin", "Bottom Items by Margin")
+        }
+
+        # Daily sales plotted so far, the last transaction they include and the metric of the bars
+        self.dates = np.array([], dtype='datetime64[D]')
+        self.total_sales = np.array([])
+        self.last_id = 0
+        self.plotted_metric = None
+
         # Create a figure
         self.figure = Figure()
         
         # Create a canvas to render the figure
         self.canvas = FigureCanvas(self.figure)
-        
+
+        # Backgrounds of the axes without their data, saved on every full draw
+        self.backgrounds = {}
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+
         # Create the plot
+        self.build_plots()
         self.generate_plots()
 
         # Create a v_layout and add the canvas
@@ -51,165 +84,373 @@ class Plots(QWidget):
         v_layout.addWidget(self.canvas)
         self.setLayout(v_layout)
 
-    def generate_plots(self):
+    def build_plots(self):
         """
-        Generates and refreshes the sales data plots.
+        Creates the axes and their artists, which are then updated in place.
 
-        Clears the current figure and arranges the plots using a grid layout.
-        Displays the total sales over time and the most and least sold items
-        as horizontal bar charts. The canvas is updated to reflect changes.
+        The line of total sales and the bars with their labels are animated, so they
+        are left out of full draws and drawn over the saved backgrounds instead.
         """
-        # Clear the figure
-        self.figure.clear()
-        
         # Create a GridSpec layout to arrange subplots
         gs = self.figure.add_gridspec(2, 2, height_ratios=[2, 1])
+        self.sales_ax = self.figure.add_subplot(gs[0, :])
+        self.most_ax = self.figure.add_subplot(gs[1, 0])
+        self.least_ax = self.figure.add_subplot(gs[1, 1])
+
+        # Total Sales Plot, with a line and markers
+        self.sales_line, = self.sales_ax.plot(
+            self.dates, self.total_sales, linestyle='--', marker='o', color='g', markersize=5, linewidth=1,
+            label='Total Sales', animated=True
+        )
+        self.sales_ax.set_title('Total Sales Over Time', fontsize=self.title_fontsize)
+        # Improve date formatting on the x-axis
+        self.sales_ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
+        # Fix date locator to tick every 15 days
+        self.sales_ax.xaxis.set_major_locator(mdates.DayLocator(interval=15))
+        # Rotate date labels for better readability
+        self.sales_ax.tick_params(axis='x', labelrotation=45)
+        # Set the font size of the tick labels
+        self.sales_ax.tick_params(axis='both', which='major', labelsize=self.ticks_fontsize)
 
-        # Total Sales Plot
-        self.total_sales_plot(self.figure.add_subplot(gs[0, :]))
-
-        # Get the most sold items
-        data = sold_items_sorted()
-        most_sold_items = data[-self.limit:]
-
-        # Most sold items
-        self.most_sold_items_plot(self.figure.add_subplot(gs[1, 0]), most_sold_items)
-
-        # Less sold items
-        less_sold_items = data[:self.limit]
-        self.least_sold_items_plot(self.figure.add_subplot(gs[1, 1]), less_sold_items)
+        # Most and less sold items, a bar and its label per position, from the bottom
+        self.most_bars, self.most_labels = self.bars_plot(self.most_ax, 'lightblue')
+        self.least_bars, self.least_labels = self.bars_plot(self.least_ax, 'lightcoral')
+        self.least_ax.invert_xaxis()
+        self.least_ax.yaxis.tick_right()
 
         # Add padding between first and second row
         self.figure.subplots_adjust(hspace=0.8)
-        # Refresh canvas
-        self.canvas.draw()
 
-    def total_sales_plot(self, ax):
+    def bars_plot(self, ax, color: str) -> tuple[list, list]:
         """
-        Plots total sales over time.
-
-        The method retrieves the sales data and plots it on a line chart 
-        with markers. It sets appropriate labels, titles, and formats the 
-        x-axis to show dates, with a locator set to tick every 15 days.
+        Creates the empty horizontal bars of a chart of items, with a label inside each.
 
         Parameters
         ----------
         ax : matplotlib.axes.Axes
-            The Matplotlib axes object where the plot will be drawn.
+            The Matplotlib axes object where the bars are drawn.
+        color : str
+            The color of the bars.
+
+        Returns
+        -------
+        tuple of (list, list)
+            The bars and their labels.
         """
-        dates, total_sales = get_transactions()
-        
-        # Plot data with a line and markers
-        ax.plot(dates, total_sales, linestyle='--', marker='o', color='g', markersize=5, linewidth=1, label='Total Sales')
-
-        # Add title
-        ax.set_title('Total Sales Over Time', fontsize=self.title_fontsize)
+        bars = list(ax.barh(range(self.limit), np.zeros(self.limit), color=color))
+        labels = [
+            ax.text(0, bar.get_y() + bar.get_height() / 2, "", ha='center', va='center',
+                    fontsize=self.ticks_fontsize, color='black', animated=True)
+            for bar in bars
+        ]
+        for bar in bars:
+            bar.set_animated(True)
+        ax.set_ylim(-0.5, self.limit - 0.5)
+
+        # Set the font size of the tick labels and hide the y-ticks, the labels are inside the bars
+        ax.tick_params(axis='both', which='major', labelsize=self.ticks_fontsize)
+        ax.yaxis.set_ticks([])
+        return bars, labels
 
-        # Improve date formatting on the x-axis
-        ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
-        
-        # Fix date locator to tick every 15 days
-        ax.xaxis.set_major_locator(mdates.DayLocator(interval=15))
+    def generate_plots(self):
+        """
+        Refreshes the sales data plots with the sales made since the last refresh.
 
-        # Rotate date labels for better readability
-        for label in ax.get_xticklabels():
-            label.set_rotation(45)
-            label.set_horizontalalignment('right')
-        
-        # Set the font size of the tick labels
-        ax.tick_params(axis='both', which='major', labelsize=self.ticks_fontsize)
-    
-    def most_sold_items_plot(self, ax, data: list[tuple]):      
+        The daily sales are read from the first day with new sales, and the items
+        are ranked again only if there are new sales or another metric. The canvas is
+        fully redrawn when an axis has to be rescaled or retitled, otherwise the
+        changed axes are blitted.
+        """
+        first_day, last_id = get_sales_after(self.last_id)
+        new_sales = last_id != self.last_id or not self.last_id
+        changed, rescaled = [], False
+
+        if new_sales:
+            # Replace the days from the first one with new sales on, and append the new days
+            dates, total_sales, _ = get_transactions(start=first_day if self.last_id else None)
+            keep = self.dates < dates[0] if len(dates) and self.last_id else np.zeros(len(self.dates), dtype=bool)
+            self.dates = np.concatenate([self.dates[keep], dates])
+            self.total_sales = np.concatenate([self.total_sales[keep], total_sales])
+            self.last_id = last_id
+
+            self.sales_line.set_data(self.dates, self.total_sales)
+            rescaled |= self.rescale(self.sales_ax, mdates.date2num(self.dates), self.total_sales)
+            changed.append(self.sales_ax)
+
+        if new_sales or self.metric != self.plotted_metric:
+            # Get the items sorted by their totals
+            names, totals = sold_items_sorted(self.metric)
+
+            # Most sold items, and less sold items
+            rescaled |= self.update_bars(self.most_ax, self.most_bars, self.most_labels,
+                                         names[-self.limit:], totals[-self.limit:])
+            rescaled |= self.update_bars(self.least_ax, self.least_bars, self.least_labels,
+                                         names[:self.limit], totals[:self.limit])
+            changed += [self.most_ax, self.least_ax]
+
+            if self.metric != self.plotted_metric:
+                self.most_ax.set_title(self.titles[self.metric][0], fontsize=self.title_fontsize)
+                self.least_ax.set_title(self.titles[self.metric][1], fontsize=self.title_fontsize)
+                self.plotted_metric, rescaled = self.metric, True
+
+        if rescaled or not self.backgrounds:
+            # Rotated date labels read better aligned to their tick
+            for label in self.sales_ax.get_xticklabels():
+                label.set_horizontalalignment('right')
+            # Refresh canvas, the backgrounds are saved and the animated artists drawn on the draw event
+            self.canvas.draw()
+        else:
+            self.blit(changed)
+
+    def rescale(self, ax, x: np.ndarray, y: np.ndarray) -> bool:
         """
-        Plots the most sold items as a horizontal bar chart.
+        Fits the limits of an axis to its data again, if the data left them.
 
-        The method takes sales data, extracts the top-selling items, 
-        and displays them in a bar chart. It also configures the plot 
-        for visual appeal.
+        Parameters
+        ----------
+        ax : matplotlib.axes.Axes
+            The axes to fit.
+        x : numpy.ndarray
+            The x values of the data.
+        y : numpy.ndarray
+            The y values of the data.
+
+        Returns
+        -------
+        bool
+            Whether the limits changed, which needs a full draw.
+        """
+        if not len(x):
+            return False
+        (x0, x1), (y0, y1) = ax.get_xlim(), ax.get_ylim()
+        if x0 <= x.min() and x.max() <= x1 and y0 <= y.min() and y.max() <= y1:
+            return False
+        ax.relim()
+        ax.autoscale_view()
+        return True
+
+    def update_bars(self, ax, bars: list, labels: list, items: np.ndarray, totals: np.ndarray) -> bool:
+        """
+        Resizes the bars of a chart of items and relabels them.
 
         Parameters
         ----------
-        ax : matplotlib.axes._axes.Axes
-            The Matplotlib axes object where the plot will be drawn.
-        data : list of tuples
-            A list of tuples containing item names and quantities sold.
+        ax : matplotlib.axes.Axes
+            The Matplotlib axes object where the bars are drawn.
+        bars : list of matplotlib.patches.Rectangle
+            The bars of the chart, from the bottom.
+        labels : list of matplotlib.text.Text
+            The labels inside the bars.
+        items : numpy.ndarray
+            The item names, at most one per bar.
+        totals : numpy.ndarray
+            Their totals (quantity, revenue or margin).
+
+        Returns
+        -------
+        bool
+            Whether the x limits changed, which needs a full draw.
         """
-        items = [item[0] for item in data]
-        quantity = [item[1] for item in data]
+        widths = np.zeros(len(bars))
+        widths[:len(totals)] = totals
+        for bar, width in zip(bars, widths):
+            bar.set_width(width)
+
+        # Fit the x-axis when the bars leave it, or fill less than half of it
+        low, high = min(widths.min(), 0), max(widths.max(), 0)
+        x0, x1 = sorted(ax.get_xlim())
+        rescaled = low < x0 or high > x1 or (high - low) * 2 < x1 - x0
+        if rescaled:
+            ax.set_xlim(*sorted([low * 1.05, high * 1.05 or 1], reverse=bool(ax.xaxis_inverted())))
+
+        # Place the labels inside the bars
+        x_center = ax.get_xlim()[0] / 2
+        for index, (bar, label) in enumerate(zip(bars, labels)):
+            width = bar.get_width()
+            x_position = width / 2 if width > x_center // 4 else x_center  # Minimum x-position when width is 0
+            label.set_position((x_position, bar.get_y() + bar.get_height() / 2))
+            label.set_text(items[index] if index < len(items) else "")
+        return rescaled
 
-        # Create a bar chart
-        bars = ax.barh(items, quantity, color='lightblue')
+    def on_draw(self, event):
+        """
+        Saves the background of each axis after a full draw, and draws the animated artists over it.
 
-        # Add labels and title
-        ax.set_title('Most Sold Items', fontsize=self.title_fontsize)
+        Parameters
+        ----------
+        event : matplotlib.backend_bases.DrawEvent
+            The draw event of the canvas.
+        """
+        self.backgrounds = {ax: self.canvas.copy_from_bbox(ax.bbox) for ax in self.figure.axes}
+        for ax in self.figure.axes:
+            self.draw_animated(ax)
 
-        self.configure_plot(ax, bars, items)
+    def draw_animated(self, ax):
+        """
+        Draws the animated artists of an axis, the line or the bars and their labels.
+        """
+        artists = {
+            self.sales_ax: [self.sales_line],
+            self.most_ax: self.most_bars + self.most_labels,
+            self.least_ax: self.least_bars + self.least_labels
+        }[ax]
+        for artist in artists:
+            ax.draw_artist(artist)
+
+    def blit(self, axes: list):
+        """
+        Re-renders only some axes, restoring their backgrounds and drawing their artists on top.
 
-    def least_sold_items_plot(self, ax, data: list[tuple]):
+        Parameters
+        ----------
+        axes : list of matplotlib.axes.Axes
+            The axes whose data changed.
         """
-        Plots the least sold items as a horizontal bar chart.
+        for ax in axes:
+            self.canvas.restore_region(self.backgrounds[ax])
+            self.draw_animated(ax)
+            self.canvas.blit(ax.bbox)
 
-        This method is similar to `most_sold_items_plot`, but it inverts
-        the x-axis to emphasize the lower quantities and displays the 
-        least sold items.
+
+class Forecast(QWidget):
+    """
+    A QWidget that lists the items running out first, with their forecast sales and reorder quantity.
+    """
+    def __init__(self, parent: QWidget = None):
+        """
+        Initializes the Forecast widget with a title and a read-only table.
 
         Parameters
         ----------
-        ax : matplotlib.axes._axes.Axes
-            The Matplotlib axes object where the plot will be drawn.
-        data : list of tuples
-            A list of tuples containing item names and quantities sold.
-        """        
-        items = [item[0] for item in data]
-        quantity = [item[1] for item in data]
+        parent : QWidget, optional
+            The parent widget. Defaults to None.
+        """
+        super().__init__(parent)
 
-        # Create a bar chart
-        bars = ax.barh(items, quantity, color='lightcoral')
+        # Number of items to list
+        self.limit = 100
 
-        # Add labels and title
-        ax.invert_xaxis()
-        ax.yaxis.tick_right()
-        ax.set_title('Less Sold Items', fontsize=self.title_fontsize)
+        self.title = QLabel("Reorder Forecast")
+        self.title.setObjectName("forecastTitle")
+
+        self.table = QTableWidget(self)
+        self.table.setColumnCount(5)
+        self.table.setHorizontalHeaderLabels(["Item", "Stock", "Per Day", "Days Left", "Reorder"])
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        self.table.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+
+        v_layout = QVBoxLayout()
+        v_layout.addWidget(self.title)
+        v_layout.addWidget(self.table)
+        self.setLayout(v_layout)
 
-        self.configure_plot(ax, bars, items)
+        self.refresh()
 
-    def configure_plot(self, ax, bars: list, items: list[str]):
+    def refresh(self):
+        """
+        Fills the table with the items that will run out first.
         """
-        Configures the plot by adjusting tick labels and placing item names inside the bars.
+        forecast = get_forecast()
+        rows = min(self.limit, len(forecast['name']))
+
+        self.table.setRowCount(rows)
+        for row in range(rows):
+            days_left = forecast['days_left'][row]
+            values = [
+                forecast['name'][row],
+                str(forecast['stock'][row]),
+                f"{forecast['velocity'][row]:.2f}",
+                "-" if days_left == float('inf') else f"{days_left:.0f}",
+                str(forecast['reorder'][row])
+            ]
+            for column, value in enumerate(values):
+                cell = QTableWidgetItem(value)
+                if column:
+                    cell.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+                self.table.setItem(row, column, cell)
+
+
+class Heatmap(QWidget):
+    """
+    A QWidget that shows the revenue or the number of transactions by weekday and hour of the day.
 
-        The method customizes the appearance of the bar chart, including font sizes and 
-        positioning of labels within the bars for better readability.
+    The 7 × 24 cells are drawn as a single image, so the plot costs the same
+    however many transactions it aggregates.
+    """
+    def __init__(self, parent: QWidget = None):
+        """
+        Initializes the Heatmap widget with the metric and period selectors and its figure.
 
         Parameters
         ----------
-        ax : matplotlib.axes.Axes
-            The Matplotlib axes object where the plot is drawn.
-        bars : list of matplotlib.patches.Rectangle
-            The bars of the chart.
-        items : list of str
-            The item names corresponding to each bar.
+        parent : QWidget, optional
+            The parent widget. Defaults to None.
         """
-        # Set the font size of the tick labels
+        super().__init__(parent)
+
+        self.ticks_fontsize = 8
+
+        # Metric and period of the heatmap
+        self.metric_input = QComboBox()
+        self.metric_input.addItems(["Revenue", "Transactions"])
+        self.metric_input.currentIndexChanged.connect(self.refresh)
+        self.period_input = QComboBox()
+        self.period_input.addItems(["All time", "Last 30 days", "Last 90 days", "Last 365 days"])
+        self.period_input.currentIndexChanged.connect(self.refresh)
+        self.periods = [None, 30, 90, 365]
+
+        selector_layout = QHBoxLayout()
+        selector_layout.addWidget(QLabel("Busy Hours"))
+        selector_layout.addStretch()
+        selector_layout.addWidget(self.metric_input)
+        selector_layout.addWidget(self.period_input)
+
+        self.figure = Figure()
+        self.canvas = FigureCanvas(self.figure)
+
+        v_layout = QVBoxLayout()
+        v_layout.addLayout(selector_layout)
+        v_layout.addWidget(self.canvas)
+        self.setLayout(v_layout)
+
+        self.refresh()
+
+    def refresh(self):
+        """
+        Reads the sales by weekday and hour of the selected period and redraws the heatmap.
+        """
+        days = self.periods[self.period_input.currentIndex()]
+        start = datetime.combine(datetime.now().date() - timedelta(days=days - 1), datetime.min.time()) if days else None
+        revenue, transactions = get_sales_heatmap(start=start)
+        data = revenue if self.metric_input.currentIndex() == 0 else transactions
+
+        self.figure.clear()
+        ax = self.figure.add_subplot()
+        image = ax.imshow(data, aspect='auto', cmap='YlOrRd', interpolation='nearest')
+        ax.grid(False)
+
+        ax.set_yticks(range(7))
+        ax.set_yticklabels(["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"])
+        ax.set_xticks(range(0, 24, 2))
+        ax.set_xlabel('Hour', fontsize=self.ticks_fontsize)
         ax.tick_params(axis='both', which='major', labelsize=self.ticks_fontsize)
 
-        # Get the center position of the x-axis
-        x_center = ax.get_xlim()[0] / 2
+        colorbar = self.figure.colorbar(image, ax=ax)
+        colorbar.ax.tick_params(labelsize=self.ticks_fontsize)
 
-        # Place the y-tick labels inside the bars
-        ax.yaxis.set_ticks([])  # Hide y-ticks
-        for bar, label in zip(bars, items):
-            width = bar.get_width()
-            x_position = width / 2 if width > x_center // 4 else x_center  # Minimum x-position when width is 0
-            ax.text(x_position, bar.get_y() + bar.get_height() / 2,
-                    label, ha='center', va='center', fontsize=self.ticks_fontsize, color='black')
+        self.figure.tight_layout()
+        self.canvas.draw()
 
 
 class AnalyticsTab(QWidget):
     """
     A QWidget that represents the analytics tab of the POSApp.
 
-    The AnalyticsTab class contains the plots for sales data and allows 
-    refreshing of the plots through the `redraw` method.
+    The AnalyticsTab class contains the plots for sales data, the reorder forecast and the busy hours, and allows 
+    refreshing of the plots through the `redraw` method. The plots are drawn
+    from the reporting snapshot, whose age is shown above them.
     """
     def __init__(self, parent: QMainWindow = None):
         """
@@ -225,12 +466,43 @@ class AnalyticsTab(QWidget):
         """
         super().__init__(parent)
 
+        # Freshness of the reporting snapshot and a button to refresh it now
+        self.freshness_layout = QHBoxLayout()
+        self.freshness_label = QLabel()
+        self.freshness_label.setObjectName("freshnessLabel")
+        self.refresh_button = QPushButton("Refresh Data")
+        self.refresh_button.setObjectName("refreshButton")
+        self.refresh_button.clicked.connect(self.refresh_data)
+        self.freshness_layout.addWidget(self.freshness_label)
+        self.freshness_layout.addStretch()
+
+        # Total the top and bottom items are ranked by
+        self.metric_input = QComboBox()
+        self.metric_input.addItems(["Quantity", "Revenue", "Margin"])
+        self.metric_input.currentTextChanged.connect(self.change_metric)
+        self.freshness_layout.addWidget(QLabel("Rank items by:"))
+        self.freshness_layout.addWidget(self.metric_input)
+        self.freshness_layout.addWidget(self.refresh_button)
+
         # Create the Matplotlib widget
         self.plot_widget = Plots(self)
+        self.update_freshness()
+
+        # Forecast and busy hours next to the plots
+        self.forecast_widget = Forecast(self)
+        self.heatmap_widget = Heatmap(self)
+        self.side_layout = QVBoxLayout()
+        self.side_layout.addWidget(self.forecast_widget)
+        self.side_layout.addWidget(self.heatmap_widget)
+
+        self.content_layout = QHBoxLayout()
+        self.content_layout.addWidget(self.plot_widget, 3)
+        self.content_layout.addLayout(self.side_layout, 2)
 
         # Create a layout and add the Matplotlib widget
         v_layout = QVBoxLayout()
-        v_layout.addWidget(self.plot_widget)
+        v_layout.addLayout(self.freshness_layout)
+        v_layout.addLayout(self.content_layout)
 
         # Set the v_layout for this tab
         self.setLayout(v_layout)
@@ -244,3 +516,36 @@ class AnalyticsTab(QWidget):
         """
         # Call the generate_plots method to refresh the plots
         self.plot_widget.generate_plots()
+        self.forecast_widget.refresh()
+        self.heatmap_widget.refresh()
+        self.update_freshness()
+
+    def change_metric(self, metric: str):
+        """
+        Ranks the top and bottom items by another total and redraws the plots.
+
+        Parameters
+        ----------
+        metric : str
+            The name of the total, "Quantity", "Revenue" or "Margin".
+        """
+        self.plot_widget.metric = metric.lower()
+        self.plot_widget.generate_plots()
+
+    def refresh_data(self):
+        """
+        Refreshes the reporting snapshot with the latest sales and redraws the plots.
+        """
+        refresh_snapshot()
+        self.redraw()
+
+    def update_freshness(self):
+        """
+        Shows when the reporting snapshot was taken and how often it is refreshed.
+        """
+        snapshot_time = get_snapshot_time()
+        taken = snapshot_time.strftime('%Y-%m-%d %H:%M:%S') if snapshot_time else "never"
+        self.freshness_label.setText(
+            f"Data as of {taken} (refreshed every {get_setting('snapshot_interval') // 60} min "
+            f"or {get_setting('snapshot_sales')} sales)"
+        )
@@ -0,0 +1,248 @@
+from PyQt6.QtWidgets import (
+    QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QPushButton,
+    QTreeWidget, QTreeWidgetItem, QDateEdit, QCheckBox, QHeaderView, QInputDialog, QMessageBox
+)
+from PyQt6.QtCore import Qt, QDate
+from PyQt6.QtGui import QDoubleValidator, QKeyEvent
+from backend.services import get_transaction_page, get_transaction_lines
+from backend.archive import get_archivable_years, archive_year
+from .z_report import ZReportDialog
+from datetime import datetime, timedelta
+
+
+class HistoryTab(QWidget):
+    """
+    Class representing the transaction history tab in the application.
+    Allows users to browse past sales, newest first, and inspect their items.
+    """
+    def __init__(self, parent: QMainWindow = None):
+        """
+        Initializes the History tab and sets up the filters and the transaction tree.
+
+        Transactions are loaded one page at a time while the user scrolls down, and
+        the items of a transaction are only loaded when its row is expanded.
+
+        Parameters
+        ----------
+        parent : QMainWindow, optional
+            The parent widget for the History tab. Defaults to None.
+        """
+        super().__init__(parent)
+
+        # Number of transactions fetched per page
+        self.page_size = 100
+
+        self.v_layout = QVBoxLayout(self)
+
+        # Filters
+        self.filter_layout = QHBoxLayout()
+
+        self.date_filter = QCheckBox("From:")
+        self.date_filter.toggled.connect(self.toggle_date_filter)
+        self.start_date = QDateEdit(QDate.currentDate().addMonths(-1))
+        self.start_date.setCalendarPopup(True)
+        self.start_date.setEnabled(False)
+        self.end_date_label = QLabel("To:")
+        self.end_date = QDateEdit(QDate.currentDate())
+        self.end_date.setCalendarPopup(True)
+        self.end_date.setEnabled(False)
+        self.filter_layout.addWidget(self.date_filter)
+        self.filter_layout.addWidget(self.start_date)
+        self.filter_layout.addWidget(self.end_date_label)
+        self.filter_layout.addWidget(self.end_date)
+
+        amount_validator = QDoubleValidator(0.0, 1e10, 2, self)
+        amount_validator.setNotation(QDoubleValidator.Notation.StandardNotation)
+        self.min_amount_input = QLineEdit()
+        self.min_amount_input.setPlaceholderText("Min amount")
+        self.min_amount_input.setValidator(amount_validator)
+        self.max_amount_input = QLineEdit()
+        self.max_amount_input.setPlaceholderText("Max amount")
+        self.max_amount_input.setValidator(amount_validator)
+        self.filter_layout.addWidget(self.min_amount_input)
+        self.filter_layout.addWidget(self.max_amount_input)
+
+        self.item_input = QLineEdit()
+        self.item_input.setPlaceholderText("Search for a item...")
+        self.filter_layout.addWidget(self.item_input)
+
+        self.search_button = QPushButton("Search")
+        self.search_button.setObjectName("searchButton")
+        self.search_button.clicked.connect(self.refresh)
+        self.filter_layout.addWidget(self.search_button)
+
+        self.v_layout.addLayout(self.filter_layout)
+
+        # Transactions tree, each transaction expands into its items
+        self.tree = QTreeWidget(self)
+        self.tree.setColumnCount(5)
+        self.tree.setHeaderLabels(["Date", "Transaction", "Total", "Received", "Change"])
+        self.tree.header().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.tree.itemExpanded.connect(self.load_lines)
+        self.tree.verticalScrollBar().valueChanged.connect(self.on_scroll)
+        self.v_layout.addWidget(self.tree)
+
+        # Buttons to show the end-of-day report and to move closed years into their archive database
+        self.archive_layout = QHBoxLayout()
+        self.archive_layout.addStretch()
+        self.z_report_button = QPushButton("Z Report")
+        self.z_report_button.setObjectName("zReportButton")
+        self.z_report_button.clicked.connect(self.show_z_report)
+        self.archive_layout.addWidget(self.z_report_button)
+        self.archive_button = QPushButton("Archive Year")
+        self.archive_button.setObjectName("archiveButton")
+        self.archive_button.clicked.connect(self.archive)
+        self.archive_layout.addWidget(self.archive_button)
+        self.v_layout.addLayout(self.archive_layout)
+
+        # Keyset of the last loaded transaction and whether there are more pages
+        self.last_key = None
+        self.has_more = False
+        self.filters = {}
+
+    def toggle_date_filter(self, checked: bool):
+        """
+        Enables or disables the date range inputs.
+
+        Parameters
+        ----------
+        checked : bool
+            Whether the date range filter is active.
+        """
+        self.start_date.setEnabled(checked)
+        self.end_date.setEnabled(checked)
+
+    def read_filters(self) -> dict:
+        """
+        Reads the filter inputs.
+
+        Returns
+        -------
+        dict
+            The keyword arguments for `get_transaction_page` matching the current filters.
+        """
+        filters = {}
+        if self.date_filter.isChecked():
+            filters['start'] = datetime.combine(self.start_date.date().toPyDate(), datetime.min.time())
+            # The end date is inclusive
+            end = self.end_date.date().toPyDate() + timedelta(days=1)
+            filters['end'] = datetime.combine(end, datetime.min.time())
+        if self.min_amount_input.text():
+            filters['min_amount'] = float(self.min_amount_input.text())
+        if self.max_amount_input.text():
+            filters['max_amount'] = float(self.max_amount_input.text())
+        if self.item_input.text():
+            filters['item'] = self.item_input.text()
+        return filters
+
+    def load_page(self):
+        """
+        Fetches the next page of transactions and appends it to the tree.
+        """
+        rows = get_transaction_page(after=self.last_key, limit=self.page_size, **self.filters)
+        self.has_more = len(rows) == self.page_size
+
+        for row in rows:
+            tree_item = QTreeWidgetItem([
+                row.timestamp.strftime('%Y-%m-%d %H:%M:%S') if row.timestamp else "",
+                str(row.id),
+                f"${row.total_amount:.2f}",
+                f"${row.payment_received:.2f}",
+                f"${row.change_returned:.2f}"
+            ])
+            tree_item.setData(0, Qt.ItemDataRole.UserRole, (row.id, row.timestamp))
+            # Show the expand arrow before the items are loaded
+            tree_item.setChildIndicatorPolicy(QTreeWidgetItem.ChildIndicatorPolicy.ShowIndicator)
+            self.tree.addTopLevelItem(tree_item)
+
+        if rows:
+            self.last_key = (rows[-1].timestamp, rows[-1].id)
+
+    def load_lines(self, tree_item: QTreeWidgetItem):
+        """
+        Loads the items of a transaction the first time its row is expanded.
+
+        Parameters
+        ----------
+        tree_item : QTreeWidgetItem
+            The expanded transaction row.
+        """
+        if tree_item.childCount() or tree_item.parent() is not None:
+            return
+
+        transaction_id, timestamp = tree_item.data(0, Qt.ItemDataRole.UserRole)
+        for name, quantity in get_transaction_lines(transaction_id, timestamp):
+            tree_item.addChild(QTreeWidgetItem(["", name if name is not None else "(removed item)", f"x {quantity}"]))
+
+        if not tree_item.childCount():
+            tree_item.setChildIndicatorPolicy(QTreeWidgetItem.ChildIndicatorPolicy.DontShowIndicator)
+
+    def on_scroll(self, value: int):
+        """
+        Loads the next page when the user scrolls close to the bottom of the tree.
+
+        Parameters
+        ----------
+        value : int
+            The current position of the vertical scroll bar.
+        """
+        if self.has_more and value >= self.tree.verticalScrollBar().maximum() - 10:
+            self.load_page()
+
+    def show_z_report(self):
+        """
+        Opens the end-of-day report of today, where past days' reports can be reopened.
+        """
+        ZReportDialog(self).exec()
+
+    def archive(self):
+        """
+        Asks for a closed year and moves its transactions into the year's archive database.
+
+        Raises
+        ------
+        QMessageBox
+            If there are no closed years to archive.
+            After a successful archive, display the number of archived transactions.
+        """
+        years = [str(year) for year in get_archivable_years()]
+        if not years:
+            QMessageBox.information(self, "Nothing to Archive", "There are no closed years with transactions to archive.")
+            return
+
+        year, accepted = QInputDialog.getItem(self, "Archive Year", "Year to archive:", years, 0, False)
+        if not accepted:
+            return
+
+        archived = archive_year(int(year))
+        QMessageBox.information(self, "Success", f"{archived} transactions of {year} archived successfully!")
+        self.refresh()
+
+    def refresh(self):
+        """
+        Clears the tree and loads the first page of transactions with the current filters.
+        """
+        self.tree.clear()
+        self.filters = self.read_filters()
+        self.last_key = None
+        self.load_page()
+
+    def keyPressEvent(self, event: QKeyEvent):
+        """
+        This method is triggered when the user presses the Escape or Enter key.
+
+        Escape clears the filters and Enter applies them.
+
+        Parameters
+        ----------
+        event : QKeyEvent
+            The key event that triggers the method.
+        """
+        if event.key() == Qt.Key.Key_Escape:
+            self.date_filter.setChecked(False)
+            self.min_amount_input.clear()
+            self.max_amount_input.clear()
+            self.item_input.clear()
+            self.refresh()
+        elif event.key() in (Qt.Key.Key_Return, Qt.Key.Key_Enter):
+            self.refresh()
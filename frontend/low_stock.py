@@ -0,0 +1,42 @@
+from PyQt6.QtWidgets import QWidget, QLabel, QListWidget
+from backend.services import get_low_stock
+
+
+class LowStockBadge(QLabel):
+    """
+    A QLabel showing how many items are low on stock, listing them in its tooltip.
+
+    An optional list widget can be attached to show the same items in full.
+    """
+    def __init__(self, parent: QWidget = None, item_list: QListWidget = None):
+        """
+        Initializes the badge and shows the current low stock items.
+
+        Parameters
+        ----------
+        parent : QWidget, optional
+            The parent widget of the badge. Defaults to None.
+        item_list : QListWidget, optional
+            A list widget to fill with the low stock items. Defaults to None.
+        """
+        super().__init__(parent)
+        self.setObjectName("lowStockBadge")
+        self.item_list = item_list
+        self.refresh()
+
+    def refresh(self):
+        """
+        Reads the low stock items and updates the badge, its tooltip and the attached list.
+        """
+        rows = [f"{name}: {stock} left (reorder at {threshold})" for name, stock, threshold in get_low_stock()]
+
+        self.setText(f"Low stock: {len(rows)}")
+        self.setToolTip("\n".join(rows) if rows else "No items low on stock")
+        # Highlight the badge only when there is something to reorder
+        self.setProperty("alert", bool(rows))
+        self.style().unpolish(self)
+        self.style().polish(self)
+
+        if self.item_list is not None:
+            self.item_list.clear()
+            self.item_list.addItems(rows)
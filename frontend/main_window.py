@@ -1,9 +1,11 @@
 from PyQt6.QtWidgets import QMainWindow, QWidget, QVBoxLayout, QTabWidget
-from PyQt6.QtCore import QLocale
+from PyQt6.QtCore import QLocale, QTimer
+from PyQt6.QtGui import QCloseEvent
 from .pos_tab import POSTab
 from .store_tab import StoreTab
-from .analytics import AnalyticsTab
+from .history_tab import HistoryTab
 from .utils import populate_table
+from backend.services import release_reservations
 
 class POSApp(QMainWindow):
     """
@@ -15,7 +17,7 @@ class POSApp(QMainWindow):
         Initializes the main window of the POSApp.
 
         Sets the window title, size, and locale. Initializes the main widget and
-        the three primary tabs (POS, Store, Analytics). The layout and tab system 
+        the primary tabs (POS, Store, Analytics, History). The layout and tab system 
         are set up within the central widget, and the tab change event is connected 
         to the `refresh_current_tab` method.
         """
@@ -42,12 +44,25 @@ class POSApp(QMainWindow):
         self.store_tab = StoreTab(self)
         self.tabs.addTab(self.store_tab, "Store")
 
-        self.analytics_tab = AnalyticsTab(self)
-        self.tabs.addTab(self.analytics_tab, "Analytics")
+        # The analytics tab is built the first time it is shown, since Matplotlib
+        # takes about as long to import as the rest of the application
+        self.analytics_tab = None
+        self.analytics_container = QWidget(self)
+        self.analytics_layout = QVBoxLayout(self.analytics_container)
+        self.analytics_layout.setContentsMargins(0, 0, 0, 0)
+        self.tabs.addTab(self.analytics_container, "Analytics")
+
+        self.history_tab = HistoryTab(self)
+        self.tabs.addTab(self.history_tab, "History")
 
         # Refresh the tab content after tab is changed
         self.tabs.currentChanged.connect(self.refresh_current_tab)
 
+        # Keep the low stock badges current with the sales of the other tills
+        self.low_stock_timer = QTimer(self)
+        self.low_stock_timer.timeout.connect(self.refresh_low_stock)
+        self.low_stock_timer.start(30000)
+
         # Main layout inside the main widget
         self.main_layout = QVBoxLayout(self.main_widget)
         self.main_layout.addWidget(self.tabs)
@@ -58,16 +73,53 @@ class POSApp(QMainWindow):
 
         This method is triggered when the user switches between tabs. Depending on the
         index of the currently selected tab, it refreshes the content by repopulating
-        the item table for POS and Store tabs, or redrawing the analytics chart.
+        the item table for POS and Store tabs, redrawing the analytics chart, or reloading
+        the transaction history.
 
         Parameters
         ----------
         index : int
-            The index of the currently selected tab (0 for POS, 1 for Store, 2 for Analytics).
+            The index of the currently selected tab (0 for POS, 1 for Store, 2 for Analytics, 3 for History).
         """
         if index == 0:
             self.pos_tab.refresh()
         elif index == 1:
             self.store_tab.refresh()
         elif index == 2:
-            self.analytics_tab.redraw()
+            self.show_analytics().redraw()
+        elif index == 3:
+            self.history_tab.refresh()
+
+    def show_analytics(self):
+        """
+        Returns the analytics tab, building it the first time.
+
+        Returns
+        -------
+        AnalyticsTab
+            The analytics tab.
+        """
+        if self.analytics_tab is None:
+            from .analytics import AnalyticsTab
+            self.analytics_tab = AnalyticsTab(self.analytics_container)
+            self.analytics_layout.addWidget(self.analytics_tab)
+        return self.analytics_tab
+
+    def refresh_low_stock(self):
+        """
+        Refreshes the low stock badges of the POS and Store tabs.
+        """
+        self.pos_tab.low_stock_badge.refresh()
+        self.store_tab.low_stock_badge.refresh()
+
+    def closeEvent(self, event: QCloseEvent):
+        """
+        Releases the items reserved by the POS cart when the window is closed.
+
+        Parameters
+        ----------
+        event : QCloseEvent
+            The close event of the window.
+        """
+        release_reservations(self.pos_tab.cart_id)
+        super().closeEvent(event)
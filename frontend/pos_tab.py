@@ -1,13 +1,20 @@
 from PyQt6.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, QLabel, QTableWidget, QSpinBox, QSizePolicy, 
-    QSpacerItem, QListWidget, QPushButton, QLineEdit, QHBoxLayout, QMessageBox
+    QSpacerItem, QListWidget, QPushButton, QLineEdit, QHBoxLayout, QMessageBox, QComboBox, QGridLayout
 )
-from PyQt6.QtCore import Qt, QSize
-from PyQt6.QtGui import QIcon, QPixmap, QDoubleValidator, QKeyEvent
-from .utils import display_table, populate_table, filter_search, item_selected
-from backend.services import save_transaction, discount_stock
+from PyQt6.QtCore import Qt, QSize, QTimer
+from PyQt6.QtGui import QIcon, QPixmap, QDoubleValidator, QKeyEvent, QKeySequence, QShortcut
+from .utils import display_table, populate_table, filter_search, item_selected, update_stock, refresh_rows, spacer
+from .low_stock import LowStockBadge
+from backend.services import save_transaction, reserve_stock, release_reservations, InsufficientStockError, PriceChangedError
+from backend.carts import park_cart, get_parked_carts, resume_cart
+from backend.quick_keys import get_quick_keys, refresh_quick_keys_async
+from backend.promotions import CartPricer
+from backend.config import get_setting
+from sqlalchemy.exc import OperationalError
 from backend.path import get_resource_path
-import os, re
+from functools import partial
+import os, re, uuid
 
 
 class POSTab(QWidget):
@@ -33,9 +40,6 @@ class POSTab(QWidget):
         # Main vertical layout for the entire POS tab
         self.v_layout = QVBoxLayout(self)
 
-        # Spacer item for adding empty space in layouts
-        self.spacer = QSpacerItem(40, 20, QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Minimum)
-
         # Create search filter and item table for displaying products
         self.filter_search, self.item_table = display_table(self)
         
@@ -45,8 +49,11 @@ class POSTab(QWidget):
         # Connect the selection change event to update selected item details
         self.item_table.selectionModel().selectionChanged.connect(lambda: self.selection(self.item_table))
 
-        # Populate the table with items
-        populate_table(self.item_table)
+        # Identifier of the cart, which holds its items through reservations
+        self.cart_id = uuid.uuid4().hex
+
+        # Populate the table with the available stock of the items
+        populate_table(self.item_table, show_available=True)
 
         # Layout for holding the table and icon
         self.table_icon = QHBoxLayout()
@@ -56,19 +63,47 @@ class POSTab(QWidget):
         icon_pixmap = QPixmap(get_resource_path(os.path.join("assets", "pos.ico")))
         icon_label.setPixmap(icon_pixmap)        
 
-        # Spacer item to add padding between table and icon
-        space = QSpacerItem(60, 20, QSizePolicy.Policy.Minimum, QSizePolicy.Policy.Expanding)
-        
-        # Add table and icon to the horizontal layout
+        # Add table and icon to the horizontal layout, with padding between them
         self.table_icon.addWidget(self.item_table)
-        self.table_icon.addItem(space)
+        self.table_icon.addItem(QSpacerItem(60, 20, QSizePolicy.Policy.Minimum, QSizePolicy.Policy.Expanding))
         self.table_icon.addWidget(icon_label)
-        self.table_icon.addItem(space)
+        self.table_icon.addItem(QSpacerItem(60, 20, QSizePolicy.Policy.Minimum, QSizePolicy.Policy.Expanding))
+
+        # Search box with the low stock badge next to it
+        self.search_layout = QHBoxLayout()
+        self.low_stock_badge = LowStockBadge(self)
+        self.search_layout.addWidget(self.filter_search)
+        self.search_layout.addItem(spacer())
+        self.search_layout.addWidget(self.low_stock_badge)
 
         # Add the filter search box and table layout to the main vertical layout
-        self.v_layout.addWidget(self.filter_search)
+        self.v_layout.addLayout(self.search_layout)
         self.v_layout.addLayout(self.table_icon)
 
+        # One-touch grid of the pinned items and the top sellers, the first slots are bound to F1 to F12
+        self.quick_keys_layout = QGridLayout()
+        self.quick_key_buttons = []
+        columns = get_setting("quick_keys_columns")
+        for slot in range(get_setting("quick_keys")):
+            button = QPushButton()
+            button.setObjectName("quickKeyButton")
+            button.setVisible(False)
+            button.clicked.connect(partial(self.quick_add, slot))
+            self.quick_keys_layout.addWidget(button, slot // columns, slot % columns)
+            self.quick_key_buttons.append(button)
+            if slot < 12:
+                shortcut = QShortcut(QKeySequence(f"F{slot + 1}"), self)
+                shortcut.setContext(Qt.ShortcutContext.WidgetWithChildrenShortcut)
+                shortcut.activated.connect(partial(self.quick_add, slot))
+        self.v_layout.addLayout(self.quick_keys_layout)
+
+        # The grid shows the items read by the last background refresh, checked every 2 seconds
+        self.quick_keys = None
+        self.show_quick_keys()
+        self.quick_keys_timer = QTimer(self)
+        self.quick_keys_timer.timeout.connect(self.show_quick_keys)
+        self.quick_keys_timer.start(2000)
+
         # Quantity input section
         self.quantity_layout = QHBoxLayout()
         self.quantity_label = QLabel("Quantity:")
@@ -78,7 +113,7 @@ class POSTab(QWidget):
         self.quantity_input.setMaximum(1000000)
         self.quantity_layout.addWidget(self.quantity_label)
         self.quantity_layout.addWidget(self.quantity_input)
-        self.quantity_layout.addItem(self.spacer)
+        self.quantity_layout.addItem(spacer())
         self.v_layout.addLayout(self.quantity_layout)
 
         # Cart display list
@@ -87,19 +122,34 @@ class POSTab(QWidget):
         self.v_layout.addWidget(QLabel("Cart:"))
         self.v_layout.addWidget(self.cart_list)
 
+        # Enable the "Remove Line" button only while a line of the cart is selected
+        self.cart_list.itemSelectionChanged.connect(lambda: self.remove_button.setEnabled(bool(self.cart_list.selectedItems())))
+
+        # Carts parked while their customers step away, to resume them later
+        self.parked_layout = QHBoxLayout()
+        self.parked_input = QComboBox()
+        self.resume_button = QPushButton("Resume")
+        self.resume_button.setObjectName("resumeButton")
+        self.resume_button.clicked.connect(self.resume)
+        self.parked_layout.addWidget(QLabel("Parked:"))
+        self.parked_layout.addWidget(self.parked_input)
+        self.parked_layout.addWidget(self.resume_button)
+        self.parked_layout.addItem(spacer())
+        self.v_layout.addLayout(self.parked_layout)
+
         # Container for holding total price, amount received input, and buttons
         self.container = QHBoxLayout()
 
         # Add empty space to the container
-        self.container.addItem(self.spacer)
+        self.container.addItem(spacer())
 
         # Layout for displaying the total price
         self.total_price = QVBoxLayout()
         self.total_label = QLabel("Total: $0.00")
         self.total_label.setObjectName("totalLabel")
-        self.total_price.addItem(self.spacer)
+        self.total_price.addItem(spacer())
         self.total_price.addWidget(self.total_label)
-        self.total_price.addItem(self.spacer)
+        self.total_price.addItem(spacer())
         self.container.addLayout(self.total_price)
 
         # Input field for the received amount
@@ -115,9 +165,9 @@ class POSTab(QWidget):
         self.received_amount_input.setValidator(self.amount_validator)
         self.amount.addWidget(self.price_label)
         self.amount.addWidget(self.received_amount_input)
-        self.amount.addItem(self.spacer)
+        self.amount.addItem(spacer())
         self.received_amount.addLayout(self.amount)
-        self.received_amount.addItem(self.spacer)
+        self.received_amount.addItem(spacer())
         self.container.addLayout(self.received_amount)
 
         # Buttons for adding to cart, clearing, and checkout
@@ -133,6 +183,12 @@ class POSTab(QWidget):
         self.add_button.clicked.connect(self.add_to_cart)
         self.button_layout.addWidget(self.add_button)
 
+        self.remove_button = QPushButton("  Remove Line")
+        self.remove_button.setObjectName("removeLineButton")
+        self.remove_button.setEnabled(False)
+        self.remove_button.clicked.connect(self.remove_line)
+        self.button_layout.addWidget(self.remove_button)
+
         self.clear_button = QPushButton("  Clear")
         self.clear_button.setObjectName("clearButton")
         clear_icon_path = get_resource_path(os.path.join("assets", "clear.png"))
@@ -142,6 +198,12 @@ class POSTab(QWidget):
         self.clear_button.clicked.connect(self.clear_cart)
         self.button_layout.addWidget(self.clear_button)
 
+        self.park_button = QPushButton("  Park")
+        self.park_button.setObjectName("parkButton")
+        self.park_button.setEnabled(False)
+        self.park_button.clicked.connect(self.park)
+        self.button_layout.addWidget(self.park_button)
+
         self.checkout_button = QPushButton("  Checkout")
         self.checkout_button.setObjectName("checkoutButton")
         checkout_icon_path = get_resource_path(os.path.join("assets", "checkout.png"))
@@ -154,14 +216,19 @@ class POSTab(QWidget):
         self.container.addLayout(self.button_layout)
 
         # Add empty space to the container
-        self.container.addItem(self.spacer)
+        self.container.addItem(spacer())
 
         self.v_layout.addLayout(self.container)
 
         # Initialize variables
         self.total_price = 0
         self.cart = []
+        # Promotions applied to the cart, evaluated again on each change for the lines it affects
+        self.pricer = CartPricer()
         self.name, self.price, self.stock = None, None, None
+
+        # List the carts parked before the application was closed
+        self.refresh_parked()
     
     def selection(self, item_table: QTableWidget):
         """
@@ -189,95 +256,265 @@ class POSTab(QWidget):
         Adds the selected item to the cart.
 
         This method checks if a valid item and quantity are selected,
-        and adds the item to the cart. It updates the total price
-        and enables the necessary buttons for further actions.
+        reserves the quantity for the cart and adds the item to the cart.
+        It updates the total price and enables the necessary buttons for
+        further actions.
 
         Raises
         ------
         QMessageBox
-            If no item is selected or if the requested quantity exceeds stock.
+            If no item is selected or if the requested quantity exceeds the available stock.
         """
         if self.name == "":
             QMessageBox.warning(self, "No Item Selected", "Please select an item from the list above.")
             return
 
         self.quantity = self.quantity_input.value()
+        if self.add_line(self.name, self.quantity, self.price):
+            # Disable the 'Add to Cart' button
+            self.add_button.setEnabled(False)
 
-        # Check if the requested quantity exceeds the available stock
-        if self.quantity > self.stock:
+    def add_line(self, name: str, quantity: int, price: float) -> bool:
+        """
+        Reserves a quantity of an item for the cart and adds it, to the line of the item if it's already in the cart.
+
+        Parameters
+        ----------
+        name : str
+            The name of the item.
+        quantity : int
+            The quantity to add.
+        price : float
+            The unit price of the item.
+
+        Returns
+        -------
+        bool
+            True if the item was added, False if there isn't enough available stock.
+        """
+        # Reserve the quantity, checking it against the stock available right now
+        if not reserve_stock(self.cart_id, name, quantity):
             QMessageBox.warning(self, "Invalid Quantity", "Not enough stock. Please select a valid quantity.")
             self.quantity_input.setValue(1)
-            return
-        
-        total_item_price = self.price * self.quantity
-        self.total_price += total_item_price
-
-        # Add the item to the cart list and update the display
-        self.cart.append((self.name, self.quantity))
-        cart_text = f"{self.name}: {self.quantity} x ${self.price:.2f} = ${total_item_price:.2f}"
-        self.cart_list.addItem(cart_text)
+            populate_table(self.item_table, show_available=True)
+            filter_search(self.filter_search, self.item_table)
+            return False
+        update_stock(self.item_table, name, -quantity)
+
+        self.pricer.add(name, quantity, price)
+
+        # The cart and the cart list have a line per item, in the same order
+        line = next((index for index, (item, _) in enumerate(self.cart) if item == name), None)
+        if line is None:
+            self.cart.append((name, quantity))
+            self.cart_list.addItem(f"{name}: {quantity} x ${price:.2f} = ${price * quantity:.2f}")
+        else:
+            quantity += self.cart[line][1]
+            self.cart[line] = (name, quantity)
+            self.cart_list.item(line).setText(f"{name}: {quantity} x ${price:.2f} = ${price * quantity:.2f}")
 
         # Update the total price label
-        self.total_label.setText(f"Total: ${self.total_price:.2f}")
+        self.show_total()
 
         # Reset the quantity input to 1
         self.quantity_input.setValue(1)
 
-        # Enable the clear and checkout buttons
+        # Enable the clear, park and checkout buttons
         self.clear_button.setEnabled(True)
+        self.park_button.setEnabled(True)
         self.checkout_button.setEnabled(True)
+        return True
 
-        # Disable the 'Add to Cart' button
-        self.add_button.setEnabled(False)
-
-    def clear_cart(self):
+    def show_total(self):
+        """
+        Shows the total of the cart after the promotions, and the amount they take off.
         """
-        Clears the selected items or the entire cart.
+        self.total_price = self.pricer.total
+        if self.pricer.discount >= 0.005:
+            self.total_label.setText(f"Total: ${self.total_price:.2f} (saved ${self.pricer.discount:.2f})")
+        else:
+            self.total_label.setText(f"Total: ${self.total_price:.2f}")
 
-        This method either removes selected items from the cart or clears
-        all items if no specific item is selected. It updates the total price
-        and disables buttons if the cart becomes empty.
+    def show_quick_keys(self):
         """
-        selected_items = self.cart_list.selectedItems()
-        
-        if selected_items:
-            for item in selected_items:
-                row = self.cart_list.row(item)
-                item_text = item.text()
-                
-                # Use regex to extract name and quantity from the item text
-                match = re.match(r"^(.*?): (\d+) x \$.+ = \$(\d+\.\d{2})$", item_text)
-                if match:
-                    name = match.group(1)
-                    quantity = int(match.group(2))
-                    total_price = float(match.group(3))
-                    
-                    # Remove item from self.cart
-                    if (name, quantity) in self.cart:
-                        self.cart.remove((name, quantity))
-                        self.total_price -= total_price
-                        self.total_label.setText(f"Total: ${self.total_price:.2f}")
-                
-                # Remove item from cart list
-                self.cart_list.takeItem(row)
-            
-            self.cart_list.clearSelection()  # Unselect all items in the cart list
+        Shows the items of the last refresh of the quick keys on the grid, if they changed.
+        """
+        quick_keys = get_quick_keys()
+        if quick_keys is self.quick_keys:
+            return
+        self.quick_keys = quick_keys
+        for slot, button in enumerate(self.quick_key_buttons):
+            if slot < len(quick_keys):
+                name, price = quick_keys[slot]
+                button.setText(f"{name}\n${price:.2f}")
+                button.setToolTip(f"F{slot + 1}" if slot < 12 else "")
+            button.setVisible(slot < len(quick_keys))
+
+    def quick_add(self, slot: int):
+        """
+        Adds the item of a quick-key slot to the cart, in the quantity entered, or adds to its line.
 
-        else:
-            # Clear all items if no specific item is selected
-            self.total_price = 0.0
-            self.cart.clear()
-            self.cart_list.clear()
-            self.total_label.setText("Total: $0.00")
+        The price is the one shown on the quick key, so no query is made for it. If it changed
+        meanwhile, the checkout shows the new total before saving the sale. The quantity is
+        reserved as for any other item added to the cart, so no other till can sell it.
 
-        # Clear table selection
-        self.item_table.clearSelection()
+        Parameters
+        ----------
+        slot : int
+            The slot of the grid, starting at 0.
+        """
+        if self.quick_keys is None or slot >= len(self.quick_keys):
+            return
+        name, price = self.quick_keys[slot]
+        self.add_line(name, self.quantity_input.value(), price)
+
+    def remove_line(self):
+        """
+        Removes the selected lines from the cart, releasing their reservations.
 
-        # Disable Clear and Checkout buttons if the cart list is empty
+        It updates the total price and disables buttons if the cart becomes empty.
+        """
+        for item in self.cart_list.selectedItems():
+            row = self.cart_list.row(item)
+            item_text = item.text()
+
+            # Use regex to extract name and quantity from the item text
+            match = re.match(r"^(.*?): (\d+) x \$.+ = \$(\d+\.\d{2})$", item_text)
+            if match:
+                name = match.group(1)
+                quantity = int(match.group(2))
+
+                # Remove item from self.cart
+                if (name, quantity) in self.cart:
+                    self.cart.remove((name, quantity))
+                    release_reservations(self.cart_id, [name])
+                    update_stock(self.item_table, name, quantity)
+                    self.pricer.set_line(name, 0, 0.0)
+                    self.show_total()
+
+            # Remove item from cart list
+            self.cart_list.takeItem(row)
+
+        self.cart_list.clearSelection()  # Unselect all items in the cart list
+
+        # Disable Clear, Park and Checkout buttons if the cart list is empty
         if len(self.cart_list) == 0:
             self.clear_button.setEnabled(False)
+            self.park_button.setEnabled(False)
             self.checkout_button.setEnabled(False)
 
+    def clear_cart(self):
+        """
+        Clears the entire cart, releasing the reservations of its items.
+
+        It resets the total price and disables the buttons that need items in the cart.
+        """
+        if self.cart:
+            release_reservations(self.cart_id)
+        for name, quantity in self.cart:
+            update_stock(self.item_table, name, quantity)
+        self.pricer.clear()
+        self.cart.clear()
+        self.cart_list.clear()
+        self.show_total()
+
+        # Clear table selection
+        self.item_table.clearSelection()
+
+        self.clear_button.setEnabled(False)
+        self.park_button.setEnabled(False)
+        self.checkout_button.setEnabled(False)
+
+    def new_cart(self):
+        """
+        Starts a new empty cart with a new identifier, once the current one is parked or sold.
+
+        The items of the previous cart aren't released, they are held by the parked cart or were sold.
+        """
+        self.cart_id = uuid.uuid4().hex
+        self.pricer.clear()
+        self.cart = []
+        self.cart_list.clear()
+        self.show_total()
+        self.received_amount_input.clear()
+        self.clear_button.setEnabled(False)
+        self.park_button.setEnabled(False)
+        self.checkout_button.setEnabled(False)
+
+    def refresh_parked(self):
+        """
+        Lists the carts parked at this till's location, enabling the "Resume" button if there are any.
+        """
+        self.parked_input.clear()
+        for cart_id, parked_at, count, total in get_parked_carts():
+            self.parked_input.addItem(f"{parked_at:%H:%M} - {count} items - ${total:.2f}", cart_id)
+        self.resume_button.setEnabled(self.parked_input.count() > 0)
+
+    def park(self) -> bool:
+        """
+        Parks the current cart and starts a new one, so the next customer can be served.
+
+        The items of the parked cart stay reserved, so the available stock shown doesn't change.
+
+        Returns
+        -------
+        bool
+            True if the cart was parked.
+        """
+        if not self.cart:
+            return False
+        try:
+            park_cart(self.cart_id, self.cart, self.pricer.total)
+        except OperationalError:
+            QMessageBox.warning(self, "Database Busy", "The database is busy. Please try again.")
+            return False
+
+        # Start a new cart, the parked one keeps its identifier
+        self.new_cart()
+        self.refresh_parked()
+        return True
+
+    def resume(self):
+        """
+        Resumes the parked cart selected, parking the current cart first if it has items.
+
+        The stock of the resumed items is checked again, and the items sold out
+        meanwhile are reduced or removed, with a warning.
+        """
+        cart_id = self.parked_input.currentData()
+        if cart_id is None or (self.cart and not self.park()):
+            return
+        try:
+            lines, short = resume_cart(cart_id)
+        except KeyError:
+            # Resumed meanwhile from another window of the same till
+            self.refresh_parked()
+            return
+        except OperationalError:
+            QMessageBox.warning(self, "Database Busy", "The database is busy. Please try again.")
+            return
+
+        self.cart_id = cart_id
+        self.cart = [(name, quantity) for name, _, quantity in lines]
+        self.pricer.clear()
+        self.cart_list.clear()
+        for name, price, quantity in lines:
+            self.pricer.add(name, quantity, price)
+            self.cart_list.addItem(f"{name}: {quantity} x ${price:.2f} = ${price * quantity:.2f}")
+        self.show_total()
+        self.clear_button.setEnabled(bool(self.cart))
+        self.park_button.setEnabled(bool(self.cart))
+        self.checkout_button.setEnabled(bool(self.cart))
+
+        populate_table(self.item_table, show_available=True)
+        filter_search(self.filter_search, self.item_table)
+        self.refresh_parked()
+        if short:
+            QMessageBox.warning(
+                self, "Invalid Quantity",
+                f"Not enough stock left for: {', '.join(short)}.\nTheir quantity was reduced or they were removed from the cart."
+            )
+
     def checkout(self):
         """
         Completes the transaction, updates the stock, and resets the cart.
@@ -290,6 +527,7 @@ class POSTab(QWidget):
         ------
         QMessageBox
             If the received amount is invalid or insufficient.
+            If some items sold out on another till, their prices changed, or the database stays busy.
             After a succesful transaction, display the change to return.
         """
         amount_received = self.received_amount_input.text()
@@ -306,23 +544,44 @@ class POSTab(QWidget):
         # Calculate the change to return
         change = amount_received - self.total_price
         
-        # Save the transaction
-        items = save_transaction(self.total_price, amount_received, change, self.cart)
-        
-        # Update the stock
-        discount_stock(items)
-        
-        # Clear the cart and reset the total price
-        self.clear_cart()
-
-        # Clear the received amount input field
-        self.received_amount_input.clear()
+        # Save the transaction and update the stock
+        try:
+            save_transaction(self.total_price, amount_received, change, self.cart, self.cart_id)
+        except InsufficientStockError as error:
+            QMessageBox.warning(
+                self, "Invalid Quantity",
+                f"Not enough stock for: {', '.join(error.items)}.\nPlease remove them from the cart or change their quantity."
+            )
+            populate_table(self.item_table, show_available=True)
+            return
+        except PriceChangedError as error:
+            # Show the cart at the current prices, so the customer pays the total that is saved
+            self.pricer.clear()
+            self.cart_list.clear()
+            for name, quantity in self.cart:
+                price = error.prices[name]
+                self.pricer.add(name, quantity, price)
+                self.cart_list.addItem(f"{name}: {quantity} x ${price:.2f} = ${price * quantity:.2f}")
+            self.show_total()
+            self.received_amount_input.clear()
+            QMessageBox.warning(
+                self, "Prices Changed",
+                f"The prices or promotions changed meanwhile.\nThe new total is ${error.total:.2f}, please enter the amount received again."
+            )
+            return
+        except OperationalError:
+            QMessageBox.warning(self, "Database Busy", "The database is busy. Please try again.")
+            return
 
-        # Reset the total price label
-        self.total_label.setText("Total: $0.00")
+        # Start a new cart, the reservations of the sold one were turned into the sale
+        sold = [name for name, _ in self.cart]
+        self.new_cart()
+        self.item_table.clearSelection()
 
-        # Refresh the item table to reflect the changes
-        populate_table(self.item_table)        
+        # Refresh the rows of the items sold and the low stock badge to reflect the changes,
+        # the whole table is reloaded when the tab is shown again
+        refresh_rows(self.item_table, sold, show_available=True)
+        self.low_stock_badge.refresh()
         
         QMessageBox.information(self, "Success", f"Transaction successful!\nChange to return: ${change:.2f}")
 
@@ -330,8 +589,10 @@ class POSTab(QWidget):
         """
         It refreshes the table, clears the item table selection, input fields, and disable some buttons.
         """
-        # Refresh the item table to reflect the changes
-        populate_table(self.item_table)
+        # Refresh the item table and the low stock badge to reflect the changes
+        populate_table(self.item_table, show_available=True)
+        self.low_stock_badge.refresh()
+        refresh_quick_keys_async()
 
         # Deselect all rows in the table
         self.item_table.clearSelection()
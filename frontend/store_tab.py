@@ -1,10 +1,11 @@
 from PyQt6.QtWidgets import (
-    QMainWindow, QWidget, QTableWidget, QVBoxLayout, QGridLayout, QLabel, QLineEdit, 
-    QPushButton, QSpinBox, QMessageBox, QSpacerItem, QSizePolicy
+    QMainWindow, QWidget, QTableWidget, QVBoxLayout, QHBoxLayout, QGridLayout, QLabel, QLineEdit, 
+    QPushButton, QSpinBox, QMessageBox, QListWidget
 )
 from PyQt6.QtCore import Qt, QSize
 from PyQt6.QtGui import QDoubleValidator, QIcon, QKeyEvent
-from .utils import display_table, populate_table, filter_search, item_selected
+from .utils import display_table, populate_table, filter_search, item_selected, spacer
+from .low_stock import LowStockBadge
 from backend.services import save_item, remove_item_by_name
 from backend.path import get_resource_path
 import os
@@ -31,9 +32,6 @@ class StoreTab(QWidget):
 
         self.v_layout = QVBoxLayout(self)
 
-        # Empty widget to fill the space
-        self.spacer = QSpacerItem(40, 20, QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Minimum)
-
         # Store Filter Search Box and Item Table display
         self.filter_search, self.item_table = display_table(self)
 
@@ -46,10 +44,22 @@ class StoreTab(QWidget):
         # Populate items
         populate_table(self.item_table)
 
+        # Items low on stock, listed next to the table
+        self.low_stock_layout = QVBoxLayout()
+        self.low_stock_list = QListWidget(self)
+        self.low_stock_list.setMaximumWidth(300)
+        self.low_stock_badge = LowStockBadge(self, self.low_stock_list)
+        self.low_stock_layout.addWidget(self.low_stock_badge)
+        self.low_stock_layout.addWidget(self.low_stock_list)
+
+        self.table_layout = QHBoxLayout()
+        self.table_layout.addWidget(self.item_table)
+        self.table_layout.addLayout(self.low_stock_layout)
+
         # Add to layout
         self.v_layout.addWidget(self.filter_search)
-        self.v_layout.addWidget(self.item_table)
-        self.v_layout.addItem(self.spacer)
+        self.v_layout.addLayout(self.table_layout)
+        self.v_layout.addItem(spacer())
 
         # Horizontal Layout as container
         self.grid_layout = QGridLayout()
@@ -72,6 +82,15 @@ class StoreTab(QWidget):
         self.grid_layout.addWidget(self.item_price_label, 0, 1)
         self.grid_layout.addWidget(self.item_price_input, 1, 1)
 
+        # Item Cost, optional, used to report margins
+        self.item_cost_label = QLabel("Item Cost:")
+        self.item_cost_input = QLineEdit()
+        self.item_cost_input.setPlaceholderText("Optional")
+        self.item_cost_input.setValidator(price_validator)
+        self.item_cost_input.textChanged.connect(self.is_edited)
+        self.grid_layout.addWidget(self.item_cost_label, 0, 2)
+        self.grid_layout.addWidget(self.item_cost_input, 1, 2)
+
         # Item Stock
         self.item_stock_label = QLabel("Item Stock:")
         self.item_stock_input = QSpinBox()
@@ -79,8 +98,18 @@ class StoreTab(QWidget):
         self.item_stock_input.setMinimum(0)
         self.item_stock_input.setMaximum(1000000)
         self.item_stock_input.textChanged.connect(self.is_edited)
-        self.grid_layout.addWidget(self.item_stock_label, 0, 2)
-        self.grid_layout.addWidget(self.item_stock_input, 1, 2)
+        self.grid_layout.addWidget(self.item_stock_label, 0, 3)
+        self.grid_layout.addWidget(self.item_stock_input, 1, 3)
+
+        # Item Reorder Threshold
+        self.item_threshold_label = QLabel("Reorder At:")
+        self.item_threshold_input = QSpinBox()
+        # Stock at or below which the item is flagged as low on stock
+        self.item_threshold_input.setMinimum(0)
+        self.item_threshold_input.setMaximum(1000000)
+        self.item_threshold_input.textChanged.connect(self.is_edited)
+        self.grid_layout.addWidget(self.item_threshold_label, 0, 4)
+        self.grid_layout.addWidget(self.item_threshold_input, 1, 4)
 
         # Remove Item Button
         self.remove_item_button = QPushButton("  Remove Item")
@@ -90,7 +119,7 @@ class StoreTab(QWidget):
         self.remove_item_button.setIconSize(QSize(20, 20))
         self.remove_item_button.clicked.connect(self.delete_item)
         self.remove_item_button.setEnabled(False)  # Initially disable the button
-        self.grid_layout.addWidget(self.remove_item_button, 0, 3)
+        self.grid_layout.addWidget(self.remove_item_button, 0, 5)
 
         # Edit field button
         self.edit_item_button = QPushButton("  Edit/Add Item")
@@ -100,19 +129,19 @@ class StoreTab(QWidget):
         self.edit_item_button.setIconSize(QSize(20, 20))
         self.edit_item_button.clicked.connect(self.edit_add_item)
         self.edit_item_button.setEnabled(False)  # Initially disable the button
-        self.grid_layout.addWidget(self.edit_item_button, 1, 3)
+        self.grid_layout.addWidget(self.edit_item_button, 1, 5)
 
         self.v_layout.addLayout(self.grid_layout)
-        self.v_layout.addItem(self.spacer)
+        self.v_layout.addItem(spacer())
 
-        self.name, self.price, self.stock = None, None, None
+        self.name, self.price, self.stock, self.threshold, self.cost = None, None, None, None, None
 
     def selection(self, item_table: QTableWidget):
         """
         Handles item selection from the table and updates the input fields accordingly.
 
         When a row is selected in the item table, this method retrieves the item's
-        name, price, and stock and populates the respective input fields. It also
+        name, price, cost, stock and reorder threshold and populates the respective input fields. It also
         enables the 'Remove Item' button and disables the 'Edit/Add Item' button until
         an edit is detected.
 
@@ -123,10 +152,17 @@ class StoreTab(QWidget):
         """
         self.name, self.price, self.stock = item_selected(item_table)
         if self.name:
+            # The cost and the reorder threshold are stored in the price and stock cells
+            row = item_table.selectionModel().selectedRows()[0].row()
+            cost = item_table.item(row, 1).data(Qt.ItemDataRole.UserRole)
+            self.cost = str(cost) if cost is not None else ""
+            self.threshold = item_table.item(row, 2).data(Qt.ItemDataRole.UserRole)
             self.item_name_input.setText(self.name)
             self.item_name_input.setEnabled(False)
             self.item_price_input.setText(str(self.price))
+            self.item_cost_input.setText(self.cost)
             self.item_stock_input.setValue(self.stock)
+            self.item_threshold_input.setValue(self.threshold)
         self.remove_item_button.setEnabled(True)
         self.edit_item_button.setEnabled(False)
 
@@ -135,25 +171,29 @@ class StoreTab(QWidget):
         Monitors the input fields for any changes and enables the 'Edit/Add Item' button.
 
         This method checks if the current values in the input fields differ from the
-        originally selected item's values (name, price, stock). It also validates
-        the price input to ensure it contains a valid floating-point number.
+        originally selected item's values (name, price, cost, stock, reorder threshold). It also validates
+        the price and cost inputs to ensure they contain valid floating-point numbers.
 
         If changes are detected and the input is valid, the 'Edit/Add Item' button
         is enabled; otherwise, it remains disabled.
         """
         name, price, stock = self.item_name_input.text(), self.item_price_input.text(), self.item_stock_input.value()
+        threshold, cost = self.item_threshold_input.value(), self.item_cost_input.text()
 
         # Verify if there is selection and edition
         if self.name and self.price and self.stock:            
-            if self.name != name or price != self.price or self.stock != stock:
+            if (self.name != name or price != self.price or self.stock != stock
+                    or self.threshold != threshold or self.cost != cost):
                 self.edit_item_button.setEnabled(True)
 
         # Normalize the input: replace comma with dot
         normalized_price = price.replace(',', '.')        
         # Temporarily set the normalized text to the input field to perform validation
         self.item_price_input.setText(normalized_price)
+        self.item_cost_input.setText(cost.replace(',', '.'))
 
-        if name and self.item_price_input.hasAcceptableInput():
+        cost_valid = not cost or self.item_cost_input.hasAcceptableInput()
+        if name and self.item_price_input.hasAcceptableInput() and cost_valid:
             self.edit_item_button.setEnabled(True)
         else:
             self.edit_item_button.setEnabled(False)
@@ -187,7 +227,7 @@ class StoreTab(QWidget):
         """
         Adds or edits an item in the store inventory.
 
-        This method saves the current values from the input fields (name, price, stock)
+        This method saves the current values from the input fields (name, price, cost, stock, reorder threshold)
         to the database. If the item already exists, it is updated; otherwise, a new
         entry is created. Upon successful save, a message box confirms the action, the
         item table is refreshed, and the input fields are cleared.
@@ -198,9 +238,10 @@ class StoreTab(QWidget):
             Displays a confirmation message after the item is successfully added or edited.
         """
         name, price, stock = self.item_name_input.text(), self.item_price_input.text(), self.item_stock_input.value()
+        threshold, cost = self.item_threshold_input.value(), self.item_cost_input.text()
         
         # Update item in the database
-        save_item(name, price, stock)  # Assuming save_item can handle updates
+        save_item(name, price, stock, threshold, float(cost) if cost else None)  # Assuming save_item can handle updates
 
         QMessageBox.information(self, "Success", "Item updated successfully!")
 
@@ -211,8 +252,9 @@ class StoreTab(QWidget):
         """
         It refreshes the table, clears the item table selection, input fields, and disable some buttons.
         """
-        # Refresh the item table to reflect the changes
+        # Refresh the item table and the low stock items to reflect the changes
         populate_table(self.item_table)
+        self.low_stock_badge.refresh()
 
         # Deselect all rows in the table
         self.item_table.clearSelection()
@@ -221,7 +263,9 @@ class StoreTab(QWidget):
         self.filter_search.clear()
         self.item_name_input.clear()
         self.item_price_input.clear()
+        self.item_cost_input.clear()
         self.item_stock_input.setValue(0)
+        self.item_threshold_input.setValue(0)
         
         # Enable input name
         self.item_name_input.setEnabled(True)
@@ -1,13 +1,30 @@
-from PyQt6.QtWidgets import QWidget, QLineEdit, QTableWidget, QTableWidgetItem, QPushButton, QHeaderView
+from PyQt6.QtWidgets import QWidget, QLineEdit, QTableWidget, QTableWidgetItem, QPushButton, QHeaderView, QSpacerItem, QSizePolicy
 from PyQt6.QtCore import Qt
-from backend.services import get_items
+from PyQt6.QtGui import QColor
+from backend.services import get_items, get_item
+
+def spacer() -> QSpacerItem:
+    """
+    Creates a spacer item that expands horizontally, to add empty space in a layout.
+
+    A layout owns the items added to it and deletes them with itself, so each
+    layout needs spacers of its own. A spacer shared by several layouts is
+    deleted more than once, which crashes the application when the window is closed.
+
+    Returns
+    -------
+    QSpacerItem
+        A new spacer item.
+    """
+    return QSpacerItem(40, 20, QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Minimum)
 
 def display_table(parent: QWidget):
     """
     Creates a search input and item table for displaying store items.
 
     This function sets up a QLineEdit widget for filtering items and a QTableWidget
-    for displaying store items with three columns: Item, Price, and Stock. The table
+    for displaying store items with four columns: Item, Price, Stock, the stock at the till's
+    location, and Total, the stock at all the locations. The table
     is sortable, supports single-row selection, and automatically resizes columns
     to fit the content. An event filter is installed to handle scroll events within
     the table's viewport.
@@ -26,8 +43,8 @@ def display_table(parent: QWidget):
     filter_search.setPlaceholderText("Search for a item...")
 
     item_table = QTableWidget(parent)
-    item_table.setColumnCount(3)
-    item_table.setHorizontalHeaderLabels(["Item", "Price", "Stock"])
+    item_table.setColumnCount(4)
+    item_table.setHorizontalHeaderLabels(["Item", "Price", "Stock", "Total"])
     item_table.verticalHeader().setVisible(False)
     item_table.horizontalHeader().setStretchLastSection(True)
     item_table.setSortingEnabled(True)
@@ -45,12 +62,13 @@ def display_table(parent: QWidget):
 
     return filter_search, item_table
 
-def populate_table(item_table: QTableWidget):
+def populate_table(item_table: QTableWidget, show_available: bool = False):
     """
     Populates the item table with store data.
 
     This function retrieves the store's item data and adds it to the item table.
-    Each row contains the item's name, price, and stock. 
+    Each row contains the item's name, price, stock at the till's location and total stock, and the price and stock
+    cells hold the cost and the reorder threshold as user data. Items low on stock are highlighted.
     The table is cleared before inserting new rows, and items are marked
     as selectable but not editable.
 
@@ -58,24 +76,95 @@ def populate_table(item_table: QTableWidget):
     ----------
     item_table : QTableWidget
         The table widget where the items will be displayed.
+    show_available : bool, optional
+        Whether to show the available stock, without the quantities reserved
+        by open carts, instead of the stock. Defaults to False.
     """
     data = get_items()
     item_table.setRowCount(0)
-    for row, (store, item) in enumerate(data):
+    for row, (name, price, cost, stock, reorder_threshold, available, total_stock) in enumerate(data):
         item_table.insertRow(row)
-        name_item = QTableWidgetItem(item.name)
+        name_item = QTableWidgetItem(name)
         price_item = QTableWidgetItem()
         stock_item = QTableWidgetItem()
-        price_item.setData(Qt.ItemDataRole.DisplayRole, round(item.price, 2))
-        stock_item.setData(Qt.ItemDataRole.DisplayRole, store.stock)
+        total_item = QTableWidgetItem()
+        price_item.setData(Qt.ItemDataRole.DisplayRole, round(price, 2))
+        stock_item.setData(Qt.ItemDataRole.DisplayRole, available if show_available else stock)
+        total_item.setData(Qt.ItemDataRole.DisplayRole, total_stock)
+        price_item.setData(Qt.ItemDataRole.UserRole, cost)
+        stock_item.setData(Qt.ItemDataRole.UserRole, reorder_threshold)
+        if stock <= reorder_threshold:
+            # Flag the items low on stock
+            stock_item.setForeground(QColor("#d1775c"))
 
         name_item.setFlags(Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable)
         price_item.setFlags(Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable)
         stock_item.setFlags(Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable)
+        total_item.setFlags(Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable)
 
         item_table.setItem(row, 0, name_item)
         item_table.setItem(row, 1, price_item)
         item_table.setItem(row, 2, stock_item)
+        item_table.setItem(row, 3, total_item)
+
+def update_stock(item_table: QTableWidget, name: str, delta: int) -> int | None:
+    """
+    Adds a quantity to the stock shown for an item, without reloading the table.
+
+    The row is found by Qt's own search, so it stays quick on large catalogs.
+
+    Parameters
+    ----------
+    item_table : QTableWidget
+        The table widget containing the item data.
+    name : str
+        The name of the item.
+    delta : int
+        The quantity to add, negative to subtract it.
+
+    Returns
+    -------
+    int or None
+        The stock shown after the change, None if the item isn't in the table.
+    """
+    for name_item in item_table.findItems(name, Qt.MatchFlag.MatchExactly):
+        if name_item.column() == 0:
+            stock_item = item_table.item(name_item.row(), 2)
+            stock = int(stock_item.text()) + delta
+            stock_item.setData(Qt.ItemDataRole.DisplayRole, stock)
+            return stock
+    return None
+
+def refresh_rows(item_table: QTableWidget, names: list[str], show_available: bool = False):
+    """
+    Reloads the stock shown for some items, e.g. those just sold, without reloading the table.
+
+    Only the rows of the items are read from the database, so it stays quick on large catalogs.
+    Items no longer in the database keep their row until the table is reloaded.
+
+    Parameters
+    ----------
+    item_table : QTableWidget
+        The table widget containing the item data.
+    names : list of str
+        The names of the items.
+    show_available : bool, optional
+        Whether to show the available stock, as `populate_table`. Defaults to False.
+    """
+    for name in names:
+        data = get_item(name)
+        if data is None:
+            continue
+        _, _, _, stock, reorder_threshold, available, total_stock = data
+        for name_item in item_table.findItems(name, Qt.MatchFlag.MatchExactly):
+            if name_item.column() == 0:
+                row = name_item.row()
+                stock_item = item_table.item(row, 2)
+                stock_item.setData(Qt.ItemDataRole.DisplayRole, available if show_available else stock)
+                stock_item.setData(Qt.ItemDataRole.UserRole, reorder_threshold)
+                stock_item.setForeground(QColor("#d1775c") if stock <= reorder_threshold else item_table.palette().text())
+                item_table.item(row, 3).setData(Qt.ItemDataRole.DisplayRole, total_stock)
+                break
 
 def filter_search(input: QLineEdit, table: QTableWidget):
     """
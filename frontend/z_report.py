@@ -0,0 +1,102 @@
+from PyQt6.QtWidgets import (
+    QWidget, QDialog, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QDateEdit, QPlainTextEdit, QFileDialog, QMessageBox
+)
+from PyQt6.QtCore import QDate
+from PyQt6.QtGui import QFontDatabase
+from backend.zreport import get_z_report, close_day, format_z_report, export_z_report
+from datetime import date
+
+
+class ZReportDialog(QDialog):
+    """
+    A dialog showing the end-of-day report of a day, to close the day and export its report.
+    """
+    def __init__(self, parent: QWidget = None):
+        """
+        Initializes the dialog and shows the report of today.
+
+        Parameters
+        ----------
+        parent : QWidget, optional
+            The parent widget of the dialog. Defaults to None.
+        """
+        super().__init__(parent)
+        self.setWindowTitle("Z Report")
+        self.resize(460, 600)
+        self.report = None
+
+        self.v_layout = QVBoxLayout(self)
+
+        self.day_layout = QHBoxLayout()
+        self.day_layout.addWidget(QLabel("Day:"))
+        self.day_input = QDateEdit(QDate.currentDate())
+        self.day_input.setCalendarPopup(True)
+        self.day_input.setMaximumDate(QDate.currentDate())
+        self.day_input.dateChanged.connect(self.refresh)
+        self.day_layout.addWidget(self.day_input)
+        self.day_layout.addStretch()
+        self.v_layout.addLayout(self.day_layout)
+
+        # The report is laid out in columns, so it is shown in a fixed width font
+        self.report_view = QPlainTextEdit(self)
+        self.report_view.setReadOnly(True)
+        self.report_view.setFont(QFontDatabase.systemFont(QFontDatabase.SystemFont.FixedFont))
+        self.v_layout.addWidget(self.report_view)
+
+        self.button_layout = QHBoxLayout()
+        self.button_layout.addStretch()
+        self.close_day_button = QPushButton("Close Day")
+        self.close_day_button.setObjectName("closeDayButton")
+        self.close_day_button.clicked.connect(self.close_day)
+        self.button_layout.addWidget(self.close_day_button)
+        self.export_button = QPushButton("Export")
+        self.export_button.setObjectName("exportButton")
+        self.export_button.clicked.connect(self.export)
+        self.button_layout.addWidget(self.export_button)
+        self.v_layout.addLayout(self.button_layout)
+
+        self.refresh()
+
+    def refresh(self):
+        """
+        Shows the report of the selected day, saved if the day is closed and computed otherwise.
+        """
+        self.report = get_z_report(self.day_input.date().toPyDate())
+        self.report_view.setPlainText(format_z_report(self.report))
+        self.close_day_button.setEnabled(self.report['closed_at'] is None)
+
+    def close_day(self):
+        """
+        Asks for confirmation and closes the selected day, saving its report.
+
+        Raises
+        ------
+        QMessageBox
+            After closing, display the number of transactions and the total sales of the day.
+        """
+        day = self.day_input.date().toPyDate()
+        if day == date.today():
+            answer = QMessageBox.question(
+                self, "Close Day", "Sales made after closing the day won't be included in its report. Close the day?"
+            )
+            if answer != QMessageBox.StandardButton.Yes:
+                return
+
+        self.report = close_day(day)
+        self.refresh()
+        QMessageBox.information(
+            self, "Success",
+            f"{day.isoformat()} closed: {self.report['transactions']} transactions, ${self.report['total_sales']:,.2f}."
+        )
+
+    def export(self):
+        """
+        Asks for a file and exports the report to it, as text or PDF.
+        """
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Export Z Report", f"z_report_{self.report['date']}.pdf", "PDF (*.pdf);;Text (*.txt)"
+        )
+        if not path:
+            return
+        export_z_report(self.report, path)
+        QMessageBox.information(self, "Success", f"Report exported to {path}.")
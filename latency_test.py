@@ -0,0 +1,353 @@
+"""
+POS System Checkout Latency Test
+
+Author: Alejandro Vargas
+Github: https://github.com/sagravela
+
+This script checks that a long report doesn't slow down the checkout. On a database
+of its own, filled with a sales history, it times a series of checkouts while nothing
+else runs, and then the same series while another process runs a long report on the
+reporting snapshot, holding its read transaction open for seconds at a time. The checkouts keep
+refreshing the snapshot every "snapshot_sales" sales, as they do on a till.
+
+It then times them while another till sells in a process of its own, first alone and
+then with the snapshot refreshed every second meanwhile, so the refreshes are copying
+the database while both tills write to it.
+
+The checkout latency with the report running must stay close to the idle one, and with
+the refreshes running close to the one with the other till alone. With `--live` the
+report is also run on the live database, as it was before the snapshot, to show what
+it protects from. The exit code is 1 if the latency grew over the thresholds.
+
+Examples
+--------
+    python latency_test.py
+    python latency_test.py --lines 1000000 --seconds 30 --live
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+# Query of the long report, the sales of each item by day
+REPORT = """
+    SELECT t.day_key, i.item_id, SUM(i.quantity), SUM(i.line_total)
+    FROM transaction_items AS i JOIN transactions AS t ON t.id = i.transaction_id
+    GROUP BY t.day_key, i.item_id
+"""
+
+def seed_history(path: str, items: list[tuple[int, float]], lines: int, rng: random.Random):
+    """
+    Adds a history of sales of some items over the last three years, three lines per sale.
+
+    Parameters
+    ----------
+    path : str
+        The path of the database.
+    items : list of tuple of (int, float)
+        The identifier and price of each item sold.
+    lines : int
+        The number of lines of the history.
+    rng : random.Random
+        The random generator of the quantities and times.
+    """
+    connection = sqlite3.connect(path)
+    start = datetime.now() - timedelta(days=3 * 365)
+    count = lines // 3
+
+    def transactions():
+        for number in range(1, count + 1):
+            timestamp = start + timedelta(seconds=rng.randrange(3 * 365 * 24 * 3600))
+            yield number, timestamp.strftime("%Y-%m-%d %H:%M:%S.%f"), int(timestamp.strftime("%Y%m%d"))
+
+    def transaction_items():
+        for number in range(1, count + 1):
+            for _ in range(3):
+                item_id, price = rng.choice(items)
+                quantity = rng.randint(1, 5)
+                yield number, item_id, quantity, price, round(price * quantity, 2)
+
+    connection.executemany(
+        "INSERT INTO transactions (id, total_amount, payment_received, change_returned, timestamp, day_key, discount) "
+        "VALUES (?, 0, 0, 0, ?, ?, 0)", transactions()
+    )
+    connection.executemany(
+        "INSERT INTO transaction_items (transaction_id, item_id, quantity, unit_price, line_total, discount) "
+        "VALUES (?, ?, ?, ?, ?, 0)", transaction_items()
+    )
+    connection.execute(
+        "UPDATE transactions SET total_amount = (SELECT SUM(line_total) FROM transaction_items WHERE transaction_id = transactions.id)"
+    )
+    connection.commit()
+    connection.close()
+
+def long_report(path: str, hold: float, ready, stop) -> int:
+    """
+    Runs the report over and over until told to stop, in read transactions held open for some seconds each.
+
+    Parameters
+    ----------
+    path : str
+        The path of the database the report reads.
+    hold : float
+        The seconds each read transaction is held open.
+    ready : multiprocessing.Event
+        Set once the read transaction is open.
+    stop : multiprocessing.Event
+        Set when the report should end.
+
+    Returns
+    -------
+    int
+        The number of times the report ran.
+    """
+    connection = sqlite3.connect(path, isolation_level=None)
+    runs = 0
+    while not stop.is_set():
+        started = time.perf_counter()
+        connection.execute("BEGIN")
+        connection.execute("SELECT COUNT(*) FROM transactions").fetchone()
+        ready.set()
+        while not stop.is_set() and time.perf_counter() - started < hold:
+            connection.execute(REPORT).fetchall()
+            runs += 1
+        connection.execute("COMMIT")
+    connection.close()
+    return runs
+
+def time_checkouts(items: list[tuple[str, float]], seconds: float, interval: float, rng: random.Random) -> list[float]:
+    """
+    Checks out small carts one after another for some seconds, timing each one.
+
+    Parameters
+    ----------
+    items : list of tuple of (str, float)
+        The name and price of each item sold.
+    seconds : float
+        The seconds to keep checking out, the last checkout may end later.
+    interval : float
+        The seconds to wait between checkouts.
+    rng : random.Random
+        The random generator of the carts.
+
+    Returns
+    -------
+    list of float
+        The seconds each checkout took.
+    """
+    from backend.services import save_transaction
+
+    prices = dict(items)
+    latencies = []
+    end = time.perf_counter() + seconds
+    while not latencies or time.perf_counter() < end:
+        cart = [(name, rng.randint(1, 3)) for name, _ in rng.sample(items, 3)]
+        total = round(sum(prices[name] * quantity for name, quantity in cart), 2)
+        started = time.perf_counter()
+        save_transaction(total, total, 0.0, cart)
+        latencies.append(time.perf_counter() - started)
+        time.sleep(interval)
+    return latencies
+
+def other_till(items: list[tuple[str, float]], seconds: float, interval: float, seed: int, ready) -> int:
+    """
+    Checks out small carts for some seconds from another process, as a second till would.
+
+    Returns
+    -------
+    int
+        The number of checkouts made.
+    """
+    ready.set()
+    return len(time_checkouts(items, seconds, interval, random.Random(seed)))
+
+def refresh_loop(interval: float, stop: threading.Event, counts: list[int]):
+    """
+    Refreshes the reporting snapshot every some seconds until told to stop, counting the refreshes
+    copied and those given up because the database kept changing.
+    """
+    from backend.snapshot import refresh_snapshot
+
+    while not stop.is_set():
+        counts[0 if refresh_snapshot() else 1] += 1
+        stop.wait(interval)
+
+def summarize(latencies: list[float]) -> dict:
+    """
+    Returns the median, 95th percentile and maximum of some latencies, in milliseconds.
+    """
+    ordered = sorted(latencies)
+    return {
+        'median': ordered[len(ordered) // 2] * 1000,
+        'p95': ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)] * 1000,
+        'max': ordered[-1] * 1000,
+    }
+
+def with_report(path: str, items: list[tuple[str, float]], args: argparse.Namespace, rng: random.Random) -> tuple[dict, int]:
+    """
+    Times the checkouts while a process runs the long report on a database.
+
+    Returns
+    -------
+    tuple of (dict, int)
+        The summary of the latencies and the number of times the report ran meanwhile.
+    """
+    context = multiprocessing.get_context("spawn")
+    manager = context.Manager()
+    ready, stop = manager.Event(), manager.Event()
+    with context.Pool(1) as pool:
+        report = pool.apply_async(long_report, (path, args.hold, ready, stop))
+        ready.wait()
+        latencies = time_checkouts(items, args.seconds, args.interval, rng)
+        stop.set()
+        runs = report.get()
+    return summarize(latencies), runs
+
+def with_other_till(items: list[tuple[str, float]], args: argparse.Namespace, rng: random.Random, refresh: bool) -> tuple[dict, list[int]]:
+    """
+    Times the checkouts while another till sells, and optionally while the snapshot is refreshed meanwhile.
+
+    Returns
+    -------
+    tuple of (dict, list of int)
+        The summary of the latencies, and the number of refreshes copied and given up.
+    """
+    context = multiprocessing.get_context("spawn")
+    ready = context.Manager().Event()
+    counts = [0, 0]
+    with context.Pool(1) as pool:
+        till = pool.apply_async(other_till, (items, args.seconds + 1, args.till_interval, args.seed + 1, ready))
+        ready.wait()
+        stop = threading.Event()
+        refresher = threading.Thread(target=refresh_loop, args=(args.refresh_interval, stop, counts), daemon=True)
+        if refresh:
+            refresher.start()
+        latencies = time_checkouts(items, args.seconds, args.till_interval, rng)
+        stop.set()
+        if refresh:
+            refresher.join()
+        till.get()
+    return summarize(latencies), counts
+
+def run(args: argparse.Namespace) -> tuple[list[tuple[str, dict, int]], list[tuple[str, bool, str]]]:
+    """
+    Times the checkouts idle and with the long report running, and checks the growth of their latency.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The parsed command line.
+
+    Returns
+    -------
+    tuple of (list, list)
+        The name, latency summary and report runs of each phase, and the name of each check,
+        whether it passed and the values it compared.
+    """
+    from sqlalchemy import select
+    from database.database import create_db, get_session, database_path, reporting_path
+    from database.models import Items
+    from backend.services import save_item
+    from backend.snapshot import refresh_snapshot
+
+    rng = random.Random(args.seed)
+    create_db()
+    for number in range(args.items):
+        save_item(f"Item {number:03d}", round(rng.uniform(0.5, 30), 2), 10 ** 7)
+    with get_session() as session:
+        catalog = session.execute(select(Items.id, Items.name, Items.price)).all()
+    seed_history(database_path, [(item_id, price) for item_id, _, price in catalog], args.lines, rng)
+    refresh_snapshot()
+
+    items = [(name, price) for _, name, price in catalog]
+    # Warm up the connections and caches, so the first phase isn't slower for it
+    time_checkouts(items, 1, 0, rng)
+
+    phases = [("idle", summarize(time_checkouts(items, args.seconds, args.interval, rng)), 0)]
+    phases.append(("report on snapshot", *with_report(reporting_path, items, args, rng)))
+    writing, _ = with_other_till(items, args, rng, refresh=False)
+    refreshing, (copied, given_up) = with_other_till(items, args, rng, refresh=True)
+    phases += [("other till selling", writing, 0), ("refresh while selling", refreshing, copied)]
+    if args.live:
+        phases.append(("report on live database", *with_report(database_path, items, args, rng)))
+
+    idle, snapshot = phases[0][1], phases[1][1]
+    checks = [
+        ("report ran meanwhile", phases[1][2] > 0, f"{phases[1][2]} runs"),
+        (
+            "95th percentile growth", snapshot['p95'] - idle['p95'] <= args.max_p95_growth,
+            f"{snapshot['p95'] - idle['p95']:+.1f} ms (max {args.max_p95_growth} ms)"
+        ),
+        ("maximum latency", snapshot['max'] <= args.max_latency, f"{snapshot['max']:.1f} ms (max {args.max_latency} ms)"),
+        ("refreshes ran meanwhile", copied + given_up > 0, f"{copied} copied, {given_up} given up"),
+        (
+            "95th percentile growth with refreshes", refreshing['p95'] - writing['p95'] <= args.max_p95_growth,
+            f"{refreshing['p95'] - writing['p95']:+.1f} ms (max {args.max_p95_growth} ms)"
+        ),
+        (
+            "maximum latency with refreshes", refreshing['max'] <= args.max_latency,
+            f"{refreshing['max']:.1f} ms (max {args.max_latency} ms)"
+        ),
+    ]
+    return phases, checks
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Builds the parser of the command line.
+
+    Returns
+    -------
+    argparse.ArgumentParser
+        The parser.
+    """
+    parser = argparse.ArgumentParser(description="Check that a long report doesn't slow down the checkout.")
+    parser.add_argument("--lines", type=int, default=300000, help="number of lines of the sales history")
+    parser.add_argument("--items", type=int, default=50, help="number of items of the catalog")
+    parser.add_argument("--seconds", type=float, default=10, help="seconds the checkouts are timed in each phase")
+    parser.add_argument("--interval", type=float, default=0.01, help="seconds between checkouts")
+    parser.add_argument("--till-interval", type=float, default=0.25, help="seconds between the checkouts of each till while two of them sell")
+    parser.add_argument("--refresh-interval", type=float, default=1, help="seconds between the refreshes of the snapshot while both tills sell")
+    parser.add_argument("--hold", type=float, default=3, help="seconds the report holds each read transaction open")
+    parser.add_argument("--max-p95-growth", type=float, default=25, help="maximum growth of the 95th percentile, in ms")
+    parser.add_argument("--max-latency", type=float, default=500, help="maximum latency with the report running, in ms")
+    parser.add_argument("--live", action="store_true", help="also run the report on the live database, for comparison")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the history and the carts")
+    parser.add_argument("--database", help="database file, a new temporary one by default")
+    return parser
+
+def main(argv: list[str] = None):
+    """
+    The entry point of the latency test.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        The command line arguments. Defaults to None, which reads them from `sys.argv`.
+    """
+    args = build_parser().parse_args(argv)
+
+    # Run on a database and settings of its own, before the application reads them
+    directory = tempfile.mkdtemp(prefix="pos_latency_")
+    os.environ["POS_DATABASE"] = args.database or os.path.join(directory, "latency.db")
+    os.environ["POS_CONFIG"] = os.path.join(directory, "config.json")
+
+    phases, checks = run(args)
+    print(f"{'phase':<24} {'median_ms':>10} {'p95_ms':>10} {'max_ms':>10} {'runs':>6}")
+    for name, summary, runs in phases:
+        print(f"{name:<24} {summary['median']:>10.1f} {summary['p95']:>10.1f} {summary['max']:>10.1f} {runs:>6}")
+    print()
+    for name, passed, values in checks:
+        print(f"{name:<38} {'ok' if passed else 'FAILED':<7} {values}")
+    passed = all(passed for _, passed, _ in checks)
+    print("PASSED" if passed else "FAILED")
+    sys.exit(0 if passed else 1)
+
+if __name__ == '__main__':
+    main()
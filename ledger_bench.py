@@ -0,0 +1,246 @@
+"""
+POS System Stock Ledger Benchmark
+
+Author: Alejandro Vargas
+Github: https://github.com/sagravela
+
+This script measures how fast the stock at a past time is rebuilt from the stock
+movement ledger. On a database of its own it generates millions of movements over
+some days, for thousands of items at a few locations, with a checkpoint of the stock
+taken at the end of each day, as the "checkpoint" maintenance task does.
+
+At random times it then rebuilds the stock of all the items, and of a single item,
+with `get_stock_at`, and replays all the movements from the start for comparison.
+The results must be the same as the replay's. The exit code is 1 if any differs, or
+if a median time is over its threshold.
+
+Examples
+--------
+    python ledger_bench.py
+    python ledger_bench.py --movements 5000000 --days 100 --items 10000
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Stock of every item at every location at a time, replaying all the movements until then
+REPLAY = """
+    SELECT items.name, locations.name, SUM(stock_movements.quantity) AS stock
+    FROM stock_movements
+    JOIN items ON items.id = stock_movements.item_id
+    JOIN locations ON locations.id = stock_movements.location_id
+    WHERE stock_movements.created_at <= ? {item}
+    GROUP BY stock_movements.item_id, stock_movements.location_id
+    HAVING stock != 0
+    ORDER BY items.name, locations.name
+"""
+
+def seed_ledger(path: str, args: argparse.Namespace, rng: random.Random) -> datetime:
+    """
+    Adds the items, locations, movements and daily checkpoints of the benchmark.
+
+    The stock starts at 0 and the movements are spread evenly over the days, with
+    mostly sales, and receipts that keep the stock of the items above 0.
+
+    Parameters
+    ----------
+    path : str
+        The path of the database.
+    args : argparse.Namespace
+        The parsed command line.
+    rng : random.Random
+        The random generator of the movements.
+
+    Returns
+    -------
+    datetime
+        The start of the first day.
+    """
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA synchronous = OFF")
+
+    # The opening checkpoint of a new database is taken now, after the generated history
+    connection.execute("DELETE FROM stock_checkpoint_lines")
+    connection.execute("DELETE FROM stock_checkpoints")
+    connection.executemany(
+        "INSERT INTO items (id, name, price) VALUES (?, ?, ?)",
+        [(number, f"Item {number:05d}", round(rng.uniform(0.5, 30), 2)) for number in range(1, args.items + 1)]
+    )
+    existing = connection.execute("SELECT COUNT(*) FROM locations").fetchone()[0]
+    connection.executemany(
+        "INSERT INTO locations (name) VALUES (?)", [(f"Location {number}",) for number in range(existing, args.locations)]
+    )
+    locations = [row[0] for row in connection.execute("SELECT id FROM locations ORDER BY id LIMIT ?", (args.locations,))]
+
+    start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=args.days)
+    connection.execute(
+        "INSERT INTO stock_checkpoints (taken_at, last_movement_id) VALUES (?, 0)",
+        (start.strftime("%Y-%m-%d %H:%M:%S.%f"),)
+    )
+
+    stock = {}
+    per_day = args.movements // args.days
+    movement_id = 0
+    for day in range(args.days):
+        day_start = start + timedelta(days=day)
+        rows = []
+        for number in range(per_day):
+            key = (rng.randint(1, args.items), rng.choice(locations))
+            quantity = -rng.randint(1, 3)
+            if stock.get(key, 0) + quantity < 0:
+                quantity = rng.randint(10, 50)
+            stock[key] = stock.get(key, 0) + quantity
+            movement_id += 1
+            created_at = day_start + timedelta(seconds=number * 86400 / per_day)
+            rows.append((
+                movement_id, key[0], key[1], "sale" if quantity < 0 else "receipt", quantity,
+                created_at.strftime("%Y-%m-%d %H:%M:%S.%f")
+            ))
+        connection.executemany(
+            "INSERT INTO stock_movements (id, item_id, location_id, kind, quantity, created_at) VALUES (?, ?, ?, ?, ?, ?)", rows
+        )
+
+        # Checkpoint at the end of the day, of the stock that isn't 0
+        checkpoint_id = connection.execute(
+            "INSERT INTO stock_checkpoints (taken_at, last_movement_id) VALUES (?, ?)",
+            ((day_start + timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S.%f"), movement_id)
+        ).lastrowid
+        connection.executemany(
+            "INSERT INTO stock_checkpoint_lines (checkpoint_id, item_id, location_id, stock) VALUES (?, ?, ?, ?)",
+            [(checkpoint_id, item_id, location_id, value) for (item_id, location_id), value in stock.items() if value]
+        )
+        connection.commit()
+
+    # The current stock, which the movements add up to
+    connection.executemany(
+        "INSERT INTO store (location_id, item_id, stock, reorder_threshold) VALUES (?, ?, ?, 0)",
+        [(location_id, item_id, value) for (item_id, location_id), value in stock.items()]
+    )
+    connection.commit()
+    connection.execute("ANALYZE")
+    connection.close()
+    return start
+
+def timed(function, *args) -> tuple[float, object]:
+    """
+    Runs a function, returning the seconds it took and its result.
+    """
+    started = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - started, result
+
+def run(args: argparse.Namespace) -> tuple[list[tuple], list[tuple[str, bool, str]]]:
+    """
+    Generates the ledger and times the rebuilds of the stock against a full replay.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The parsed command line.
+
+    Returns
+    -------
+    tuple of (list, list)
+        The name, median milliseconds of `get_stock_at` and of the replay of each query,
+        and the name of each check, whether it passed and the values it compared.
+    """
+    from database.database import create_db, database_path
+    from backend.ledger import get_stock_at
+
+    rng = random.Random(args.seed)
+    create_db()
+    started = time.perf_counter()
+    start = seed_ledger(database_path, args, rng)
+    print(f"{args.movements} movements generated in {time.perf_counter() - started:.1f} s", file=sys.stderr)
+
+    replay = sqlite3.connect(database_path)
+    times = {"all items": ([], []), "one item": ([], [])}
+    mismatches = 0
+    for _ in range(args.samples):
+        when = start + timedelta(seconds=rng.uniform(3600, args.days * 86400))
+        name = f"Item {rng.randint(1, args.items):05d}"
+        stamp = when.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+        seconds, rebuilt = timed(get_stock_at, when)
+        replay_seconds, replayed = timed(lambda: replay.execute(REPLAY.format(item=""), (stamp,)).fetchall())
+        times["all items"][0].append(seconds)
+        times["all items"][1].append(replay_seconds)
+        mismatches += rebuilt != replayed
+
+        seconds, rebuilt = timed(get_stock_at, when, name)
+        replay_seconds, replayed = timed(
+            lambda: replay.execute(REPLAY.format(item="AND items.name = ?"), (stamp, name)).fetchall()
+        )
+        times["one item"][0].append(seconds)
+        times["one item"][1].append(replay_seconds)
+        mismatches += rebuilt != replayed
+    replay.close()
+
+    medians = [
+        (query, statistics.median(rebuilt) * 1000, statistics.median(replayed) * 1000)
+        for query, (rebuilt, replayed) in times.items()
+    ]
+    checks = [
+        ("same stock as the replay", mismatches == 0, f"{mismatches} of {2 * args.samples} differ"),
+        ("all items", medians[0][1] <= args.max_all_ms, f"median {medians[0][1]:.1f} ms (max {args.max_all_ms} ms)"),
+        ("one item", medians[1][1] <= args.max_item_ms, f"median {medians[1][1]:.1f} ms (max {args.max_item_ms} ms)"),
+    ]
+    return medians, checks
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Builds the parser of the command line.
+
+    Returns
+    -------
+    argparse.ArgumentParser
+        The parser.
+    """
+    parser = argparse.ArgumentParser(description="Time the rebuild of past stock from the movement ledger.")
+    parser.add_argument("--movements", type=int, default=2000000, help="number of movements of the ledger")
+    parser.add_argument("--days", type=int, default=100, help="number of days the movements span, one checkpoint each")
+    parser.add_argument("--items", type=int, default=10000, help="number of items")
+    parser.add_argument("--locations", type=int, default=2, help="number of locations")
+    parser.add_argument("--samples", type=int, default=20, help="number of random times the stock is rebuilt at")
+    parser.add_argument("--max-all-ms", type=float, default=1000, help="maximum median time of the stock of all the items, in ms")
+    parser.add_argument("--max-item-ms", type=float, default=50, help="maximum median time of the stock of one item, in ms")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the movements and the times")
+    parser.add_argument("--database", help="database file, a new temporary one by default")
+    return parser
+
+def main(argv: list[str] = None):
+    """
+    The entry point of the ledger benchmark.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        The command line arguments. Defaults to None, which reads them from `sys.argv`.
+    """
+    args = build_parser().parse_args(argv)
+
+    # Run on a database and settings of its own, before the application reads them
+    directory = tempfile.mkdtemp(prefix="pos_ledger_")
+    os.environ["POS_DATABASE"] = args.database or os.path.join(directory, "ledger.db")
+    os.environ["POS_CONFIG"] = os.path.join(directory, "config.json")
+
+    medians, checks = run(args)
+    print(f"{'query':<10} {'get_stock_at_ms':>16} {'replay_ms':>10}")
+    for query, rebuilt, replayed in medians:
+        print(f"{query:<10} {rebuilt:>16.1f} {replayed:>10.1f}")
+    print()
+    for name, passed, values in checks:
+        print(f"{name:<26} {'ok' if passed else 'FAILED':<7} {values}")
+    passed = all(passed for _, passed, _ in checks)
+    print("PASSED" if passed else "FAILED")
+    sys.exit(0 if passed else 1)
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,53 @@
 # -*- mode: python ; coding: utf-8 -*-
 
+# Modules the application never imports, but that the hooks of its dependencies collect:
+# the other GUI toolkits of Matplotlib, the unused Qt modules and the test suites.
+excludes = [
+    'tkinter', '_tkinter', 'IPython', 'jupyter_client', 'ipykernel', 'pytest', 'unittest.mock',
+    'matplotlib.tests', 'matplotlib.testing', 'numpy.tests', 'numpy.testing', 'numpy.f2py',
+    'numpy.distutils', 'sqlalchemy.testing',
+    'matplotlib.backends.backend_tkagg', 'matplotlib.backends.backend_tkcairo',
+    'matplotlib.backends.backend_gtk3agg', 'matplotlib.backends.backend_gtk3cairo',
+    'matplotlib.backends.backend_gtk4agg', 'matplotlib.backends.backend_gtk4cairo',
+    'matplotlib.backends.backend_wxagg', 'matplotlib.backends.backend_wxcairo',
+    'matplotlib.backends.backend_macosx', 'matplotlib.backends.backend_webagg',
+    'matplotlib.backends.backend_nbagg', 'matplotlib.backends.backend_pdf',
+    'matplotlib.backends.backend_pgf', 'matplotlib.backends.backend_ps',
+    'matplotlib.backends.backend_svg', 'matplotlib.backends.backend_cairo',
+    'PyQt6.QtBluetooth', 'PyQt6.QtDBus', 'PyQt6.QtDesigner', 'PyQt6.QtHelp', 'PyQt6.QtMultimedia',
+    'PyQt6.QtMultimediaWidgets', 'PyQt6.QtNetwork', 'PyQt6.QtNfc', 'PyQt6.QtOpenGL',
+    'PyQt6.QtOpenGLWidgets', 'PyQt6.QtPdf', 'PyQt6.QtPdfWidgets', 'PyQt6.QtPositioning',
+    'PyQt6.QtQml', 'PyQt6.QtQuick', 'PyQt6.QtQuick3D', 'PyQt6.QtQuickWidgets',
+    'PyQt6.QtRemoteObjects', 'PyQt6.QtSensors', 'PyQt6.QtSerialPort', 'PyQt6.QtSpatialAudio',
+    'PyQt6.QtSql', 'PyQt6.QtStateMachine', 'PyQt6.QtTest', 'PyQt6.QtTextToSpeech',
+    'PyQt6.QtWebChannel', 'PyQt6.QtWebSockets', 'PyQt6.QtXml',
+]
+
+# Qt plugins the application needs, by plugin directory: the rest are left out of the bundle
+qt_plugins = {
+    'platforms': None,
+    'styles': None,
+    'iconengines': None,
+    'imageformats': ('qico', 'qsvg', 'qgif'),
+}
+
+def keep(destination: str) -> bool:
+    """
+    Tells whether a collected file belongs in the bundle, from its destination path.
+    """
+    parts = destination.replace('\\', '/').split('/')
+    if 'Qt6' not in parts:
+        return True
+    qt_path = parts[parts.index('Qt6') + 1:]
+    if qt_path[:1] == ['translations']:
+        return False
+    if qt_path[:1] != ['plugins'] or len(qt_path) < 3:
+        return True
+    if qt_path[1] not in qt_plugins:
+        return False
+    names = qt_plugins[qt_path[1]]
+    return names is None or any(name in qt_path[-1] for name in names)
+
 a = Analysis(
     ['app.py'],
     pathex=[],
@@ -7,12 +55,15 @@ a = Analysis(
     datas=[('frontend/styles.qss', 'frontend'), ('assets', 'assets')],
     hiddenimports=[],
     hookspath=[],
-    hooksconfig={},
+    hooksconfig={'matplotlib': {'backends': ['QtAgg']}},
     runtime_hooks=[],
-    excludes=[],
+    excludes=excludes,
     noarchive=False,
-    optimize=0,
+    # Strips the asserts but keeps the docstrings, which some dependencies read at run time
+    optimize=1,
 )
+a.binaries = [entry for entry in a.binaries if keep(entry[0])]
+a.datas = [entry for entry in a.datas if keep(entry[0])]
 pyz = PYZ(a.pure)
 
 exe = EXE(
@@ -24,7 +75,8 @@ exe = EXE(
     debug=False,
     bootloader_ignore_signals=False,
     strip=False,
-    upx=True,
+    # Compressed libraries are smaller, but must be unpacked in memory at every start
+    upx=False,
     console=False,
     disable_windowed_traceback=False,
     argv_emulation=False,
@@ -38,7 +90,7 @@ coll = COLLECT(
     a.binaries,
     a.datas,
     strip=False,
-    upx=True,
+    upx=False,
     upx_exclude=[],
     name='pos',
-)
\ No newline at end of file
+)
@@ -0,0 +1,536 @@
+"""
+POS System Command Line Tool
+
+Author: Alejandro Vargas
+Github: https://github.com/sagravela
+
+This script runs the batch operations of the POS System without the graphical
+interface, for scheduled jobs on the back-office computer. It only imports the
+`database` and `backend` packages, and each command imports just the modules it
+needs, so it starts much faster than `app.py`.
+
+Examples
+--------
+    python pos_cli.py items export --output items.csv
+    python pos_cli.py receive "Coffee" 24 --cost 1.10
+    python pos_cli.py transfer "Coffee" 12 --from "Back Room" --to "Main"
+    python pos_cli.py stock at "2026-03-31 22:00" --item "Coffee"
+    python pos_cli.py promotions add "3 for 5" multibuy 5 --item "Coffee" --quantity 3
+    python pos_cli.py --json report items --by revenue
+    python pos_cli.py z-report --close --output z_report.pdf
+    python pos_cli.py analytics compare --start 2026-01-01
+    python pos_cli.py check --quick
+    python pos_cli.py maintain backup
+"""
+
+import argparse
+import csv
+import json
+import sys
+from datetime import date, datetime
+
+
+def parse_date(value: str) -> datetime:
+    """
+    Parses a YYYY-MM-DD date given in the command line into the datetime at its start.
+    """
+    return datetime.combine(date.fromisoformat(value), datetime.min.time())
+
+def emit(args: argparse.Namespace, rows: list, columns: list[str]):
+    """
+    Prints the result of a command, as JSON if `--json` was given or as aligned columns otherwise.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The parsed command line.
+    rows : list
+        The rows of the result, each a sequence of values in the order of `columns`.
+    columns : list of str
+        The names of the columns.
+    """
+    rows = [[value.isoformat() if isinstance(value, (date, datetime)) else value for value in row] for row in rows]
+    if args.json:
+        json.dump([dict(zip(columns, row)) for row in rows], sys.stdout, indent=2, default=str)
+        print()
+        return
+
+    cells = [columns] + [["" if value is None else f"{value:.2f}" if isinstance(value, float) else str(value)
+                          for value in row] for row in rows]
+    widths = [max(len(row[index]) for row in cells) for index in range(len(columns))]
+    for row in cells:
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip())
+
+def write_csv(path: str, rows: list, columns: list[str]):
+    """
+    Writes rows to a CSV file with a header, or to the standard output if no path is given.
+    """
+    file = open(path, "w", newline="") if path else sys.stdout
+    try:
+        writer = csv.writer(file)
+        writer.writerow(columns)
+        writer.writerows(rows)
+    finally:
+        if path:
+            file.close()
+
+def items_export(args: argparse.Namespace):
+    """
+    Exports the catalog with its stock to CSV.
+    """
+    from backend.services import get_items
+
+    rows = [row[:5] for row in get_items()]
+    columns = ["name", "price", "cost", "stock", "reorder_threshold"]
+    if args.json:
+        emit(args, rows, columns)
+    else:
+        write_csv(args.output, rows, columns)
+
+def items_import(args: argparse.Namespace):
+    """
+    Adds or updates the items of a CSV file with the columns of `items export`.
+
+    The cost, reorder threshold and category columns are optional.
+    """
+    from backend.services import save_item
+
+    count = 0
+    with open(args.file, newline="") as file:
+        for row in csv.DictReader(file):
+            save_item(
+                row["name"],
+                float(row["price"]),
+                int(row["stock"]),
+                int(row["reorder_threshold"]) if row.get("reorder_threshold") else None,
+                float(row["cost"]) if row.get("cost") else None,
+                row.get("category") or None
+            )
+            count += 1
+    emit(args, [(count,)], ["imported"])
+
+def sales_export(args: argparse.Namespace):
+    """
+    Exports the sale lines of a period to CSV.
+    """
+    from backend.services import get_sales_lines
+
+    rows = get_sales_lines(args.start, args.end)
+    columns = ["transaction_id", "timestamp", "item", "quantity", "unit_price", "line_total"]
+    if args.json:
+        emit(args, rows, columns)
+    else:
+        write_csv(args.output, [[value.isoformat() if isinstance(value, datetime) else value for value in row]
+                                for row in rows], columns)
+
+def receive(args: argparse.Namespace):
+    """
+    Adds a delivery to the stock of an item.
+    """
+    from backend.services import receive_stock
+
+    try:
+        stock = receive_stock(args.name, args.quantity, args.cost, args.location)
+    except KeyError:
+        sys.exit(f"Error: There is no item named '{args.name}'.")
+    emit(args, [(args.name, args.quantity, stock)], ["name", "received", "stock"])
+
+def transfer(args: argparse.Namespace):
+    """
+    Moves stock of an item between two locations.
+    """
+    from backend.services import transfer_stock, InsufficientStockError
+
+    try:
+        left, stock = transfer_stock(args.name, args.quantity, args.source, args.destination)
+    except KeyError as error:
+        sys.exit(f"Error: There is no item or location named '{error.args[0]}'.")
+    except (ValueError, InsufficientStockError) as error:
+        sys.exit(f"Error: {error}.")
+    emit(args, [(args.name, args.quantity, left, stock)], ["name", "transferred", "source_stock", "destination_stock"])
+
+def stock_at(args: argparse.Namespace):
+    """
+    Prints the stock of the items at a past time, rebuilt from the movement ledger.
+    """
+    from backend.ledger import get_stock_at
+
+    try:
+        rows = get_stock_at(args.when, args.item, args.location)
+    except ValueError as error:
+        sys.exit(f"Error: {error}")
+    emit(args, rows, ["name", "location", "stock"])
+
+def stock_history(args: argparse.Namespace):
+    """
+    Lists the stock movements, newest first.
+    """
+    from backend.ledger import get_movements
+
+    rows = get_movements(args.item, args.location, args.kind, args.start, args.end, args.limit)
+    emit(args, rows, ["time", "name", "location", "kind", "quantity", "reference"])
+
+def stock_checkpoint(args: argparse.Namespace):
+    """
+    Takes a checkpoint of the stock now.
+    """
+    from backend.ledger import create_checkpoint
+
+    checkpoint_id, saved = create_checkpoint()
+    emit(args, [(checkpoint_id, saved)], ["checkpoint", "entries"])
+
+def locations(args: argparse.Namespace):
+    """
+    Lists the locations holding stock, marking the one of this till.
+    """
+    from backend.locations import get_locations, get_till_location
+
+    _, till = get_till_location()
+    emit(args, [(name, name == till) for name in get_locations()], ["location", "till"])
+
+def promotions_list(args: argparse.Namespace):
+    """
+    Lists the promotions, including the ones ended or not started yet.
+    """
+    from backend.promotions import get_promotions
+
+    emit(args, get_promotions(), ["id", "name", "kind", "target", "quantity", "value", "starts_at", "ends_at"])
+
+def promotions_add(args: argparse.Namespace):
+    """
+    Adds a promotion.
+    """
+    from backend.promotions import save_promotion
+
+    try:
+        promotion_id = save_promotion(
+            args.name, args.kind, args.value, args.item, args.category, args.quantity, args.bundle, args.start, args.end
+        )
+    except KeyError as error:
+        sys.exit(f"Error: There is no item named '{error.args[0]}'.")
+    except ValueError as error:
+        sys.exit(f"Error: {error}")
+    emit(args, [(promotion_id, args.name)], ["id", "name"])
+
+def promotions_remove(args: argparse.Namespace):
+    """
+    Removes a promotion.
+    """
+    from backend.promotions import remove_promotion
+
+    if not remove_promotion(args.id):
+        sys.exit(f"Error: There is no promotion {args.id}.")
+    emit(args, [(args.id,)], ["removed"])
+
+def report(args: argparse.Namespace):
+    """
+    Prints one of the reports of the Analytics tab, or the low stock items.
+    """
+    if args.refresh:
+        from backend.snapshot import refresh_snapshot
+        refresh_snapshot()
+
+    if args.report == "daily":
+        from backend.services import get_transactions
+        import numpy as np
+        dates, totals, counts = get_transactions(engine=args.engine)
+        keep = np.ones(len(dates), dtype=bool)
+        if args.start is not None:
+            keep &= dates >= np.datetime64(args.start.date())
+        if args.end is not None:
+            keep &= dates < np.datetime64(args.end.date())
+        rows = zip(dates[keep].tolist(), totals[keep].tolist(), counts[keep].tolist())
+        emit(args, rows, ["date", "total_sales", "transactions"])
+
+    elif args.report == "items":
+        from backend.services import sold_items_sorted
+        names, totals = sold_items_sorted(args.by, engine=args.engine)
+        totals = totals[::-1][:args.limit]
+        # Quantities are whole numbers
+        rows = zip(names[::-1][:args.limit], totals.astype(int).tolist() if args.by == "quantity" else totals.tolist())
+        emit(args, rows, ["name", args.by])
+
+    elif args.report == "low-stock":
+        from backend.services import get_low_stock
+        emit(args, get_low_stock(), ["name", "stock", "reorder_threshold"])
+
+    elif args.report == "forecast":
+        from backend.forecast import get_forecast
+        forecast = get_forecast()
+        rows = []
+        for row in range(min(args.limit, len(forecast["name"]))):
+            days_left = float(forecast["days_left"][row])
+            rows.append((
+                forecast["name"][row],
+                int(forecast["stock"][row]),
+                float(forecast["velocity"][row]),
+                # JSON has no infinity, items that don't sell never run out
+                days_left if days_left != float("inf") else None,
+                int(forecast["reorder"][row])
+            ))
+        emit(args, rows, ["name", "stock", "velocity", "days_left", "reorder"])
+
+def z_report(args: argparse.Namespace):
+    """
+    Prints or exports the end-of-day report of a day, closing it with `--close`, or lists the closed days.
+    """
+    from backend.zreport import get_z_report, close_day, get_closed_days, format_z_report, export_z_report
+
+    if args.list:
+        emit(args, get_closed_days(args.limit), ["date", "closed_at", "transactions", "total_sales"])
+        return
+
+    day = args.day.date() if args.day else date.today()
+    try:
+        report = close_day(day) if args.close else get_z_report(day)
+    except ValueError as error:
+        sys.exit(f"Error: {error}")
+
+    if args.output:
+        export_z_report(report, args.output)
+    elif args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print(format_z_report(report))
+
+def analytics_compare(args: argparse.Namespace):
+    """
+    Runs the analytics reports on SQLite and on the DuckDB engines, exiting with status 1 if their results differ.
+    """
+    from backend.columnar import is_available, compare_engines
+
+    if not is_available():
+        sys.exit("Error: The DuckDB engine needs the duckdb package and its SQLite extension.")
+    start = args.start.date() if args.start is not None else None
+    comparison = compare_engines(args.engine, start)
+    emit(args, comparison, ["report", "engine", "rows", "seconds", "difference", "match"])
+    if not all(row[-1] for row in comparison):
+        sys.exit(1)
+
+def analytics_export(args: argparse.Namespace):
+    """
+    Refreshes the Parquet export the "parquet" engine reads.
+    """
+    from backend.columnar import is_available, export_parquet
+    from database.database import parquet_path
+
+    if not is_available():
+        sys.exit("Error: The Parquet export needs the duckdb package and its SQLite extension.")
+    emit(args, [(export_parquet(args.full), parquet_path)], ["transactions", "path"])
+
+def rebuild(args: argparse.Namespace):
+    """
+    Recomputes the rollup tables from the archive databases.
+    """
+    from backend.archive import rebuild_rollups
+
+    emit(args, [(rebuild_rollups(),)], ["archived_years"])
+
+def archive(args: argparse.Namespace):
+    """
+    Archives a closed year, or lists the archived and archivable years.
+    """
+    from backend.archive import get_archived_years, get_archivable_years, archive_year
+
+    if args.year is None:
+        archived, archivable = get_archived_years(), get_archivable_years()
+        rows = [(year, "archived") for year in archived] + [(year, "archivable") for year in archivable]
+        emit(args, sorted(rows), ["year", "status"])
+        return
+
+    try:
+        archived = archive_year(args.year)
+    except ValueError as error:
+        sys.exit(f"Error: {error}")
+    emit(args, [(args.year, archived)], ["year", "transactions"])
+
+def check(args: argparse.Namespace):
+    """
+    Checks the integrity of the database, exiting with status 1 if there are problems.
+    """
+    from backend.maintenance import check_integrity
+
+    problems = check_integrity(quick=args.quick)
+    if args.json:
+        emit(args, [(problem,) for problem in problems], ["problem"])
+    else:
+        print("\n".join(problems) if problems else "ok")
+    if problems:
+        sys.exit(1)
+
+def maintain(args: argparse.Namespace):
+    """
+    Runs maintenance tasks now, or shows the last runs with `--log`.
+    """
+    from backend.maintenance import TASKS, run_task, get_maintenance_log, enable_incremental_vacuum
+
+    unknown = [task for task in args.tasks if task not in TASKS]
+    if unknown:
+        sys.exit(f"Error: Unknown maintenance tasks: {', '.join(unknown)}.")
+
+    columns = ["task", "started_at", "seconds", "pages", "result"]
+    if args.log:
+        rows = get_maintenance_log(args.limit)
+    else:
+        rows = [run_task("vacuum", enable_incremental_vacuum)] if args.enable_incremental_vacuum else []
+        rows += [run_task(task) for task in args.tasks or list(TASKS)]
+    emit(args, [[getattr(row, column) for column in columns] for row in rows], columns)
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Builds the parser of the command line, with a subcommand per operation.
+
+    Returns
+    -------
+    argparse.ArgumentParser
+        The parser.
+    """
+    parser = argparse.ArgumentParser(prog="pos-cli", description="Batch operations of the POS System.")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    items = commands.add_parser("items", help="import or export the catalog").add_subparsers(dest="action", required=True)
+    export = items.add_parser("export", help="export the items and their stock to CSV")
+    export.add_argument("--output", help="file to write, the standard output by default")
+    export.set_defaults(handler=items_export)
+    load = items.add_parser("import", help="add or update the items of a CSV file")
+    load.add_argument("file", help="CSV file with the columns name, price, stock and optionally cost, reorder_threshold and category")
+    load.set_defaults(handler=items_import)
+
+    sales = commands.add_parser("sales", help="export the sales").add_subparsers(dest="action", required=True)
+    export = sales.add_parser("export", help="export the sale lines to CSV")
+    export.add_argument("--start", type=parse_date, help="first day, YYYY-MM-DD")
+    export.add_argument("--end", type=parse_date, help="day after the last one, YYYY-MM-DD")
+    export.add_argument("--output", help="file to write, the standard output by default")
+    export.set_defaults(handler=sales_export)
+
+    delivery = commands.add_parser("receive", help="add a delivery to the stock of an item")
+    delivery.add_argument("name", help="name of the item")
+    delivery.add_argument("quantity", type=int, help="quantity received")
+    delivery.add_argument("--cost", type=float, help="price paid per unit")
+    delivery.add_argument("--location", help="location receiving the delivery, the till's location by default")
+    delivery.set_defaults(handler=receive)
+
+    move = commands.add_parser("transfer", help="move stock of an item between two locations")
+    move.add_argument("name", help="name of the item")
+    move.add_argument("quantity", type=int, help="quantity moved")
+    move.add_argument("--from", dest="source", required=True, help="location the stock is taken from")
+    move.add_argument("--to", dest="destination", required=True, help="location receiving the stock")
+    move.set_defaults(handler=transfer)
+
+    stock = commands.add_parser("stock", help="audit the stock movements and rebuild past stock").add_subparsers(
+        dest="action", required=True
+    )
+    past = stock.add_parser("at", help="print the stock at a past time")
+    past.add_argument("when", type=datetime.fromisoformat, help="time of the stock, YYYY-MM-DD[ HH:MM]")
+    past.add_argument("--item", help="only the item with this name")
+    past.add_argument("--location", help="only this location")
+    past.set_defaults(handler=stock_at)
+    history = stock.add_parser("history", help="list the stock movements, newest first")
+    history.add_argument("--item", help="only the item with this name")
+    history.add_argument("--location", help="only this location")
+    history.add_argument("--kind", choices=["sale", "receipt", "adjustment", "transfer"], help="only this kind of movement")
+    history.add_argument("--start", type=parse_date, help="first day, YYYY-MM-DD")
+    history.add_argument("--end", type=parse_date, help="day after the last one, YYYY-MM-DD")
+    history.add_argument("--limit", type=int, default=100, help="number of movements listed")
+    history.set_defaults(handler=stock_history)
+    snapshot = stock.add_parser("checkpoint", help="take a checkpoint of the stock now")
+    snapshot.set_defaults(handler=stock_checkpoint)
+
+    places = commands.add_parser("locations", help="list the locations holding stock")
+    places.set_defaults(handler=locations)
+
+    promotions = commands.add_parser("promotions", help="list, add or remove promotions").add_subparsers(
+        dest="action", required=True
+    )
+    listing = promotions.add_parser("list", help="list the promotions")
+    listing.set_defaults(handler=promotions_list)
+    add = promotions.add_parser("add", help="add a promotion")
+    add.add_argument("name", help="name of the promotion, shown on the receipts")
+    add.add_argument("kind", choices=["percent", "multibuy", "bundle"],
+                     help="percent off, QUANTITY units for VALUE, or one of each bundled item for VALUE")
+    add.add_argument("value", type=float, help="percentage off, or price of the multi-buy units or of the bundle")
+    add.add_argument("--item", help="name of the item of a percentage or multi-buy")
+    add.add_argument("--category", help="category of a percentage or multi-buy, instead of an item")
+    add.add_argument("--quantity", type=int, help="number of units of a multi-buy")
+    add.add_argument("--bundle", nargs="+", metavar="ITEM", help="names of the items of a bundle")
+    add.add_argument("--start", type=parse_date, help="first day, YYYY-MM-DD, today by default")
+    add.add_argument("--end", type=parse_date, help="day after the last one, YYYY-MM-DD, none by default")
+    add.set_defaults(handler=promotions_add)
+    drop = promotions.add_parser("remove", help="remove a promotion")
+    drop.add_argument("id", type=int, help="identifier of the promotion")
+    drop.set_defaults(handler=promotions_remove)
+
+    reports = commands.add_parser("report", help="print a report")
+    reports.add_argument("report", choices=["daily", "items", "low-stock", "forecast"])
+    reports.add_argument("--start", type=parse_date, help="first day of the daily report, YYYY-MM-DD")
+    reports.add_argument("--end", type=parse_date, help="day after the last one of the daily report, YYYY-MM-DD")
+    reports.add_argument("--by", choices=["quantity", "revenue", "margin"], default="quantity",
+                         help="total the items report is ranked by")
+    reports.add_argument("--limit", type=int, default=20, help="number of items of the items and forecast reports")
+    reports.add_argument("--refresh", action="store_true", help="refresh the reporting snapshot first")
+    reports.add_argument("--engine", choices=["sqlite", "duckdb", "parquet"],
+                         help="engine of the daily and items reports, the \"analytics_engine\" setting by default")
+    reports.set_defaults(handler=report)
+
+    analytics = commands.add_parser("analytics", help="compare the analytics engines or refresh the Parquet export").add_subparsers(
+        dest="action", required=True
+    )
+    compare = analytics.add_parser("compare", help="run the daily and items reports on every engine and compare them")
+    compare.add_argument("--engine", nargs="+", choices=["duckdb", "parquet"],
+                         help="engines compared with SQLite, all of them by default")
+    compare.add_argument("--start", type=parse_date, help="first day of the second daily report, 90 days ago by default")
+    compare.set_defaults(handler=analytics_compare)
+    export = analytics.add_parser("export", help="refresh the Parquet export of the reporting snapshot")
+    export.add_argument("--full", action="store_true", help="make the export again from the whole snapshot")
+    export.set_defaults(handler=analytics_export)
+
+    closing = commands.add_parser("z-report", help="print or export the end-of-day report of a day")
+    closing.add_argument("day", type=parse_date, nargs="?", help="day of the report, YYYY-MM-DD, today by default")
+    closing.add_argument("--close", action="store_true", help="close the day, saving its report for good")
+    closing.add_argument("--output", help="export the report to this file, as PDF if it ends in .pdf and as text otherwise")
+    closing.add_argument("--list", action="store_true", help="list the closed days instead")
+    closing.add_argument("--limit", type=int, default=31, help="number of days listed by --list")
+    closing.set_defaults(handler=z_report)
+
+    rollups = commands.add_parser("rebuild-rollups", help="recompute the rollups of the archived years")
+    rollups.set_defaults(handler=rebuild)
+
+    archives = commands.add_parser("archive", help="archive a closed year, or list the years without one")
+    archives.add_argument("year", type=int, nargs="?", help="year to archive")
+    archives.set_defaults(handler=archive)
+
+    checks = commands.add_parser("check", help="check the integrity of the database")
+    checks.add_argument("--quick", action="store_true", help="skip checking the indexes against their tables")
+    checks.set_defaults(handler=check)
+
+    maintenance = commands.add_parser("maintain", help="run database maintenance tasks, all of them by default")
+    maintenance.add_argument("tasks", nargs="*", metavar="task", help="backup, optimize, quick_check, vacuum, checkpoint or parquet")
+    maintenance.add_argument("--enable-incremental-vacuum", action="store_true",
+                             help="rewrite a database made by an older version so it can be vacuumed incrementally, "
+                                  "the tills must be closed")
+    maintenance.add_argument("--log", action="store_true", help="show the last runs instead")
+    maintenance.add_argument("--limit", type=int, default=20, help="number of runs shown by --log")
+    maintenance.set_defaults(handler=maintain)
+
+    return parser
+
+def main(argv: list[str] = None):
+    """
+    The entry point of the command line tool.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        The command line arguments. Defaults to None, which reads them from `sys.argv`.
+    """
+    args = build_parser().parse_args(argv)
+
+    # Create or migrate the database, as the application does on startup
+    from database.database import create_db
+    create_db()
+    args.handler(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""
+POS System Cart Pricing Benchmark
+
+Author: Alejandro Vargas
+Github: https://github.com/sagravela
+
+This script measures how long the promotions take to price a change of a large cart.
+On a database of its own it adds a catalog of many items, every one of them in a
+category, and a thousand active promotions: percentages off a category, percentages
+off and multi-buys of single items, and bundles. It then fills a cart with lines of
+the promoted items and changes their quantities at random, timing each change of the
+`CartPricer`.
+
+After every change the discounts of the promotions applied must add up to the discount
+of the cart, and at the end the cart must be priced the same as a new one with the
+same lines. The exit code is 1 if a check fails, or if a change took over the thresholds.
+
+Examples
+--------
+    python pricing_bench.py
+    python pricing_bench.py --items 100000 --rules 1000 --lines 200 --changes 20000
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+def seed_promotions(path: str, args: argparse.Namespace, rng: random.Random) -> list[tuple[str, float]]:
+    """
+    Adds the items and the promotions of the benchmark.
+
+    A tenth of the promotions take a percentage off a category, a fifth are bundles of
+    two or three items and the rest take a percentage off an item or sell it in multi-buys.
+
+    Parameters
+    ----------
+    path : str
+        The path of the database.
+    args : argparse.Namespace
+        The parsed command line.
+    rng : random.Random
+        The random generator of the catalog and the promotions.
+
+    Returns
+    -------
+    list of tuple of (str, float)
+        The name and price of the items with a promotion of their own, or in a bundle.
+    """
+    connection = sqlite3.connect(path)
+    items = [
+        (number, f"Item {number:06d}", round(rng.uniform(0.5, 50), 2), f"Category {number % args.categories}")
+        for number in range(1, args.items + 1)
+    ]
+    connection.executemany("INSERT INTO items (id, name, price, category) VALUES (?, ?, ?, ?)", items)
+
+    categories = args.rules // 10
+    bundles = args.rules // 5
+    promoted = rng.sample(items, args.rules - categories - bundles + 3 * bundles)
+    rows = [
+        (f"Category {number} sale", "percent", None, f"Category {number}", None, rng.choice([5, 10, 20, 50]), None)
+        for number in range(categories)
+    ]
+    for number, (item_id, name, price, _) in enumerate(promoted[:args.rules - categories - bundles]):
+        if number % 2:
+            rows.append((f"{name} 3 for 2", "multibuy", item_id, None, 3, round(2 * price, 2), None))
+        else:
+            rows.append((f"{name} off", "percent", item_id, None, None, rng.choice([10, 25, 50, 80]), None))
+    members = promoted[args.rules - categories - bundles:]
+    for number in range(bundles):
+        bundle = members[3 * number:3 * number + rng.choice([2, 3])]
+        value = round(sum(price for _, _, price, _ in bundle) * 0.8, 2)
+        rows.append((f"Bundle {number}", "bundle", None, None, None, value, json.dumps([name for _, name, _, _ in bundle])))
+    connection.executemany(
+        "INSERT INTO promotions (name, kind, item_id, category, quantity, value, bundle) VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+    )
+    connection.commit()
+    connection.close()
+    return [(name, price) for _, name, price, _ in promoted]
+
+def run(args: argparse.Namespace) -> tuple[dict, list[tuple[str, bool, str]]]:
+    """
+    Fills a cart and times the changes of its lines.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The parsed command line.
+
+    Returns
+    -------
+    tuple of (dict, list)
+        The times measured, in microseconds, and the name of each check, whether it passed
+        and the values it compared.
+    """
+    from database.database import create_db, database_path
+    from backend.promotions import CartPricer, refresh_promotions
+
+    rng = random.Random(args.seed)
+    create_db()
+    promoted = seed_promotions(database_path, args, rng)
+    started = time.perf_counter()
+    index = refresh_promotions()
+    compile_seconds = time.perf_counter() - started
+
+    pricer = CartPricer(index)
+    lines = rng.sample(promoted, args.lines)
+    started = time.perf_counter()
+    for name, price in lines:
+        pricer.set_line(name, rng.randint(1, 4), price)
+    fill_seconds = time.perf_counter() - started
+
+    times, mismatches = [], 0
+    for _ in range(args.changes):
+        name, price = rng.choice(lines)
+        quantity = rng.randint(-3, 3) or 1
+        started = time.perf_counter()
+        pricer.add(name, max(quantity, 1 - pricer.lines.get(name, (0, price))[0]), price)
+        times.append(time.perf_counter() - started)
+        applied = round(sum(amount for _, _, amount in pricer.applied()), 2)
+        mismatches += abs(applied - round(sum(pricer.line_discount(line) for line in pricer.lines), 2)) >= 0.005
+
+    # A new cart with the same lines must be priced the same
+    fresh = CartPricer(index)
+    for name, (quantity, price) in pricer.lines.items():
+        fresh.set_line(name, quantity, price)
+
+    times.sort()
+    results = {
+        'compile_ms': compile_seconds * 1000,
+        'fill_ms': fill_seconds * 1000,
+        'mean_us': statistics.mean(times) * 10 ** 6,
+        'p99_us': times[min(int(len(times) * 0.99), len(times) - 1)] * 10 ** 6,
+        'max_us': times[-1] * 10 ** 6,
+    }
+    checks = [
+        ("promotions add up", mismatches == 0, f"{mismatches} of {args.changes} changes differ"),
+        ("same as a new cart", abs(fresh.total - pricer.total) < 0.005, f"{pricer.total:.2f}, new cart {fresh.total:.2f}"),
+        ("mean change", results['mean_us'] <= args.max_mean_us, f"{results['mean_us']:.0f} us (max {args.max_mean_us:.0f} us)"),
+        ("99th percentile change", results['p99_us'] <= args.max_p99_us, f"{results['p99_us']:.0f} us (max {args.max_p99_us:.0f} us)"),
+    ]
+    return results, checks
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Builds the parser of the command line.
+
+    Returns
+    -------
+    argparse.ArgumentParser
+        The parser.
+    """
+    parser = argparse.ArgumentParser(description="Time the pricing of the changes of a large cart with many promotions.")
+    parser.add_argument("--items", type=int, default=100000, help="number of items of the catalog")
+    parser.add_argument("--categories", type=int, default=100, help="number of categories of the items, one promotion each by default")
+    parser.add_argument("--rules", type=int, default=1000, help="number of active promotions")
+    parser.add_argument("--lines", type=int, default=200, help="number of lines of the cart")
+    parser.add_argument("--changes", type=int, default=20000, help="number of changes of the cart timed")
+    parser.add_argument("--max-mean-us", type=float, default=1000, help="maximum mean time of a change, in microseconds")
+    parser.add_argument("--max-p99-us", type=float, default=1000, help="maximum 99th percentile of a change, in microseconds")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the catalog, the promotions and the changes")
+    parser.add_argument("--database", help="database file, a new temporary one by default")
+    return parser
+
+def main(argv: list[str] = None):
+    """
+    The entry point of the pricing benchmark.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        The command line arguments. Defaults to None, which reads them from `sys.argv`.
+    """
+    args = build_parser().parse_args(argv)
+
+    # Run on a database and settings of its own, before the application reads them
+    directory = tempfile.mkdtemp(prefix="pos_pricing_")
+    os.environ["POS_DATABASE"] = args.database or os.path.join(directory, "pricing.db")
+    os.environ["POS_CONFIG"] = os.path.join(directory, "config.json")
+
+    results, checks = run(args)
+    print(f"compile the promotions  {results['compile_ms']:>8.1f} ms")
+    print(f"fill the cart           {results['fill_ms']:>8.1f} ms")
+    print(f"change, mean            {results['mean_us']:>8.0f} us")
+    print(f"change, 99th percentile {results['p99_us']:>8.0f} us")
+    print(f"change, maximum         {results['max_us']:>8.0f} us")
+    print()
+    for name, passed, values in checks:
+        print(f"{name:<24} {'ok' if passed else 'FAILED':<7} {values}")
+    passed = all(passed for _, passed, _ in checks)
+    print("PASSED" if passed else "FAILED")
+    sys.exit(0 if passed else 1)
+
+if __name__ == '__main__':
+    main()
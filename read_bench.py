@@ -0,0 +1,227 @@
+"""
+POS System Catalog Read Benchmark
+
+Author: Alejandro Vargas
+Github: https://github.com/sagravela
+
+This script compares the Core statements the catalog is read with against the ORM
+query they replaced. On a database of its own it adds a catalog of many items and
+reads it, and looks items up by name, both ways:
+
+- with `get_items` and `get_item`, which return plain tuples from cached Core statements,
+- with a `Session.query` of `(Store, Items)` pairs, as the catalog was read before.
+
+Each read is timed, as the best of several runs, and its memory measured with
+`tracemalloc`: the peak while reading, and what its rows keep once read. The
+exit code is 1 if both ways return different rows, or if the Core reads don't take
+at most `--max-ratio` of the time and memory of the ORM ones.
+
+Examples
+--------
+    python read_bench.py
+    python read_bench.py --items 100000 --runs 5 --lookups 1000
+"""
+
+import argparse
+import gc
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+def seed_catalog(path: str, location_id: int, args: argparse.Namespace, rng: random.Random) -> list[str]:
+    """
+    Adds the items and their stock at the till's location.
+
+    Parameters
+    ----------
+    path : str
+        The path of the database.
+    location_id : int
+        The location of the till.
+    args : argparse.Namespace
+        The parsed command line.
+    rng : random.Random
+        The random generator of the catalog.
+
+    Returns
+    -------
+    list of str
+        The names of the items.
+    """
+    connection = sqlite3.connect(path)
+    items = [(number, f"Item {number:06d}", round(rng.uniform(0.5, 30), 2)) for number in range(1, args.items + 1)]
+    connection.executemany("INSERT INTO items (id, name, price) VALUES (?, ?, ?)", items)
+    connection.executemany(
+        "INSERT INTO store (location_id, item_id, stock, reorder_threshold) VALUES (?, ?, ?, ?)",
+        [(location_id, item_id, rng.randint(0, 200), rng.randint(0, 20)) for item_id, _, _ in items]
+    )
+    connection.commit()
+    connection.execute("ANALYZE")
+    connection.close()
+    return [name for _, name, _ in items]
+
+def measure(function, runs: int) -> tuple[float, int, int, object]:
+    """
+    Runs a function several times, measuring its time and memory.
+
+    Returns
+    -------
+    tuple of (float, int, int, object)
+        The best time in seconds, the peak memory while running and the memory kept by
+        its result, in bytes, and the result of the last run.
+    """
+    best = float("inf")
+    for _ in range(runs):
+        gc.collect()
+        started = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - started)
+        del result
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = function()
+    gc.collect()
+    kept, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak - before, kept - before, result
+
+def run(args: argparse.Namespace) -> tuple[list[tuple], list[tuple[str, bool, str]]]:
+    """
+    Generates the catalog and measures its reads with Core statements and with the ORM.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The parsed command line.
+
+    Returns
+    -------
+    tuple of (list, list)
+        The name, milliseconds, peak and kept MiB of each read, and the name of each check,
+        whether it passed and the values it compared.
+    """
+    from database.database import create_db, database_path, get_session
+    from database.models import Items, Store, Reservation
+    from backend.locations import get_till_location
+    from backend.services import get_items, get_item
+    from sqlalchemy import func, select
+    from datetime import datetime
+
+    rng = random.Random(args.seed)
+    create_db()
+    location_id, _ = get_till_location()
+    names = seed_catalog(database_path, location_id, args, rng)
+    lookups = rng.sample(names, min(args.lookups, len(names)))
+
+    def orm_query(session):
+        # The catalog as it was read before, with the location of the stock
+        reserved = (
+            select(Reservation.item_id, func.sum(Reservation.quantity).label('quantity'))
+            .where(Reservation.expires_at > datetime.now(), Reservation.location_id == location_id)
+            .group_by(Reservation.item_id)
+            .subquery()
+        )
+        return (
+            session.query(Store, Items, (Store.stock - func.coalesce(reserved.c.quantity, 0)).label('available'))
+            .join(Items, Items.id == Store.item_id)
+            .outerjoin(reserved, reserved.c.item_id == Store.item_id)
+            .filter(Store.location_id == location_id)
+        )
+
+    def orm_items():
+        with get_session() as session:
+            return orm_query(session).all()
+
+    def orm_lookups():
+        with get_session() as session:
+            return [orm_query(session).filter(Items.name == name).first() for name in lookups]
+
+    def core_items():
+        return get_items()
+
+    def core_lookups():
+        return [get_item(name) for name in lookups]
+
+    def values(rows: list) -> list[tuple]:
+        # The columns the item tables read, from the ORM pairs or the Core tuples
+        return sorted(
+            (row[1].name, row[1].price, row[1].cost, row[0].stock, row[0].reorder_threshold, row[2])
+            if isinstance(row[0], Store) else tuple(row[:6])
+            for row in rows
+        )
+
+    reads = []
+    results = {}
+    for name, function, runs in [
+        ("ORM catalog", orm_items, args.runs), ("Core catalog", core_items, args.runs),
+        (f"ORM {len(lookups)} lookups", orm_lookups, 1), (f"Core {len(lookups)} lookups", core_lookups, 1),
+    ]:
+        seconds, peak, kept, result = measure(function, runs)
+        reads.append((name, seconds * 1000, peak / 2 ** 20, kept / 2 ** 20))
+        results[name] = result
+
+    (_, orm_ms, orm_peak, _), (_, core_ms, core_peak, _), (_, orm_lookup_ms, _, _), (_, core_lookup_ms, _, _) = reads
+    different = sum(
+        values(results[orm]) != values(results[core]) for orm, core in [(reads[0][0], reads[1][0]), (reads[2][0], reads[3][0])]
+    )
+    checks = [
+        ("same rows", different == 0, f"{different} of 2 reads differ"),
+        ("catalog time", core_ms <= args.max_ratio * orm_ms, f"{core_ms:.0f} ms, ORM {orm_ms:.0f} ms (max ratio {args.max_ratio})"),
+        ("catalog memory", core_peak <= args.max_ratio * orm_peak, f"peak {core_peak:.1f} MiB, ORM {orm_peak:.1f} MiB (max ratio {args.max_ratio})"),
+        ("lookup time", core_lookup_ms <= args.max_ratio * orm_lookup_ms, f"{core_lookup_ms:.0f} ms, ORM {orm_lookup_ms:.0f} ms (max ratio {args.max_ratio})"),
+    ]
+    return reads, checks
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Builds the parser of the command line.
+
+    Returns
+    -------
+    argparse.ArgumentParser
+        The parser.
+    """
+    parser = argparse.ArgumentParser(description="Compare the catalog reads of the Core statements with the ORM query.")
+    parser.add_argument("--items", type=int, default=100000, help="number of items of the catalog")
+    parser.add_argument("--runs", type=int, default=5, help="number of timed reads of the catalog, the best is kept")
+    parser.add_argument("--lookups", type=int, default=1000, help="number of items looked up by name")
+    parser.add_argument("--max-ratio", type=float, default=0.5, help="maximum time and memory of the Core reads, relative to the ORM ones")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the catalog and the lookups")
+    parser.add_argument("--database", help="database file, a new temporary one by default")
+    return parser
+
+def main(argv: list[str] = None):
+    """
+    The entry point of the catalog read benchmark.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        The command line arguments. Defaults to None, which reads them from `sys.argv`.
+    """
+    args = build_parser().parse_args(argv)
+
+    # Run on a database and settings of its own, before the application reads them
+    directory = tempfile.mkdtemp(prefix="pos_read_")
+    os.environ["POS_DATABASE"] = args.database or os.path.join(directory, "read.db")
+    os.environ["POS_CONFIG"] = os.path.join(directory, "config.json")
+
+    reads, checks = run(args)
+    print(f"{'read':<22} {'ms':>9} {'peak_mib':>9} {'kept_mib':>9}")
+    for name, milliseconds, peak, kept in reads:
+        print(f"{name:<22} {milliseconds:>9.1f} {peak:>9.1f} {kept:>9.1f}")
+    print()
+    for name, passed, values in checks:
+        print(f"{name:<16} {'ok' if passed else 'FAILED':<7} {values}")
+    passed = all(passed for _, passed, _ in checks)
+    print("PASSED" if passed else "FAILED")
+    sys.exit(0 if passed else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,423 @@
+"""
+POS System Soak Test
+
+Author: Alejandro Vargas
+Github: https://github.com/sagravela
+
+This script simulates a long shift on a headless `POSApp`, to find out whether the
+memory of a till creeps up over the day. It drives thousands of sales through the
+POS tab, with searches, quick keys, parked carts and tab switches in between, on a
+database of its own. Along the way it samples the resident memory of the process,
+the Python heap traced by `tracemalloc`, the live QObjects and the Matplotlib
+artists of the analytics figures.
+
+The growth of each measure, from the end of a warm-up that fills the caches to the
+end of the run, is checked against a threshold. The report shows the samples, the
+growth, the QObject classes and the lines of code that allocated the most memory
+meanwhile. The exit code is 1 if any growth is over its threshold.
+
+Examples
+--------
+    python soak_test.py
+    python soak_test.py --sales 20000 --max-rss-growth 32 --report soak.json
+"""
+
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+
+def get_rss() -> int | None:
+    """
+    Returns the resident memory of the process in bytes, or None if it can't be read.
+    """
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+        return None
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return None
+
+def count_qobjects(app) -> Counter:
+    """
+    Counts the live QObjects of the application by class.
+
+    Parameters
+    ----------
+    app : QApplication
+        The application, whose children and top level widgets are counted with all their descendants.
+
+    Returns
+    -------
+    Counter
+        The number of objects of each class.
+    """
+    from PyQt6.QtCore import QObject
+
+    counts = Counter()
+    for root in [app] + app.topLevelWidgets():
+        counts[type(root).__name__] += 1
+        counts.update(type(child).__name__ for child in root.findChildren(QObject))
+    return counts
+
+def count_artists(window) -> int:
+    """
+    Counts the Matplotlib artists of the figures shown in a window, with the open pyplot figures.
+    """
+    import matplotlib.pyplot as plt
+    from PyQt6.QtWidgets import QWidget
+
+    figures = {id(widget.figure): widget.figure for widget in window.findChildren(QWidget) if hasattr(widget, "figure")}
+    return sum(len(figure.findobj()) for figure in figures.values()) + len(plt.get_fignums())
+
+def take_sample(app, window, sales: int, started: float) -> dict:
+    """
+    Collects the garbage and measures the memory of the process.
+
+    Parameters
+    ----------
+    app : QApplication
+        The application.
+    window : POSApp
+        The main window.
+    sales : int
+        The number of sales simulated so far.
+    started : float
+        The `time.perf_counter` when the run started.
+
+    Returns
+    -------
+    dict
+        The sales, the seconds elapsed, the resident memory and traced Python heap
+        in bytes, the number of QObjects, their counts by class and the number of artists.
+    """
+    from PyQt6.QtCore import QCoreApplication, QEvent
+
+    # Objects released with `deleteLater` are only deleted by the event loop
+    QCoreApplication.sendPostedEvents(None, QEvent.Type.DeferredDelete.value)
+    gc.collect()
+    qobjects = count_qobjects(app)
+    return {
+        'sales': sales,
+        'seconds': round(time.perf_counter() - started, 1),
+        'rss': get_rss(),
+        'heap': tracemalloc.get_traced_memory()[0],
+        'qobjects': sum(qobjects.values()),
+        'qobject_classes': qobjects,
+        'artists': count_artists(window),
+    }
+
+def seed_catalog(items: int, rng: random.Random):
+    """
+    Adds the items sold by the simulation, with plenty of stock, in a few categories.
+    """
+    from backend.services import save_item
+
+    for number in range(items):
+        save_item(f"Item {number:05d}", round(rng.uniform(0.5, 30), 2), 10 ** 7, 10, category=f"Category {number % 10}")
+
+def simulate_sale(window, rng: random.Random):
+    """
+    Sells a few random items through the POS tab, as a cashier would.
+
+    Items are picked from the table or tapped on the quick keys, and the cart
+    is paid with some change to return.
+    """
+    tab = window.pos_tab
+    for _ in range(rng.randint(1, 5)):
+        if tab.quick_keys and rng.random() < 0.3:
+            tab.quick_add(rng.randrange(len(tab.quick_keys)))
+            continue
+        tab.item_table.selectRow(rng.randrange(tab.item_table.rowCount()))
+        if tab.add_button.isEnabled():
+            tab.quantity_input.setValue(rng.randint(1, 3))
+            tab.add_to_cart()
+    if tab.cart:
+        tab.received_amount_input.setText(f"{tab.total_price + rng.randint(0, 20):.2f}")
+        tab.checkout()
+
+def simulate_search(window, rng: random.Random):
+    """
+    Types a search on the POS and Store tabs, and clears it with Escape.
+    """
+    for tab in (window.pos_tab, window.store_tab):
+        tab.filter_search.setText(f"Item {rng.randrange(100):02d}")
+        tab.refresh()
+
+def simulate_parking(window):
+    """
+    Parks a cart with an item and resumes it.
+    """
+    tab = window.pos_tab
+    tab.item_table.selectRow(0)
+    if tab.add_button.isEnabled():
+        tab.add_to_cart()
+    if tab.park():
+        tab.parked_input.setCurrentIndex(tab.parked_input.count() - 1)
+        tab.resume()
+
+def switch_tabs(window):
+    """
+    Visits every tab and goes back to the POS tab, refreshing each of them on the way.
+    """
+    for index in list(range(1, window.tabs.count())) + [0]:
+        window.tabs.setCurrentIndex(index)
+
+def format_table(rows: list, columns: list[str]) -> list[str]:
+    """
+    Formats rows as aligned columns, with a header.
+    """
+    cells = [columns] + [[str(value) for value in row] for row in rows]
+    widths = [max(len(row[index]) for row in cells) for index in range(len(columns))]
+    return ["  ".join(cell.rjust(width) for cell, width in zip(row, widths)) for row in cells]
+
+def megabytes(value: int | None) -> str:
+    """
+    Formats a number of bytes in megabytes, or "n/a" if unknown.
+    """
+    return "n/a" if value is None else f"{value / 2 ** 20:.1f}"
+
+def run(args: argparse.Namespace) -> dict:
+    """
+    Runs the simulated shift and measures the memory along the way.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The parsed command line.
+
+    Returns
+    -------
+    dict
+        The samples, the growth of each measure and whether it passed its threshold,
+        the QObject classes that grew and the top allocators.
+    """
+    from PyQt6.QtWidgets import QApplication, QMessageBox
+    from database.database import create_db
+    from backend.quick_keys import refresh_quick_keys
+
+    tracemalloc.start(args.frames)
+    rng = random.Random(args.seed)
+    create_db()
+    seed_catalog(args.items, rng)
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+
+    # The dialogs would wait for a click forever
+    QMessageBox.information = staticmethod(lambda *_, **__: QMessageBox.StandardButton.Ok)
+    QMessageBox.warning = staticmethod(lambda *_, **__: QMessageBox.StandardButton.Ok)
+
+    from frontend.main_window import POSApp
+    window = POSApp()
+    window.show()
+    refresh_quick_keys()
+
+    started = time.perf_counter()
+    samples, baseline, baseline_snapshot = [], None, None
+    for sale in range(1, args.warmup + args.sales + 1):
+        simulate_sale(window, rng)
+        if sale % args.search_every == 0:
+            simulate_search(window, rng)
+        if sale % args.park_every == 0:
+            simulate_parking(window)
+        if sale % args.switch_every == 0:
+            switch_tabs(window)
+        app.processEvents()
+
+        if sale == args.warmup:
+            # The snapshot holds all the traces, so it is taken before the baseline to leave it out of the growth
+            baseline_snapshot = tracemalloc.take_snapshot()
+            baseline = take_sample(app, window, sale, started)
+            samples.append(baseline)
+        elif sale > args.warmup and (sale - args.warmup) % args.sample_every == 0:
+            samples.append(take_sample(app, window, sale, started))
+            if not args.quiet:
+                print(
+                    f"{sale} sales, {samples[-1]['seconds']} s, RSS {megabytes(samples[-1]['rss'])} MB, "
+                    f"heap {megabytes(samples[-1]['heap'])} MB", file=sys.stderr
+                )
+
+    final = take_sample(app, window, args.warmup + args.sales, started)
+    if samples[-1]['sales'] != final['sales']:
+        samples.append(final)
+    final_snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    # The window must be deleted before the application
+    window.close()
+    del window
+
+    # Growth of each measure since the warm-up, against its threshold
+    thresholds = {
+        'rss': args.max_rss_growth * 2 ** 20,
+        'heap': args.max_heap_growth * 2 ** 20,
+        'qobjects': args.max_qobject_growth,
+        'artists': args.max_artist_growth,
+    }
+    growth = {}
+    for measure, threshold in thresholds.items():
+        if final[measure] is None or baseline[measure] is None:
+            growth[measure] = {'growth': None, 'threshold': threshold, 'passed': True}
+        else:
+            change = final[measure] - baseline[measure]
+            growth[measure] = {'growth': change, 'threshold': threshold, 'passed': change <= threshold}
+
+    # Growth per 1000 sales over the second half of the run, which tells a steady creep from a step at the start
+    middle = samples[len(samples) // 2]
+    trend = {
+        measure: (final[measure] - middle[measure]) * 1000 / (final['sales'] - middle['sales'])
+        if final['sales'] > middle['sales'] and final[measure] is not None and middle[measure] is not None else None
+        for measure in thresholds
+    }
+
+    classes = (final['qobject_classes'] - baseline['qobject_classes']).most_common(args.top)
+
+    # Lines that allocated the most memory since the warm-up, leaving out the measurement itself
+    statistics = [
+        statistic for statistic in final_snapshot.compare_to(baseline_snapshot, "lineno")
+        if statistic.traceback[0].filename not in (tracemalloc.__file__, __file__)
+        and not statistic.traceback[0].filename.startswith("<frozen")
+    ]
+    allocators = [
+        {'where': str(statistic.traceback), 'size_diff': statistic.size_diff, 'count_diff': statistic.count_diff}
+        for statistic in statistics[:args.top]
+    ]
+
+    for sample in samples:
+        sample.pop('qobject_classes')
+    return {
+        'sales': args.sales,
+        'warmup': args.warmup,
+        'samples': samples,
+        'growth': growth,
+        'trend': trend,
+        'qobject_classes': classes,
+        'allocators': allocators,
+        'passed': all(measure['passed'] for measure in growth.values()),
+    }
+
+def print_report(result: dict):
+    """
+    Prints the report of a run: the samples, the growth against the thresholds and where the memory went.
+    """
+    print(f"Soak test: {result['sales']} sales after a warm-up of {result['warmup']}")
+    print()
+    for line in format_table(
+        [(sample['sales'], sample['seconds'], megabytes(sample['rss']), megabytes(sample['heap']),
+          sample['qobjects'], sample['artists']) for sample in result['samples']],
+        ["sales", "seconds", "rss_mb", "heap_mb", "qobjects", "artists"]
+    ):
+        print(line)
+
+    print()
+    print("Growth since the warm-up:")
+    for measure, values in result['growth'].items():
+        in_bytes = measure in ("rss", "heap")
+        change = megabytes(values['growth']) + " MB" if in_bytes else str(values['growth'])
+        threshold = megabytes(values['threshold']) + " MB" if in_bytes else str(values['threshold'])
+        print(f"  {measure:<9} {change:>12}  (max {threshold})  {'ok' if values['passed'] else 'FAILED'}")
+
+    print()
+    print("Growth per 1000 sales over the second half:")
+    for measure, rate in result['trend'].items():
+        if rate is None:
+            print(f"  {measure:<9} {'n/a':>12}")
+        elif measure in ("rss", "heap"):
+            print(f"  {measure:<9} {rate / 2 ** 20:>+9.2f} MB")
+        else:
+            print(f"  {measure:<9} {rate:>+12.1f}")
+
+    if result['qobject_classes']:
+        print()
+        print("QObject classes that grew:")
+        for name, count in result['qobject_classes']:
+            print(f"  {count:>+8}  {name}")
+
+    print()
+    print("Top allocators since the warm-up:")
+    for allocator in result['allocators']:
+        print(f"  {allocator['size_diff'] / 1024:>+10.1f} KiB  {allocator['count_diff']:>+8} blocks  {allocator['where']}")
+
+    print()
+    print("PASSED" if result['passed'] else "FAILED")
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Builds the parser of the command line.
+
+    Returns
+    -------
+    argparse.ArgumentParser
+        The parser.
+    """
+    parser = argparse.ArgumentParser(description="Simulate a long shift on a headless POSApp and track its memory.")
+    parser.add_argument("--sales", type=int, default=2000, help="number of sales measured, after the warm-up")
+    parser.add_argument("--warmup", type=int, default=200, help="number of sales before the baseline is measured")
+    parser.add_argument("--items", type=int, default=500, help="number of items of the catalog")
+    parser.add_argument("--sample-every", type=int, default=250, help="sales between samples")
+    parser.add_argument("--search-every", type=int, default=10, help="sales between searches")
+    parser.add_argument("--park-every", type=int, default=50, help="sales between parked carts")
+    parser.add_argument("--switch-every", type=int, default=25, help="sales between visits to every tab")
+    parser.add_argument("--max-rss-growth", type=float, default=32, help="maximum growth of the resident memory, in MB")
+    parser.add_argument("--max-heap-growth", type=float, default=8, help="maximum growth of the Python heap, in MB")
+    parser.add_argument("--max-qobject-growth", type=int, default=100, help="maximum growth of the live QObjects")
+    parser.add_argument("--max-artist-growth", type=int, default=100, help="maximum growth of the Matplotlib artists")
+    parser.add_argument("--top", type=int, default=15, help="number of allocators and QObject classes reported")
+    parser.add_argument("--frames", type=int, default=1, help="frames kept per allocation by tracemalloc")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the simulation")
+    parser.add_argument("--database", help="database file, a new temporary one by default")
+    parser.add_argument("--report", help="also save the report as JSON to this file")
+    parser.add_argument("--quiet", action="store_true", help="don't print the progress")
+    return parser
+
+def main(argv: list[str] = None):
+    """
+    The entry point of the soak test.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        The command line arguments. Defaults to None, which reads them from `sys.argv`.
+    """
+    args = build_parser().parse_args(argv)
+
+    # Run without a display, on a database and settings of its own, before the application reads them
+    directory = tempfile.mkdtemp(prefix="pos_soak_")
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    os.environ["POS_DATABASE"] = args.database or os.path.join(directory, "soak.db")
+    os.environ["POS_CONFIG"] = os.path.join(directory, "config.json")
+
+    result = run(args)
+    print_report(result)
+    if args.report:
+        with open(args.report, "w") as file:
+            json.dump(result, file, indent=2)
+    sys.exit(0 if result['passed'] else 1)
+
+if __name__ == '__main__':
+    main()
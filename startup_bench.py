@@ -0,0 +1,381 @@
+"""
+POS System Startup Benchmark
+
+Author: Alejandro Vargas
+Github: https://github.com/sagravela
+
+This script measures how long the application takes to start and how large its
+bundle is, to catch regressions before a release. It reports:
+
+- The import time of the application and of its heaviest packages and modules,
+  from `python -X importtime`, as the median of several runs.
+- The time from launching `app.py` to its first painted window, headless and on a
+  database of its own, as the median of several runs.
+- The size of the PyInstaller bundle in `dist/pos`, by component, and the time the
+  bundled program takes to start, if it was built (or with `--build`).
+
+The results can be saved as JSON and compared with a previous run: the exit code is
+1 if a time grew more than `--max-regression` percent, or the bundle more than
+`--max-size-regression` percent. Measure on the same computer, with the same Python,
+for the comparison to be meaningful.
+
+Examples
+--------
+    python startup_bench.py --save startup.json
+    python startup_bench.py --build --baseline startup.json
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Components of the bundle, by the first directories of the paths of its files
+BUNDLE_COMPONENTS = [
+    ("qt translations", ("PyQt6", "Qt6", "translations")),
+    ("qt plugins", ("PyQt6", "Qt6", "plugins")),
+    ("qt libraries", ("PyQt6",)),
+    ("matplotlib", ("matplotlib",)),
+    ("numpy", ("numpy",)),
+    ("numpy", ("numpy.libs",)),
+    ("sqlalchemy", ("sqlalchemy",)),
+    ("assets", ("assets",)),
+]
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+def project_environment(directory: str) -> dict:
+    """
+    Returns the environment of a headless application with a database and settings of its own.
+
+    Parameters
+    ----------
+    directory : str
+        The directory of the database and the settings.
+
+    Returns
+    -------
+    dict
+        The environment variables.
+    """
+    environment = dict(os.environ)
+    environment["QT_QPA_PLATFORM"] = environment.get("QT_QPA_PLATFORM", "offscreen")
+    environment["POS_DATABASE"] = os.path.join(directory, "startup.db")
+    environment["POS_CONFIG"] = os.path.join(directory, "config.json")
+    environment["POS_EXIT_AFTER_START"] = "1"
+    return environment
+
+def parse_import_times(output: str) -> dict[str, int]:
+    """
+    Parses the output of `python -X importtime`.
+
+    Parameters
+    ----------
+    output : str
+        The standard error of the interpreter.
+
+    Returns
+    -------
+    dict of str to int
+        The cumulative import time of each module, in microseconds.
+    """
+    return {match[4]: int(match[2]) for match in IMPORT_LINE.finditer(output)}
+
+def measure_imports(python: str, module: str, runs: int, environment: dict) -> dict[str, int]:
+    """
+    Measures the import time of a module and of everything it imports.
+
+    Parameters
+    ----------
+    python : str
+        The Python interpreter.
+    module : str
+        The module imported.
+    runs : int
+        The number of runs, after a first one that warms up the disk cache.
+    environment : dict
+        The environment variables.
+
+    Returns
+    -------
+    dict of str to int
+        The median cumulative import time of each module, in microseconds.
+    """
+    samples = []
+    for run in range(runs + 1):
+        completed = subprocess.run(
+            [python, "-X", "importtime", "-c", f"import {module}"],
+            cwd=ROOT, env=environment, capture_output=True, text=True
+        )
+        if completed.returncode:
+            raise RuntimeError(f"Importing {module} failed:\n{completed.stderr[-2000:]}")
+        if run:
+            samples.append(parse_import_times(completed.stderr))
+    return {name: int(statistics.median(sample.get(name, 0) for sample in samples)) for name in samples[0]}
+
+def top_imports(times: dict[str, int], top: int) -> list[tuple[str, int]]:
+    """
+    Selects the heaviest top-level packages and modules of the application.
+
+    Parameters
+    ----------
+    times : dict of str to int
+        The cumulative import time of each module, in microseconds.
+    top : int
+        The number of modules kept.
+
+    Returns
+    -------
+    list of tuple
+        The name and import time of the heaviest modules, slowest first.
+    """
+    own = ("app", "frontend", "backend", "database")
+    names = [name for name in times if "." not in name or name.split(".")[0] in own]
+    return sorted(((name, times[name]) for name in names), key=lambda entry: -entry[1])[:top]
+
+def measure_launch(command: list[str], runs: int, environment: dict) -> list[float]:
+    """
+    Measures the time from launching the application to its first painted window.
+
+    The application quits as soon as its window is painted, since `POS_EXIT_AFTER_START`
+    is set in the environment.
+
+    Parameters
+    ----------
+    command : list of str
+        The command that launches the application.
+    runs : int
+        The number of runs, after a first one that creates the database and warms up the disk cache.
+    environment : dict
+        The environment variables.
+
+    Returns
+    -------
+    list of float
+        The time of each run, in seconds.
+    """
+    times = []
+    for run in range(runs + 1):
+        started = time.perf_counter()
+        completed = subprocess.run(command, cwd=ROOT, env=environment, capture_output=True, text=True)
+        elapsed = time.perf_counter() - started
+        if completed.returncode:
+            raise RuntimeError(f"{' '.join(command)} failed:\n{completed.stderr[-2000:]}")
+        if run:
+            times.append(elapsed)
+    return times
+
+def measure_bundle(directory: str) -> dict[str, int]:
+    """
+    Measures the size of a bundle by component.
+
+    Parameters
+    ----------
+    directory : str
+        The directory of the bundle.
+
+    Returns
+    -------
+    dict of str to int
+        The size of each component and the total size, in bytes.
+    """
+    sizes = {"total": 0}
+    for folder, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(folder, name)
+            if os.path.islink(path):
+                continue
+            size = os.path.getsize(path)
+            parts = os.path.relpath(path, directory).split(os.sep)
+            # One-folder bundles of recent PyInstaller versions keep everything in _internal
+            if parts[0] == "_internal":
+                parts = parts[1:]
+            component = next(
+                (label for label, prefix in BUNDLE_COMPONENTS if tuple(parts[:len(prefix)]) == prefix and len(parts) > len(prefix)),
+                "python and other"
+            )
+            sizes[component] = sizes.get(component, 0) + size
+            sizes["total"] += size
+    return sizes
+
+def build_bundle(python: str):
+    """
+    Builds the bundle with PyInstaller, from `pos.spec`.
+
+    Parameters
+    ----------
+    python : str
+        The Python interpreter with PyInstaller installed.
+    """
+    subprocess.run([python, "-m", "PyInstaller", "--noconfirm", "--clean", "pos.spec"], cwd=ROOT, check=True)
+
+def run(args) -> dict:
+    """
+    Runs the measurements.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The parsed command line.
+
+    Returns
+    -------
+    dict
+        The measurements: the import times in milliseconds, the launch times in seconds
+        and the bundle sizes in bytes.
+    """
+    directory = tempfile.mkdtemp(prefix="pos_startup_")
+    try:
+        environment = project_environment(directory)
+        result = {"python": sys.version.split()[0], "platform": sys.platform, "runs": args.runs}
+
+        times = measure_imports(args.python, "app", args.runs, environment)
+        result["import_ms"] = {name: value / 1000 for name, value in top_imports(times, args.top)}
+        launches = measure_launch([args.python, "app.py"], args.runs, environment)
+        result["launch_s"] = {"median": statistics.median(launches), "min": min(launches)}
+
+        if args.build:
+            build_bundle(args.python)
+        bundle = os.path.join(ROOT, args.bundle)
+        executable = os.path.join(bundle, "pos.exe" if sys.platform == "win32" else "pos")
+        if os.path.isfile(executable):
+            result["bundle_bytes"] = measure_bundle(bundle)
+            launches = measure_launch([executable], args.runs, environment)
+            result["bundle_launch_s"] = {"median": statistics.median(launches), "min": min(launches)}
+        return result
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def compare(result: dict, baseline: dict, max_regression: float, max_size_regression: float, floor: float) -> list[str]:
+    """
+    Compares the measurements with those of a previous run.
+
+    Parameters
+    ----------
+    result : dict
+        The measurements.
+    baseline : dict
+        The measurements of the previous run.
+    max_regression : float
+        The maximum growth of a time, in percent.
+    max_size_regression : float
+        The maximum growth of the bundle, in percent.
+    floor : float
+        The import time growth, in milliseconds, below which a module is never reported,
+        since short imports are noisy.
+
+    Returns
+    -------
+    list of str
+        The regressions found.
+    """
+    regressions = []
+
+    def check(label: str, value: float, previous: float, limit: float, unit: str, minimum: float = 0):
+        if previous and value > previous * (1 + limit / 100) and value - previous > minimum:
+            regressions.append(f"{label}: {previous:,.1f} -> {value:,.1f} {unit} (+{(value / previous - 1) * 100:.0f}%)")
+
+    for name, value in result["import_ms"].items():
+        check(f"import {name}", value, baseline.get("import_ms", {}).get(name), max_regression, "ms", floor)
+    for key in ("launch_s", "bundle_launch_s"):
+        if key in result and key in baseline:
+            check(key.replace("_s", ""), result[key]["median"], baseline[key]["median"], max_regression, "s")
+    if "bundle_bytes" in result and "bundle_bytes" in baseline:
+        for component, size in result["bundle_bytes"].items():
+            check(
+                f"bundle {component}", size / 2 ** 20, baseline["bundle_bytes"].get(component, 0) / 2 ** 20,
+                max_size_regression, "MB", 0.5
+            )
+    return regressions
+
+def print_report(result: dict, regressions: list[str] | None):
+    """
+    Prints the measurements and the regressions found.
+
+    Parameters
+    ----------
+    result : dict
+        The measurements.
+    regressions : list of str or None
+        The regressions found, or None if there was no baseline.
+    """
+    print(f"Python {result['python']} on {result['platform']}, median of {result['runs']} runs")
+    print()
+    print("Import time (cumulative):")
+    for name, value in result["import_ms"].items():
+        print(f"  {value:>9.1f} ms  {name}")
+    print()
+    print(f"Launch to first window: {result['launch_s']['median']:.3f} s (min {result['launch_s']['min']:.3f} s)")
+    if "bundle_bytes" in result:
+        print()
+        print("Bundle size:")
+        for component, size in sorted(result["bundle_bytes"].items(), key=lambda entry: -entry[1]):
+            print(f"  {size / 2 ** 20:>9.1f} MB  {component}")
+        launch = result["bundle_launch_s"]
+        print(f"Bundle launch to first window: {launch['median']:.3f} s (min {launch['min']:.3f} s)")
+    else:
+        print("No bundle found, build it with --build to measure it.")
+
+    if regressions is not None:
+        print()
+        if regressions:
+            print("Regressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+        else:
+            print("No regressions.")
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Builds the parser of the command line.
+
+    Returns
+    -------
+    argparse.ArgumentParser
+        The parser.
+    """
+    parser = argparse.ArgumentParser(description="Measure the startup time and bundle size of the POS application.")
+    parser.add_argument("--runs", type=int, default=5, help="number of measured runs of each command")
+    parser.add_argument("--top", type=int, default=20, help="number of packages and modules reported")
+    parser.add_argument("--python", default=sys.executable, help="Python interpreter that runs the application")
+    parser.add_argument("--bundle", default=os.path.join("dist", "pos"), help="directory of the PyInstaller bundle")
+    parser.add_argument("--build", action="store_true", help="build the bundle with PyInstaller first")
+    parser.add_argument("--save", help="save the measurements as JSON to this file")
+    parser.add_argument("--baseline", help="compare with the measurements saved in this file")
+    parser.add_argument("--max-regression", type=float, default=20, help="maximum growth of a time, in percent")
+    parser.add_argument("--max-size-regression", type=float, default=5, help="maximum growth of the bundle, in percent")
+    parser.add_argument("--floor", type=float, default=10, help="import time growth ignored, in milliseconds")
+    return parser
+
+def main(argv: list[str] = None):
+    """
+    The entry point of the startup benchmark.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        The command line arguments. Defaults to None, which reads them from `sys.argv`.
+    """
+    args = build_parser().parse_args(argv)
+    result = run(args)
+
+    regressions = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(result, json.load(file), args.max_regression, args.max_size_regression, args.floor)
+    print_report(result, regressions)
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(result, file, indent=2)
+    sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
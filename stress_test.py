@@ -0,0 +1,181 @@
+"""
+POS System Concurrent Checkout Stress Test
+
+Author: Alejandro Vargas
+Github: https://github.com/sagravela
+
+This script checks that tills selling the same item at the same time never sell
+more than its stock. It forks a number of processes, each one a till on the same
+database file, which start together and keep checking out carts of a single item
+until they run out of attempts. The stock is set below what they try to sell, so
+many checkouts have to be refused.
+
+At the end the stock must not be negative, the quantity sold plus the stock left
+must be the initial stock, the sales saved must be the ones the tills were told
+succeeded, and the consistency checks of the maintenance must find no problem.
+The exit code is 1 if any check fails.
+
+Examples
+--------
+    python stress_test.py
+    python stress_test.py --processes 16 --sales 200 --stock 1000
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Name of the item all the tills sell
+ITEM = "Stress Item"
+
+def till(number: int, args: argparse.Namespace, start) -> tuple[int, int, int, int]:
+    """
+    Sells the item from one process, as a till would, once all the tills are ready.
+
+    Parameters
+    ----------
+    number : int
+        The number of the till, which seeds its quantities.
+    args : argparse.Namespace
+        The parsed command line.
+    start : multiprocessing.Event
+        Set when all the tills should start selling.
+
+    Returns
+    -------
+    tuple of (int, int, int, int)
+        The number of sales saved, the quantity they sold, the number of sales refused
+        for lack of stock and the number that failed with the database busy.
+    """
+    from sqlalchemy.exc import OperationalError
+    from backend.services import save_transaction, InsufficientStockError
+
+    rng = random.Random(args.seed * 1000 + number)
+    saved = sold = refused = busy = 0
+    start.wait()
+    for _ in range(args.sales):
+        quantity = rng.randint(1, args.max_quantity)
+        total = round(quantity * args.price, 2)
+        try:
+            save_transaction(total, total, 0.0, [(ITEM, quantity)])
+        except InsufficientStockError:
+            refused += 1
+            continue
+        except OperationalError:
+            busy += 1
+            continue
+        saved += 1
+        sold += quantity
+    return saved, sold, refused, busy
+
+def run(args: argparse.Namespace) -> list[tuple[str, bool, str]]:
+    """
+    Runs the tills and checks the stock and the sales they leave.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The parsed command line.
+
+    Returns
+    -------
+    list of tuple of (str, bool, str)
+        The name of each check, whether it passed and the values it compared.
+    """
+    from sqlalchemy import func, select
+    from database.database import create_db, get_session
+    from database.models import Items, Store, Transaction, TransactionItem
+    from backend.services import save_item
+    from backend.maintenance import check_integrity
+
+    create_db()
+    save_item(ITEM, args.price, args.stock)
+
+    # Spawned processes work the same on every platform, and open their own connections
+    context = multiprocessing.get_context("spawn")
+    start = context.Manager().Event()
+    with context.Pool(args.processes) as pool:
+        results = pool.starmap_async(till, [(number, args, start) for number in range(args.processes)])
+        # Give the tills time to import the application, so they start selling together
+        time.sleep(args.startup)
+        started = time.perf_counter()
+        start.set()
+        results = results.get()
+    seconds = time.perf_counter() - started
+
+    saved = sum(result[0] for result in results)
+    reported = sum(result[1] for result in results)
+    refused = sum(result[2] for result in results)
+    busy = sum(result[3] for result in results)
+    print(
+        f"{args.processes} tills, {saved} sales saved, {refused} refused, {busy} busy, in {seconds:.2f} s",
+        file=sys.stderr
+    )
+
+    with get_session() as session:
+        item_id = session.scalar(select(Items.id).where(Items.name == ITEM))
+        stock = session.scalar(select(func.sum(Store.stock)).where(Store.item_id == item_id))
+        sold = session.scalar(
+            select(func.coalesce(func.sum(TransactionItem.quantity), 0)).where(TransactionItem.item_id == item_id)
+        )
+        transactions = session.scalar(select(func.count(Transaction.id)))
+
+    problems = check_integrity(quick=True)
+    return [
+        ("stock not negative", stock >= 0, f"stock {stock}"),
+        ("sold + stock = initial stock", sold + stock == args.stock, f"{sold} + {stock} = {sold + stock}, initial {args.stock}"),
+        ("quantity sold as reported", sold == reported, f"saved {sold}, reported {reported}"),
+        ("sales saved as reported", transactions == saved, f"saved {transactions}, reported {saved}"),
+        ("refused only when sold out", args.stock - sold < args.max_quantity or refused == 0, f"{args.stock - sold} left, {refused} refused"),
+        ("consistency checks", not problems, "; ".join(problems) or "no problems"),
+    ]
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Builds the parser of the command line.
+
+    Returns
+    -------
+    argparse.ArgumentParser
+        The parser.
+    """
+    parser = argparse.ArgumentParser(description="Check that tills checking out the same item at once never oversell it.")
+    parser.add_argument("--processes", type=int, default=8, help="number of tills, each one a process")
+    parser.add_argument("--sales", type=int, default=100, help="number of checkouts each till attempts")
+    parser.add_argument("--stock", type=int, default=500, help="initial stock of the item, below what the tills try to sell")
+    parser.add_argument("--max-quantity", type=int, default=3, help="maximum quantity of the item per checkout")
+    parser.add_argument("--price", type=float, default=2.5, help="price of the item")
+    parser.add_argument("--startup", type=float, default=3, help="seconds the tills are given to start before selling")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the quantities")
+    parser.add_argument("--database", help="database file, a new temporary one by default")
+    return parser
+
+def main(argv: list[str] = None):
+    """
+    The entry point of the stress test.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        The command line arguments. Defaults to None, which reads them from `sys.argv`.
+    """
+    args = build_parser().parse_args(argv)
+
+    # Run on a database and settings of its own, which the tills inherit, before the application reads them
+    directory = tempfile.mkdtemp(prefix="pos_stress_")
+    os.environ["POS_DATABASE"] = args.database or os.path.join(directory, "stress.db")
+    os.environ["POS_CONFIG"] = os.path.join(directory, "config.json")
+
+    checks = run(args)
+    for name, passed, values in checks:
+        print(f"{name:<30} {'ok' if passed else 'FAILED':<7} {values}")
+    passed = all(passed for _, passed, _ in checks)
+    print("PASSED" if passed else "FAILED")
+    sys.exit(0 if passed else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+"""
+POS System Sync Benchmark
+
+Author: Alejandro Vargas
+Github: https://github.com/sagravela
+
+This script measures how fast tills replicate through a back-office hub. On databases
+of their own, in a temporary folder, it serves a hub over HTTP (`python -m backend.sync`)
+and runs each till as a separate process:
+
+- a first till adds the catalog and pushes it,
+- the other tills pull it and sell for a day offline, thousands of sales each,
+- they all sync at once, pushing their backlog and pulling each other's, and sync
+  again to pull the sales pushed meanwhile,
+- a new till catches up with everything from the hub.
+
+The stock of every item, and the number of sales, must then be the same on the hub
+and on every till, and the consistency checks of the maintenance must find no
+problem on any of them. The exit code is 1 if a check fails, or if the catch-up
+applied fewer than `--min-rate` changes per second.
+
+Examples
+--------
+    python sync_bench.py
+    python sync_bench.py --tills 2 --sales 3000 --items 50
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from urllib import request
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Stock of each item over all the locations, and number of sales, of a database
+STOCK = "SELECT items.name, COALESCE(SUM(store.stock), 0) FROM items LEFT JOIN store ON store.item_id = items.id GROUP BY items.id"
+SALES = "SELECT COUNT(*) FROM transactions"
+
+def use_database(directory: str, name: str) -> str:
+    """
+    Points the application to the database and settings of a till or of the hub, before it reads them.
+
+    Returns
+    -------
+    str
+        The path of the database.
+    """
+    os.environ["POS_DATABASE"] = os.path.join(directory, f"{name}.db")
+    os.environ["POS_CONFIG"] = os.path.join(directory, f"{name}.json")
+    return os.environ["POS_DATABASE"]
+
+def write_settings(directory: str, name: str, settings: dict):
+    """
+    Saves the settings of a till or of the hub.
+    """
+    with open(os.path.join(directory, f"{name}.json"), "w") as file:
+        json.dump(settings, file, indent=4)
+
+def seed(directory: str, args: argparse.Namespace) -> dict:
+    """
+    Adds the catalog on the first till and pushes it to the hub.
+
+    Returns
+    -------
+    dict
+        The number of changes "pushed" and "pulled", and the "seconds" it took.
+    """
+    use_database(directory, "till0")
+    from database.database import create_db
+    from backend.services import save_item
+    from backend.sync import SyncEngine, HttpTransport
+    from backend.config import get_setting
+
+    create_db()
+    for number in range(args.items):
+        save_item(f"Item {number:04d}", round(1 + number % 20 * 0.5, 2), args.stock)
+    return SyncEngine(HttpTransport(get_setting("sync_hub_url"))).sync()
+
+def sell(directory: str, number: int, args: argparse.Namespace) -> tuple[int, float]:
+    """
+    Pulls the catalog on a till and sells offline, two lines per sale.
+
+    Returns
+    -------
+    tuple of (int, float)
+        The number of changes left to push, and the seconds the sales took.
+    """
+    use_database(directory, f"till{number}")
+    from sqlalchemy import func, select
+    from database.database import create_db, get_session
+    from database.models import ChangeLog
+    from backend.services import get_items, save_transaction
+    from backend.sync import SyncEngine, HttpTransport
+    from backend.config import get_setting
+
+    create_db()
+    SyncEngine(HttpTransport(get_setting("sync_hub_url"))).sync()
+    rng = random.Random(args.seed * 1000 + number)
+    prices = {name: price for name, price, *_ in get_items()}
+    names = sorted(prices)
+
+    started = time.perf_counter()
+    for _ in range(args.sales):
+        cart = [(name, rng.randint(1, 3)) for name in rng.sample(names, 2)]
+        total = round(sum(prices[name] * quantity for name, quantity in cart), 2)
+        save_transaction(total, total, 0.0, cart)
+    seconds = time.perf_counter() - started
+
+    with get_session() as session:
+        return session.scalar(select(func.count()).select_from(ChangeLog)), seconds
+
+def sync(directory: str, number: int, start) -> dict:
+    """
+    Syncs a till with the hub, once all the tills syncing together are ready.
+
+    Returns
+    -------
+    dict
+        The number of changes "pushed" and "pulled", and the "seconds" it took.
+    """
+    use_database(directory, f"till{number}")
+    from database.database import create_db
+    from backend.sync import SyncEngine, HttpTransport
+    from backend.config import get_setting
+
+    create_db()
+    engine = SyncEngine(HttpTransport(get_setting("sync_hub_url")))
+    if start is not None:
+        start.wait()
+    return engine.sync()
+
+def check(directory: str, name: str) -> tuple[dict, int, list[str]]:
+    """
+    Reads the stock and the number of sales of a database, and runs its consistency checks.
+
+    Returns
+    -------
+    tuple of (dict, int, list of str)
+        The stock of each item, the number of sales and the problems found.
+    """
+    path = use_database(directory, name)
+    from backend.maintenance import check_integrity
+
+    connection = sqlite3.connect(path)
+    stock, sales = dict(connection.execute(STOCK).fetchall()), connection.execute(SALES).fetchone()[0]
+    connection.close()
+    return stock, sales, check_integrity(quick=True)
+
+def serve_hub(directory: str, port: int) -> subprocess.Popen:
+    """
+    Starts the hub on its own database and waits until it answers.
+
+    Returns
+    -------
+    subprocess.Popen
+        The process of the hub.
+    """
+    environment = dict(os.environ)
+    environment["POS_DATABASE"] = os.path.join(directory, "hub.db")
+    environment["POS_CONFIG"] = os.path.join(directory, "hub.json")
+    hub = subprocess.Popen([sys.executable, "-m", "backend.sync", str(port)], cwd=ROOT, env=environment)
+    for _ in range(300):
+        try:
+            request.urlopen(f"http://127.0.0.1:{port}/pull?after=0&origin=bench&limit=1", timeout=1).close()
+            return hub
+        except OSError:
+            time.sleep(0.1)
+    hub.terminate()
+    raise RuntimeError("The hub didn't start.")
+
+def run(args: argparse.Namespace, directory: str) -> tuple[list[tuple], list[tuple[str, bool, str]]]:
+    """
+    Runs the hub and the tills, and checks the databases they leave.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The parsed command line.
+    directory : str
+        The folder of the databases and settings.
+
+    Returns
+    -------
+    tuple of (list, list)
+        The name, changes pushed and pulled, and seconds of each sync, and the name of
+        each check, whether it passed and the values it compared.
+    """
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    url = f"http://127.0.0.1:{port}"
+    write_settings(directory, "hub", {"sync_role": "hub"})
+    catch_up = args.tills + 1
+    for number in range(catch_up + 1):
+        settings = {"sync_role": "terminal", "sync_hub_url": url}
+        if args.batch_size:
+            settings["sync_batch_size"] = args.batch_size
+        write_settings(directory, f"till{number}", settings)
+
+    hub = serve_hub(directory, port)
+    # Each task runs in a new spawned process, which opens the database of its till
+    context = multiprocessing.get_context("spawn")
+    syncs = []
+    try:
+        with context.Pool(args.tills, maxtasksperchild=1) as pool:
+            result = pool.apply(seed, (directory, args))
+            syncs.append(("catalog", result))
+
+            sold = pool.starmap(sell, [(directory, number, args) for number in range(1, args.tills + 1)])
+            for number, (backlog, seconds) in enumerate(sold, start=1):
+                print(f"till {number}: {args.sales} sales in {seconds:.1f} s, {backlog} changes to push", file=sys.stderr)
+
+            # All the tills come back online at once
+            start = context.Manager().Event()
+            results = pool.starmap_async(sync, [(directory, number, start) for number in range(1, args.tills + 1)])
+            time.sleep(args.startup)
+            start.set()
+            for number, result in enumerate(results.get(), start=1):
+                syncs.append((f"till {number} back online", result))
+
+            # The sales pushed after a till pulled are pulled the next time
+            for number, result in enumerate(pool.starmap(sync, [(directory, number, None) for number in range(args.tills + 1)])):
+                syncs.append((f"till {number} again", result))
+
+            syncs.append(("new till catching up", pool.apply(sync, (directory, catch_up, None))))
+            states = {
+                name: pool.apply(check, (directory, name))
+                for name in ["hub"] + [f"till{number}" for number in range(catch_up + 1)]
+            }
+    finally:
+        hub.terminate()
+        hub.wait()
+
+    expected_sales = args.tills * args.sales
+    hub_stock = states["hub"][0]
+    different = [name for name, (stock, _, _) in states.items() if stock != hub_stock]
+    missing = [name for name, (_, sales, _) in states.items() if sales != expected_sales]
+    problems = [f"{name}: {problem}" for name, (_, _, found) in states.items() for problem in found]
+
+    # Nothing is sold but the items of the catalog, so the stock left is the initial stock less the quantities sold
+    connection = sqlite3.connect(os.path.join(directory, "hub.db"))
+    sold_quantity = connection.execute("SELECT COALESCE(SUM(quantity), 0) FROM transaction_items").fetchone()[0]
+    connection.close()
+    left = sum(hub_stock.values())
+
+    caught_up = syncs[-1][1]
+    rate = caught_up['pulled'] / caught_up['seconds'] if caught_up['seconds'] else 0
+    rows = [(name, result['pushed'], result['pulled'], result['seconds']) for name, result in syncs]
+    checks = [
+        ("same stock everywhere", not different, f"differs on {', '.join(different)}" if different else f"{len(states)} databases"),
+        ("stock left", left + sold_quantity == args.items * args.stock, f"{left} + {sold_quantity} sold, initial {args.items * args.stock}"),
+        ("same sales everywhere", not missing, f"{', '.join(missing)} without {expected_sales} sales" if missing else f"{expected_sales} sales"),
+        ("consistency checks", not problems, "; ".join(problems[:5]) or "no problems"),
+        ("catch-up rate", rate >= args.min_rate, f"{rate:.0f} changes/s (min {args.min_rate:.0f})"),
+    ]
+    return rows, checks
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Builds the parser of the command line.
+
+    Returns
+    -------
+    argparse.ArgumentParser
+        The parser.
+    """
+    parser = argparse.ArgumentParser(description="Time the replication of tills selling offline through a hub.")
+    parser.add_argument("--tills", type=int, default=2, help="number of tills selling offline, each one a process")
+    parser.add_argument("--sales", type=int, default=3000, help="number of sales of each till while offline")
+    parser.add_argument("--items", type=int, default=50, help="number of items of the catalog")
+    parser.add_argument("--stock", type=int, default=100000, help="initial stock of each item")
+    parser.add_argument("--batch-size", type=int, help="changes per request, the \"sync_batch_size\" setting by default")
+    parser.add_argument("--min-rate", type=float, default=1000, help="minimum changes applied per second while catching up")
+    parser.add_argument("--startup", type=float, default=3, help="seconds the tills are given to start before syncing")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the sales")
+    return parser
+
+def main(argv: list[str] = None):
+    """
+    The entry point of the sync benchmark.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        The command line arguments. Defaults to None, which reads them from `sys.argv`.
+    """
+    args = build_parser().parse_args(argv)
+    directory = tempfile.mkdtemp(prefix="pos_sync_")
+
+    rows, checks = run(args, directory)
+    print(f"{'sync':<24} {'pushed':>7} {'pulled':>7} {'seconds':>8} {'changes/s':>10}")
+    for name, pushed, pulled, seconds in rows:
+        print(f"{name:<24} {pushed:>7} {pulled:>7} {seconds:>8.2f} {(pushed + pulled) / seconds if seconds else 0:>10.0f}")
+    print()
+    for name, passed, values in checks:
+        print(f"{name:<22} {'ok' if passed else 'FAILED':<7} {values}")
+    passed = all(passed for _, passed, _ in checks)
+    print("PASSED" if passed else "FAILED")
+    sys.exit(0 if passed else 1)
+
+if __name__ == '__main__':
+    main()